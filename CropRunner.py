@@ -29,6 +29,7 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
 from downloaders.common import atomic_output_path
+from downloaders.store_catalog import StoreCatalog
 
 # The largest panos our own downloader writes are 16384x8192 = 134 MP, over Pillow's 89 MP
 # DecompressionBombWarning default; bulk_extract_crops raises the ceiling to this rather than warning once
@@ -599,10 +600,14 @@ def bulk_extract_crops(labels_to_crop, path_to_gsv_scrapes, destination_dir, mar
 
     processed = counts['errors']
     made_dirs = set()
+    # Both existence checks below - is the pano on the store, is the crop already cut - run once per pano and
+    # once per label. Over sshfs each was a round trip; the catalog answers them from one listing per shard
+    # and per label-type folder instead (downloaders/store_catalog.py).
+    catalog = StoreCatalog()
     for pano_id, labels in labels_by_pano.items():
         pano_img_path = os.path.join(path_to_gsv_scrapes, pano_id[:2], pano_id + ".jpg")
 
-        if not os.path.exists(pano_img_path):
+        if not catalog.isfile(pano_img_path):
             counts['missing_pano'] += len(labels)
             processed += len(labels)
             print("Panorama image not found: %s (%d labels skipped)" % (pano_img_path, len(labels)))
@@ -664,7 +669,7 @@ def bulk_extract_crops(labels_to_crop, path_to_gsv_scrapes, destination_dir, mar
                 destination_folder = os.path.join(destination_dir, str(label_type))
                 crop_destination = os.path.join(destination_folder, str(label_id) + ".jpg")
 
-                if os.path.exists(crop_destination):
+                if catalog.isfile(crop_destination):
                     counts['skipped_existing'] += 1
                     continue
                 try:
@@ -677,6 +682,7 @@ def bulk_extract_crops(labels_to_crop, path_to_gsv_scrapes, destination_dir, mar
                         made_dirs.add(destination_folder)
                     box = make_single_crop(pano, pano_x, pano_y, crop_destination,
                                            draw_mark=mark_label)
+                    catalog.added(crop_destination)  # a repeated label row must still find it cut
                 except Exception as e:
                     counts['errors'] += 1
                     logging.warning("Failed to crop label %d on pano %s: %s", label_id, pano_id, e)
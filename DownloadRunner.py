@@ -1,14 +1,17 @@
 # !/usr/bin/python3
 
 import argparse
+import collections
+import concurrent.futures
 import csv
+import functools
 import logging
 import logging.handlers
 import math
 import os
-import random
 import signal
 import sys
+import threading
 import time
 from datetime import datetime
 from os.path import exists
@@ -17,7 +20,10 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
-from downloaders import DownloadResult, download_pano, gsv, mapillary
+from downloaders import DownloadResult, download_pano, gsv, ledger_index, mapillary, schedule, store_catalog
+from downloaders.common import DeadlineExceeded, InlineExecutor, deadline, is_storage_failure, write_behind
+from downloaders.failure_log import IMAGE_FAILURE_LOG_FILENAME, TransientFailureLog
+from downloaders.tile_cache import TILE_CACHE_DIRNAME, TileCache
 
 
 def _reservation_minutes(value):
@@ -35,6 +41,66 @@ def _reservation_minutes(value):
     return minutes
 
 
+# Default --pano-memory-mb: two full-size 16384x8192 canvases (384 MB each) plus headroom, which is what the
+# documented 2 GB minimum box can hold alongside the interpreter, the stitch's own temporaries and the JPEG
+# encoder. Raise it on bigger boxes; it only matters once --pano-workers is above 1.
+DEFAULT_PANO_MEMORY_MB = 1024
+DEFAULT_WRITE_WORKERS = 2
+
+
+def _positive_int(value):
+    """argparse type= for --pano-workers: an integer >= 1. Zero workers would be a run that downloads nothing
+    and says so only by its counts, which is the quiet misconfiguration _reservation_minutes exists to stop."""
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: %r" % (value,))
+    if count < 1:
+        raise argparse.ArgumentTypeError("must be at least 1: %r" % (value,))
+    return count
+
+
+def _non_negative_int(value):
+    """argparse type= for --write-workers: an integer >= 0 (0 writes inline)."""
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: %r" % (value,))
+    if count < 0:
+        raise argparse.ArgumentTypeError("must be at least 0: %r" % (value,))
+    return count
+
+
+def _memory_megabytes(value):
+    """argparse type= for --pano-memory-mb: a finite, positive float."""
+    try:
+        megabytes = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid float value: %r" % (value,))
+    if math.isnan(megabytes) or math.isinf(megabytes) or megabytes <= 0:
+        raise argparse.ArgumentTypeError("must be a finite, positive number of megabytes: %r" % (value,))
+    return megabytes
+
+
+def _cache_megabytes(value):
+    """argparse type= for --tile-cache-mb: a finite, non-negative float (0 turns the cache off)."""
+    try:
+        megabytes = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid float value: %r" % (value,))
+    if math.isnan(megabytes) or math.isinf(megabytes) or megabytes < 0:
+        raise argparse.ArgumentTypeError("must be a finite, non-negative number of megabytes: %r" % (value,))
+    return megabytes
+
+
+def _depth_codec(value):
+    """argparse type= for --depth-codec: a gsv.DepthCodec name, parsed once here rather than per artifact."""
+    try:
+        return gsv.parse_depth_codec(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('d', help='sidewalk_server_domain - FQDN of SidewalkWebpage server to fetch pano list from, i.e. sidewalk-columbus.cs.washington.edu')
@@ -45,6 +111,15 @@ def build_parser():
     parser.add_argument('--max-runtime', type=float, default=None, metavar='MINUTES', help='Stop starting new downloads after this many minutes have elapsed.')
     parser.add_argument('--min-depth-runtime', type=_reservation_minutes, default=0.0, metavar='MINUTES', help='Reserve the last MINUTES of --max-runtime for the depth phase when the depth ledger shows unresolved work, so an image backlog cannot starve depth. This is a reservation carved out of the image phase\'s start budget, not a hard floor on depth wall time: the image phase stops STARTING new panos once its share is spent (a pano already in flight can overrun into the reserved slice), and depth still ends at --max-runtime, so it also gets any slack images leave. If the reservation meets or exceeds --max-runtime, NO images are downloaded that run. Default 0 (no reservation); the production crontab should pass 60. Ignored without --max-runtime or with --skip-depth.')
     parser.add_argument('--max-depth-requests', type=int, default=None, metavar='N', help='Stop the depth phase after this many depth metadata requests.')
+    parser.add_argument('--pano-workers', type=_positive_int, default=1, metavar='N', help='Keep up to N panos in flight at once in the image phase, so one pano\'s stitch and save overlap the next one\'s tile fan-out. Default 1 (one pano at a time). The ledger, the counters and the --max-runtime check stay on the main thread; see also --pano-memory-mb.')
+    parser.add_argument('--pano-memory-mb', type=_memory_megabytes, default=DEFAULT_PANO_MEMORY_MB, metavar='MB', help='Cap on the decoded canvases in flight under --pano-workers, at 3 bytes per reported pixel (384 MB for a 16384x8192 pano). A pano that would push the total over the cap waits for one in flight to finish; one bigger than the whole cap still runs, alone. Default %d.' % DEFAULT_PANO_MEMORY_MB)
+    parser.add_argument('--tile-cache-mb', type=_cache_megabytes, default=0.0, metavar='MB', help='Keep the tiles a GSV pano did get when it fails part-way, in <storage>/%s and up to MB in total, so its retry fetches only the tiles it is missing. Least recently used panos are evicted first; panos resolved since are dropped at the start of each run. Default 0 (no cache).' % TILE_CACHE_DIRNAME)
+    parser.add_argument('--schedule', choices=schedule.SCHEDULES, default=schedule.SHUFFLE, help='The order each phase attempts its unresolved panos in. shuffle (the default) is uniformly random; priority puts the most valuable first - labelled panos, and for depth panos whose image is already on the store - keeping a weighted shuffle as the tiebreak so no pano is starved. See docs/downloader.md.')
+    parser.add_argument('--ledger-index', action='store_true', help='Keep a compacted snapshot of each resume ledger beside it (pano_id_log.csv.idx, depth_log.csv.idx), so a run start parses only the rows appended since instead of the whole CSV. The CSVs stay the ledgers and are appended exactly as before; a snapshot is a cache, rebuilt whenever it no longer matches its ledger, and safe to delete.')
+    parser.add_argument('--concurrent-phases', action='store_true', help='Run the depth phase on its own thread beside the image phase instead of after it. Both share the --max-runtime deadline from the first minute, so --min-depth-runtime no longer carves a tail out of the image phase: depth holds the whole window. log.csv still reports each phase\'s own counts and duration.')
+    parser.add_argument('--depth-workers', type=_positive_int, default=1, metavar='N', help='Keep up to N photometa requests in flight at once in the depth phase, with each artifact\'s decode, checks and compression on a pool of N beside them. Requests are still started no closer than depth_min_request_interval, and the ledger, the counters, the circuit breaker and the retreats stay on the phase\'s own thread. Default 1 (one pano at a time).')
+    parser.add_argument('--depth-codec', type=_depth_codec, default=gsv.DEFAULT_DEPTH_CODEC, metavar='CODEC', help='How depth artifacts are compressed: store (none), deflate (the default, at zlib level 6), or delta or packed, which encode plane_indices as column deltas or in the fewest bits per pixel ahead of deflate. Any but store takes a level, as in deflate:1. The codec is recorded in each artifact, and load_depth_artifact decodes whichever wrote it. benchmarks/depth_codecs.py compares them.')
+    parser.add_argument('--write-workers', type=_non_negative_int, default=DEFAULT_WRITE_WORKERS, metavar='N', help='Threads that JPEG-encode and write stitched GSV panos in the background, so the next pano\'s download does not wait on the store. A pano is ledgered only once its write has landed. 0 writes inline. Default %d.' % DEFAULT_WRITE_WORKERS)
     # Deprecated no-op, kept for one release so existing invocations don't crash argparse.
     parser.add_argument('--attempt-depth', action='store_true', help=argparse.SUPPRESS)
     return parser
@@ -73,6 +148,16 @@ def configure_logging(log_path):
     logging.getLogger('urllib3').setLevel(logging.WARNING)
 
 
+# pano_id_log.csv's downloaded column: 0 for a permanent failure, 1 for an image on the store.
+IMAGE_LEDGER_STATUSES = ('0', '1')
+
+
+def downloaded_pano_ids(csv_pano_log_path):
+    """The ids the image ledger records as downloaded (a downloaded=1 row), or an empty set when there is no
+    ledger yet. The same tolerance as progress_check: a damaged row is skipped."""
+    return ledger_index.read_ledger(csv_pano_log_path, IMAGE_LEDGER_STATUSES).ids['1']
+
+
 def progress_check(csv_pano_log_path):
     """Read the image ledger once: every ledgered pano id, plus the prior counters seeded into this run's.
 
@@ -83,17 +168,12 @@ def progress_check(csv_pano_log_path):
     Row-tolerant on the gsv._load_depth_log model: a line torn by a crash mid-append (or a float minted by
     the old rewrite path) is skipped, so a damaged ledger degrades to re-attempting a few panos instead of a
     ParserError that crashes every future run (#55). Reads with csv, not pandas, so the id type can never
-    depend on what the ids happen to look like (#46).
+    depend on what the ids happen to look like (#46). With --ledger-index, through the ledger's snapshot
+    (downloaders/ledger_index.py): the same answer, without re-parsing every row.
     """
-    ledgered_ids, total_processed, total_success = set(), 0, 0
-    with open(csv_pano_log_path, newline='') as f:
-        for row in csv.reader(f):
-            if len(row) != 2 or row[0] == 'pano_id' or row[1] not in ('0', '1'):
-                continue
-            ledgered_ids.add(row[0])
-            total_processed += 1
-            total_success += row[1] == '1'
-    return ledgered_ids, total_processed, total_success, total_processed - total_success
+    summary = ledger_index.read_ledger(csv_pano_log_path, IMAGE_LEDGER_STATUSES)
+    total_processed, total_success = summary.rows['0'] + summary.rows['1'], summary.rows['1']
+    return summary.ids['0'] | summary.ids['1'], total_processed, total_success, total_processed - total_success
 
 
 def _normalize_pano_records(records):
@@ -290,7 +370,67 @@ def filter_supported_sources(pano_infos):
     return [p for p in pano_infos if p.get('source') in supported]
 
 
-def download_panorama_images(storage_path, pano_infos, run_start_monotonic=None, max_runtime_minutes=None):
+class _CanvasBudget:
+    """Admission control for --pano-memory-mb, in bytes of decoded canvas.
+
+    Only ever touched from the main thread (panos are admitted and retired there), so it needs no lock.
+    Nothing in flight admits anything: a pano bigger than the whole cap still runs, alone, rather than
+    wedging the loop forever.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+
+    def admits(self, nbytes):
+        return self.in_use == 0 or self.in_use + nbytes <= self.limit_bytes
+
+    def take(self, nbytes):
+        self.in_use += nbytes
+
+    def release(self, nbytes):
+        self.in_use -= nbytes
+
+
+def _canvas_bytes(pano_info):
+    """What a pano's stitch holds decoded: 3 bytes per reported pixel, 384 MB at 16384x8192.
+
+    GSV only - Mapillary streams its JPEG to disk and never decodes it. A GSV pano with no dims fails before
+    any canvas exists, so it weighs nothing either.
+    """
+    if pano_info.get('source', 'gsv') != 'gsv':
+        return 0
+    try:
+        return int(pano_info['width']) * int(pano_info['height']) * 3
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+def download_panorama_images(storage_path, pano_infos, run_start_monotonic=None, max_runtime_minutes=None,
+                             pano_workers=1, pano_memory_mb=DEFAULT_PANO_MEMORY_MB, tile_cache_mb=0.0,
+                             write_workers=DEFAULT_WRITE_WORKERS, schedule_name=schedule.SHUFFLE):
+    """Download every unledgered pano's image, ledgering each permanent outcome in pano_id_log.csv.
+
+    Panos that have failed transiently on several runs in a row sit out a backoff window recorded beside the
+    ledger (downloaders/failure_log.py); they are neither attempted nor counted until it passes.
+
+    With pano_workers > 1 up to that many panos are in flight at once on a thread pool, so one pano's stitch
+    and save overlap the next one's tile fan-out. Everything with run-wide state stays on the main thread
+    regardless: the --max-runtime check (made before a pano is STARTED, as in the serial loop), the
+    counters, and the ledger - appended by exactly one writer, in completion order. pano_memory_mb caps the
+    decoded canvases in flight (see _CanvasBudget); a pano that does not fit waits for one to finish.
+    tile_cache_mb > 0 keeps a failed GSV pano's tiles for its retry (see downloaders/tile_cache.py). A pano
+    still downloading when the --max-runtime budget runs out is cut off (common.DeadlineExceeded) and counted
+    nowhere: it is not ledgered, and is attempted again next run.
+
+    write_workers > 0 moves GSV panos' encode-and-write off the workers (common.WriteBehind): a pano whose
+    download hands back a Future leaves its worker slot at once, keeps its canvas budget, and is counted and
+    ledgered when the write resolves - never before the rename, so a crash mid-write still leaves no row.
+
+    schedule_name picks the order candidates are attempted in (--schedule; see downloaders/schedule.py).
+
+    @return (success, fallback_success, fail, skipped, total_completed) - log.csv fields 7-11.
+    """
     success_count, skipped_count, fallback_success_count, fail_count, total_completed = 0, 0, 0, 0, 0
 
     # The attempted-pano ledger, in 'storage' alongside the pano results (see progress_check for semantics).
@@ -305,23 +445,33 @@ def download_panorama_images(storage_path, pano_infos, run_start_monotonic=None,
     skipped_count = prior_success
     fail_count = prior_fail
     total_completed = prior_total
-    # Partition before attempting anything, then shuffle - the depth phase's pattern (gsv.download_depth_maps).
+    # Partition before attempting anything, then order - the depth phase's pattern (gsv.download_depth_maps).
     # Iteration order is otherwise the server's, and since #41 a transiently-failing pano is never ledgered, so
     # it keeps its place at the head of that order forever: a cluster of panos that fail every night would be
     # re-attempted first every night, spending --max-runtime before the loop ever reaches new work. Ledgering
-    # every attempt used to guarantee the frontier advanced; nothing does now, so the shuffle has to.
+    # every attempt used to guarantee the frontier advanced; nothing does now, so the shuffle has to - and
+    # --schedule priority keeps it, as the tiebreak between panos of equal worth.
     # This also covers the #40 fallback: if /adminapi/panos itself ever returns a source-clustered list,
     # filter_supported_sources preserving that order no longer starves the sources behind the first cluster.
     candidates = [p for p in pano_infos if p['pano_id'] not in df_id_set]
+    # The shuffle spreads a failing cluster out; it does not stop each of its panos costing a full attempt every
+    # night. Panos that have failed transiently run after run sit out a doubling window first (see
+    # downloaders/failure_log.py) - still unledgered, so never a verdict, and attempted again once it passes.
+    failures = TransientFailureLog(os.path.join(storage_path, IMAGE_FAILURE_LOG_FILENAME))
+    failures.load(keep=lambda pano_id: pano_id not in df_id_set)
+    candidates, deferred = failures.partition(candidates)
+    if deferred:
+        print("IMAGEDOWNLOAD: %d panos are backing off after repeated transient failures and sit this run out"
+              % len(deferred))
     # Denominator = previously logged + panos we'll attempt this run, so it can never be exceeded.
     total_panos = prior_total + len(candidates)
-    random.shuffle(candidates)
+    schedule.order(candidates, schedule_name, schedule.image_weight)
 
     # One handle held for the whole phase, appended and flushed per row - the depth ledger's pattern (#55).
     # The old shape opened/closed the file per pano over sshfs, and carried a dead 'update' branch that,
     # when the #46 dtype mismatch made it reachable, rewrote the ENTIRE file per pano with mode='w' - O(n^2)
     # per run, and a crash mid-rewrite truncated the only image ledger in place.
-    with open(csv_pano_log_path, 'a', newline='') as ledger_file:
+    with open(csv_pano_log_path, 'a', newline='') as ledger_file, failures:
         # lineterminator='\n': csv.writer's excel default is '\r\n', but every existing image ledger was
         # written by pandas to_csv, whose default is os.linesep - '\n' on the Linux scraper boxes. Without
         # this pin, appending to a years-old ledger would mix line endings in one file and hand ops greps a
@@ -339,23 +489,17 @@ def download_panorama_images(storage_path, pano_infos, run_start_monotonic=None,
                 # downloaders' shard-dir setup swallows it for the same reason.
                 pass
 
-        for pano_info in candidates:
+        def record(pano_info, future, start_time, written=False):
+            """Count and (for a permanent verdict) ledger one finished pano. Main thread only.
+
+            @param written Whether future is the pano's write-behind (common.deferred_write) rather than its
+                           download: whatever that raises, the store raised.
+            """
+            nonlocal success_count, fallback_success_count, skipped_count, fail_count, total_completed
             pano_id = pano_info['pano_id']
-            # candidates is already filtered against the ledger; this still catches a duplicate id surviving
-            # intake, which would otherwise be downloaded and ledgered twice.
-            if pano_id in df_id_set:
-                continue
-            if max_runtime_minutes is not None and run_start_monotonic is not None:
-                # time.monotonic, not the wall clock: an NTP step or DST transition must not stretch or shrink
-                # the budget (#51).
-                elapsed_minutes = (time.monotonic() - run_start_monotonic) / 60.0
-                if elapsed_minutes >= max_runtime_minutes:
-                    print("IMAGEDOWNLOAD: Max runtime of %.1f minutes reached (%.1f elapsed). Stopping." % (max_runtime_minutes, elapsed_minutes))
-                    break
-            start_time = time.time()
-            print("IMAGEDOWNLOAD: Processing pano %s " % (pano_id))
-            try:
-                result_code = download_pano(storage_path, pano_info)
+            error = future.exception()
+            if error is None:
+                result_code = future.result()
                 if result_code == DownloadResult.success:
                     success_count += 1
                 elif result_code == DownloadResult.fallback_success:
@@ -365,26 +509,118 @@ def download_panorama_images(storage_path, pano_infos, run_start_monotonic=None,
                 elif result_code == DownloadResult.failure:
                     fail_count += 1
                 downloaded = 0 if result_code == DownloadResult.failure else 1
-
-            except Exception as e:
-                # Transient (network, storage, a bug): counted in THIS run's failures but NOT ledgered, so
+            elif isinstance(error, DeadlineExceeded):
+                # Cut off mid-download at the --max-runtime deadline (common.deadline). The budget's doing, not
+                # the pano's: neither a failure nor a strike toward its backoff. Not ledgered, so it is simply
+                # attempted again next run, like a pano that never started.
+                downloaded = None
+                logging.info("IMAGEDOWNLOAD: Pano %s was cut off at the max runtime; it is retried next run", pano_id)
+            elif isinstance(error, Exception) and (written or is_storage_failure(error)):
+                # The store failed the write - ENOSPC/EIO, an sshfs mount gone. Counted and not ledgered, like any
+                # transient failure, but no strike toward the pano's backoff: a full or unmounted store fails every
+                # pano alike, and backing each off would leave the backlog sitting out for nights after the store
+                # is fixed - the depth phase's rule (gsv.download_depth_maps).
+                fail_count += 1
+                downloaded = None
+                logging.error("IMAGEDOWNLOAD: Could not store pano %s: %s", pano_id, str(error))
+            elif isinstance(error, Exception):
+                # Transient (network, a bug): counted in THIS run's failures but NOT ledgered, so
                 # the pano is re-attempted next run - the depth ledger's semantics (#41). Only the
                 # downloader's own verdict (DownloadResult.failure above: the source has nothing for this
                 # pano) is permanent and writes the terminal 0-row.
                 fail_count += 1
                 downloaded = None
-                logging.error("IMAGEDOWNLOAD: Failed to download pano %s due to error %s", pano_id, str(e))
+                logging.error("IMAGEDOWNLOAD: Failed to download pano %s due to error %s", pano_id, str(error))
+                failures.failed(pano_id, type(error).__name__)
+            else:
+                # Not Exception: whatever a worker thread died of must stop the run the way it would have
+                # stopped the serial loop, not be counted as one pano's bad night.
+                raise error
             total_completed = success_count + fallback_success_count + fail_count + skipped_count
 
             if downloaded is not None:
                 ledger.writerow([pano_id, downloaded])
                 ledger_file.flush()
                 df_id_set.add(pano_id)
+                failures.resolved(pano_id)
 
             print("IMAGEDOWNLOAD: Completed %d of %d (%d success, %d fallback success, %d failed, %d skipped)"
                   % (total_completed, total_panos, success_count, fallback_success_count, fail_count, skipped_count))
             print("--- %s seconds ---" % (time.time() - start_time))
 
+        canvases = _CanvasBudget(pano_memory_mb * 1024 * 1024)
+        pending = collections.deque(candidates)
+        in_flight = {}  # future -> (pano_info, start time, canvas bytes)
+        writing = {}    # the same, for panos downloaded and waiting on their write-behind
+        tile_cache = None
+        if tile_cache_mb > 0:
+            tile_cache = TileCache(os.path.join(storage_path, TILE_CACHE_DIRNAME), int(tile_cache_mb * 1024 * 1024))
+            # A pano ledgered since its tiles were spilled - by this store's last run or another user's - will
+            # never ask for them again.
+            tile_cache.cleanup(keep=lambda pano_id: pano_id not in df_id_set)
+        # One event loop and one keep-alive tile pool for the whole phase, shared by every pano worker (see
+        # gsv.TileSession). Outside the executor on purpose: the pool must outlive the last pano using it.
+        # The deadline is the admission check's, pushed into the downloads: a pano still fetching when the
+        # budget runs out is cut off there rather than overrunning the cron slot by its whole fan-out.
+        run_deadline = None
+        if max_runtime_minutes is not None and run_start_monotonic is not None:
+            run_deadline = run_start_monotonic + max_runtime_minutes * 60.0
+        with gsv.tile_session(cache=tile_cache), write_behind(write_workers), deadline(run_deadline):
+            executor = (InlineExecutor() if pano_workers == 1
+                        else concurrent.futures.ThreadPoolExecutor(max_workers=pano_workers,
+                                                                   thread_name_prefix='pano-worker'))
+            try:
+                while pending or in_flight or writing:
+                    while pending and len(in_flight) < pano_workers:
+                        pano_info = pending[0]
+                        pano_id = pano_info['pano_id']
+                        # candidates is already filtered against the ledger; this still catches a duplicate id
+                        # surviving intake, which would otherwise be downloaded and ledgered twice - including
+                        # one whose twin is still in flight on another worker.
+                        if pano_id in df_id_set or any(p['pano_id'] == pano_id
+                                                       for p, _, _ in (*in_flight.values(), *writing.values())):
+                            pending.popleft()
+                            continue
+                        if max_runtime_minutes is not None and run_start_monotonic is not None:
+                            # time.monotonic, not the wall clock: an NTP step or DST transition must not stretch
+                            # or shrink the budget (#51).
+                            elapsed_minutes = (time.monotonic() - run_start_monotonic) / 60.0
+                            if elapsed_minutes >= max_runtime_minutes:
+                                print("IMAGEDOWNLOAD: Max runtime of %.1f minutes reached (%.1f elapsed). Stopping." % (max_runtime_minutes, elapsed_minutes))
+                                # Panos already in flight are cut off at the same deadline and recorded below;
+                                # nothing new starts.
+                                pending.clear()
+                                break
+                        canvas_bytes = _canvas_bytes(pano_info)
+                        if not canvases.admits(canvas_bytes):
+                            break
+                        pending.popleft()
+                        canvases.take(canvas_bytes)
+                        start_time = time.time()
+                        print("IMAGEDOWNLOAD: Processing pano %s " % (pano_id))
+                        future = executor.submit(download_pano, storage_path, pano_info)
+                        in_flight[future] = (pano_info, start_time, canvas_bytes)
+                    if not in_flight and not writing:
+                        continue
+                    done, _ = concurrent.futures.wait([*in_flight, *writing],
+                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        written = future in writing
+                        if written:
+                            pano_info, start_time, canvas_bytes = writing.pop(future)
+                        else:
+                            pano_info, start_time, canvas_bytes = in_flight.pop(future)
+                            if future.exception() is None and isinstance(future.result(), concurrent.futures.Future):
+                                writing[future.result()] = (pano_info, start_time, canvas_bytes)
+                                continue
+                        canvases.release(canvas_bytes)
+                        record(pano_info, future, start_time, written)
+            finally:
+                # On the way out after a SIGTERM or a worker's fatal error, drop what has not started; panos
+                # already running finish on their own (a thread cannot be killed) and write atomically, and are
+                # simply re-registered as skipped by the next run.
+                executor.shutdown(wait=True, cancel_futures=True)
+
     logging.debug(
         "IMAGEDOWNLOAD: Final result: Completed %d of %d (%d success, %d fallback success, %d failed, %d skipped)",
         total_completed,
@@ -422,7 +658,10 @@ def write_log_csv_row(storage_location, fields):
 
 
 def run_scraper_and_log_results(storage_location, image_pano_infos, depth_pano_infos, skip_depth,
-                                max_runtime_minutes=None, max_depth_requests=None, min_depth_runtime=0.0):
+                                max_runtime_minutes=None, max_depth_requests=None, min_depth_runtime=0.0,
+                                pano_workers=1, pano_memory_mb=DEFAULT_PANO_MEMORY_MB, tile_cache_mb=0.0,
+                                write_workers=DEFAULT_WRITE_WORKERS, schedule_name=schedule.SHUFFLE,
+                                concurrent_phases=False, depth_workers=1, depth_codec=gsv.DEFAULT_DEPTH_CODEC):
     """Run the image and depth phases and append this run's row to log.csv.
 
     Fields are accumulated as each phase completes and the row is written once, in a finally, padded to the
@@ -434,6 +673,15 @@ def run_scraper_and_log_results(storage_location, image_pano_infos, depth_pano_i
     @param image_pano_infos Panos eligible for image download (narrowed by --all-panos).
     @param depth_pano_infos Every supported pano; the depth phase filters this to source == 'gsv' itself.
     @param min_depth_runtime Minutes of max_runtime_minutes reserved for the depth phase (see the flag's help).
+    @param pano_workers Panos in flight at once in the image phase (--pano-workers).
+    @param pano_memory_mb Cap on their decoded canvases (--pano-memory-mb).
+    @param tile_cache_mb Size of the failed-pano tile cache; 0 turns it off (--tile-cache-mb).
+    @param write_workers Background encode-and-write threads; 0 writes inline (--write-workers).
+    @param schedule_name The order both phases attempt their candidates in (--schedule).
+    @param concurrent_phases Run the depth phase on its own thread beside the image phase rather than after it
+                             (--concurrent-phases).
+    @param depth_workers Photometa requests in flight at once in the depth phase (--depth-workers).
+    @param depth_codec The gsv.DepthCodec depth artifacts are written with (--depth-codec).
     """
     start_time = datetime.now()
     # Wall-clock datetimes feed the log; the runtime budget gets a monotonic reference instead (#51).
@@ -450,8 +698,16 @@ def run_scraper_and_log_results(storage_location, image_pano_infos, depth_pano_i
     # backfilled the depth phase returns in milliseconds, and reserving for it would burn image throughput for
     # nothing. Depth still ends at the total, so slack from a light image night rolls to depth rather than being
     # lost. No reservation when depth is skipped: the image phase keeps the whole window.
+    #
+    # Side by side (--concurrent-phases) there is no tail to reserve: depth runs from the first minute to the
+    # last, so it holds the whole window - at least any --min-depth-runtime that fits in it - whatever the image
+    # phase does, and the image phase keeps the whole window too.
     image_max_runtime = max_runtime_minutes
-    if max_runtime_minutes is not None and not skip_depth and min_depth_runtime > 0:
+    concurrent_phases = concurrent_phases and not skip_depth
+    if max_runtime_minutes is not None and concurrent_phases:
+        print("Budget: %.1f min total; image and depth phases run side by side and both get all of it"
+              % (max_runtime_minutes,))
+    elif max_runtime_minutes is not None and not skip_depth and min_depth_runtime > 0:
         depth_backlog = gsv.count_unresolved_depth(storage_location, gsv_panos)
         if depth_backlog:
             image_max_runtime = max(0.0, max_runtime_minutes - min_depth_runtime)
@@ -478,38 +734,80 @@ def run_scraper_and_log_results(storage_location, image_pano_infos, depth_pano_i
         xml_duration = int(round((xml_end_time - start_time).total_seconds() / 60.0))
         fields += [xml_res[0], xml_res[1], xml_res[2], xml_res[3], xml_duration]
 
-        # The budget arguments are passed by keyword deliberately: several changes have rewritten these call
-        # sites, and a positional resolution can put a datetime where a monotonic float belongs — a TypeError
-        # that only fires when --max-runtime is set, i.e. in the nightly cron and never in the suite.
-        im_res = download_panorama_images(storage_location, image_pano_infos,
-                                          run_start_monotonic=run_start_monotonic,
-                                          max_runtime_minutes=image_max_runtime)
-        im_end_time = datetime.now()
-        im_duration = int(round((im_end_time - xml_end_time).total_seconds() / 60.0))
-        fields += [im_res[0], im_res[1], im_res[2], im_res[3], im_res[4], im_duration]
-
-        # The depth phase runs after the image phase and ends at the shared --max-runtime, so it gets the
-        # reserved tail (when one was taken) plus whatever slack the image phase left. It iterates the full
-        # pano list — not the pano_id_log.csv-gated image loop, and not narrowed by --all-panos — which is what
-        # backfills depth for panos downloaded in earlier runs and for panos nobody has labelled.
-        if skip_depth:
-            depth_res = (0, 0, 0, 0)
-        else:
+        def image_phase():
+            # The budget arguments are passed by keyword deliberately: several changes have rewritten these call
+            # sites, and a positional resolution can put a datetime where a monotonic float belongs — a TypeError
+            # that only fires when --max-runtime is set, i.e. in the nightly cron and never in the suite.
+            return download_panorama_images(storage_location, image_pano_infos,
+                                            run_start_monotonic=run_start_monotonic,
+                                            max_runtime_minutes=image_max_runtime,
+                                            pano_workers=pano_workers, pano_memory_mb=pano_memory_mb,
+                                            tile_cache_mb=tile_cache_mb, write_workers=write_workers,
+                                            schedule_name=schedule_name)
+
+        # Set if the run is ending under a depth phase that runs on its own thread, so that thread stops too.
+        depth_stop = threading.Event()
+
+        def depth_phase():
+            """The depth phase's log.csv result, and when it ended."""
+            # The depth phase ends at the shared --max-runtime, so run after the image phase it gets the reserved
+            # tail (when one was taken) plus whatever slack the image phase left. It iterates the full pano list —
+            # not the pano_id_log.csv-gated image loop, and not narrowed by --all-panos — which is what backfills
+            # depth for panos downloaded in earlier runs and for panos nobody has labelled.
+            if skip_depth:
+                return (0, 0, 0, 0), datetime.now()
+            # Read when the phase starts: after the image phase, tonight's images already lift their panos' depth;
+            # beside it, only earlier nights' do.
+            imaged_ids = (downloaded_pano_ids(os.path.join(storage_location, "pano_id_log.csv"))
+                          if schedule_name == schedule.PRIORITY else set())
+            depth_order = functools.partial(schedule.order, schedule=schedule_name,
+                                            weight=schedule.depth_weight(imaged_ids))
             depth_res = gsv.download_depth_maps(storage_location, gsv_panos,
                                                 run_start_monotonic=run_start_monotonic,
                                                 max_runtime_minutes=max_runtime_minutes,
-                                                max_requests=max_depth_requests)
-        depth_end_time = datetime.now()
-        depth_duration = int(round((depth_end_time - im_end_time).total_seconds() / 60.0))
+                                                max_requests=max_depth_requests, order=depth_order,
+                                                stop=depth_stop if concurrent_phases else None,
+                                                depth_workers=depth_workers, depth_codec=depth_codec)
+            return depth_res, datetime.now()
+
+        if concurrent_phases:
+            # The image phase is tile bandwidth and stitching CPU against the CBK host; the depth phase is one
+            # paced photometa request at a time against another endpoint. Back to back, each spent the window
+            # waiting on the other. The image phase stays on the main thread, where a SIGTERM lands; whatever
+            # ends the run there stops the depth thread before the pool is joined.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='depth-phase') as pool:
+                try:
+                    depth_future = pool.submit(depth_phase)
+                    im_res = image_phase()
+                    im_end_time = datetime.now()
+                    fields += [im_res[0], im_res[1], im_res[2], im_res[3], im_res[4],
+                               int(round((im_end_time - xml_end_time).total_seconds() / 60.0))]
+                    depth_res, depth_end_time = depth_future.result()
+                except BaseException:
+                    depth_stop.set()
+                    raise
+            depth_start_time = xml_end_time
+        else:
+            im_res = image_phase()
+            im_end_time = datetime.now()
+            fields += [im_res[0], im_res[1], im_res[2], im_res[3], im_res[4],
+                       int(round((im_end_time - xml_end_time).total_seconds() / 60.0))]
+            depth_res, depth_end_time = depth_phase()
+            depth_start_time = im_end_time
+        # Each phase's duration is its own, so side by side the two add up to more than the run took.
+        depth_duration = int(round((depth_end_time - depth_start_time).total_seconds() / 60.0))
         fields += [depth_res[0], depth_res[1], depth_res[2], depth_res[3], depth_duration]
 
-        fields.append(int(round((depth_end_time - start_time).total_seconds() / 60.0)))
+        fields.append(int(round((max(im_end_time, depth_end_time) - start_time).total_seconds() / 60.0)))
     finally:
         write_log_csv_row(storage_location, fields)
 
 
 def run(sidewalk_server_fqdn, storage_location, pano_metadata_csv=None, all_panos=False, skip_depth=False,
-        max_runtime_minutes=None, min_depth_runtime=0.0, max_depth_requests=None):
+        max_runtime_minutes=None, min_depth_runtime=0.0, max_depth_requests=None, pano_workers=1,
+        pano_memory_mb=DEFAULT_PANO_MEMORY_MB, tile_cache_mb=0.0, write_workers=DEFAULT_WRITE_WORKERS,
+        schedule_name=schedule.SHUFFLE, index_ledgers=False, concurrent_phases=False, depth_workers=1,
+        depth_codec=gsv.DEFAULT_DEPTH_CODEC):
     """Fetch the pano list, narrow it, and run the scrape - the whole job, minus process-level setup.
 
     main() owns argv parsing, directory creation, logging, and signal handling; this seam takes plain
@@ -546,9 +844,16 @@ def run(sidewalk_server_fqdn, storage_location, pano_metadata_csv=None, all_pano
     # Use pano_id list and associated info to gather panos from respective APIs
     print("Fetching Panoramas")
     try:
-        run_scraper_and_log_results(storage_location, image_pano_infos, pano_infos, skip_depth,
-                                    max_runtime_minutes=max_runtime_minutes,
-                                    max_depth_requests=max_depth_requests, min_depth_runtime=min_depth_runtime)
+        # --ledger-index: every ledger read below, both phases' and the budget split's, goes through the snapshots.
+        # The store catalog answers both phases' "is it already on the store?" from shard listings.
+        with ledger_index.indexing(index_ledgers), store_catalog.cataloguing():
+            run_scraper_and_log_results(storage_location, image_pano_infos, pano_infos, skip_depth,
+                                        max_runtime_minutes=max_runtime_minutes,
+                                        max_depth_requests=max_depth_requests, min_depth_runtime=min_depth_runtime,
+                                        pano_workers=pano_workers, pano_memory_mb=pano_memory_mb,
+                                        tile_cache_mb=tile_cache_mb, write_workers=write_workers,
+                                        schedule_name=schedule_name, concurrent_phases=concurrent_phases,
+                                        depth_workers=depth_workers, depth_codec=depth_codec)
     except BaseException:
         # run_scraper_and_log_results's own finally has already written the evidence row; this puts the
         # traceback - otherwise stderr-only, the exact channel that dies with the container - into scrape.log
@@ -595,7 +900,10 @@ def main(argv=None):
 
     run(sidewalk_server_fqdn=args.d, storage_location=args.s, pano_metadata_csv=args.c,
         all_panos=args.all_panos, skip_depth=args.skip_depth, max_runtime_minutes=args.max_runtime,
-        min_depth_runtime=args.min_depth_runtime, max_depth_requests=args.max_depth_requests)
+        min_depth_runtime=args.min_depth_runtime, max_depth_requests=args.max_depth_requests,
+        pano_workers=args.pano_workers, pano_memory_mb=args.pano_memory_mb, tile_cache_mb=args.tile_cache_mb,
+        write_workers=args.write_workers, schedule_name=args.schedule, index_ledgers=args.ledger_index,
+        concurrent_phases=args.concurrent_phases, depth_workers=args.depth_workers, depth_codec=args.depth_codec)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+# !/usr/bin/python3
+"""Benchmark of the depth-artifact codecs (gsv.parse_depth_codec): size, encode time and decode time.
+
+Each codec writes the same v4 artifacts - synthetic street-scene payloads from benchmarks/payloads.py - to
+memory, and each result is read back the way consumers read it (gsv.read_depth_artifact, which decodes
+plane_indices, then the raster fetched out of it). Encoding runs on the depth phase's writer, once per pano;
+decoding runs in every consumer, once per read. np.savez_compressed, which the writer called before codecs
+existed, is the baseline. Every codec must give the plane fields back exactly, or the run fails.
+
+Usage:
+    python3 benchmarks/depth_codecs.py [--panos N] [--repeat N] [--codecs SPEC,SPEC,...]
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from payloads import gsv, street_planes  # noqa: E402
+
+CODECS = ('store', 'deflate:1', 'deflate', 'deflate:9', 'delta:1', 'delta', 'packed:0', 'packed:1', 'packed')
+BASELINE = 'np.savez_compressed'
+
+
+def artifact_fields(planes):
+    """The fields _write_depth_artifact stores for a pano with these planes."""
+    return {'plane_indices': planes.indices, 'planes_n': planes.normals, 'planes_d': planes.distances,
+            'heading': 1.25, 'pitch': 0.02, 'roll': -0.01, 'format_version': gsv.DEPTH_ARTIFACT_FORMAT_VERSION}
+
+
+def encode(spec, fields):
+    """The .npz bytes of fields under the codec spec (or the baseline)."""
+    f = io.BytesIO()
+    if spec == BASELINE:
+        np.savez_compressed(f, **fields)
+    else:
+        gsv.save_depth_fields(f, fields, gsv.parse_depth_codec(spec))
+    return f.getvalue()
+
+
+def measure(spec, payloads, repeat):
+    """(mean bytes, median encode ms, median decode ms) per artifact for spec over payloads."""
+    fields = [artifact_fields(planes) for planes in payloads]
+    encoded = [encode(spec, artifact) for artifact in fields]
+    encode_times, decode_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for artifact in fields:
+            encode(spec, artifact)
+        encode_times.append((time.perf_counter() - start) / len(fields))
+        start = time.perf_counter()
+        for data in encoded:
+            gsv.read_depth_artifact(io.BytesIO(data))['plane_indices']
+        decode_times.append((time.perf_counter() - start) / len(fields))
+    return (statistics.mean(len(data) for data in encoded), statistics.median(encode_times) * 1e3,
+            statistics.median(decode_times) * 1e3)
+
+
+def mismatched_panos(spec, payloads):
+    """How many payloads spec does not give back exactly, field for field."""
+    mismatched = 0
+    for planes in payloads:
+        fields = artifact_fields(planes)
+        artifact = gsv.read_depth_artifact(io.BytesIO(encode(spec, fields)))
+        mismatched += any(not np.array_equal(artifact[name], fields[name]) for name in fields)
+    return mismatched
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare depth-artifact codecs on synthetic 256x512 street-scene '
+                                                 'payloads: bytes per artifact, encode and decode time.')
+    parser.add_argument('--panos', type=int, default=20, help='Distinct synthetic payloads. Default 20.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed passes over them; the median is '
+                                                              'reported. Default 5.')
+    parser.add_argument('--codecs', default=','.join(CODECS),
+                        help='Comma-separated codec specs to compare. Default: %s.' % ','.join(CODECS))
+    args = parser.parse_args(argv)
+
+    specs = [BASELINE] + args.codecs.split(',')
+    payloads = [street_planes(seed) for seed in range(args.panos)]
+    print("%-20s %12s %12s %12s" % ('codec', 'KB / pano', 'encode ms', 'decode ms'))
+    for spec in specs:
+        size, encode_ms, decode_ms = measure(spec, payloads, args.repeat)
+        print("%-20s %12.1f %12.2f %12.2f" % (spec, size / 1024, encode_ms, decode_ms))
+
+    mismatched = {spec: mismatched_panos(spec, payloads) for spec in specs}
+    failures = ['%s (%d pano(s))' % (spec, count) for spec, count in mismatched.items() if count]
+    print("round trip: %s" % ('exact' if not failures else 'NOT EXACT - ' + ', '.join(failures)))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
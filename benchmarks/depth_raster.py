@@ -0,0 +1,96 @@
+# !/usr/bin/python3
+"""Microbenchmark for gsv._compute_depth_raster against the formulation it replaced.
+
+The reference below is the raster computation as it stood before it was rewritten: a float64 (h, w, 3) ray
+array built per call, (h, w, 3) normals and (h, w) offsets gathered by fancy indexing, and an einsum. The
+benchmark times both on the same synthetic street-scene payloads (benchmarks/payloads.py), reports the peak
+memory each allocates per call, and checks that the two agree bit for bit - the rewrite is only worth having
+if it is exact, since migrate_depth_artifacts.py drops a v3 raster on the strength of it.
+
+Usage:
+    python3 benchmarks/depth_raster.py [--panos N] [--repeat N]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from payloads import gsv, street_planes  # noqa: E402
+
+
+def reference_raster(planes):
+    """The pre-rewrite _compute_depth_raster, verbatim in its arithmetic."""
+    indices = planes.indices
+    height, width = indices.shape
+    theta = (height - np.arange(height) - 0.5) / height * np.pi
+    phi = (width - np.arange(width) - 0.5) / width * 2.0 * np.pi + np.pi / 2.0
+    if len(planes.normals) == 0:
+        return np.full((height, width), gsv.DEPTH_NO_PLANE, dtype=np.float32)
+    rays = np.empty((height, width, 3))
+    rays[..., 0] = np.sin(theta)[:, None] * np.cos(phi)[None, :]
+    rays[..., 1] = np.sin(theta)[:, None] * np.sin(phi)[None, :]
+    rays[..., 2] = np.broadcast_to(np.cos(theta)[:, None], (height, width))
+    index_grid = indices.astype(np.intp)
+    normals = np.asarray(planes.normals, dtype=np.float64)[index_grid]
+    offsets = np.asarray(planes.distances, dtype=np.float64)[index_grid]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raster = np.abs(offsets / np.einsum('hwc,hwc->hw', rays, normals))
+    return np.where(index_grid == 0, gsv.DEPTH_NO_PLANE, raster).astype(np.float32)
+
+
+IMPLEMENTATIONS = (('reference (h, w, 3) einsum', reference_raster),
+                   ('gsv._compute_depth_raster', gsv._compute_depth_raster))
+
+
+def measure(compute, payloads, repeat):
+    """(median ms per pano, peak bytes allocated by one call) for compute over payloads."""
+    compute(payloads[0])  # warm the ray cache, as every pano after a process's first finds it
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for planes in payloads:
+            compute(planes)
+        timings.append((time.perf_counter() - start) / len(payloads))
+    tracemalloc.start()
+    compute(payloads[0])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings) * 1e3, peak
+
+
+def mismatched_panos(payloads):
+    """How many payloads the two implementations do not agree on bit for bit (NaN payloads included)."""
+    return sum(not np.array_equal(reference_raster(planes).view(np.uint32),
+                                  gsv._compute_depth_raster(planes).view(np.uint32)) for planes in payloads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time gsv._compute_depth_raster against the formulation it '
+                                                 'replaced, on synthetic 256x512 street-scene payloads.')
+    parser.add_argument('--panos', type=int, default=20, help='Distinct synthetic payloads. Default 20.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed passes over them; the median is '
+                                                              'reported. Default 5.')
+    args = parser.parse_args(argv)
+
+    payloads = [street_planes(seed) for seed in range(args.panos)]
+    print("%-28s %12s %14s" % ('implementation', 'ms / pano', 'peak MB / call'))
+    results = {}
+    for name, compute in IMPLEMENTATIONS:
+        results[name] = measure(compute, payloads, args.repeat)
+        print("%-28s %12.2f %14.1f" % (name, results[name][0], results[name][1] / 2 ** 20))
+    (reference, _), (current, _) = IMPLEMENTATIONS
+    print("speed-up: %.1fx" % (results[reference][0] / results[current][0]))
+
+    mismatched = mismatched_panos(payloads)
+    print("bit-for-bit: %s" % ('yes' if not mismatched else 'NO - %d pano(s) differ' % mismatched))
+    return 1 if mismatched else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,47 @@
+# Synthetic depth payloads for the benchmarks in this directory.
+#
+# The repo carries no captured photometa responses (the suite is network-free, and a real payload is Google's
+# data), so the benchmarks run on planes shaped like a street scene instead. The numbers that matter - run
+# lengths of equal indices, how many planes, where the sky and the ground are - follow what a real 256x512
+# payload looks like: sky (index 0) across the top, a ground plane under the whole horizon, facade planes in
+# column bands of varying width and height between them, and a few small planes (curbs, cars) near the horizon.
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from downloaders import gsv  # noqa: E402
+
+HEIGHT, WIDTH = 256, 512
+
+
+def street_planes(seed, height=HEIGHT, width=WIDTH, facades=30, clutter=8):
+    """A gsv.DepthPlanes for one synthetic street-scene pano, deterministic in `seed`.
+
+    Plane 0 is the never-dereferenced no-plane entry, plane 1 the ground, then the facades and the clutter.
+    """
+    rng = np.random.default_rng(seed)
+    horizon = height // 2
+    indices = np.zeros((height, width), dtype=np.uint8)
+    normals = [[0.0, 0.0, 0.0], [rng.normal(0, 0.02), rng.normal(0, 0.02), 1.0]]
+    distances = [0.0, -rng.uniform(2.2, 2.8)]
+    indices[horizon:, :] = 1
+
+    edges = np.sort(rng.choice(np.arange(1, width), size=facades - 1, replace=False))
+    for left, right in zip(np.concatenate([[0], edges]), np.concatenate([edges, [width]])):
+        azimuth = rng.uniform(0, 2 * np.pi)
+        normals.append([np.cos(azimuth), np.sin(azimuth), rng.normal(0, 0.01)])
+        distances.append(rng.uniform(3.0, 40.0))
+        top = int(rng.integers(horizon // 4, horizon))
+        indices[top:horizon + int(rng.integers(0, 6)), left:right] = len(normals) - 1
+
+    for _ in range(clutter):
+        azimuth = rng.uniform(0, 2 * np.pi)
+        normals.append([np.cos(azimuth), np.sin(azimuth), rng.normal(0, 0.3)])
+        distances.append(rng.uniform(1.5, 15.0))
+        row, col = int(rng.integers(horizon - 8, horizon + 24)), int(rng.integers(0, width - 40))
+        indices[row:row + int(rng.integers(3, 12)), col:col + int(rng.integers(8, 40))] = len(normals) - 1
+
+    return gsv.DepthPlanes(indices, np.asarray(normals, dtype=np.float32), np.asarray(distances, dtype=np.float32))
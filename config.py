@@ -1,12 +1,29 @@
-# Threads to use for asyncio - test but usually more threads the better as I/O task
+# Tiles in flight at the start of a run. The image phase adapts from here as it goes (see
+# downloaders/gsv.py's _AdaptiveConcurrency): up while throughput holds, halved when Google pushes back.
 thread_count = 8
 
+# The most tiles the adaptive controller will ever have in flight at once, across every pano in the run.
+tile_concurrency_max = 32
+
+# Assemble a native-zoom GSV pano from its tiles' DCT coefficients instead of decoding and re-encoding them
+# (downloaders/jpeg_dct.py): no second generation of JPEG loss, and no full-frame encode. Needs the optional
+# jpeglib (`pip3 install jpeglib`, not in requirements.txt), and is off unless asked for - it is the newer, less
+# travelled path, and a pano it cannot copy as it is falls back to the Pillow stitch anyway.
+lossless_stitch = False
+
 # Proxy settings - if proxy not added, leave as is
 proxies = {
     "http": "http://",
     "https": "http://",
 }
 
+# Host-wide request budget, shared by every DownloadRunner on this machine that names the same directory: set
+# the directory and a rate to have overlapping city runs draw tile and depth requests from one budget, split
+# fairly between them, instead of each pacing itself (see downloaders/host_limiter.py). None / 0 disable.
+host_rate_limit_dir = None
+host_tile_requests_per_second = 0
+host_depth_requests_per_second = 0
+
 # Minimum seconds between GSV depth-map metadata requests; 0 disables the throttle. The depth phase is already
 # serial (one request in flight at a time, unlike the image phase's `thread_count` fan-out), so this is a further,
 # deliberate slowdown. Leave it at 0 unless a canary run shows Google pushing back: the backfill is inherently a
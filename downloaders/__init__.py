@@ -1,5 +1,6 @@
-from . import gsv, mapillary
-from .common import DownloadResult
+from . import (depth_pack, depth_sampling, failure_log, gsv, host_limiter, ledger_index, mapillary, schedule,
+               store_catalog, tile_cache)
+from .common import DeadlineExceeded, DownloadResult
 
 
 def download_pano(storage_path, pano_info):
@@ -15,6 +16,13 @@ def download_pano(storage_path, pano_info):
     Both downloaders are held to this by tests/test_image_downloaders.py. The corollary they also honour:
     an image on disk IS the resume marker, so every write goes through common.atomic_output_path - a
     download killed mid-write must leave nothing rather than a truncated file the next run reports as done.
+
+    While a common.write_behind stage is installed (the image phase's --write-workers), a GSV download may
+    return a concurrent.futures.Future of its DownloadResult instead: the pano is stitched and its encode and
+    write are queued. The Future carries the same contract - the verdict, or the exception.
+
+    While a common.deadline is installed (the image phase's --max-runtime), a download still fetching when it
+    passes is cut off and raises common.DeadlineExceeded: a raise like any other, so the pano retries next run.
     """
     source = pano_info.get('source', 'gsv')
     if source == 'gsv':
@@ -24,4 +32,5 @@ def download_pano(storage_path, pano_info):
     raise ValueError(f"Unknown pano source: {source!r}")
 
 
-__all__ = ['DownloadResult', 'download_pano', 'gsv', 'mapillary']
+__all__ = ['DeadlineExceeded', 'DownloadResult', 'depth_pack', 'depth_sampling', 'download_pano', 'failure_log',
+           'gsv', 'host_limiter', 'ledger_index', 'mapillary', 'schedule', 'store_catalog', 'tile_cache']
@@ -1,6 +1,15 @@
+import concurrent.futures
 import contextlib
 import enum
 import os
+import stat
+import threading
+import time
+
+import aiohttp
+import requests
+
+from . import store_catalog
 
 
 class DownloadResult(enum.Enum):
@@ -24,6 +33,15 @@ class DownloadResult(enum.Enum):
     failure = 'failure'
 
 
+class DeadlineExceeded(Exception):
+    """The run's --max-runtime deadline passed while a pano was still being fetched.
+
+    Its requests were abandoned where they stood and nothing was written for it. Raised, so transient under
+    the #41 ledger contract: the pano is not ledgered and is attempted again next run. The phases count it as
+    neither a success nor a failure - the budget ran out, the pano did nothing wrong.
+    """
+
+
 @contextlib.contextmanager
 def atomic_output_path(final_path, mode=0o664):
     """Yield a '<final_path>.part' to write to, then chmod and rename it into place.
@@ -36,16 +54,178 @@ def atomic_output_path(final_path, mode=0o664):
     very next run reaches the exists() check and records the stub as downloaded=1.
 
     The .part is removed on any exception (including SystemExit from the SIGTERM translation), because
-    nothing else ever cleans it up and the retry writes to the same name.
+    nothing else ever cleans it up and the retry writes to the same name. A file that lands is added to the
+    run's store_catalog, so a directory listed before it was written still answers for it.
     """
     tmp_path = final_path + '.part'
     try:
         yield tmp_path
         os.chmod(tmp_path, mode)
         os.replace(tmp_path, final_path)
-    except BaseException:
+        store_catalog.added(final_path)
+    except BaseException as e:
         try:
             os.remove(tmp_path)
         except OSError:
             pass
+        if isinstance(e, OSError) and not isinstance(e, (requests.RequestException, aiohttp.ClientError)):
+            # The write, the chmod or the rename failed - the store's doing (see is_storage_failure). The
+            # network errors are excluded by name because they subclass OSError too, and a download that streams
+            # straight into the .part (mapillary) raises them from inside this block.
+            e.storage_failure = True
         raise
+
+
+def is_storage_failure(error):
+    """Whether error was raised writing an output (atomic_output_path) rather than fetching it.
+
+    A full, read-only or unmounted store fails every pano alike, so the phases count these without holding
+    them against the pano (failure_log.TransientFailureLog): a pano backed off for a storage failure would sit
+    out nights after the store was fixed.
+    """
+    return getattr(error, 'storage_failure', False)
+
+
+def ensure_shard_dir(path):
+    """Create the shard directory `path` (<storage>/<pano_id[:2]>) unless it exists, group-writable and setgid
+    so every lab user's runs can write into it. Checked through the run's store_catalog, so a shard that
+    exists costs no stat once the store root has been listed."""
+    if store_catalog.isdir(path):
+        return
+    # exist_ok: concurrent city runs, and the image and depth phases, race on shard dirs.
+    os.makedirs(path, exist_ok=True)
+    try:
+        os.chmod(path, 0o775 | stat.S_ISGID)
+    except PermissionError:
+        pass  # lost the race to another user's process; their dir, their modes — must not fail the pano
+    store_catalog.made_dir(path)
+
+
+class WriteBehind:
+    """A small thread pool that encodes and writes finished panos while the downloader moves on.
+
+    A full pano's JPEG encode plus its write to the sshfs store is seconds of work the network path used to
+    sit through before it could start the next pano. submit() hands it here instead and returns a Future of
+    the pano's DownloadResult; the image loop ledgers the pano only once that Future resolves - after the
+    atomic rename - so the resume semantics are those of an inline write.
+
+    Bounded: at most `workers` writes running plus `workers` queued. A submit past that blocks its caller
+    until a write finishes, so a store slower than the network holds back the downloads rather than piling
+    decoded canvases up in memory.
+    """
+
+    def __init__(self, workers):
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pano-writer')
+        self._slots = threading.BoundedSemaphore(2 * workers)
+
+    def submit(self, write):
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(write)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _future: self._slots.release())
+        return future
+
+    def close(self):
+        """Finish the writes already running; drop the queued ones (their panos are simply not ledgered, and
+        are retried next run - the same as a pano still downloading when the run stops)."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+class InlineExecutor:
+    """The one-worker stand-in for a ThreadPoolExecutor (--pano-workers 1, --depth-workers 1): runs each task on
+    the calling thread, as submit() is called.
+
+    Keeping the serial case on the calling thread is deliberate rather than a pool of one. A SIGTERM arrives as
+    SystemExit in whatever the main thread is doing, and here that is the download itself - so the stop lands
+    exactly where it did before worker pools existed, instead of in a wait() while a worker thread carries on.
+    Only Exception is captured into the future, for the same reason: anything else must propagate as itself.
+    """
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+# The run's WriteBehind, when one is installed (see write_behind).
+_write_behind = None
+
+
+@contextlib.contextmanager
+def write_behind(workers):
+    """Install a WriteBehind of `workers` threads for the duration of the block; 0 keeps writes inline."""
+    global _write_behind
+    if workers <= 0:
+        yield None
+        return
+    writer, previous = WriteBehind(workers), _write_behind
+    _write_behind = writer
+    try:
+        yield writer
+    finally:
+        _write_behind = previous
+        writer.close()
+
+
+def deferred_write(write):
+    """Run write() - a pano's encode, atomic write, and verdict - on the run's WriteBehind if there is one,
+    returning a Future of its DownloadResult, and inline (returning the DownloadResult itself) if not."""
+    writer = _write_behind
+    if writer is None:
+        return write()
+    return writer.submit(write)
+
+
+# The image phase's deadline, a time.monotonic() value, when it has one (see deadline).
+_deadline = None
+
+
+@contextlib.contextmanager
+def deadline(at):
+    """Install `at` - a time.monotonic() value, or None for none - as the deadline in-flight downloads are cut
+    off at, for the duration of the block.
+
+    The image phase installs its --max-runtime share here. The depth phase does not: under --concurrent-phases
+    it runs beside the image phase on its own thread, so it hands its deadline to its request session instead
+    (gsv._depth_session).
+    """
+    global _deadline
+    previous, _deadline = _deadline, at
+    try:
+        yield
+    finally:
+        _deadline = previous
+
+
+def seconds_left():
+    """Seconds until the installed deadline - 0 once it has passed - or None when there is no deadline."""
+    at = _deadline
+    if at is None:
+        return None
+    return max(0.0, at - time.monotonic())
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the installed deadline has passed."""
+    if seconds_left() == 0:
+        raise DeadlineExceeded('the run deadline has passed')
+
+
+def request_timeout(seconds):
+    """A request's timeout: `seconds`, capped by the time left before the installed deadline.
+
+    Raises DeadlineExceeded once the deadline has passed, so nothing new is sent after it.
+    """
+    left = seconds_left()
+    if left == 0:
+        raise DeadlineExceeded('the run deadline has passed')
+    return seconds if left is None else min(seconds, left)
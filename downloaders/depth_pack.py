@@ -0,0 +1,257 @@
+# Per-shard depth containers: a store's artifacts packed for memory-mapped random access.
+#
+# Every depth artifact is its own zip-compressed .npz, so reading one pano's depth costs a file open, a zip
+# directory parse and a zlib inflate - on the sshfs stores, several network round trips each. A training job
+# that jumps from pano to pano pays that for every one. A depth pack holds a whole shard's artifacts in one
+# uncompressed file, laid out so np.memmap maps it once and every pano after that is a page fault at most:
+#
+#   _MAGIC, then a one-line JSON header - section offsets, the index dtype, and the size and mtime of each .npz
+#              in the shard that is not packed - padded to _ALIGN
+#   index      one fixed-size record per pano, sorted by pano id: where its raster and planes are, its
+#              heading/pitch/roll/format_version, and the size and mtime of the .npz it was packed from
+#   normals    every pano's planes_n, concatenated: float32 (planes, 3)
+#   distances  every pano's planes_d, concatenated: float32 (planes,)
+#   rasters    every pano's plane_indices, concatenated: uint8, height * width each
+#
+# Sections start on _ALIGN boundaries and every number is little-endian, so a pack reads the same anywhere.
+#
+# Only artifacts with the plane fields (v3 and v4) are packed, and without a 'depth' raster: the planes
+# reconstruct it (gsv.DepthArtifact), so a pack is a quarter the size of the float raster alone. A v3 artifact
+# whose stored raster its planes do not reproduce bit for bit is left out, as migrate_depth_artifacts.py leaves
+# it v3. v1 and v2 artifacts have no planes to pack; readers fall back to the .npz for those.
+#
+# The .npz files stay the source of truth: a pack is a derived view, rebuilt from them by
+# pack_depth_artifacts.py whenever its shard has changed, and always safe to delete. "Changed" is exact: a pack
+# records the size and mtime of every .npz it was built from, packed or not (DepthPack.sources), so any
+# artifact written, rewritten or deleted since is noticed without opening one.
+
+import json
+import os
+
+import numpy as np
+
+from . import gsv
+from .common import atomic_output_path
+
+PACK_SUFFIX = '.depthpack'
+# The default home of a store's packs, under its root. Not a 2-char name, so nothing mistakes it for a shard.
+PACK_DIR_NAME = 'depth_packs'
+
+_MAGIC = b'SIDEWALK-DEPTH-PACK 1\n'
+# Section alignment: a cache line, and a divisor of every page size, so no section shares a line with another.
+_ALIGN = 64
+
+# The index record, less the pano id, whose width is the longest id in the pack (see _index_dtype).
+_INDEX_FIELDS = [('source_size', '<i8'), ('source_mtime_ns', '<i8'), ('height', '<u4'), ('width', '<u4'),
+                 ('raster_offset', '<u8'), ('plane_start', '<u8'), ('plane_count', '<u8'), ('heading', '<f8'),
+                 ('pitch', '<f8'), ('roll', '<f8'), ('format_version', '<i8')]
+_SCALAR_FIELDS = ('heading', 'pitch', 'roll', 'format_version')
+
+
+def _index_dtype(id_bytes):
+    return np.dtype([('pano_id', 'S%d' % max(id_bytes, 1))] + _INDEX_FIELDS)
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def pack_path(pack_dir, shard):
+    """Where the pack for shard (a pano_id[:2]) lives under pack_dir."""
+    return os.path.join(pack_dir, shard + PACK_SUFFIX)
+
+
+def _packable(path):
+    """The fields of the artifact at path to pack, without 'depth'.
+
+    @raise LookupError if it has no plane fields (v1, v2): nothing to pack, and not a failure.
+    @raise ValueError  if it is a v3 artifact whose planes do not reconstruct its stored raster bit for bit, or
+                       lacks a field the index holds.
+    """
+    fields = gsv._load_depth_fields(path)
+    if not all(name in fields for name in gsv._PLANE_FIELDS):
+        raise LookupError("no plane fields")
+    missing = [name for name in _SCALAR_FIELDS if name not in fields]
+    if missing:
+        raise ValueError("no %s field" % ', '.join(missing))
+    stored = fields.pop('depth', None)
+    if stored is not None:
+        rebuilt = gsv.DepthArtifact(dict(fields))['depth']
+        if stored.shape != rebuilt.shape or not np.array_equal(stored, rebuilt, equal_nan=True):
+            raise ValueError("the raster its planes reconstruct differs from the stored one")
+    if np.asarray(fields['plane_indices']).ndim != 2:
+        raise ValueError("plane_indices is not a raster")
+    return fields
+
+
+def write_pack(artifact_paths, path):
+    """Pack the artifacts at artifact_paths into one depth pack at path, atomically.
+
+    @param artifact_paths <pano_id>.depth.npz paths; the pano id is the file name.
+    @return               (packed, left_out, failed): pano ids packed, paths with no plane fields, and
+                          (path, reason) for artifacts that could not be packed.
+    """
+    records, normals, distances, rasters = [], [], [], []
+    left_out, failed = [], []
+    skipped = {}  # pano id -> [size, mtime_ns], for the artifacts not packed
+    planes = raster_bytes = 0
+    for artifact_path in sorted(artifact_paths, key=os.path.basename):
+        pano_id = os.path.basename(artifact_path)[:-len(gsv.DEPTH_ARTIFACT_SUFFIX)]
+        try:
+            stat = os.stat(artifact_path)
+        except OSError as e:
+            failed.append((artifact_path, str(e)))  # gone since it was listed: not recorded, so tried again
+            continue
+        try:
+            fields = _packable(artifact_path)
+            encoded_id = pano_id.encode('ascii')
+        except LookupError:
+            left_out.append(artifact_path)
+            skipped[pano_id] = [stat.st_size, stat.st_mtime_ns]
+            continue
+        except Exception as e:
+            # Unreadable, or a v3 raster the planes do not give back. Recorded, so the pack counts as current until
+            # the file changes rather than retrying it every run.
+            failed.append((artifact_path, str(e)))
+            skipped[pano_id] = [stat.st_size, stat.st_mtime_ns]
+            continue
+        indices = np.ascontiguousarray(fields['plane_indices'], dtype=np.uint8)
+        plane_normals = np.asarray(fields['planes_n'], dtype='<f4').reshape(-1, 3)
+        records.append((encoded_id, stat.st_size, stat.st_mtime_ns, indices.shape[0], indices.shape[1], raster_bytes,
+                        planes, len(plane_normals)) + tuple(fields[name] for name in _SCALAR_FIELDS))
+        normals.append(plane_normals)
+        distances.append(np.asarray(fields['planes_d'], dtype='<f4').reshape(-1))
+        rasters.append(indices)
+        planes += len(plane_normals)
+        raster_bytes += indices.size
+
+    index = np.array(records, dtype=_index_dtype(max((len(record[0]) for record in records), default=1)))
+    sections = [('index', index), ('normals', np.concatenate(normals or [np.zeros((0, 3), dtype='<f4')])),
+                ('distances', np.concatenate(distances or [np.zeros(0, dtype='<f4')]))]
+    header = {'count': len(index), 'planes': planes, 'index_dtype': np.lib.format.dtype_to_descr(index.dtype),
+              'skipped': skipped}
+    # The header's own length decides where the sections start, and the offsets are in the header: lay the
+    # sections out after a header sized for offsets of up to 20 digits, then pad it to that size.
+    offset = _aligned(len(_MAGIC) + len(json.dumps(dict(header, **{name: 10 ** 20 for name, _ in sections},
+                                                        rasters=10 ** 20))) + 1)
+    header_end = offset
+    for name, array in sections:
+        header[name] = offset
+        offset = _aligned(offset + array.nbytes)
+    header['rasters'] = offset
+    with atomic_output_path(path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(json.dumps(header).encode().ljust(header_end - len(_MAGIC) - 1) + b'\n')
+            for name, array in sections:
+                f.seek(header[name])
+                f.write(array.tobytes())
+            f.seek(header['rasters'])
+            for raster in rasters:
+                f.write(raster.tobytes())
+            f.truncate(header['rasters'] + raster_bytes)
+    return [record[0].decode('ascii') for record in records], left_out, failed
+
+
+class DepthPack:
+    """A depth pack, memory-mapped: pano id -> gsv.DepthArtifact, each a zero-copy view into the map.
+
+    pack[pano_id] stands in for np.load on that pano's .npz wherever the helpers read one -
+    ground_plane_from_artifact, camera_height_from_artifact, artifact['depth'] - since it is the same
+    DepthArtifact gsv.read_depth_artifact returns, over the same fields. Opening maps the file and reads the
+    index; nothing else is read until a pano is.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.readline() != _MAGIC:
+                raise ValueError("%s is not a depth pack" % (path,))
+            header = json.loads(f.readline())
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        index_dtype = np.lib.format.descr_to_dtype(header['index_dtype'])
+        self._index = self._section(header['index'], index_dtype, header['count'])
+        self._normals = self._section(header['normals'], np.dtype('<f4'), header['planes'] * 3).reshape(-1, 3)
+        self._distances = self._section(header['distances'], np.dtype('<f4'), header['planes'])
+        self._rasters = header['rasters']
+        self._rows = {pano_id.decode('ascii'): row for row, pano_id in enumerate(self._index['pano_id'])}
+        self._skipped = {pano_id: tuple(source) for pano_id, source in header['skipped'].items()}
+
+    def _section(self, offset, dtype, count):
+        return self._map[offset:offset + dtype.itemsize * count].view(dtype)
+
+    def __contains__(self, pano_id):
+        return pano_id in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __getitem__(self, pano_id):
+        record = self._index[self._rows[pano_id]]
+        start, count = int(record['plane_start']), int(record['plane_count'])
+        raster_start = self._rasters + int(record['raster_offset'])
+        height, width = int(record['height']), int(record['width'])
+        fields = {'plane_indices': self._map[raster_start:raster_start + height * width].reshape(height, width),
+                  'planes_n': self._normals[start:start + count], 'planes_d': self._distances[start:start + count]}
+        fields.update((name, np.array(record[name], dtype=np.float64 if name != 'format_version' else np.int64))
+                      for name in _SCALAR_FIELDS)
+        return gsv.DepthArtifact(fields)
+
+    def source(self, pano_id):
+        """(size, mtime_ns) of the .npz pano_id was packed from, as it was then."""
+        record = self._index[self._rows[pano_id]]
+        return int(record['source_size']), int(record['source_mtime_ns'])
+
+    @property
+    def sources(self):
+        """pano id -> (size, mtime_ns) of every .npz the pack was built from, as it was then - packed or not."""
+        sources = {pano_id: self.source(pano_id) for pano_id in self._rows}
+        sources.update(self._skipped)
+        return sources
+
+
+class PackedStore:
+    """A store's depth artifacts by pano id, from its packs where they hold the pano and its .npz otherwise.
+
+    @param storage_path Root of the pano store (the 2-char shard dirs live here).
+    @param pack_dir     Where the packs are; default <storage_path>/depth_packs, where pack_depth_artifacts.py
+                        writes them. Copy it to local disk for a training job and point this at the copy.
+    @param verify       Stat each pano's .npz and read it instead when it is no longer the file that was packed.
+                        Off by default: a stat is the network round trip packing saves. Leave it off when the
+                        packs were rebuilt after the last scrape.
+    """
+
+    def __init__(self, storage_path, pack_dir=None, verify=False):
+        self.storage_path = storage_path
+        self.pack_dir = os.path.join(storage_path, PACK_DIR_NAME) if pack_dir is None else pack_dir
+        self.verify = verify
+        self._packs = {}  # shard -> DepthPack, or None when it has no pack
+
+    def load(self, pano_id):
+        """The pano's DepthArtifact; see DepthPack and gsv.load_depth_artifact.
+
+        @raise FileNotFoundError when the pano is in no pack and has no .npz.
+        """
+        path = os.path.join(self.storage_path, pano_id[:2], pano_id + gsv.DEPTH_ARTIFACT_SUFFIX)
+        pack = self._pack(pano_id[:2])
+        if pack is not None and pano_id in pack:
+            if not self.verify:
+                return pack[pano_id]
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return pack[pano_id]  # the store copy is gone, or was never mounted here: the pack is all there is
+            if (stat.st_size, stat.st_mtime_ns) == pack.source(pano_id):
+                return pack[pano_id]
+        return gsv.load_depth_artifact(path)
+
+    def _pack(self, shard):
+        if shard not in self._packs:
+            try:
+                self._packs[shard] = DepthPack(pack_path(self.pack_dir, shard))
+            except FileNotFoundError:
+                self._packs[shard] = None
+        return self._packs[shard]
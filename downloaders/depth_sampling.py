@@ -0,0 +1,138 @@
+# Depth under many labels at once, for consumers that sample a whole city.
+#
+# docs/depth.md's recipe samples one label at a time: load the pano's artifact, index its raster. A training
+# pipeline sampling hundreds of thousands of labels that way opens and inflates an artifact once per label on
+# it, and for a v4 artifact rebuilds the whole raster to read one pixel. sample_depth takes the label table
+# instead: rows are grouped by pano, each artifact is loaded once through gsv.load_depth_artifact's bounded
+# cache, and every label on it is sampled in one vectorised pass - only those pixels of a v4 raster are
+# computed (gsv.DepthArtifact.depth_at) - under exactly the recipe's floor convention.
+#
+# Nothing here writes to the store, so it is as safe to run against a live store as against a copy.
+
+import collections
+import concurrent.futures
+import logging
+import os
+
+import numpy as np
+
+from . import gsv
+
+# One entry per label, in the order the labels were given:
+#   depth            float32 meters; -1 where Google modelled no plane, NaN where the label was not sampled (no
+#                    artifact for its pano, an unreadable or pre-v2 one, or a position outside the pano)
+#   plane_index      int16 index into the artifact's plane list, 0 = no plane; -1 where there is none to give
+#                    (not sampled, or a v2 artifact, which has no plane fields)
+#   ground_distance  float32 perpendicular distance from the camera to the pano's ground plane - the camera
+#                    height (gsv.camera_height_from_artifact) - for every sampled label on a pano that has one,
+#                    else NaN
+DepthSamples = collections.namedtuple('DepthSamples', ['depth', 'plane_index', 'ground_distance'])
+
+# Panos per task under a process pool: enough that shipping a task's labels and results between processes is
+# small next to loading its artifacts, few enough that the last tasks do not leave the pool idle for long.
+PANOS_PER_TASK = 256
+
+
+def label_pixels(pano_x, pano_y, pano_width, pano_height, height, width):
+    """The (row, col) of the depth pixel under each label: docs/depth.md's recipe, vectorised.
+
+    Truncation, as the recipe says, so each label lands on the pixel containing it; the column wraps around the
+    pano and the row is clamped at the bottom edge.
+
+    @param pano_x, pano_y, pano_width, pano_height float64 arrays, one entry per label, in pano image pixels.
+    @param height, width                           The depth raster's shape.
+    @return                                        (rows, cols), intp arrays.
+    """
+    cols = np.trunc(pano_x / pano_width * width).astype(np.intp) % width
+    rows = np.minimum(np.trunc(pano_y / pano_height * height).astype(np.intp), height - 1)
+    return rows, cols
+
+
+def sample_depth(storage_path, labels, workers=1):
+    """Sample depth, plane index and ground-plane distance under every label in `labels`.
+
+    @param storage_path Root of the pano store (the 2-char shard dirs live here).
+    @param labels       An iterable of (pano_id, pano_x, pano_y, pano_width, pano_height) rows - pano_x/pano_y
+                        in the heading-centred frame docs/depth.md describes, not the legacy sv_image_x. Read
+                        once, so a csv.reader or a DataFrame.itertuples(index=False) can be passed as it is.
+    @param workers      Processes to spread the panos over. 1 (the default) samples in this process; more
+                        is for city-scale tables, where loading artifacts rather than sampling them is the
+                        cost. Each process keeps its own artifact cache.
+    @return             DepthSamples, each array aligned with `labels`.
+    """
+    by_pano = collections.defaultdict(list)
+    numbers = []
+    for position, row in enumerate(labels):
+        by_pano[row[0]].append(position)
+        numbers.append(row[1:5])
+    numbers = np.array(numbers, dtype=np.float64).reshape(-1, 4)
+    count = len(numbers)
+    samples = DepthSamples(np.full(count, np.nan, dtype=np.float32), np.full(count, -1, dtype=np.int16),
+                           np.full(count, np.nan, dtype=np.float32))
+
+    groups = [(pano_id, np.asarray(positions)) for pano_id, positions in by_pano.items()]
+    tasks = [groups[start:start + PANOS_PER_TASK] for start in range(0, len(groups), PANOS_PER_TASK)]
+
+    def task_input(task):
+        return [(pano_id, numbers[positions]) for pano_id, positions in task]
+
+    if workers == 1:
+        results = (_sample_panos(storage_path, task_input(task)) for task in tasks)
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_sample_panos, [storage_path] * len(tasks), map(task_input, tasks))
+    try:
+        for task, task_results in zip(tasks, results):
+            for (_, positions), pano_samples in zip(task, task_results):
+                for column, values in zip(samples, pano_samples):
+                    column[positions] = values
+    finally:
+        if workers != 1:
+            pool.shutdown(cancel_futures=True)
+    return samples
+
+
+def _sample_panos(storage_path, panos):
+    """[_sample_pano(...) for each (pano_id, label numbers) in panos] - one process pool task."""
+    return [_sample_pano(storage_path, pano_id, numbers) for pano_id, numbers in panos]
+
+
+def _sample_pano(storage_path, pano_id, numbers):
+    """(depth, plane_index, ground_distance) arrays for the labels on one pano; see DepthSamples.
+
+    @param numbers float64 (n, 4): pano_x, pano_y, pano_width, pano_height per label.
+    """
+    count = len(numbers)
+    depth = np.full(count, np.nan, dtype=np.float32)
+    plane_index = np.full(count, -1, dtype=np.int16)
+    ground_distance = np.full(count, np.nan, dtype=np.float32)
+    path = os.path.join(storage_path, pano_id[:2], pano_id + gsv.DEPTH_ARTIFACT_SUFFIX)
+    try:
+        artifact = gsv.load_depth_artifact(path)
+    except FileNotFoundError:
+        return depth, plane_index, ground_distance  # no depth for this pano (yet): not a problem to report
+    except Exception as e:
+        # Truncated, foreign, or on a store that went away mid-table. One pano's labels go unsampled; the rest
+        # of a city-sized table should not.
+        logging.warning("Depth artifact %s is unreadable (%s); its labels are left unsampled", path, e)
+        return depth, plane_index, ground_distance
+    if 'format_version' not in artifact:
+        logging.warning("Depth artifact %s predates the x-mirror fix (#58); its labels are left unsampled. "
+                        "Run migrate_depth_artifacts.py on the store.", path)
+        return depth, plane_index, ground_distance
+
+    has_planes = 'plane_indices' in artifact
+    height, width = (artifact['plane_indices'] if has_planes else artifact['depth']).shape
+    pano_x, pano_y, pano_width, pano_height = numbers.T
+    # Outside the pano there is no pixel to sample; the recipe's clamp is for pano_y == pano_height, not for
+    # records that are out of frame (which the cropper rejects too).
+    with np.errstate(invalid='ignore'):
+        in_frame = (np.isfinite(numbers).all(axis=1) & (pano_width > 0) & (pano_height > 0)
+                    & (pano_y >= 0) & (pano_y <= pano_height))
+    rows, cols = label_pixels(pano_x[in_frame], pano_y[in_frame], pano_width[in_frame], pano_height[in_frame],
+                              height, width)
+    depth[in_frame] = artifact.depth_at(rows, cols)
+    if has_planes:
+        plane_index[in_frame] = artifact['plane_indices'][rows, cols]
+        ground_distance[in_frame] = gsv.camera_height_from_artifact(artifact, default=np.nan)
+    return depth, plane_index, ground_distance
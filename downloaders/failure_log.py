@@ -0,0 +1,177 @@
+# Memory of panos that keep failing transiently, so a known-bad tail stops costing a full attempt every night.
+#
+# Since #41 a transient failure is never ledgered: the pano is retried next run, which is what keeps a network
+# blip from becoming a permanent verdict. The shuffle keeps a failing cluster from monopolising the head of the
+# queue, but nothing stopped a pano that fails every night from being attempted every night, at full cost,
+# forever - on a city with a few thousand such panos that is most of --max-runtime. A TransientFailureLog is a
+# small sidecar CSV beside each ledger that records, for each pano currently failing, how many runs in a row
+# it has failed, the class of its last failure, and when it may next be attempted. Each further failure doubles
+# the wait, up to a month.
+#
+# It is never a verdict. A deferred pano is not ledgered, is attempted again once its window passes, and its
+# entry is dropped the moment it resolves either way. Deleting the file is the manual force-retry lever.
+
+import csv
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from .common import atomic_output_path
+
+# Beside pano_id_log.csv and depth_log.csv respectively.
+IMAGE_FAILURE_LOG_FILENAME = 'pano_retry_log.csv'
+DEPTH_FAILURE_LOG_FILENAME = 'depth_retry_log.csv'
+
+# The scrape runs nightly, so backoff counts in nights. A pano's first failure costs it nothing - it is tried
+# again next run, as before this existed - and each failure after that doubles the wait: the next attempt is
+# 2, 4, 8, ... nights later.
+BACKOFF_BASE_SECONDS = 24 * 60 * 60
+BACKOFF_MAX_SECONDS = 32 * 24 * 60 * 60
+# Taken off every wait, so that "one night" still means the next run when cron starts it a few minutes
+# earlier than the last one - a pano must not slip to the night after because tonight's run began at 02:58.
+BACKOFF_SLACK_SECONDS = 2 * 60 * 60
+
+_HEADER = ['pano_id', 'attempts', 'last_failure', 'next_eligible']
+_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Rows are appended, and an entry's last row wins, so the file also holds every row an entry has outgrown.
+# load() rewrites it once those outnumber the live entries by this many.
+_COMPACT_AFTER_DEAD_ROWS = 1000
+
+
+def backoff_seconds(attempts):
+    """How long after its `attempts`-th transient failure in a row a pano sits out."""
+    if attempts < 2:
+        return 0.0
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS) - BACKOFF_SLACK_SECONDS
+
+
+class TransientFailureLog:
+    """The panos at `path` that are failing transiently: pano_id -> (attempts, last failure class, next
+    eligible time), as an append-only CSV whose last row per pano wins. A row with 0 attempts clears its pano.
+
+    Times are wall-clock UTC: the window has to survive from one run to the next, which a monotonic clock
+    does not. A clock that jumps only moves a pano's next attempt by the size of the jump.
+
+    Best-effort like the tile cache: a sidecar that cannot be read starts empty, and one that cannot be
+    written is logged once and then ignored - at worst a pano is attempted when it could have sat out, which
+    is exactly what happened before the sidecar existed. Never touched by more than one thread.
+    """
+
+    def __init__(self, path, clock=None):
+        self.path = path
+        self._clock = clock or time.time
+        self._entries = {}  # pano_id -> (attempts, last failure class, next eligible in epoch seconds)
+        self._file = None
+        self._writer = None
+        self._warned = False
+
+    def load(self, keep=None):
+        """Read the sidecar, dropping any pano for which keep(pano_id) is false - one the ledger has resolved
+        since its last failure - and compacting the file when it has outgrown its live entries."""
+        rows = 0
+        try:
+            with open(self.path, newline='') as f:
+                for row in csv.reader(f):
+                    rows += 1
+                    try:
+                        pano_id, attempts, last_failure, next_eligible = row
+                        entry = (int(attempts), last_failure, _parse_time(next_eligible))
+                    except ValueError:
+                        continue  # the header, or a row a crash cut short
+                    if entry[0] > 0:
+                        self._entries[pano_id] = entry
+                    else:
+                        self._entries.pop(pano_id, None)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self._warn('unreadable', e)
+        if keep is not None:
+            self._entries = {pano_id: entry for pano_id, entry in self._entries.items() if keep(pano_id)}
+        if rows - 1 - len(self._entries) >= _COMPACT_AFTER_DEAD_ROWS:
+            self._compact()
+        return self
+
+    def deferred(self, pano_id):
+        """Whether pano_id is still inside its backoff window."""
+        entry = self._entries.get(pano_id)
+        return entry is not None and entry[2] > self._clock()
+
+    def partition(self, pano_infos):
+        """Split pano_infos into (those to attempt this run, those still backing off), keeping their order."""
+        eligible, deferred = [], []
+        for pano_info in pano_infos:
+            (deferred if self.deferred(pano_info['pano_id']) else eligible).append(pano_info)
+        return eligible, deferred
+
+    def failed(self, pano_id, failure):
+        """Record one more transient failure of pano_id, of class `failure` (a short name for the log)."""
+        attempts = self._entries.get(pano_id, (0,))[0] + 1
+        entry = (attempts, failure, self._clock() + backoff_seconds(attempts))
+        self._entries[pano_id] = entry
+        self._append(pano_id, entry)
+
+    def resolved(self, pano_id):
+        """Forget pano_id: it has an outcome now, or a transient failure was not its fault after all."""
+        if self._entries.pop(pano_id, None) is not None:
+            self._append(pano_id, (0, '', self._clock()))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _append(self, pano_id, entry):
+        if self._warned:
+            return
+        try:
+            if self._file is None:
+                existed = os.path.isfile(self.path)
+                self._file = open(self.path, 'a', newline='')
+                # lineterminator as the image ledger's, for the same ops greps.
+                self._writer = csv.writer(self._file, lineterminator='\n')
+                if not existed:
+                    self._writer.writerow(_HEADER)
+                    try:
+                        os.chmod(self.path, 0o664)
+                    except OSError:
+                        pass  # another user's run created it first: their file, their modes
+            self._writer.writerow(_row(pano_id, entry))
+            self._file.flush()
+        except OSError as e:
+            self._warn('unwritable', e)
+
+    def _compact(self):
+        """Rewrite the sidecar with only its live entries. Atomic, so a crash leaves the old file whole; a
+        concurrent run's append racing the rename loses that row, which costs one pano one early attempt."""
+        try:
+            with atomic_output_path(self.path) as tmp_path:
+                with open(tmp_path, 'w', newline='') as f:
+                    writer = csv.writer(f, lineterminator='\n')
+                    writer.writerow(_HEADER)
+                    writer.writerows(_row(pano_id, entry) for pano_id, entry in self._entries.items())
+        except OSError as e:
+            self._warn('unwritable', e)
+
+    def _warn(self, state, error):
+        # Once: every later write is skipped (see _append).
+        self._warned = True
+        logging.warning("Transient-failure log %s is %s (%s); failing panos are not backed off this run",
+                        self.path, state, error)
+
+
+def _row(pano_id, entry):
+    attempts, failure, next_eligible = entry
+    return [pano_id, attempts, failure,
+            datetime.fromtimestamp(next_eligible, timezone.utc).strftime(_TIME_FORMAT)]
+
+
+def _parse_time(text):
+    return datetime.strptime(text, _TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
@@ -9,14 +9,20 @@
 import asyncio
 import base64
 import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import contextvars
 import csv
+import functools
 import logging
 import math
 import os
 import random
-import stat
 import struct
+import threading
 import time
+import zipfile
 from io import BytesIO
 
 import aiohttp
@@ -36,7 +42,28 @@ except ImportError:
     # leave it behind). Don't take the whole scraper down over a throttle that defaults to off anyway.
     depth_min_request_interval = 0.0
 
-from .common import DownloadResult, atomic_output_path
+try:
+    from config import tile_concurrency_max
+except ImportError:
+    # Same story: a config.py from before the adaptive tile concurrency.
+    tile_concurrency_max = 32
+
+try:
+    from config import lossless_stitch
+except ImportError:
+    # And from before the coefficient-domain stitch, which is opt-in.
+    lossless_stitch = False
+
+try:
+    from config import host_depth_requests_per_second, host_rate_limit_dir, host_tile_requests_per_second
+except ImportError:
+    # And again: a config.py from before the host-wide budget, which is off unless configured.
+    host_rate_limit_dir, host_tile_requests_per_second, host_depth_requests_per_second = None, 0, 0
+
+from . import host_limiter, jpeg_dct, ledger_index, schedule, store_catalog
+from .common import (DeadlineExceeded, DownloadResult, InlineExecutor, WriteBehind, atomic_output_path,
+                     deferred_write, ensure_shard_dir, seconds_left)
+from .failure_log import DEPTH_FAILURE_LOG_FILENAME, TransientFailureLog
 
 
 def _normalize_proxies(raw):
@@ -52,6 +79,10 @@ def _normalize_proxies(raw):
 
 _proxies = _normalize_proxies(proxies)
 
+# This host's shared request budgets (config.host_rate_limit_dir), or None when host-wide limiting is off.
+_host_tile_limiter = host_limiter.from_config(host_rate_limit_dir, 'tiles', host_tile_requests_per_second)
+_host_depth_limiter = host_limiter.from_config(host_rate_limit_dir, 'depth', host_depth_requests_per_second)
+
 
 def _random_header():
     return random.choice(headers_list)
@@ -96,6 +127,23 @@ _CBK_BASE_URL = 'https://maps.google.com/cbk?output=tile&cb_client=maps_sv&onerr
 # timeout used to get zero retries - and now that one failed tile fails the whole pano, that costs a download.
 _TILE_RETRY_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
 
+# The second-chance pass for a pano's failed tiles (see _retry_failed_tiles). Each tile has already had its 10
+# backoff tries by then, so the pass is for the blip that outlasted them - a few seconds of CBK 5xx, a reset
+# connection pool - which is what nearly every tile failure in scrape.log turns out to be. A short pause, then
+# a few tiles at a time rather than thread_count, so a struggling host is not hit with the same burst again.
+TILE_RETRY_PASS_DELAY_SECONDS = 5.0
+TILE_RETRY_PASS_CONCURRENCY = 2
+
+# _AdaptiveConcurrency's knobs. Fewer plain ClientErrors than TILE_ERROR_BURST in one window are noise (a
+# reset connection, one bad body); a 429 or a timeout is Google or the network saying "too many" outright.
+# A window whose throughput is down more than TILE_THROUGHPUT_TOLERANCE on the one before holds the level
+# rather than raising it: past the host's sweet spot, more tiles in flight only queue.
+TILE_ERROR_BURST = 3
+TILE_THROUGHPUT_TOLERANCE = 0.1
+# How many of the controller's level changes the end-of-run summary lists (every change is logged as it
+# happens; the summary is for reading the night at a glance).
+TILE_CONCURRENCY_HISTORY_SHOWN = 40
+
 # A stitched frame with more black than this is not imagery, it is a grid bug. Nothing below the stitch can
 # see one: an out-of-range tile is answered 200 OK with a valid ALL-BLACK image/jpeg (pinned on real bytes in
 # tests/test_gsv_tile_contract.py), so a wrong grid looks exactly like a successful download tile by tile.
@@ -109,6 +157,12 @@ class StitchedPanoMostlyBlackError(Exception):
     """The stitch produced a frame that is mostly black - a tile-grid fault, not imagery."""
 
 
+class _UnexpectedContentTypeError(aiohttp.ClientResponseError):
+    """A tile answered with something other than a JPEG. Retried like any ClientResponseError, and reported to
+    the fan-out's stitch once the retries are spent (see _note_tile_giveup): a cell that answers HTML to the
+    end is not imagery either."""
+
+
 def _pano_max_zoom(width):
     """The pano's own maximum zoom level, inferred from its reported full width.
 
@@ -158,36 +212,433 @@ async def _fetch_tile(session, tile):
     the fan-out uses.
     """
     x, y, url = tile
+    if _host_tile_limiter is not None:
+        # Every attempt draws, retries included: to Google a retry is just another request from this host.
+        await _host_tile_limiter.wait_async()
     async with session.get(url, proxy=_proxies.get("http"), headers=_random_header()) as response:
         # .get(), not [..]: a response with no Content-Type must raise the same retryable error as a wrong
         # one, not a bare KeyError that is in neither backoff tuple (#45).
         content_type = response.headers.get('Content-Type', '')
         if content_type[0:10] != "image/jpeg":
-            raise aiohttp.ClientResponseError(
+            raise _UnexpectedContentTypeError(
                 response.request_info, response.history, status=response.status,
                 message="unexpected Content-Type %r for tile (%d, %d)" % (content_type, x, y))
         return x, y, await response.content.read()
 
 
-_download_tile = backoff.on_exception(backoff.expo, _TILE_RETRY_ERRORS, max_tries=10)(_fetch_tile)
+class _AdaptiveConcurrency:
+    """An AIMD limit on tiles in flight, in place of the fixed config.thread_count the fan-out used to use.
+
+    thread_count was a guess ("test but usually more threads the better"), and the right number differs by
+    city, by proxy, and by hour of the night: too low leaves throughput on the table, too high gets 429s and
+    timeouts that then cost backoff sleeps. So the limit is learned. Completions are counted in windows of
+    `limit` tiles (one round at the current level), throughput measured over the time tiles were actually in
+    flight (the gaps between panos, spent stitching and saving, are not the network's fault):
 
+    - additive increase: a window with no congestion signal and throughput no worse than the last one's
+      (within TILE_THROUGHPUT_TOLERANCE) raises the limit by one, up to `ceiling`;
+    - multiplicative decrease: a 429, a timeout, or TILE_ERROR_BURST other ClientErrors in one window halve
+      it, down to `floor` - and not again until the tiles in flight at the old level are through, since one
+      overloaded moment fails many tiles at once.
+
+    Every attempt is observed, backoff's retries included (via _note_tile_retry), so a tile that took three
+    tries to get through reports the two pushbacks it met, not just its eventual success.
+
+    Used from one event loop only: the TileSession's for a run, a one-shot fan-out's otherwise. A tile holds
+    its slot through its own backoff sleeps, which is deliberate - under pushback that is fewer requests.
+    """
 
-async def _download_tiles(tiles):
+    def __init__(self, initial, ceiling, floor=1, clock=time.monotonic):
+        self._clock = clock
+        self.floor, self.ceiling = floor, max(floor, ceiling)
+        self.limit = min(max(initial, self.floor), self.ceiling)
+        self._in_flight = 0
+        self._waiters = collections.deque()  # futures of tiles waiting for a slot, first come first served
+        self._started = self._clock()
+        self._busy_since = None
+        self._last_throughput = None
+        self._start_window()
+        self.tiles, self.retries, self.cuts = 0, 0, collections.Counter()
+        self.history = [(0.0, self.limit, 'start')]
+
+    async def acquire(self):
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter  # _wake() counts the slot as ours before resolving this
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.release()  # handed a slot in the same tick we were cancelled
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)  # (_wake may already have dropped it, see there)
+                raise
+        if self._busy_since is None:
+            self._busy_since = self._clock()
+
+    def release(self):
+        self._in_flight -= 1
+        if self._in_flight == 0 and self._busy_since is not None:
+            self._window_busy += self._clock() - self._busy_since
+            self._busy_since = None
+        self._wake()
+
+    def _wake(self):
+        # One waiter per free slot, not all of them: a pano queues hundreds of tiles behind the limit.
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if waiter.cancelled():
+                # Its task was cancelled (an aborted fan-out) but has not run its cleanup yet: no slot for it.
+                continue
+            self._in_flight += 1
+            waiter.set_result(None)
+
+    def record(self, latency, error=None):
+        """One tile done - fetched, or given up on with `error` - after `latency` seconds in its slot."""
+        self.tiles += 1
+        self._window_done += 1
+        self._window_latency += latency
+        if error is not None:
+            self._observe_error(error, finished=True)
+        if self._window_done >= self._window_size:
+            self._close_window()
+
+    def note_retry(self, error):
+        """One failed attempt that backoff is about to retry."""
+        self.retries += 1
+        self._observe_error(error)
+
+    def _observe_error(self, error, finished=False):
+        # A tile that has finished still holds its slot until release(); it is not one of those still to come.
+        still_in_flight = self._in_flight - 1 if finished else self._in_flight
+        if isinstance(error, aiohttp.ClientResponseError) and error.status == 429:
+            self._cut('429', still_in_flight)
+        elif isinstance(error, asyncio.TimeoutError):
+            self._cut('timeout', still_in_flight)
+        elif isinstance(error, aiohttp.ClientError):
+            self._window_errors += 1
+            if self._window_errors >= TILE_ERROR_BURST:
+                self._cut('client errors', still_in_flight)
+
+    def _cut(self, cause, still_in_flight):
+        if self._cut_this_window:
+            return
+        self.cuts[cause] += 1
+        self._set_limit(max(self.floor, self.limit // 2), cause)
+        # The tiles already in flight at the old level are what fail next, and they are the same overload, not
+        # a new one: the window after a cut lasts until they are through, and can neither cut nor raise.
+        self._start_window(size=still_in_flight, after_cut=True)
+
+    def _close_window(self):
+        busy = self._window_busy
+        if self._busy_since is not None:
+            busy += self._clock() - self._busy_since
+        throughput = self._window_done / busy if busy > 0 else None
+        no_worse = (throughput is not None and (self._last_throughput is None or
+                                                throughput >= self._last_throughput * (1 - TILE_THROUGHPUT_TOLERANCE)))
+        if no_worse and not self._cut_this_window and self.limit < self.ceiling:
+            self._set_limit(self.limit + 1, '%.1f tiles/s, %.2fs mean latency'
+                            % (throughput, self._window_latency / self._window_done))
+        self._last_throughput = throughput
+        self._start_window()
+
+    def _start_window(self, size=None, after_cut=False):
+        self._window_size = self.limit if size is None else size
+        self._window_busy = 0.0
+        if self._busy_since is not None:
+            self._busy_since = self._clock()
+        self._window_done = self._window_errors = 0
+        self._window_latency = 0.0
+        self._cut_this_window = after_cut
+
+    def _set_limit(self, limit, reason):
+        if limit == self.limit:
+            return
+        log = logging.info if limit < self.limit else logging.debug
+        log("IMAGEDOWNLOAD: tile concurrency %d -> %d (%s)", self.limit, limit, reason)
+        self.limit = limit
+        self.history.append((self._clock() - self._started, limit, reason))
+        self._wake()
+
+    def log_summary(self):
+        """The run's line in scrape.log: where the limit ended up, and how it got there."""
+        if not self.tiles:
+            return
+        levels = [level for _elapsed, level, _reason in self.history]
+        shown = self.history[-TILE_CONCURRENCY_HISTORY_SHOWN:]
+        cuts = ', '.join('%d on %s' % (count, cause) for cause, count in sorted(self.cuts.items())) or 'none'
+        logging.info("IMAGEDOWNLOAD: tile concurrency: started at %d, ended at %d (range %d-%d) over %d tiles and "
+                     "%d retried attempts; cuts: %s; history%s: %s",
+                     levels[0], self.limit, min(levels), max(levels), self.tiles, self.retries, cuts,
+                     '' if len(shown) == len(self.history) else ' (last %d changes)' % len(shown),
+                     ' '.join('%.0fs:%d' % (elapsed, level) for elapsed, level, _reason in shown))
+
+
+# The controller governing the fan-out this task belongs to. A context variable because the backoff hook below
+# is called with backoff's details and nothing else; tile tasks inherit it from _gather_tiles.
+_active_concurrency = contextvars.ContextVar('gsv_tile_concurrency', default=None)
+# ...and the on_tile it hands bodies to, for the same reason.
+_active_on_tile = contextvars.ContextVar('gsv_tile_on_tile', default=None)
+
+
+def _note_tile_retry(details):
+    concurrency = _active_concurrency.get()
+    if concurrency is not None:
+        concurrency.note_retry(details['exception'])
+
+
+def _note_tile_giveup(details):
+    on_tile = _active_on_tile.get()
+    if on_tile is not None and isinstance(details['exception'], _UnexpectedContentTypeError):
+        # on_tile(x, y, None): "this cell is not answering with imagery". Only once its retries are spent: an
+        # HTML page mid-retry is as often a rate-limit or interstitial burst that the next attempt gets past,
+        # and counting it then would refuse a healthy pano as black. May raise to abort the fan-out.
+        x, y, _url = details['args'][1]
+        on_tile(x, y, None)
+
+
+_download_tile = backoff.on_exception(backoff.expo, _TILE_RETRY_ERRORS, max_tries=10,
+                                      on_backoff=_note_tile_retry, on_giveup=_note_tile_giveup)(_fetch_tile)
+
+
+async def _download_tiles(tiles, on_tile=None):
     """Fetch every tile concurrently; failures come back as exception OBJECTS in the result list.
 
     No whole-batch backoff on purpose: each tile already retries up to 10 times in _download_tile, and with
     return_exceptions=True nothing propagates out of the gather anyway - the decorator this replaces could
     never fire for tile errors and only re-ran connector construction, re-downloading every tile (#45).
+
+    With on_tile, each body is handed to on_tile(x, y, body) on an executor thread the moment its response
+    completes, and comes back as (x, y, None): the stitch overlaps the network tail, and the fan-out never
+    holds every compressed body at once. on_tile raising fails that tile like any fetch error - except
+    StitchedPanoMostlyBlackError, which cancels every tile still to come and is raised from here. A tile
+    that answers a non-JPEG Content-Type to its last retry is reported as on_tile(x, y, None).
     """
-    conn = aiohttp.TCPConnector(limit=thread_count)
+    shared = _tile_session
+    if shared is not None and shared.owns_running_loop():
+        return await _gather_tiles(shared.http, tiles, on_tile, shared.concurrency)
+    # No run-scoped session (a direct call, or a caller outside the image phase): a one-shot pool, as every
+    # pano used to get, and a controller that only learns within this one fan-out.
+    conn = aiohttp.TCPConnector(limit=tile_concurrency_max)
     async with aiohttp.ClientSession(raise_for_status=True, connector=conn) as session:
-        tasks = [asyncio.ensure_future(_download_tile(session, tile)) for tile in tiles]
-        return await asyncio.gather(*tasks, return_exceptions=True)
+        return await _gather_tiles(session, tiles, on_tile,
+                                   _AdaptiveConcurrency(thread_count, tile_concurrency_max))
+
+
+async def _retry_failed_tiles(tiles, on_tile=None):
+    """The second-chance pass: re-request `tiles` after TILE_RETRY_PASS_DELAY_SECONDS, at most
+    TILE_RETRY_PASS_CONCURRENCY at a time. Results as _download_tiles, in `tiles` order."""
+    await asyncio.sleep(TILE_RETRY_PASS_DELAY_SECONDS)
+    results = []
+    for start in range(0, len(tiles), TILE_RETRY_PASS_CONCURRENCY):
+        results += await _download_tiles(tiles[start:start + TILE_RETRY_PASS_CONCURRENCY], on_tile=on_tile)
+    return results
+
+
+async def _gather_tiles(session, tiles, on_tile, concurrency):
+    # The connector's limit is only the ceiling now; `concurrency` decides how many tiles are in flight.
+    token = _active_concurrency.set(concurrency)
+    on_tile_token = _active_on_tile.set(on_tile)
+    try:
+        tasks = [asyncio.ensure_future(_governed_download(session, tile, on_tile, concurrency)) for tile in tiles]
+    finally:
+        _active_on_tile.reset(on_tile_token)
+        _active_concurrency.reset(token)
+
+    def abort_if_evidently_wrong(task):
+        # on_tile has seen enough black (or non-JPEG) cells that the stitch cannot pass the black guard: every
+        # request still queued or in flight is bandwidth spent on a pano that is already refused.
+        if not task.cancelled() and isinstance(task.exception(), StitchedPanoMostlyBlackError):
+            for other in tasks:
+                other.cancel()
+
+    for task in tasks:
+        task.add_done_callback(abort_if_evidently_wrong)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, StitchedPanoMostlyBlackError):
+            raise result
+    return results
+
+
+async def _governed_download(session, tile, on_tile, concurrency):
+    await concurrency.acquire()
+    started = time.monotonic()
+    try:
+        result = await _download_tile(session, tile)
+    except StitchedPanoMostlyBlackError:
+        concurrency.record(time.monotonic() - started)  # an abort from on_tile, not pushback from Google
+        raise
+    except Exception as e:
+        concurrency.record(time.monotonic() - started, e)
+        raise
+    else:
+        concurrency.record(time.monotonic() - started)
+    finally:
+        concurrency.release()
+    if on_tile is None:
+        return result
+    return await _hand_off(result, on_tile)
+
+
+async def _hand_off(result, on_tile):
+    x, y, data = result
+    # Off the loop: a decode is milliseconds of CPU, and the loop is shared by every pano in flight.
+    await asyncio.get_running_loop().run_in_executor(None, on_tile, x, y, data)
+    return x, y, None
+
+
+class TileSession:
+    """One event loop and one pooled, keep-alive aiohttp session shared by every pano in a run.
+
+    Without it every pano paid for a fresh event loop (asyncio.run), a fresh connector and fresh TLS
+    handshakes to the CBK host, tens of thousands of times a night. The loop runs on its own daemon thread and
+    callers on any thread hand it coroutines through run(), so the --pano-workers threads all fan out through
+    the same pool - and its _AdaptiveConcurrency limits the RUN's tiles in flight to Google, not each pano's,
+    learning the level from the whole night's traffic (logged when the session closes). Nothing is started
+    until the first run(): an image phase with no GSV work opens nothing.
+
+    Install one with tile_session(); download_single_pano falls back to a one-shot loop and pool without it.
+    It also carries the run's tile_cache.TileCache, when the run has one (--tile-cache-mb).
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.concurrency = _AdaptiveConcurrency(thread_count, tile_concurrency_max)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self.http = None
+
+    def _started_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='gsv-tile-loop', daemon=True)
+                thread.start()
+                # The ClientSession is built ON the loop: aiohttp binds a session to the loop it was created in.
+                self.http = asyncio.run_coroutine_threadsafe(_open_tile_http_session(), loop).result()
+                self._loop, self._thread = loop, thread
+            return self._loop
+
+    def owns_running_loop(self):
+        """Whether the calling coroutine is running on this session's loop (and so may use self.http)."""
+        return self._loop is not None and asyncio.get_running_loop() is self._loop
+
+    def run(self, coro):
+        """Run `coro` on the shared loop and block the calling thread for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._started_loop()).result()
+
+    def close(self):
+        """Cancel anything still in flight, close the pool, and stop and join the loop thread."""
+        with self._lock:
+            loop, thread, http = self._loop, self._thread, self.http
+            self._loop = self._thread = self.http = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(_close_tile_http_session(http), loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            self.concurrency.log_summary()
+
+
+async def _open_tile_http_session():
+    return aiohttp.ClientSession(raise_for_status=True, connector=aiohttp.TCPConnector(limit=tile_concurrency_max))
+
+
+async def _close_tile_http_session(http):
+    # A pano abandoned mid-fan-out (SIGTERM lands in the main thread, not here) leaves its tile tasks on the
+    # loop; cancel them so closing the pool doesn't race requests still using it.
+    current = asyncio.current_task()
+    pending = [task for task in asyncio.all_tasks() if task is not current]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    await http.close()
+    await asyncio.get_running_loop().shutdown_default_executor()
+
+
+# The run-scoped TileSession, when one is installed (see tile_session). Read, never written, by the download
+# path, so any number of pano worker threads can share it.
+_tile_session = None
+
+
+@contextlib.contextmanager
+def tile_session(cache=None):
+    """Install a TileSession for the duration of the block - the image phase wraps its whole loop in one."""
+    global _tile_session
+    session = TileSession(cache)
+    previous, _tile_session = _tile_session, session
+    try:
+        yield session
+    finally:
+        _tile_session = previous
+        session.close()
+
+
+def _run_tile_coroutine(coro):
+    coro = _before_deadline(coro)
+    shared = _tile_session
+    if shared is None:
+        return asyncio.run(coro)
+    return shared.run(coro)
+
+
+async def _before_deadline(coro):
+    """Await `coro`, cancelling it and raising DeadlineExceeded if the run's deadline (common.deadline) comes
+    first.
+
+    The --max-runtime check only runs between panos, and a full-resolution fan-out is 512 tiles of backoff-retried
+    requests: one started a second before the deadline could overrun it by minutes, and push the city's cron slot
+    into the next city's. Cancelling the fan-out cancels every tile request in it, queued or in flight.
+    """
+    left = seconds_left()
+    if left is None:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded('the run deadline passed with tiles still in flight') from None
+
+
+def _probe_body(url):
+    """One zoom probe's body - tile (0, 0) at that zoom - as bytes.
+
+    On the run's shared pool when there is one, retried like any tile, and otherwise through a requests
+    session scoped to this call (#51: one per pano, left unclosed, piled up pools until GC). Read to the end
+    either way, so nothing holds a connection once the probe is answered. On the shared pool it is cut off
+    at the run's deadline like the fan-out.
+    """
+    if _tile_session is None:
+        if _host_tile_limiter is not None:
+            _host_tile_limiter.wait()
+        with _request_session() as session:
+            return _get_response(url, session, stream=True).read()
+    (result,) = _run_tile_coroutine(_download_tiles([(0, 0, url)]))
+    if isinstance(result, BaseException):
+        raise result
+    return result[2]
+
+
+def _is_blank_tile(data):
+    """Whether a tile body is entirely black - Google's answer for a zoom (or a pano) with no imagery.
+
+    How to check: http://stackoverflow.com/questions/14041562/python-pil-detect-if-an-image-is-completely-black-or-white
+    """
+    with Image.open(BytesIO(data)) as tile_image:
+        return tile_image.convert("L").getextrema() == (0, 0)
 
 
 def _partition_tile_results(tiles, results):
     """Split a gather's results into (ok [(x, y, bytes)], failed [((x, y), exception)]).
 
+    A tile already handed to the stitch by _download_tiles' on_tile is ok with a body of None.
+
     The pre-#45 stitch loop indexed every result unconditionally, so one failed tile crashed the pano with
     'ClientResponseError object is not subscriptable' and the real cause never reached scrape.log.
     """
@@ -205,102 +656,309 @@ def _partition_tile_results(tiles, results):
     return ok, failed
 
 
-def _tile_body_size(data):
-    """The tile body's pixel dimensions, read from the JPEG header without decoding the image."""
-    with Image.open(BytesIO(data)) as tile_image:
-        return tile_image.size
-
-
-def _stitch_cell_size(tile_results):
-    """The pixel size each grid cell occupies in the stitch: the largest body this fan-out returned.
-
-    Defence in depth rather than a live requirement, since dropping `fover` from _CBK_BASE_URL removed the
-    only known cause of undersized bodies. It stays because the failure it prevents is silent and expensive:
-    with fover, CBK returned 256x256 bodies for the polar rows of every zoom-5 grid, and pasting one of those
-    at the full grid pitch leaves three quarters of its cell black in a pano that is still saved as success.
-    A half-size body is the same grid cell rendered at half scale (proven against the zoom-4 tile covering
-    the same region in tests/test_gsv_tile_contract.py), so cells still tile the pano and only need bringing
-    to a common scale.
-
-    Taking the largest keeps the best imagery the fan-out actually got. If every body were undersized the
-    cell would simply be smaller, so the canvas is a quarter of the size and one final LANCZOS pass does the
-    upscaling instead of 512 per-tile ones.
+class _StreamingStitch:
+    """The stitch, built as the fan-out runs: each body is header-sized, decoded and pasted as it arrives.
+
+    Thread-safe: bodies arrive from the loop's executor threads, several at a time. The decode happens outside
+    the lock (Pillow releases the GIL for it), so only the paste itself is serialised.
+
+    Every body is brought to the cell size before pasting. That is what the pre-#44 `img.resize((512, 512))`
+    was quietly doing: while the URL still carried `fover`, CBK returned half-size bodies for the polar rows of
+    zoom 5, and pasting one at the full grid pitch leaves three quarters of its cell black - saved as success,
+    exactly the corruption #44 is about. Google never returns a true-size short edge body, so an undersized
+    body is never a legitimately narrow edge tile: a real bottom-edge tile arrives as a full 512 body
+    black-padded below (tests/fixtures/tiles/z3_edge_bottom.jpg), and the crop in finish() removes that padding.
+
+    The cell size is the largest body the fan-out returned. Defence in depth rather than a live requirement,
+    since dropping `fover` from _CBK_BASE_URL removed the only known cause of undersized bodies, but the
+    failure it prevents is silent and expensive. A half-size body is the same grid cell rendered at half scale
+    (proven against the zoom-4 tile covering the same region in tests/test_gsv_tile_contract.py), so cells
+    still tile the pano and only need bringing to a common scale. Taking the largest keeps the best imagery
+    the fan-out actually got. If every body is undersized the cell is simply smaller, so the canvas is a
+    quarter of the size and one final LANCZOS pass does the upscaling instead of 512 per-tile ones.
+
+    Streaming means the largest body is not known up front, so an undersized body that arrives before any
+    full-size one is held (still compressed) until a full-size body fixes the cell, or until finish() if none
+    ever does. A body that arrives larger than the cell grows the canvas - not something CBK does, but it keeps
+    the result independent of arrival order.
+
+    Each paste also counts the cell's exact-black pixels (over the part of it finish() crops to), so the
+    mostly-black guard gets its answer without a second full-frame pass - see black_fraction. Once the cells
+    pasted so far are already black enough to fail the guard whatever arrives next, over_black_budget is set
+    and later bodies are dropped undecoded.
+
+    With lossless=True and jpeglib installed, a pano at its native zoom whose frame is a whole number of
+    tiles is assembled from the bodies' DCT coefficients instead (jpeg_dct.py): nothing is decoded, and
+    finish() returns a jpeg_dct.DctMosaic that saves without a re-encode. Black is then judged per 8x8 block
+    from the coefficients (jpeg_dct.black_pixels). The first body that cannot be copied as it is - undersized,
+    other tables, unreadable by jpeglib - sends the whole pano back to the Pillow path, replaying the bodies
+    placed so far, which are kept (compressed) for exactly that.
     """
-    if not tile_results:
-        return (TILE_SIZE, TILE_SIZE)
-    sizes = [_tile_body_size(data) for _x, _y, data in tile_results]
-    return (max(s[0] for s in sizes), max(s[1] for s in sizes))
 
-
-def _undersized_tile_count(tile_results):
-    """How many bodies came back below the NOMINAL tile size - i.e. how much of this pano is half-resolution.
-
-    Measured against TILE_SIZE rather than against _stitch_cell_size: if every body in a fan-out were
-    undersized the cell size would itself be 256, so nothing would look undersized relative to its
-    neighbours even though the whole pano arrived at half resolution. Undersized means "smaller than what
-    CBK serves", which is a fixed 512.
-
-    Expected to be 0 on every pano now that `fover` is gone. It is kept as the tripwire for that: if this
-    ever fires, some request parameter has started costing us resolution again (#73).
-    """
-    return sum(1 for _x, _y, data in tile_results
-               if min(_tile_body_size(data)) < TILE_SIZE)
+    def __init__(self, zoom_dims, final_dims=None, lossless=False):
+        self.zoom_dims = zoom_dims
+        # What the caller will pass to finish(); only used to tell whether the per-cell counts will be exact.
+        self.final_dims = tuple(final_dims if final_dims is not None else zoom_dims)
+        self.tiles_x = int(math.ceil(zoom_dims[0] / float(TILE_SIZE)))
+        self.tiles_y = int(math.ceil(zoom_dims[1] / float(TILE_SIZE)))
+        self.cell_size = None
+        self.count = 0
+        # Bodies below the NOMINAL tile size - i.e. how much of this pano is half-resolution. Measured against
+        # TILE_SIZE rather than the cell size: if every body were undersized the cell would itself be 256, so
+        # nothing would look undersized relative to its neighbours even though the whole pano arrived at half
+        # resolution. Expected to be 0 on every pano now that `fover` is gone; it is kept as the tripwire for
+        # that: if this ever fires, some request parameter has started costing us resolution again (#73).
+        self.undersized = 0
+        self._canvas = None
+        self._held = []
+        self._lock = threading.Lock()
+        # (x, y) -> [exact-black pixels, pixels] over the cell's visible part, at the current cell size. None
+        # once the canvas has been grown: the resize invalidates every count taken before it.
+        self._cell_black = {}
+        self._black_pixels = 0
+        self._covered_pixels = 0
+        self.over_black_budget = False
+        # The finished frame's exact black fraction, when finish() could take it from the per-cell counts.
+        self.black_fraction = None
+        # Only where the Pillow path would neither crop nor resize: the coefficients are copied, not rescaled.
+        self.lossless = (lossless and jpeg_dct.available() and tuple(zoom_dims) == self.final_dims
+                         and self.final_dims == (self.tiles_x * TILE_SIZE, self.tiles_y * TILE_SIZE))
+        self._mosaic = None
+        self._placed = {}  # (x, y) -> the compressed body placed in the mosaic, for a fallback to replay
+
+    def add(self, x, y, data):
+        """Take one tile body; pasted now unless it has to wait for the cell size (see the class docstring).
+
+        A body of None reports a cell that answered with something other than imagery to its last retry: it is
+        counted as the black it will be if nothing better arrives for it before finish() (the second-chance
+        pass may yet fetch it).
+        """
+        if self.over_black_budget:
+            return  # the pano is failing the black guard whatever this body holds; save the decode
+        if data is None:
+            with self._lock:
+                if self.cell_size is not None and self._cell_black is not None:
+                    self._record_black(x, y, self._visible(x, y), None)
+            return
+        if self.lossless and self._place_coefficients(x, y, data):
+            return
+        with Image.open(BytesIO(data)) as tile_image:
+            undersized = min(tile_image.size) < TILE_SIZE
+            tile_image.load()
+            with self._lock:
+                self.count += 1
+                if undersized:
+                    self.undersized += 1
+                    if self._canvas is None:
+                        self._held.append((x, y, data))
+                        return
+                self._fit(tile_image.size)
+                self._paste(x, y, tile_image)
+                held, self._held = self._held, []
+            # First full-size body: the cell is fixed, so the bodies held for it can go in.
+            for held_x, held_y, held_data in held:
+                self._paste_body(held_x, held_y, held_data)
+
+    def _place_coefficients(self, x, y, data):
+        """The lossless path's add(): False once the pano is on the Pillow path, this body included."""
+        try:
+            tile = jpeg_dct.read_coefficients(data)
+        except Exception:
+            tile = None  # the Pillow path will decode it, or say what is wrong with it
+        with self._lock:
+            if not self.lossless:
+                return False  # another body sent the pano back to Pillow while this one was being read
+            try:
+                if tile is None:
+                    raise jpeg_dct.IncompatibleTile('tile (%d, %d) is unreadable as coefficients' % (x, y))
+                if self._mosaic is None:
+                    self._mosaic = jpeg_dct.DctMosaic(self.tiles_x, self.tiles_y, TILE_SIZE, tile)
+                    self.cell_size = (TILE_SIZE, TILE_SIZE)
+                self._mosaic.place(x, y, tile)
+            except jpeg_dct.IncompatibleTile as e:
+                logging.debug("IMAGEDOWNLOAD: %s; stitching this pano with Pillow", e)
+                replay = self._leave_lossless()
+            else:
+                self.count += 1
+                self._placed[(x, y)] = data
+                self._record_black(x, y, (TILE_SIZE, TILE_SIZE), jpeg_dct.black_pixels(tile))
+                return True
+        for placed_x, placed_y, placed_data in replay:
+            self._paste_body(placed_x, placed_y, placed_data)
+        return False
+
+    def _leave_lossless(self):
+        """Switch to the Pillow path; returns the bodies already placed, for the caller to paste outside the
+        lock. Their black counts are replaced, exactly, as they are pasted. Caller holds the lock."""
+        self.lossless = False
+        self._mosaic = None
+        replay = [(x, y, data) for (x, y), data in self._placed.items()]
+        self._placed = {}
+        return replay
+
+    def _paste_body(self, x, y, data):
+        with Image.open(BytesIO(data)) as tile_image:
+            tile_image.load()
+            with self._lock:
+                self._fit(tile_image.size)
+                self._paste(x, y, tile_image)
+
+    def _fit(self, size):
+        """Make the cell (and canvas) at least `size`. Caller holds the lock."""
+        if self._canvas is None:
+            self.cell_size = size
+            self._canvas = Image.new('RGB', (self.tiles_x * size[0], self.tiles_y * size[1]))
+        elif size[0] > self.cell_size[0] or size[1] > self.cell_size[1]:
+            self.cell_size = (max(size[0], self.cell_size[0]), max(size[1], self.cell_size[1]))
+            grown = self._canvas.resize((self.tiles_x * self.cell_size[0], self.tiles_y * self.cell_size[1]),
+                                        Image.LANCZOS)
+            self._canvas.close()
+            self._canvas = grown
+            self._cell_black = None
+
+    def _crop_dims(self):
+        """The zoom's true size in cell pixels - what finish() crops the canvas to. Caller holds the lock."""
+        # zoom_dims is in nominal 512-grid pixels; the canvas is in cell pixels, so scale the crop to match.
+        cell_w, cell_h = self.cell_size
+        return (int(round(self.zoom_dims[0] * cell_w / float(TILE_SIZE))),
+                int(round(self.zoom_dims[1] * cell_h / float(TILE_SIZE))))
+
+    def _paste(self, x, y, tile_image):
+        cell_w, cell_h = self.cell_size
+        body = (tile_image if tile_image.size == (cell_w, cell_h)
+                else tile_image.resize((cell_w, cell_h), Image.LANCZOS))
+        self._canvas.paste(body, (cell_w * x, cell_h * y))
+        if self._cell_black is not None:
+            self._count_black(x, y, body)
+
+    def _visible(self, x, y):
+        """The (width, height) of cell (x, y) that survives the crop in finish(). Caller holds the lock."""
+        cell_w, cell_h = self.cell_size
+        crop_w, crop_h = self._crop_dims()
+        return max(0, min(cell_w, crop_w - cell_w * x)), max(0, min(cell_h, crop_h - cell_h * y))
+
+    def _count_black(self, x, y, body):
+        """Record the pasted cell's exact-black pixels, as _black_fraction would count them on the finished
+        frame: over the part of the cell the crop keeps, after the same conversion the paste made. Caller
+        holds the lock."""
+        visible = self._visible(x, y)
+        region = body if visible == body.size else body.crop((0, 0) + visible)
+        if region.mode != self._canvas.mode:
+            region = region.convert(self._canvas.mode)  # what paste() did to it
+        self._record_black(x, y, visible, region.convert('L').histogram()[0])
+
+    def _record_black(self, x, y, visible, black):
+        """Set cell (x, y)'s count to `black` of its `visible` pixels - all of them for black=None, a cell
+        still unpainted on the canvas - and check the budget. Caller holds the lock."""
+        pixels = visible[0] * visible[1]
+        if black is None:
+            black = pixels
+        old_black, old_pixels = self._cell_black.get((x, y), (0, 0))
+        self._cell_black[(x, y)] = (black, pixels)
+        self._black_pixels += black - old_black
+        self._covered_pixels += pixels - old_pixels
+        # Fail fast, but only where the count is the guard's own: with a final resize ahead it is not.
+        crop_w, crop_h = self._crop_dims()
+        if (crop_w, crop_h) == self.final_dims \
+                and self._black_pixels > STITCH_MAX_BLACK_FRACTION * crop_w * crop_h:
+            self.over_black_budget = True
+
+    def known_black_fraction(self):
+        """The fraction of the frame already known to be black from the cells pasted so far - a lower bound
+        on the finished frame's, since an unpasted cell can only add black."""
+        with self._lock:
+            if self.cell_size is None or self._cell_black is None:
+                return 0.0
+            crop_w, crop_h = self._crop_dims()
+            return self._black_pixels / float(crop_w * crop_h)
+
+    def finish(self, final_dims):
+        """Crop the canvas to the zoom's true size and scale it to the reported dims.
+
+        The final resize is what the pre-#44 code's `if zoom == 3` no-op resize was reaching for: downstream
+        consumers (label pixel coords, depth-map alignment) assume the JPEG is at the server-reported
+        dimensions, so a zoom-3 download is upscaled rather than saved at native size.
+
+        On the lossless path the result is the jpeg_dct.DctMosaic instead of an Image.
+        """
+        with self._lock:
+            held, self._held = self._held, []
+            replay = []
+            if self.lossless:
+                if self._mosaic is not None and tuple(final_dims) == self.final_dims:
+                    area = self._mosaic.size[0] * self._mosaic.size[1]
+                    self.black_fraction = (self._black_pixels + area - self._covered_pixels) / float(area)
+                    return self._mosaic
+                replay = self._leave_lossless()
+        for x, y, data in replay:
+            self._paste_body(x, y, data)
+        if self._canvas is None:
+            # Nothing full-size arrived: the cell is the largest of the undersized bodies, or the nominal tile
+            # for an empty fan-out (which the black check then refuses, with the pano id attached).
+            sizes = []
+            for _x, _y, data in held:
+                with Image.open(BytesIO(data)) as tile_image:
+                    sizes.append(tile_image.size)
+            with self._lock:
+                self._fit((max((s[0] for s in sizes), default=TILE_SIZE),
+                           max((s[1] for s in sizes), default=TILE_SIZE)))
+        for x, y, data in held:
+            self._paste_body(x, y, data)
+        crop_w, crop_h = self._crop_dims()
+        # A full-size zoom-5 grid needs no crop, and crop() would copy the whole canvas to make none.
+        image = (self._canvas if self._canvas.size == (crop_w, crop_h)
+                 else self._canvas.crop((0, 0, crop_w, crop_h)))
+        if image.size != tuple(final_dims):
+            # The resize blends black into its neighbours, so the per-cell counts no longer describe the frame.
+            return image.resize(final_dims, Image.LANCZOS)
+        if self._cell_black is not None:
+            # Every cell never pasted is canvas background: black.
+            self.black_fraction = ((self._black_pixels + crop_w * crop_h - self._covered_pixels)
+                                   / float(crop_w * crop_h))
+        return image
 
 
 def _stitch_tiles(tile_results, zoom_dims, final_dims):
-    """Paste tiles into a zoom-native canvas, crop to the zoom's true size, and scale to the reported dims.
-
-    Every body is brought to the cell size (see _stitch_cell_size) before pasting. That is what the pre-#44
-    `img.resize((512, 512))` was quietly doing: while the URL still carried `fover`, CBK returned half-size
-    bodies for the polar rows of zoom 5, and pasting one at the full grid pitch leaves three quarters of its
-    cell black - saved as success, exactly the corruption #44 is about. Google never returns a true-size
-    short edge body, so an undersized body is never a legitimately narrow edge tile: a real bottom-edge tile
-    arrives as a full 512 body black-padded below (tests/fixtures/tiles/z3_edge_bottom.jpg), and the crop
-    below is what removes that padding.
-
-    The final resize is what the pre-#44 code's `if zoom == 3` no-op resize was reaching for: downstream
-    consumers (label pixel coords, depth-map alignment) assume the JPEG is at the server-reported
-    dimensions, so a zoom-3 download is upscaled rather than saved at native size.
-    """
-    cell_w, cell_h = _stitch_cell_size(tile_results)
-    tiles_x = int(math.ceil(zoom_dims[0] / float(TILE_SIZE)))
-    tiles_y = int(math.ceil(zoom_dims[1] / float(TILE_SIZE)))
-    canvas = Image.new('RGB', (tiles_x * cell_w, tiles_y * cell_h))
+    """Stitch a complete list of (x, y, jpeg_bytes) in one go - _StreamingStitch fed in list order."""
+    stitch = _StreamingStitch(zoom_dims)
     for x, y, data in tile_results:
-        with Image.open(BytesIO(data)) as tile_image:
-            body = (tile_image if tile_image.size == (cell_w, cell_h)
-                    else tile_image.resize((cell_w, cell_h), Image.LANCZOS))
-            canvas.paste(body, (cell_w * x, cell_h * y))
-    # zoom_dims is in nominal 512-grid pixels; the canvas is in cell pixels, so scale the crop to match.
-    crop_w = int(round(zoom_dims[0] * cell_w / float(TILE_SIZE)))
-    crop_h = int(round(zoom_dims[1] * cell_h / float(TILE_SIZE)))
-    image = canvas.crop((0, 0, crop_w, crop_h))
-    if image.size != tuple(final_dims):
-        image = image.resize(final_dims, Image.LANCZOS)
-    return image
+        stitch.add(x, y, data)
+    return stitch.finish(final_dims)
+
+
+# Rows per band in _black_fraction: 256 rows of a 16384-wide frame is a 4 MB luma band instead of 128 MB.
+BLACK_COUNT_BAND_ROWS = 256
 
 
 def _black_fraction(image):
     """Exact fraction of black pixels in the frame, via the luma histogram.
 
     Counted over every pixel rather than a downsampled probe, and by histogram rather than a numpy array so
-    it stays a C-level pass with no second copy of a 16384x8192 frame. Both alternatives to an exact count
-    are wrong in a way that matters here: an averaging downscale blends a black region into its neighbours
-    and reports "slightly dark" for a frame that is three-quarters missing, while a NEAREST probe aliases on
-    exactly the sort of regular black/imagery pattern a tiling bug produces.
+    it stays a C-level pass. Both alternatives to an exact count are wrong in a way that matters here: an
+    averaging downscale blends a black region into its neighbours and reports "slightly dark" for a frame
+    that is three-quarters missing, while a NEAREST probe aliases on exactly the sort of regular
+    black/imagery pattern a tiling bug produces. Converted a band of rows at a time, so the count never holds
+    a second copy of a 16384x8192 frame. A stitch usually has its count already (_StreamingStitch.black_fraction);
+    this is for the frames it could not count, the ones finish() had to resize.
     """
-    luma = image.convert('L')
-    return luma.histogram()[0] / float(luma.width * luma.height)
+    black = 0
+    for top in range(0, image.height, BLACK_COUNT_BAND_ROWS):
+        band = image.crop((0, top, image.width, min(image.height, top + BLACK_COUNT_BAND_ROWS)))
+        black += band.convert('L').histogram()[0]
+    return black / float(image.width * image.height)
 
 
-def _reject_mostly_black_stitch(image, pano_id, zoom):
+def _reject_mostly_black_stitch(image, pano_id, zoom, black=None):
     """Refuse to save a stitch that is mostly black - the one place a tile-grid fault is visible.
 
     Raised, not returned as failure: like a failed tile, this must not be ledgered downloaded=1 (the skip
     check treats any saved file as done forever), and raising keeps it transient so a fixed grid or a
     recovered endpoint re-attempts the pano instead of blacklisting it.
+
+    `black` is the frame's black fraction when the caller already has it; it is counted from `image` if not.
     """
-    black = _black_fraction(image)
+    if black is None:
+        black = _black_fraction(image)
     if black > STITCH_MAX_BLACK_FRACTION:
         logging.error("IMAGEDOWNLOAD: pano %s: stitched frame at zoom %s is %.0f%% black (limit %.0f%%); "
                       "refusing to save - the tile grid or the tile responses are wrong, not the imagery",
@@ -316,78 +974,131 @@ def download_single_pano(storage_path, pano_info):
     base_url = _CBK_BASE_URL
 
     destination_dir = os.path.join(storage_path, pano_id[:2])
-    if not os.path.isdir(destination_dir):
-        # exist_ok: concurrent city runs (and the depth phase) race on shard dirs.
-        os.makedirs(destination_dir, exist_ok=True)
-        try:
-            os.chmod(destination_dir, 0o775 | stat.S_ISGID)
-        except PermissionError:
-            pass  # lost the race to another user's process; their dir, their modes — must not fail the pano
-
     filename = pano_id + ".jpg"
     out_image_name = os.path.join(destination_dir, filename)
 
-    # Skip download if image already exists.
-    if os.path.isfile(out_image_name):
+    # Skip download if image already exists. Through the run's store catalog, and before the shard dir check,
+    # so that a pano already on the store costs no stat of its own over sshfs.
+    if store_catalog.isfile(out_image_name):
         return DownloadResult.skipped
 
+    ensure_shard_dir(destination_dir)
+
     final_image_width = int(pano_dims[0]) if pano_dims[0] is not None else None
     final_image_height = int(pano_dims[1]) if pano_dims[1] is not None else None
 
-    # Session scoped to the zoom/dimension probes below; the tile fan-out uses its own aiohttp session. This
-    # runs once per pano, so leaving it unclosed would pile up connection pools until GC (#51).
-    with _request_session() as session:
-        # There is no legacy-XML path here any more (#52 items 3/4/5). It read a `<pano_id>.xml` for dims and
-        # zoom; #39 removed the downloader that wrote those (cbk?output=xml died in 2022), so the files on the
-        # store are frozen 2022 metadata. It could only ever run for a pano with an .xml and NO .jpg - the
-        # skip check above returns first - which is 1 of the 1,025 .xml files sampled across dc, columbus-oh,
-        # amsterdam and newberg-or. On that one pano it did harm: a declared num_zoom_levels was trusted over
-        # the probe and test-fetched, and a black tile returned DownloadResult.failure, which is PERMANENT
-        # under the #41 ledger. So stale 2022 metadata could blacklist a pano Google still serves.
-
-        # Without dims we cannot size the tile grid. Permanent, hence failure: /adminapi/panos is the only
-        # source for them, so re-attempting the same row tomorrow asks the same question again.
-        if final_image_width is None or final_image_height is None:
-            return DownloadResult.failure
-
-        # The probe is now the only thing that picks a zoom, so it is unconditional - it used to sit behind
-        # `if zoom is None:` because the legacy XML could have set one already.
-        url_zoom_3 = f'{base_url}&zoom=3&x=0&y=0&panoid={pano_id}'
-        url_zoom_5 = f'{base_url}&zoom=5&x=0&y=0&panoid={pano_id}'
-
-        req_zoom_3 = _get_response(url_zoom_3, session, stream=True)
-        im_zoom_3 = Image.open(req_zoom_3)
-        req_zoom_5 = _get_response(url_zoom_5, session, stream=True)
-        im_zoom_5 = Image.open(req_zoom_5)
-
-        # In some cases (e.g., old GSV images), we don't have zoom level 5, so Google returns a transparent
-        # image. This means we need to set the zoom level to 3. Google also returns a transparent image if
-        # there is no imagery. So check at both zoom levels. How to check:
-        # http://stackoverflow.com/questions/14041562/python-pil-detect-if-an-image-is-completely-black-or-white
-        if im_zoom_5.convert("L").getextrema() != (0, 0):
-            zoom = 5
-        elif im_zoom_3.convert("L").getextrema() != (0, 0):
-            zoom = 3
-        else:
-            # Can't determine zoom.
-            return DownloadResult.failure
+    # There is no legacy-XML path here any more (#52 items 3/4/5). It read a `<pano_id>.xml` for dims and
+    # zoom; #39 removed the downloader that wrote those (cbk?output=xml died in 2022), so the files on the
+    # store are frozen 2022 metadata. It could only ever run for a pano with an .xml and NO .jpg - the
+    # skip check above returns first - which is 1 of the 1,025 .xml files sampled across dc, columbus-oh,
+    # amsterdam and newberg-or. On that one pano it did harm: a declared num_zoom_levels was trusted over
+    # the probe and test-fetched, and a black tile returned DownloadResult.failure, which is PERMANENT
+    # under the #41 ledger. So stale 2022 metadata could blacklist a pano Google still serves.
+
+    # Without dims we cannot size the tile grid. Permanent, hence failure: /adminapi/panos is the only
+    # source for them, so re-attempting the same row tomorrow asks the same question again.
+    if final_image_width is None or final_image_height is None:
+        return DownloadResult.failure
+
+    # The probe is now the only thing that picks a zoom, so it is unconditional - it used to sit behind
+    # `if zoom is None:` because the legacy XML could have set one already.
+    #
+    # In some cases (e.g., old GSV images), we don't have zoom level 5, so Google returns a blank tile and we
+    # fall back to zoom 3. Google also returns a blank tile if there is no imagery at all, hence a blank at
+    # both means failure. Zoom 5 is asked first and zoom 3 only if it has to be: zoom 5 answers for nearly
+    # every pano, so the second round trip used to be spent on a question whose answer was then discarded.
+    # The probe that picks the zoom IS that zoom's tile (0, 0), so it goes straight into the stitch below
+    # rather than being fetched a second time by the fan-out.
+    zoom, probe = None, None
+    for candidate in (5, 3):
+        body = _probe_body(f'{base_url}&zoom={candidate}&x=0&y=0&panoid={pano_id}')
+        if not _is_blank_tile(body):
+            zoom, probe = candidate, body
+            break
+    if zoom is None:
+        # Can't determine zoom.
+        return DownloadResult.failure
 
     final_im_dimension = (final_image_width, final_image_height)
 
-    tiles = _generate_tile_urls(pano_id, final_image_width, final_image_height, zoom)
-    results = asyncio.run(_download_tiles(tiles))
+    grid = _generate_tile_urls(pano_id, final_image_width, final_image_height, zoom)
+    zoom_dims = _dims_at_zoom(final_image_width, final_image_height, zoom)
+    stitch = _StreamingStitch(zoom_dims, final_im_dimension, lossless=lossless_stitch)
+    stitch.add(0, 0, probe)
+
+    # What an earlier attempt at this pano already fetched (tile_cache.py), minus the probe cell, which the
+    # probe has just fetched again anyway.
+    cache = _tile_session.cache if _tile_session is not None else None
+    cached = cache.load(pano_id, zoom) if cache is not None else {}
+    cached.pop((0, 0), None)
+    try:
+        for (x, y), data in cached.items():
+            stitch.add(x, y, data)
+    except Exception:
+        # A body that will not decode would fail this pano on every retry, forever. Drop it and refetch.
+        cache.discard(pano_id)
+        raise
+    tiles = [tile for tile in grid if tile[:2] != (0, 0) and tile[:2] not in cached]
+
+    # With a cache, bodies are also kept (compressed) until the pano resolves, so a failure can spill them.
+    kept = []
+
+    def on_tile(x, y, data):
+        stitch.add(x, y, data)
+        if cache is not None and data is not None:
+            kept.append((x, y, data))
+        if stitch.over_black_budget:
+            # The cells in so far fail the black guard whatever the rest hold: this stops the fan-out (see
+            # _download_tiles) instead of fetching and stitching a full pano that is already refused.
+            raise StitchedPanoMostlyBlackError('pano %s: over the black limit mid-fan-out' % pano_id)
+
+    def fan_out(coro):
+        try:
+            return _run_tile_coroutine(coro)
+        except StitchedPanoMostlyBlackError:
+            # on_tile's abort: log it the way a finished stitch's refusal is logged, with the pano id and the
+            # black already counted (a lower bound - the rest of the grid was never fetched).
+            _reject_mostly_black_stitch(None, pano_id, zoom, black=stitch.known_black_fraction())
+            raise
+        except DeadlineExceeded:
+            # Cut off by the run's deadline. Nothing is stitched or saved, and - with a cache - what did arrive
+            # is kept, so next run's attempt picks up where this one stopped.
+            if cache is not None:
+                cache.put(pano_id, zoom, list(kept))
+            raise
+
+    results = fan_out(_download_tiles(tiles, on_tile=on_tile))
     ok, failed = _partition_tile_results(tiles, results)
     if failed:
-        # Fail the whole pano: a partial stitch would leave silently-black regions that downstream crops
-        # can't detect - exactly the corruption #44 is about. Raise (rather than return failure) so the
-        # failure is treated as transient: the tile that timed out today usually exists tomorrow, and under
-        # #41's ledger semantics a raised pano is re-attempted next run instead of blacklisted.
+        # One more go at just the failed cells before giving the pano up to tomorrow's run: the rest of its
+        # grid is already fetched (and, streamed, already pasted), and the failure is usually momentary.
+        logging.warning("IMAGEDOWNLOAD: pano %s: %d/%d tiles failed; retrying them in %.0fs",
+                        pano_id, len(failed), len(grid), TILE_RETRY_PASS_DELAY_SECONDS)
+        failed_cells = {cell for cell, _error in failed}
+        retry_tiles = [tile for tile in tiles if tile[:2] in failed_cells]
+        retried_ok, failed = _partition_tile_results(
+            retry_tiles, fan_out(_retry_failed_tiles(retry_tiles, on_tile=on_tile)))
+        ok += retried_ok
+    # A fan-out that returned its bodies rather than streaming them (see _download_tiles).
+    returned = [(x, y, data) for x, y, data in ok if data is not None]
+    if failed:
+        # Still failing after the second pass, so fail the whole pano: a partial stitch would leave
+        # silently-black regions that downstream crops can't detect - exactly the corruption #44 is about.
+        # Raise (rather than return failure) so the failure is treated as transient: the tile that timed out
+        # today usually exists tomorrow, and under #41's ledger semantics a raised pano is re-attempted next
+        # run instead of blacklisted.
         (x, y), first_error = failed[0]
         logging.error("IMAGEDOWNLOAD: pano %s: %d/%d tiles failed; first failure: tile (%d, %d): %r",
-                      pano_id, len(failed), len(tiles), x, y, first_error)
+                      pano_id, len(failed), len(grid), x, y, first_error)
+        if cache is not None:
+            # ...but not from scratch: the retry fetches only what is still missing.
+            cache.put(pano_id, zoom, kept + returned)
         raise first_error
 
-    degraded = _undersized_tile_count(ok)
+    for x, y, data in returned:
+        stitch.add(x, y, data)
+
+    degraded = stitch.undersized
     if degraded:
         # Should never fire now that `fover` is gone (#73). Not a failure if it does: a half-size body is
         # the same cell at half scale, so the stitch is still correct and full-frame, just softer. But it
@@ -395,26 +1106,34 @@ def download_single_pano(storage_path, pano_info):
         # saved JPEG - which is at the reported dims either way.
         logging.warning("IMAGEDOWNLOAD: pano %s: %d/%d tiles came back below the nominal %dpx tile; "
                         "stitching at reduced resolution - check the CBK request parameters (#73)",
-                        pano_id, degraded, len(ok), TILE_SIZE)
-
-    zoom_dims = _dims_at_zoom(final_image_width, final_image_height, zoom)
-    image = _stitch_tiles(ok, zoom_dims, final_im_dimension)
-    _reject_mostly_black_stitch(image, pano_id, zoom)
-    # atomic_output_path, not a direct save: an image on disk IS the resume marker, so a mid-write crash
-    # would otherwise leave a truncated .jpg that every later run reports as a completed download.
-    with atomic_output_path(out_image_name) as tmp_path:
-        image.save(tmp_path, 'jpeg')
-
-    # log.csv column 8 (#52 item 2). The test is whether the grid we could actually download covers the
-    # pano's reported frame; if it doesn't, _stitch_tiles LANCZOS-upscaled to reach it, and the JPEG on disk
-    # holds less imagery than its dimensions advertise. Deliberately NOT `zoom == 3`: an old four-level pano
-    # (3328x1664) has max zoom 3, so zoom 3 IS its native resolution and nothing was lost - calling that
-    # degraded would put a permanent false positive in front of ops on the oldest imagery in the store.
-    if zoom_dims != final_im_dimension:
-        logging.info("IMAGEDOWNLOAD: pano %s: only zoom %s was available for a %dx%d frame; stitched %dx%d "
-                     "and upscaled", pano_id, zoom, final_image_width, final_image_height, *zoom_dims)
-        return DownloadResult.fallback_success
-    return DownloadResult.success
+                        pano_id, degraded, stitch.count, TILE_SIZE)
+
+    image = stitch.finish(final_im_dimension)
+    _reject_mostly_black_stitch(image, pano_id, zoom, black=stitch.black_fraction)
+
+    def save():
+        # atomic_output_path, not a direct save: an image on disk IS the resume marker, so a mid-write crash
+        # would otherwise leave a truncated .jpg that every later run reports as a completed download.
+        with atomic_output_path(out_image_name) as tmp_path:
+            image.save(tmp_path, 'jpeg')
+        if cache is not None:
+            # Whatever an earlier attempt left - even at the other zoom - has nothing left to save.
+            cache.discard(pano_id)
+
+        # log.csv column 8 (#52 item 2). The test is whether the grid we could actually download covers the
+        # pano's reported frame; if it doesn't, _stitch_tiles LANCZOS-upscaled to reach it, and the JPEG on
+        # disk holds less imagery than its dimensions advertise. Deliberately NOT `zoom == 3`: an old
+        # four-level pano (3328x1664) has max zoom 3, so zoom 3 IS its native resolution and nothing was lost
+        # - calling that degraded would put a permanent false positive in front of ops on the oldest imagery.
+        if zoom_dims != final_im_dimension:
+            logging.info("IMAGEDOWNLOAD: pano %s: only zoom %s was available for a %dx%d frame; stitched %dx%d "
+                         "and upscaled", pano_id, zoom, final_image_width, final_image_height, *zoom_dims)
+            return DownloadResult.fallback_success
+        return DownloadResult.success
+
+    # The encode and the write - seconds for a full pano on the sshfs store - go to the run's write-behind
+    # pool when it has one (common.write_behind), so this worker can start the next pano's network work.
+    return deferred_write(save)
 
 
 DEPTH_LOG_FILENAME = 'depth_log.csv'
@@ -424,8 +1143,9 @@ DEPTH_ARTIFACT_SUFFIX = '.depth.npz'
 # predate v2 and store streetlevel's raw column order, which is x-mirrored relative to the pano JPEG (#58).
 # v3 adds Google's plane list - per-pixel plane indices plus plane normals and offsets - which the v2 decode
 # threw away (#56). A v2 artifact cannot be upgraded offline (the planes were never stored): delete it and its
-# depth_log.csv row to trigger a re-fetch.
-DEPTH_ARTIFACT_FORMAT_VERSION = 3
+# depth_log.csv row to trigger a re-fetch. v4 drops the float 'depth' raster, which the plane fields reconstruct
+# bit for bit (load_depth_artifact); migrate_depth_artifacts.py rewrites a v3 artifact as v4 offline.
+DEPTH_ARTIFACT_FORMAT_VERSION = 4
 
 # The value a depth pixel carries when Google modelled no plane there (sky, or anything else it skipped) -
 # streetlevel's depth.INFINITELY_FAR. Reconstructed depths are |d / (v . n)|, so they are never negative and
@@ -447,6 +1167,7 @@ DEPTH_STOP_BLOCKED = 'blocked'
 DEPTH_STOP_CONSECUTIVE_FAILURES = 'consecutive-failures'
 DEPTH_STOP_MAX_RUNTIME = 'max-runtime'
 DEPTH_STOP_MAX_REQUESTS = 'max-requests'
+DEPTH_STOP_RUN_ENDING = 'run-ending'
 
 # Substrings that mark Google's "you are a robot" landing pages rather than pano metadata.
 _BLOCK_URL_MARKERS = ('/sorry/', 'consent.google.com')
@@ -457,7 +1178,7 @@ class DepthBlockedError(Exception):
 
 
 class DepthPayloadError(RuntimeError):
-    """Google's depth payload - or the v3 artifact about to be derived from it - is malformed.
+    """Google's depth payload - or the artifact about to be derived from it - is malformed.
 
     A RuntimeError subclass on purpose, and deliberately NOT a ValueError: download_depth_maps classes
     ValueError as 'network' (streetlevel surfaces a non-JSON response as JSONDecodeError, a ValueError
@@ -488,10 +1209,15 @@ class _TimeoutHTTPAdapter(HTTPAdapter):
 
     streetlevel's internal requests carry no timeout, so without this a single hung connection would stall a
     nightly cron run indefinitely.
+
+    With a deadline (a time.monotonic() value) the timeout is also capped by the time left before it, nothing
+    is sent once it has passed, and a request that fails after it - typically the capped timeout firing -
+    raises DeadlineExceeded rather than a network error: the budget ran out, Google did nothing wrong.
     """
 
-    def __init__(self, *args, timeout=30, **kwargs):
+    def __init__(self, *args, timeout=30, deadline=None, **kwargs):
         self._timeout = timeout
+        self._deadline = deadline
         super().__init__(*args, **kwargs)
 
     def send(self, request, **kwargs):
@@ -499,14 +1225,51 @@ class _TimeoutHTTPAdapter(HTTPAdapter):
         # setdefault would never fire.
         if kwargs.get('timeout') is None:
             kwargs['timeout'] = self._timeout
-        return super().send(request, **kwargs)
+        if self._deadline is None:
+            return super().send(request, **kwargs)
+        left = self._deadline - time.monotonic()
+        if left <= 0:
+            raise DeadlineExceeded('the run deadline has passed')
+        kwargs['timeout'] = min(kwargs['timeout'], left)
+        try:
+            return super().send(request, **kwargs)
+        except requests.RequestException as e:
+            if time.monotonic() >= self._deadline:
+                raise DeadlineExceeded('the run deadline passed with the request in flight (%s)' % (e,)) from e
+            raise
+
+
+class _DeadlineRetry(Retry):
+    """urllib3's Retry, except that a wait between attempts that would run past `deadline` raises
+    DeadlineExceeded instead: the retries live inside one requests call, where the adapter's cap cannot see them.
+    """
+
+    def __init__(self, *args, deadline=None, **kwargs):
+        self.deadline = deadline
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kw):
+        # Retry is immutable; every attempt's copy is made here, and must keep the deadline.
+        kw.setdefault('deadline', self.deadline)
+        return super().new(**kw)
 
+    def sleep(self, response=None):
+        # Retry.sleep's choice of wait - the server's Retry-After, else the backoff - checked before it is taken.
+        wait = self.get_retry_after(response) if self.respect_retry_after_header and response else None
+        if not wait:
+            wait = self.get_backoff_time()
+        if self.deadline is not None and time.monotonic() + wait >= self.deadline:
+            raise DeadlineExceeded('retrying in %.0fs would pass the run deadline' % (wait,))
+        if wait > 0:
+            time.sleep(wait)
 
-def _depth_session():
+
+def _depth_session(deadline=None):
     """Build the requests.Session handed to streetlevel for photometa requests.
 
     Same retry policy as _request_session(), plus a default timeout (streetlevel never sets one), backoff jitter,
-    and the block-detection hook.
+    and the block-detection hook. With a deadline (a time.monotonic() value), no request or retry runs past it
+    (see _TimeoutHTTPAdapter and _DeadlineRetry).
 
     Deliberately does NOT borrow config.headers_list the way the tile downloader does. streetlevel sends its own
     Accept/Host/Referer/User-Agent on every photometa request, and in requests a request-level header beats a
@@ -518,9 +1281,9 @@ def _depth_session():
     session = requests.Session()
     # backoff_jitter keeps concurrent city runs from resynchronising onto an identical retry schedule after a
     # shared outage and pounding in lockstep (requires urllib3 >= 2.0).
-    retry = Retry(total=5, connect=5, status_forcelist=[429, 500, 502, 503, 504], backoff_factor=1,
-                  backoff_jitter=0.5)
-    adapter = _TimeoutHTTPAdapter(max_retries=retry, timeout=30)
+    retry = _DeadlineRetry(total=5, connect=5, status_forcelist=[429, 500, 502, 503, 504], backoff_factor=1,
+                           backoff_jitter=0.5, deadline=deadline)
+    adapter = _TimeoutHTTPAdapter(max_retries=retry, timeout=30, deadline=deadline)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     session.proxies.update({k: v for k, v in _proxies.items() if v})
@@ -529,17 +1292,19 @@ def _depth_session():
 
 
 def _pace(last_request_at):
-    """Sleep so consecutive depth requests are at least config.depth_min_request_interval apart.
+    """Sleep so consecutive depth requests are at least config.depth_min_request_interval apart, then draw
+    the request from the host's shared depth budget when one is configured (host_limiter.py).
 
     @param last_request_at time.monotonic() of the previous request, or None if this is the first one.
     """
-    if depth_min_request_interval <= 0 or last_request_at is None:
-        return
-    # Jitter on top of the floor so overlapping city runs don't settle into a shared cadence.
-    wait = depth_min_request_interval - (time.monotonic() - last_request_at)
-    wait += random.uniform(0, depth_min_request_interval * 0.25)
-    if wait > 0:
-        time.sleep(wait)
+    if depth_min_request_interval > 0 and last_request_at is not None:
+        # Jitter on top of the floor so overlapping city runs don't settle into a shared cadence.
+        wait = depth_min_request_interval - (time.monotonic() - last_request_at)
+        wait += random.uniform(0, depth_min_request_interval * 0.25)
+        if wait > 0:
+            time.sleep(wait)
+    if _host_depth_limiter is not None:
+        _host_depth_limiter.wait()
 
 
 def _load_depth_log(depth_log_path):
@@ -548,16 +1313,12 @@ def _load_depth_log(depth_log_path):
     Tolerates malformed rows (e.g. a line truncated by a crash mid-append) by skipping them, so a damaged ledger
     degrades to re-checking a few panos rather than crashing the run.
 
+    Goes through the ledger's snapshot when DownloadRunner's --ledger-index is on (downloaders/ledger_index.py).
+
     @return Set of pano ids whose depth outcome is already known ('saved' or 'unavailable').
     """
-    resolved = set()
-    if not os.path.isfile(depth_log_path):
-        return resolved
-    with open(depth_log_path, newline='') as f:
-        for row in csv.reader(f):
-            if len(row) == 2 and row[0] != 'pano_id' and row[1] in ('saved', 'unavailable'):
-                resolved.add(row[0])
-    return resolved
+    ids = ledger_index.read_ledger(depth_log_path, ('saved', 'unavailable')).ids
+    return ids['saved'] | ids['unavailable']
 
 
 def count_unresolved_depth(storage_path, pano_infos):
@@ -570,17 +1331,19 @@ def count_unresolved_depth(storage_path, pano_infos):
     A pano whose artifact exists but whose ledger row is missing (only possible after manual ledger surgery)
     counts as unresolved even though the phase will self-heal it without a request; that inaccuracy is not
     worth a directory walk here. An unreadable ledger counts as no backlog: download_depth_maps sits the run
-    out in that state, so there is nothing to reserve for.
+    out in that state, so there is nothing to reserve for. Nor do panos still backing off after repeated
+    transient failures count: the phase will not request them tonight, so time reserved for them is wasted.
 
     @param storage_path Root of the pano store (depth_log.csv lives here).
     @param pano_infos   Pano dicts (needs 'pano_id'); callers pre-filter to source == 'gsv'.
-    @return             Number of panos with no 'saved'/'unavailable' ledger row.
+    @return             Number of panos with no 'saved'/'unavailable' ledger row and no backoff pending.
     """
     try:
         resolved = _load_depth_log(os.path.join(storage_path, DEPTH_LOG_FILENAME))
     except OSError:
         return 0
-    return sum(1 for p in pano_infos if p['pano_id'] not in resolved)
+    failures = TransientFailureLog(os.path.join(storage_path, DEPTH_FAILURE_LOG_FILENAME)).load()
+    return sum(1 for p in pano_infos if p['pano_id'] not in resolved and not failures.deferred(p['pano_id']))
 
 
 # Google's plane data for one pano, as decoded from the raw photometa depth payload (#56): 'indices' is a
@@ -647,6 +1410,24 @@ def _decode_depth_planes(b64_payload):
                        planes[:, 3].astype(np.float32))
 
 
+@functools.lru_cache(maxsize=8)
+def _depth_rays(height, width):
+    """The unit ray of every pixel of a (height, width) depth raster, as read-only float64 (x, y, z) arrays -
+    x and y (height, width), z (height, 1) - under the ray formula _write_depth_artifact documents.
+
+    Cached per resolution: every real raster is 256x512, so the trigonometry runs once a process, not once a
+    pano. x and y are each sin(theta) * cos|sin(phi), computed the way the one-shot formula computed them, so
+    the products built from them are bit-for-bit the same.
+    """
+    theta = (height - np.arange(height) - 0.5) / height * np.pi
+    phi = (width - np.arange(width) - 0.5) / width * 2.0 * np.pi + np.pi / 2.0
+    rays = (np.sin(theta)[:, None] * np.cos(phi)[None, :], np.sin(theta)[:, None] * np.sin(phi)[None, :],
+            np.cos(theta)[:, None])
+    for axis in rays:
+        axis.flags.writeable = False
+    return rays
+
+
 def _compute_depth_raster(planes):
     """The per-pixel distance raster derived from the plane data, in PAYLOAD (= stored JPEG) column order.
 
@@ -657,25 +1438,73 @@ def _compute_depth_raster(planes):
     tests/test_depth_helpers.py's TestComputeDepthRaster, so swapping the raster source changed nothing for
     the panos both decoders handle. Near the horizon the ground plane runs almost parallel to the ray and
     distances legitimately grow huge - exactly as upstream's decode produces.
+
+    It runs wherever a v4 artifact's raster is reconstructed - every consumer's read - so it is written for
+    speed: the rays come from _depth_rays' per-resolution cache, each normal component and the
+    offset are gathered into one reused buffer, and the arithmetic runs in place. Every operation is the
+    float64 one the straightforward (h, w, 3) formulation performs, in the same order -
+    ((x * n_x + y * n_y) + z * n_z), then the division, then the cast - so the result is the same bit for
+    bit, which migrate_depth_artifacts.py relies on when it drops a v3 raster. (float32 arithmetic would be
+    faster again, and would not be.) tests/test_depth_helpers.py pins that against the reference formulation.
+
+    @raise IndexError if an index points past the plane list (_decode_depth_planes rejects those on the wire;
+           this catches them in an artifact read back from disk).
     """
     indices = planes.indices
     height, width = indices.shape
-    theta = (height - np.arange(height) - 0.5) / height * np.pi
-    phi = (width - np.arange(width) - 0.5) / width * 2.0 * np.pi + np.pi / 2.0
     if len(planes.normals) == 0:
         return np.full((height, width), DEPTH_NO_PLANE, dtype=np.float32)
-    rays = np.empty((height, width, 3))
-    rays[..., 0] = np.sin(theta)[:, None] * np.cos(phi)[None, :]
-    rays[..., 1] = np.sin(theta)[:, None] * np.sin(phi)[None, :]
-    rays[..., 2] = np.broadcast_to(np.cos(theta)[:, None], (height, width))
-    index_grid = indices.astype(np.intp)  # bounds-checked in _decode_depth_planes
-    normals = np.asarray(planes.normals, dtype=np.float64)[index_grid]
-    offsets = np.asarray(planes.distances, dtype=np.float64)[index_grid]
+    if indices.size and int(indices.max()) >= len(planes.normals):
+        raise IndexError("plane index %d is past the %d-plane list" % (int(indices.max()), len(planes.normals)))
+    x, y, z = _depth_rays(height, width)
+    index_grid = indices.astype(np.intp)
+    normals = np.asarray(planes.normals, dtype=np.float64)
+    offsets = np.asarray(planes.distances, dtype=np.float64)
+    gathered = np.empty((height, width))
+    dot = np.empty((height, width))
+    # mode='clip' skips take's buffered bounds check; the indices were checked above.
+    np.take(normals[:, 0], index_grid, out=gathered, mode='clip')
+    np.multiply(x, gathered, out=dot)
+    np.take(normals[:, 1], index_grid, out=gathered, mode='clip')
+    gathered *= y
+    dot += gathered
+    np.take(normals[:, 2], index_grid, out=gathered, mode='clip')
+    gathered *= z
+    dot += gathered
+    np.take(offsets, index_grid, out=gathered, mode='clip')
     # A ray exactly perpendicular to its plane's normal is measure-zero in real payloads; inf beats crashing
     # the pano over it (streetlevel would raise ZeroDivisionError there).
     with np.errstate(divide='ignore', invalid='ignore'):
-        raster = np.abs(offsets / np.einsum('hwc,hwc->hw', rays, normals))
-    return np.where(index_grid == 0, DEPTH_NO_PLANE, raster).astype(np.float32)
+        np.divide(gathered, dot, out=dot)
+    np.abs(dot, out=dot)
+    raster = dot.astype(np.float32)
+    raster[indices == 0] = DEPTH_NO_PLANE
+    return raster
+
+
+def _depth_at_pixels(planes, rows, cols):
+    """_compute_depth_raster(planes)[rows, cols], computed for those pixels only.
+
+    The same float64 operations in the same order, on the same cached rays, so each value is bit for bit the
+    raster's - at a cost proportional to the pixels asked for rather than the whole raster.
+
+    @param rows, cols Integer arrays of the same shape, already in range.
+    """
+    indices = np.asarray(planes.indices)[rows, cols].astype(np.intp)
+    if len(planes.normals) == 0:
+        return np.full(indices.shape, DEPTH_NO_PLANE, dtype=np.float32)
+    if indices.size and int(indices.max()) >= len(planes.normals):
+        raise IndexError("plane index %d is past the %d-plane list" % (int(indices.max()), len(planes.normals)))
+    x, y, z = _depth_rays(*planes.indices.shape)
+    normals = np.asarray(planes.normals, dtype=np.float64)[indices]
+    offsets = np.asarray(planes.distances, dtype=np.float64)[indices]
+    dot = x[rows, cols] * normals[..., 0]
+    dot += y[rows, cols] * normals[..., 1]
+    dot += z[rows, 0] * normals[..., 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        depth = np.abs(offsets / dot).astype(np.float32)
+    depth[indices == 0] = DEPTH_NO_PLANE
+    return depth
 
 
 def _msg_path(value, *path):
@@ -692,16 +1521,18 @@ def _msg_path(value, *path):
     return value
 
 
-# What the depth path needs from a photometa response: the raster (None when the pano carries no depth
-# payload) and the three orientation scalars, shaped like the streetlevel object it replaced so
-# _write_depth_artifact and the tests' make_pano are indifferent to the source.
-_DepthRaster = collections.namedtuple('_DepthRaster', ['data'])
-_PanoOrientation = collections.namedtuple('_PanoOrientation', ['depth', 'heading', 'pitch', 'roll'])
+# What the depth path needs from a photometa response besides the planes: the three orientation scalars, named
+# like the streetlevel object's they replaced so _write_depth_artifact and the tests' make_pano are indifferent
+# to the source.
+_PanoOrientation = collections.namedtuple('_PanoOrientation', ['heading', 'pitch', 'roll'])
 
 
 def _fetch_pano_with_depth_planes(pano_id, session):
     """One photometa request -> (pano-shaped namespace | None, DepthPlanes | None).
 
+    (None, None) when the pano is gone; (orientation, None) when it carries no depth payload. No raster: v4
+    artifacts do not store one, and a consumer that wants it reconstructs it from the planes (DepthArtifact).
+
     Only streetlevel's api half (the protobuf-URL builder + fetch) is used; the response is parsed here.
     The session - and with it the timeout adapter, retry policy, and block-detection hook - passes through
     exactly as streetlevel's own find_panorama_by_id would pass it, so the request on the wire is identical
@@ -738,27 +1569,152 @@ def _fetch_pano_with_depth_planes(pano_id, session):
     pitch = _msg_path(msg, 5, 0, 1, 2, 1)
     roll = _msg_path(msg, 5, 0, 1, 2, 2)
     orientation = _PanoOrientation(
-        depth=None,
         heading=math.radians(heading) if heading is not None else None,
         pitch=math.radians(90 - pitch) if pitch is not None else None,
         roll=math.radians(roll) if roll is not None else None)
     payload = _msg_path(msg, 5, 0, 5, 1, 2)
     if not payload:
         return orientation, None
-    planes = _decode_depth_planes(payload)
-    # The raster is handed back in streetlevel's x-mirrored column order deliberately: _write_depth_artifact
-    # un-mirrors on write (#58) and every CI pin on the stored orientation is written against that contract,
-    # so the seam keeps the shape its predecessor produced and the two flips cancel. Collapse them if the
-    # writer contract is ever revisited.
-    raster = _compute_depth_raster(planes)[:, ::-1]
-    return orientation._replace(depth=_DepthRaster(raster)), planes
+    return orientation, _decode_depth_planes(payload)
+
+
+# How an artifact's fields are compressed: how plane_indices is encoded (DEPTH_INDEX_ENCODINGS), then the zlib
+# level of the .npz's deflate, 0 storing every field uncompressed. The default is np.savez_compressed's zlib
+# default level over the raw raster, so an artifact written with it is the v4 format exactly as it was.
+DepthCodec = collections.namedtuple('DepthCodec', ['encoding', 'level'])
+DEFAULT_DEPTH_CODEC = DepthCodec('raw', 6)
+# 'raw' stores plane_indices as the (h, w) raster. 'delta' stores each pixel's difference from its left
+# neighbour, mod 256: a plane spans runs of columns, so most differences are 0 and deflate finds longer runs.
+# 'packed' stores every index in the fewest bits that hold the largest one - Google's plane lists are well under
+# 64 entries, so 5 or 6 bits a pixel instead of 8. An encoded raster is stored as 'plane_indices_encoded', with
+# its encoding in 'plane_indices_codec' - under a name of its own, so a plain np.load consumer that does not
+# decode it fails on the missing 'plane_indices' rather than reading deltas or packed bits as plane indices.
+DEPTH_INDEX_ENCODINGS = ('raw', 'delta', 'packed')
 
 
-def _write_depth_artifact(storage_path, pano_id, pano, planes):
-    """Atomically write <pano_id[:2]>/<pano_id>.depth.npz for a streetlevel pano with depth data.
+def parse_depth_codec(spec):
+    """A DepthCodec from its name: 'store', 'deflate', 'delta' or 'packed', the last three optionally with a
+    zlib level as in 'deflate:1' (default 6; 0 stores uncompressed).
 
-    Contents (format v3, see DEPTH_ARTIFACT_FORMAT_VERSION):
-      'depth'          float32 (h, w) meters; -1 = no plane (sky, or anything Google didn't model)
+    @raise ValueError for anything else.
+    """
+    name, _, level = spec.partition(':')
+    if name == 'store' and not level:
+        return DepthCodec('raw', 0)
+    encoding = 'raw' if name == 'deflate' else name
+    if encoding not in DEPTH_INDEX_ENCODINGS[1:] and name != 'deflate':
+        raise ValueError("unknown depth codec %r; expected store, deflate, delta or packed" % (spec,))
+    if not level:
+        return DepthCodec(encoding, DEFAULT_DEPTH_CODEC.level)
+    if not level.isdigit() or int(level) > 9:
+        raise ValueError("depth codec %r: the level must be 0-9" % (spec,))
+    return DepthCodec(encoding, int(level))
+
+
+def _encode_plane_indices(indices, encoding):
+    """The fields a uint8 (h, w) plane_indices raster is stored as under `encoding`; see DEPTH_INDEX_ENCODINGS."""
+    if encoding == 'raw':
+        return {'plane_indices': indices}
+    if encoding == 'delta':
+        # uint8 arithmetic wraps, so the difference is mod 256 and the cumulative sum in _decode_plane_indices
+        # undoes it exactly.
+        return {'plane_indices_encoded': np.diff(indices, axis=1, prepend=np.zeros((indices.shape[0], 1),
+                                                                                    dtype=np.uint8)),
+                'plane_indices_codec': np.array(encoding)}
+    if encoding == 'packed':
+        bits = max(int(indices.max(initial=0)).bit_length(), 1)
+        return {'plane_indices_encoded': np.packbits(np.unpackbits(indices.reshape(-1, 1), axis=1)[:, 8 - bits:]),
+                'plane_indices_codec': np.array(encoding), 'plane_indices_bits': np.int64(bits),
+                'plane_indices_shape': np.array(indices.shape, dtype=np.int64)}
+    raise ValueError("unknown plane_indices encoding %r" % (encoding,))
+
+
+def _decode_plane_indices(fields):
+    """Put an encoded plane_indices back in `fields` as the (h, w) uint8 raster, in place; the inverse of
+    _encode_plane_indices. Fields with no encoding recorded are left as they are.
+
+    @raise ValueError for an encoding this code does not know - an artifact from a newer writer.
+    """
+    if 'plane_indices_codec' not in fields:
+        return fields
+    encoding = str(fields.pop('plane_indices_codec'))
+    encoded = fields.pop('plane_indices_encoded')
+    if encoding == 'delta':
+        fields['plane_indices'] = np.cumsum(encoded, axis=1, dtype=np.uint8)
+    elif encoding == 'packed':
+        bits = int(fields.pop('plane_indices_bits'))
+        height, width = (int(n) for n in fields.pop('plane_indices_shape'))
+        # Shifted in a bit column at a time: packbits over the zero-padded (pixels, 8) bit matrix is the obvious
+        # inverse, and five times slower - this runs on every read.
+        unpacked = np.unpackbits(encoded, count=height * width * bits).reshape(-1, bits)
+        indices = np.zeros(height * width, dtype=np.uint8)
+        for bit in range(bits):
+            indices <<= 1
+            indices |= unpacked[:, bit]
+        fields['plane_indices'] = indices.reshape(height, width)
+    else:
+        raise ValueError("unknown plane_indices encoding %r" % (encoding,))
+    return fields
+
+
+def save_depth_fields(f, fields, codec=DEFAULT_DEPTH_CODEC):
+    """Write `fields` (name -> array or scalar) to the open file f as an .npz under `codec`.
+
+    np.savez_compressed's container - a zip of .npy members, which numpy.load reads whatever their compression -
+    with the zlib level chosen rather than fixed. The level needs no recording: each zip member names its own
+    compression method, and inflate needs no level.
+    """
+    fields = dict(fields)
+    if 'plane_indices' in fields:
+        fields.update(_encode_plane_indices(np.asarray(fields.pop('plane_indices'), dtype=np.uint8),
+                                            codec.encoding))
+    compression = zipfile.ZIP_DEFLATED if codec.level else zipfile.ZIP_STORED
+    with zipfile.ZipFile(f, 'w', compression=compression, compresslevel=codec.level or None,
+                         allowZip64=True) as archive:
+        for name, value in fields.items():
+            with archive.open(name + '.npy', 'w', force_zip64=True) as member:
+                np.lib.format.write_array(member, np.asanyarray(value), allow_pickle=False)
+
+
+def _check_depth_planes(pano_id, planes):
+    """Refuse plane data whose documented reconstruction (see _write_depth_artifact) would not run, or would
+    give a raster of infinities, before anything is written.
+
+    Checked on the planes alone, in one pass over the raster (a bincount of the indices): the (h, w) index
+    raster, normals and offsets of one length between them, every index inside the plane list, and a finite,
+    nonzero normal and a finite offset for every plane a pixel references. Plane 0 is never dereferenced, so
+    it is not checked. _decode_depth_planes already refuses most of this on the wire; what this still guards,
+    for a one-shot backfill that cannot be redone offline, is any edit between that decode and this writer.
+
+    @raise DepthPayloadError naming what is wrong.
+    """
+    if planes is None:
+        raise DepthPayloadError("pano %s has a depth payload but no plane data; refusing to write a malformed "
+                                "artifact" % (pano_id,))
+    indices = np.asarray(planes.indices)
+    normals = np.asarray(planes.normals)
+    distances = np.asarray(planes.distances)
+    if indices.ndim != 2 or indices.size == 0 or indices.dtype != np.uint8:
+        raise DepthPayloadError("pano %s plane indices are not a uint8 (h, w) raster: %s %r"
+                                % (pano_id, indices.dtype, indices.shape))
+    if normals.ndim != 2 or normals.shape[1:] != (3,) or distances.shape != normals.shape[:1]:
+        raise DepthPayloadError("pano %s plane normals %r and offsets %r do not describe one plane list"
+                                % (pano_id, normals.shape, distances.shape))
+    referenced = np.bincount(indices.ravel(), minlength=len(normals))
+    if len(referenced) > max(len(normals), 1):
+        raise DepthPayloadError("pano %s plane index %d is past its %d-plane list"
+                                % (pano_id, len(referenced) - 1, len(normals)))
+    referenced = np.flatnonzero(referenced[1:]) + 1
+    if not (np.isfinite(normals[referenced]).all() and np.isfinite(distances[referenced]).all()
+            and np.any(normals[referenced] != 0, axis=1).all()):
+        raise DepthPayloadError("pano %s has a referenced plane with a non-finite or zero normal, or a non-finite "
+                                "offset" % (pano_id,))
+
+
+def _write_depth_artifact(storage_path, pano_id, pano, planes, codec=DEFAULT_DEPTH_CODEC):
+    """Atomically write <pano_id[:2]>/<pano_id>.depth.npz for a pano with depth data.
+
+    Contents (format v4, see DEPTH_ARTIFACT_FORMAT_VERSION):
       'plane_indices'  uint8 (h, w) per-pixel index into the plane list; 0 = no plane
       'planes_n'       float32 (P, 3) plane normals, verbatim wire values (#56)
       'planes_d'       float32 (P,) plane offsets, verbatim; a plane is {p : p . n = d}, so its perpendicular
@@ -766,12 +1722,16 @@ def _write_depth_artifact(storage_path, pano_id, pano, planes):
                        see ground_plane_from_artifact / camera_height_from_artifact)
       'heading'/'pitch'/'roll'  scalars in radians (NaN if absent)
       'format_version' int
+    plane_indices may instead be stored encoded, as `codec` says (see DEPTH_INDEX_ENCODINGS); read_depth_artifact
+    and load_depth_artifact decode it.
 
-    The stored raster shares the pano JPEG's column order: streetlevel's decoder x-mirrors the payload
-    (compute_depth_map writes the value for payload column x to output column w-1-x), so pano.depth.data is
-    horizontally flipped relative to the imagery and is flipped back here on write (#58). plane_indices comes
-    from the raw payload, whose column order already IS the JPEG's, so it is stored verbatim - and the plane
-    normals live in the pano-local frame of the decode's ray formula, untouched by any raster relabeling.
+    The float32 'depth' raster v3 also stored - meters, -1 = no plane (sky, or anything Google didn't model) -
+    is neither written nor computed: it is exactly the identity below run forward, and compressed it was most
+    of the artifact and most of the time spent writing it. load_depth_artifact reconstructs it on demand.
+
+    The raster shares the pano JPEG's column order (#58: streetlevel's decoder x-mirrors the payload, so its
+    depth.data never did). plane_indices comes from the raw payload, whose column order already IS the JPEG's,
+    so it is stored verbatim - and the plane normals live in the pano-local frame of the decode's ray formula.
     The operational definition of that frame, tying every stored field together (pinned by
     tests/test_depth_helpers.py):
 
@@ -782,37 +1742,12 @@ def _write_depth_artifact(storage_path, pano_id, pano, planes):
     the write index jointly, either of which flipping alone would change the orientation - so a streetlevel
     change fails CI rather than silently re-mirroring new artifacts.
 
-    @raise DepthPayloadError if the plane data is missing, the wrong shape, or disagrees with the raster.
+    @raise DepthPayloadError if the plane data is missing or malformed (_check_depth_planes).
     """
-    if planes is None:
-        raise DepthPayloadError("pano %s has a depth raster but no plane data; refusing to write a malformed "
-                                "v3 artifact" % (pano_id,))
-    stored_depth = np.asarray(pano.depth.data)[:, ::-1].astype(np.float32)
-    if tuple(planes.indices.shape) != stored_depth.shape:
-        raise DepthPayloadError("pano %s plane indices shape %r does not match depth shape %r"
-                                % (pano_id, tuple(planes.indices.shape), stored_depth.shape))
-    # The one invariant docs/depth.md promises consumers - index 0 sits exactly where the raster says -1 -
-    # enforced instead of assumed. Both now come from our own decode, so this is no longer a cross-parser
-    # check; what it still guards, for one pass over ~130k pixels, is the flip plumbing between the seam and
-    # this writer (payload order -> mirrored -> un-mirrored) and any raster/index divergence a future edit
-    # introduces. This backfill is one-shot and cannot be redone offline, so a broken invariant must stop
-    # the pano, not quietly produce millions of artifacts whose documented reconstruction identity does not
-    # hold.
-    if not np.array_equal(planes.indices == 0, stored_depth == DEPTH_NO_PLANE):
-        raise DepthPayloadError("pano %s plane indices disagree with the depth raster: %d pixel(s) where "
-                                "exactly one of (index == 0, depth == %g) holds"
-                                % (pano_id, int(np.count_nonzero((planes.indices == 0)
-                                                                 != (stored_depth == DEPTH_NO_PLANE))),
-                                   DEPTH_NO_PLANE))
+    _check_depth_planes(pano_id, planes)
 
     destination_dir = os.path.join(storage_path, pano_id[:2])
-    if not os.path.isdir(destination_dir):
-        # exist_ok: concurrent city runs (and the image phase) race on shard dirs.
-        os.makedirs(destination_dir, exist_ok=True)
-        try:
-            os.chmod(destination_dir, 0o775 | stat.S_ISGID)
-        except PermissionError:
-            pass  # lost the race to another user's process; their dir, their modes — must not fail the pano
+    ensure_shard_dir(destination_dir)
 
     final_path = os.path.join(destination_dir, pano_id + DEPTH_ARTIFACT_SUFFIX)
 
@@ -822,20 +1757,18 @@ def _write_depth_artifact(storage_path, pano_id, pano, planes):
     # .part + rename so a crash can never leave a truncated .npz that would be treated as done forever; the
     # image downloaders now share the same helper.
     with atomic_output_path(final_path) as tmp_path:
-        # savez_compressed needs an open file object: given a path without a .npz extension it silently appends
-        # one, which would write to the wrong filename.
         with open(tmp_path, 'wb') as f:
-            np.savez_compressed(f, depth=stored_depth,
-                                plane_indices=np.asarray(planes.indices, dtype=np.uint8),
-                                planes_n=np.asarray(planes.normals, dtype=np.float32).reshape(-1, 3),
-                                planes_d=np.asarray(planes.distances, dtype=np.float32).reshape(-1),
-                                heading=scalar(pano.heading), pitch=scalar(pano.pitch),
-                                roll=scalar(pano.roll), format_version=DEPTH_ARTIFACT_FORMAT_VERSION)
+            save_depth_fields(f, {'plane_indices': np.asarray(planes.indices),
+                                   'planes_n': np.asarray(planes.normals, dtype=np.float32).reshape(-1, 3),
+                                   'planes_d': np.asarray(planes.distances, dtype=np.float32).reshape(-1),
+                                   'heading': scalar(pano.heading), 'pitch': scalar(pano.pitch),
+                                   'roll': scalar(pano.roll), 'format_version': DEPTH_ARTIFACT_FORMAT_VERSION},
+                               codec)
 
 
 def ground_plane_from_artifact(artifact, min_vertical=0.7):
-    """Pick the ground plane out of a v3 depth artifact: the near-horizontal plane that most of the pano's
-    downward-looking pixels actually land on.
+    """Pick the ground plane out of a depth artifact (v3 or later): the near-horizontal plane that most of the
+    pano's downward-looking pixels actually land on.
 
     Deliberately a helper rather than a field baked into the artifact: the artifact stores Google's plane
     list verbatim, so this heuristic (which plane is "ground" on a tilted street, a bridge, a plaza?) stays
@@ -853,8 +1786,8 @@ def ground_plane_from_artifact(artifact, min_vertical=0.7):
     _write_depth_artifact). For even heights - every real raster - that is plain h//2; the +1 matters only
     for odd heights, whose middle row sits exactly ON the horizon and belongs to neither half.
 
-    @param artifact     An open numpy.load(...) NpzFile, or any mapping with 'plane_indices', 'planes_n',
-                        'planes_d' (see _write_depth_artifact for the fields).
+    @param artifact     A load_depth_artifact(...) DepthArtifact, an open numpy.load(...) NpzFile, or any
+                        mapping with 'plane_indices', 'planes_n', 'planes_d' (see _write_depth_artifact).
     @param min_vertical Minimum |n_z| / ||n|| for a plane to count as ground at all.
     @return             (unit_normal float32 (3,), distance_m, plane_index) for the winning plane - the
                         distance is the camera height when the plane really is the ground - or None if no
@@ -891,7 +1824,7 @@ def ground_plane_from_artifact(artifact, min_vertical=0.7):
 
 
 def camera_height_from_artifact(artifact, default=None):
-    """Camera height in meters from a v3 depth artifact: |d| / ||n|| of the ground plane (#56).
+    """Camera height in meters from a depth artifact (v3 or later): |d| / ||n|| of the ground plane (#56).
 
     @return The height, or `default` when no plane qualifies as ground (see ground_plane_from_artifact).
     """
@@ -899,8 +1832,147 @@ def camera_height_from_artifact(artifact, default=None):
     return default if ground is None else ground[1]
 
 
+# The fields the raster is reconstructed from; an artifact carrying them needs no stored 'depth' (v4).
+_PLANE_FIELDS = ('plane_indices', 'planes_n', 'planes_d')
+
+# Artifacts a DepthArtifactCache keeps by default. A reconstructed raster is 4 bytes a pixel - 512 KB at the
+# usual 256x512 - so a full default cache holds ~32 MB of rasters on top of the far smaller stored fields.
+DEPTH_ARTIFACT_CACHE_ENTRIES = 64
+
+
+class DepthArtifact(collections.abc.Mapping):
+    """One depth artifact's fields by name, whichever format wrote it: the read side of _write_depth_artifact.
+
+    Indexes like the NpzFile numpy.load returns - artifact['plane_indices'], artifact.files, `with` - so the
+    helpers above and any consumer written against np.load take either. 'depth' is always there when the
+    artifact has depth at all: as stored by v3 and earlier, and for v4 reconstructed from the plane fields
+    (_compute_depth_raster, the identity _write_depth_artifact documents) the first time it is asked for, then
+    kept. Every array is read-only, since a cached artifact is shared by everyone who loads its path.
+    """
+
+    def __init__(self, fields):
+        self._fields = dict(fields)
+        for value in self._fields.values():
+            value.flags.writeable = False
+        self._derive_depth = 'depth' not in self._fields and all(name in self._fields for name in _PLANE_FIELDS)
+        self._lock = threading.Lock()
+
+    @property
+    def files(self):
+        """The field names, 'depth' included when it is reconstructed - NpzFile.files for a v3 artifact."""
+        return list(self._fields) + (['depth'] if self._derive_depth and 'depth' not in self._fields else [])
+
+    def __getitem__(self, name):
+        if name == 'depth' and self._derive_depth:
+            with self._lock:
+                if 'depth' not in self._fields:
+                    raster = _compute_depth_raster(self._planes())
+                    raster.flags.writeable = False
+                    self._fields['depth'] = raster
+        return self._fields[name]
+
+    def depth_at(self, rows, cols):
+        """self['depth'][rows, cols], without reconstructing a whole v4 raster to read a few pixels of it
+        (_depth_at_pixels gives the same values bit for bit).
+
+        @param rows, cols Integer arrays of the same shape, already in range for the raster.
+        """
+        if self._derive_depth and 'depth' not in self._fields:
+            return _depth_at_pixels(self._planes(), rows, cols)
+        return self['depth'][rows, cols]
+
+    def _planes(self):
+        return DepthPlanes(self._fields['plane_indices'], np.asarray(self._fields['planes_n']).reshape(-1, 3),
+                           self._fields['planes_d'])
+
+    def __contains__(self, name):
+        # Mapping's default would look the name up, and so reconstruct a v4 raster just to say it is there.
+        return name in self._fields or (name == 'depth' and self._derive_depth)
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def close(self):
+        """Nothing to release - the fields were read when the artifact was loaded. For NpzFile parity."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def _load_depth_fields(path):
+    """Every field of the .npz at path (a path or an open file), plane_indices decoded if it was encoded."""
+    with np.load(path) as d:
+        return _decode_plane_indices({name: d[name] for name in d.files})
+
+
+def read_depth_artifact(path):
+    """Read the depth artifact at path into a DepthArtifact, with no caching, whichever codec wrote it.
+
+    @raise ValueError if the file is an .npz but not a depth artifact (neither a raster nor the plane fields), or
+           its plane_indices is in an encoding this code does not know; anything numpy.load raises for a file
+           that is not an .npz at all, or cannot be read.
+    """
+    fields = _load_depth_fields(path)
+    if 'depth' not in fields and not all(name in fields for name in _PLANE_FIELDS):
+        raise ValueError("%s is not a depth artifact: no 'depth' raster and no plane fields" % (path,))
+    return DepthArtifact(fields)
+
+
+class DepthArtifactCache:
+    """Loaded DepthArtifacts by path, least recently used out first past max_entries.
+
+    Keyed by the file's size and mtime as well as its path, so an artifact rewritten since it was loaded (say,
+    by migrate_depth_artifacts.py) is read again rather than served stale. A consumer that comes back to a
+    pano - one lookup per label, and a pano has many labels - pays one read and at most one reconstruction.
+
+    Thread-safe. Two threads missing on the same artifact at once both read it, and one copy is kept.
+    """
+
+    def __init__(self, max_entries=DEPTH_ARTIFACT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # (path, mtime_ns, size) -> DepthArtifact
+
+    def load(self, path):
+        """The DepthArtifact at path, from the cache when it is current there; see read_depth_artifact."""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            artifact = self._entries.get(key)
+            if artifact is not None:
+                self._entries.move_to_end(key)
+                return artifact
+        artifact = read_depth_artifact(path)
+        with self._lock:
+            artifact = self._entries.setdefault(key, artifact)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return artifact
+
+
+_artifact_cache = DepthArtifactCache()
+
+
+def load_depth_artifact(path):
+    """Open the depth artifact at path - v3 and v4 alike - as a DepthArtifact, through a process-wide
+    DepthArtifactCache of DEPTH_ARTIFACT_CACHE_ENTRIES artifacts.
+
+    The reader for every consumer: artifact['depth'] is the raster whichever format is on disk. Use a
+    DepthArtifactCache of your own to size the cache, or read_depth_artifact to bypass it.
+    """
+    return _artifact_cache.load(path)
+
+
 def download_depth_maps(storage_path, pano_infos, run_start_monotonic=None, max_runtime_minutes=None,
-                        max_requests=None):
+                        max_requests=None, order=schedule.order, stop=None, depth_workers=1,
+                        depth_codec=DEFAULT_DEPTH_CODEC):
     """Fetch GSV depth maps via the streetlevel library for every pano in pano_infos.
 
     Callers pre-filter to source == 'gsv'. Depth rides Google's photometa response, so this costs one metadata
@@ -910,7 +1982,10 @@ def download_depth_maps(storage_path, pano_infos, run_start_monotonic=None, max_
     next run. The artifact on disk is the ground truth; deleting the ledger just makes the next run re-stat
     artifacts (re-appending 'saved') and re-request unresolved panos.
 
-    Unresolved panos are shuffled, so a cluster that fails on every run can't permanently starve max_requests.
+    Unresolved panos are shuffled (or put in `order`'s order, which keeps the shuffle as its tiebreak), so a
+    cluster that fails on every run can't permanently starve max_requests,
+    and one that has failed transiently on several runs in a row sits out a backoff window recorded in
+    <storage_path>/depth_retry_log.csv (downloaders/failure_log.py) - network and unexpected failures only.
     The phase stops early if Google starts refusing requests (see DepthBlockedError) or after
     DEPTH_MAX_CONSECUTIVE_FAILURES transient failures in a row, rather than spending the rest of the budget on a
     wall. config.depth_min_request_interval paces requests if set.
@@ -925,8 +2000,17 @@ def download_depth_maps(storage_path, pano_infos, run_start_monotonic=None, max_
     @param run_start_monotonic Shared run start, a time.monotonic() value, used for the max_runtime_minutes
                                budget. Monotonic, not the wall clock: an NTP step or DST transition must not
                                stretch or shrink the budget (#51).
-    @param max_runtime_minutes Stop starting new requests once this much time has elapsed since run start.
+    @param max_runtime_minutes Stop starting new requests once this much time has elapsed since run start. A
+                               request still in flight then is cut off, and its pano re-requested next run.
     @param max_requests        Stop after this many HTTP attempts this run (manual backfill throttle).
+    @param order               Puts the unresolved panos in the order they are requested, in place: by
+                               default a uniform shuffle (see downloaders/schedule.py for the alternative).
+    @param stop                A threading.Event set when the run is ending under the phase - it runs on its
+                               own thread beside the image phase under DownloadRunner's --concurrent-phases.
+                               No new request is started once it is set, and a retreat wakes up for it.
+    @param depth_workers       Photometa requests in flight at once, and artifact writes alongside them
+                               (DownloadRunner's --depth-workers). 1 is the serial loop: one pano at a time.
+    @param depth_codec         The DepthCodec artifacts are written with (DownloadRunner's --depth-codec).
     @return                    (success_count, fail_count, skipped_count, total_completed).
     """
     try:
@@ -968,11 +2052,20 @@ def download_depth_maps(storage_path, pano_infos, run_start_monotonic=None, max_
     # might actually fetch - after backfill that's a small set, so this stays cheap on a multi-million-pano corpus.
     candidates = [p for p in pano_infos if p['pano_id'] not in resolved_ids]
     skipped_count = total_panos - len(candidates)
+    # A pano whose photometa request has failed transiently run after run sits out a doubling window (see
+    # downloaders/failure_log.py) instead of spending a request - and max_requests - every night. Not ledgered
+    # and not counted: it is simply not this run's work.
+    failures = TransientFailureLog(os.path.join(storage_path, DEPTH_FAILURE_LOG_FILENAME))
+    failures.load(keep=lambda pano_id: pano_id not in resolved_ids)
+    candidates, deferred = failures.partition(candidates)
+    if deferred:
+        print("DEPTHDOWNLOAD: %d panos are backing off after repeated transient failures and sit this run out"
+              % len(deferred))
 
     # Shuffle so a cluster of panos that fail every time can't monopolise --max-depth-requests run after run and
     # starve the rest of the backfill: iteration order is otherwise stable, so the same head block would be
-    # re-attempted forever and never make progress.
-    random.shuffle(candidates)
+    # re-attempted forever and never make progress. A priority order keeps that property (schedule.PRIORITY).
+    order(candidates)
 
     try:
         depth_log = open(depth_log_path, 'a', newline='')
@@ -990,86 +2083,88 @@ def download_depth_maps(storage_path, pano_infos, run_start_monotonic=None, max_
         print("DEPTHDOWNLOAD: WARNING - cannot write the depth ledger (%s). Skipping the depth phase." % (e))
         return 0, 0, skipped_count, skipped_count
 
-    # Created after the ledger so an early return can't leak it; the with closes both (#51).
-    session = _depth_session()
-    with depth_log, session:
+    # Created after the ledger so an early return can't leak it; the with closes both (#51). Requests in flight
+    # are cut off at the budget's end, not just new ones held back - see _TimeoutHTTPAdapter.
+    deadline = None
+    if max_runtime_minutes is not None and run_start_monotonic is not None:
+        deadline = run_start_monotonic + max_runtime_minutes * 60.0
+    session = _depth_session(deadline)
+    # depth_workers > 1 pipelines the phase: up to that many photometa requests in flight on a thread pool, and
+    # each artifact's reconstruction, consistency checks and compression (_write_depth_artifact - most of a
+    # pano's CPU) on a WriteBehind of the same size, so a response never waits on the previous pano's write.
+    # One requests.Session serves every request thread: its connection pool is thread-safe. Everything with
+    # phase-wide state stays on this thread: pacing and the budget checks, made before a request is STARTED as
+    # in the serial loop; the counters, the breaker and the retreat, fed in completion order; and the ledger,
+    # appended by one writer. One worker is the serial loop exactly: each pano is requested, written and
+    # ledgered on this thread before the next request.
+    if depth_workers == 1:
+        requester, writer = InlineExecutor(), None
+    else:
+        requester = concurrent.futures.ThreadPoolExecutor(max_workers=depth_workers,
+                                                          thread_name_prefix='depth-request')
+        writer = WriteBehind(depth_workers)
+    with depth_log, session, failures:
 
         def record(pano_id, status):
             ledger.writerow([pano_id, status])
             depth_log.flush()
             resolved_ids.add(pano_id)
-
-        last_request_at = None
-        for pano_info in candidates:
-            pano_id = pano_info['pano_id']
-
-            artifact_path = os.path.join(storage_path, pano_id[:2], pano_id + DEPTH_ARTIFACT_SUFFIX)
-            if os.path.isfile(artifact_path):
-                # Artifact exists but the ledger doesn't know it (e.g. the ledger was deleted): self-heal.
-                try:
-                    record(pano_id, 'saved')
-                except OSError as e:
-                    # Deliberately not a failure (the artifact is safe; next run self-heals again), but it must
-                    # feed last_error: a full store failing every self-heal write used to end the phase with
-                    # zero stdout, indistinguishable from a healthy fully-backfilled city.
-                    last_error = e
-                    logging.error("DEPTHDOWNLOAD: Could not ledger existing artifact for pano %s: %s", pano_id,
-                                  str(e))
-                skipped_count += 1
-                continue
-
-            if max_runtime_minutes is not None and run_start_monotonic is not None:
-                elapsed_minutes = (time.monotonic() - run_start_monotonic) / 60.0
-                if elapsed_minutes >= max_runtime_minutes:
-                    stop_reason = DEPTH_STOP_MAX_RUNTIME
-                    print("DEPTHDOWNLOAD: Max runtime of %.1f minutes reached (%.1f elapsed). Stopping."
-                          % (max_runtime_minutes, elapsed_minutes))
-                    break
-            if max_requests is not None and request_count >= max_requests:
-                stop_reason = DEPTH_STOP_MAX_REQUESTS
-                print("DEPTHDOWNLOAD: Max depth requests (%d) reached. Stopping." % (max_requests))
-                break
-
-            _pace(last_request_at)
-            last_request_at = time.monotonic()
-
-            print("DEPTHDOWNLOAD: Processing pano %s " % (pano_id))
-            request_count += 1
+            failures.resolved(pano_id)
+
+        def settle(pano_id, future, written):
+            """Ledger and count what `future` - pano_id's request, or with `written` its artifact write - came to,
+            or class what it raised. A request whose artifact still has to be written on the writer is queued
+            there (into in_flight) instead. True when an outcome was counted and the breaker and retreat should
+            look at it; False when there is none yet, or the phase is stopping on it."""
+            nonlocal success_count, fail_count, unavailable_count, consecutive_failures, stop_reason, last_error, \
+                failure_class
             try:
-                pano, planes = _fetch_pano_with_depth_planes(pano_id, session)
-                if pano is None or pano.depth is None or pano.depth.data is None \
-                        or np.ndim(pano.depth.data) != 2:
-                    # Pano deleted/id rotated, no depth payload, or a payload that isn't the (h, w) grid
-                    # _write_depth_artifact's [:, ::-1] needs - a property of the pano, not of the network, so
-                    # it must not fall through to the write and be miscounted as transient. Depth availability
-                    # for a given pano id is static, so remember the outcome and never re-request.
-                    record(pano_id, 'unavailable')
-                    unavailable_count += 1
-                    fail_count += 1
-                elif planes is None:
-                    # A depth raster with no plane data can only mean the payload path or wire format drifted
-                    # upstream (the contract tests exist to catch that first). Depth exists, so 'unavailable'
-                    # would be a lie. DepthPayloadError is a RuntimeError, so it lands in the 'unexpected'
-                    # arm below - transient, not ledgered, retried next run. The remaining malformed-v3
-                    # cases (shape mismatch, indices disagreeing with the raster) raise the same type from
-                    # _write_depth_artifact, which is where the comparison the checks need is computed.
-                    raise DepthPayloadError("depth payload present but no plane data for pano %s" % (pano_id,))
-                else:
-                    _write_depth_artifact(storage_path, pano_id, pano, planes)
+                if written:
+                    future.result()
                     record(pano_id, 'saved')
                     success_count += 1
+                else:
+                    pano, planes = future.result()
+                    if pano is None or planes is None:
+                        # Pano deleted/id rotated, or no depth payload - a property of the pano, not of the
+                        # network, so it must not fall through to the write and be miscounted as transient. Depth
+                        # availability for a given pano id is static, so remember the outcome and never re-request.
+                        # (A payload that is there but malformed raises instead: _decode_depth_planes on the wire,
+                        # _check_depth_planes in the write - DepthPayloadError, transient, retried next run.)
+                        record(pano_id, 'unavailable')
+                        unavailable_count += 1
+                        fail_count += 1
+                    elif writer is not None:
+                        write = functools.partial(_write_depth_artifact, storage_path, pano_id, pano, planes,
+                                                  depth_codec)
+                        in_flight[writer.submit(write)] = (pano_id, True)
+                        return False
+                    else:
+                        _write_depth_artifact(storage_path, pano_id, pano, planes, depth_codec)
+                        record(pano_id, 'saved')
+                        success_count += 1
                 # Either outcome proves we're still talking to Google, so the breaker resets.
                 consecutive_failures = 0
                 streak_classes.clear()
+            except DeadlineExceeded as e:
+                # The budget ran out during this pano's request. Not a failure - of the pano or of Google - so
+                # it is neither counted nor backed off; nothing was written, and it is re-requested next run.
+                logging.info("DEPTHDOWNLOAD: Max runtime reached during the request for pano %s (%s)", pano_id, e)
+                if stop_reason is None:
+                    stop_reason = DEPTH_STOP_MAX_RUNTIME
+                    print("DEPTHDOWNLOAD: Max runtime of %.1f minutes reached mid-request. Stopping."
+                          % (max_runtime_minutes))
+                return False
             except (DepthBlockedError, requests.exceptions.RetryError) as e:
                 # Google is refusing us: an interstitial, or a 429/5xx that survived every retry. That's a verdict
                 # on the endpoint, not on this pano, so stop rather than spend the rest of the budget on a wall.
                 fail_count += 1
-                stop_reason = DEPTH_STOP_BLOCKED
                 last_error = e
-                logging.error("DEPTHDOWNLOAD: Stopping depth phase, Google is refusing requests (%s)", str(e))
-                print("DEPTHDOWNLOAD: Google is refusing requests (%s). Stopping the depth phase." % (e))
-                break
+                if stop_reason != DEPTH_STOP_BLOCKED:
+                    stop_reason = DEPTH_STOP_BLOCKED
+                    logging.error("DEPTHDOWNLOAD: Stopping depth phase, Google is refusing requests (%s)", str(e))
+                    print("DEPTHDOWNLOAD: Google is refusing requests (%s). Stopping the depth phase." % (e))
+                return False
             except (requests.RequestException, ValueError) as e:
                 # Transient: connection errors/timeouts, or a non-JSON page that isn't a recognised interstitial -
                 # streetlevel never checks status codes, so non-200 responses surface as JSONDecodeError. Not
@@ -1081,6 +2176,7 @@ def download_depth_maps(storage_path, pano_infos, run_start_monotonic=None, max_
                 streak_classes[failure_class] += 1
                 last_error = e
                 logging.error("DEPTHDOWNLOAD: Failed to fetch depth for pano %s due to error %s", pano_id, str(e))
+                failures.failed(pano_id, failure_class)
             except OSError as e:
                 # Storage-side failure writing the artifact or the ledger - ENOSPC/EIO on the sshfs mount is the
                 # realistic one, given this feature adds terabytes. Also transient and also not ledgered. Caught
@@ -1093,6 +2189,8 @@ def download_depth_maps(storage_path, pano_infos, run_start_monotonic=None, max_
                 streak_classes[failure_class] += 1
                 last_error = e
                 logging.error("DEPTHDOWNLOAD: Could not store depth for pano %s: %s", pano_id, str(e))
+                # Not a failure of this pano: a full or unmounted store fails every pano alike, and backing each
+                # off would leave the backlog sitting out for nights after the store is fixed.
             except Exception as e:
                 # Unexpected (e.g. a malformed depth payload crashing streetlevel's parser). Treated as
                 # transient; worst case a permanently-bad pano costs one request per run.
@@ -1102,26 +2200,107 @@ def download_depth_maps(storage_path, pano_infos, run_start_monotonic=None, max_
                 streak_classes[failure_class] += 1
                 last_error = e
                 logging.exception("DEPTHDOWNLOAD: Unexpected error fetching depth for pano %s: %s", pano_id, str(e))
+                failures.failed(pano_id, failure_class)
+            return True
 
-            total_completed = success_count + fail_count + skipped_count
-            print("DEPTHDOWNLOAD: Completed %d of %d (%d success, %d failed [%d unavailable], %d skipped)"
-                  % (total_completed, total_panos, success_count, fail_count, unavailable_count, skipped_count))
-
-            if consecutive_failures >= DEPTH_MAX_CONSECUTIVE_FAILURES:
-                stop_reason = DEPTH_STOP_CONSECUTIVE_FAILURES
-                logging.error("DEPTHDOWNLOAD: Stopping depth phase after %d consecutive failures",
-                              consecutive_failures)
-                print("DEPTHDOWNLOAD: %d consecutive failures. Stopping the depth phase."
-                      % (consecutive_failures))
-                break
-            # The retreat exists to give a network blip or rate limit time to clear. A full or unmounted store
-            # cannot clear itself, so storage failures skip the wait (they still count toward the breaker, which
-            # then trips fast) instead of burning up to 7.5 minutes of a shared --max-runtime window.
-            retreat_seconds = None if failure_class == 'storage' else DEPTH_RETREAT_SCHEDULE.get(consecutive_failures)
-            if retreat_seconds:
-                print("DEPTHDOWNLOAD: %d consecutive failures, backing off for %ds before continuing."
-                      % (consecutive_failures, retreat_seconds))
-                time.sleep(retreat_seconds)
+        pending = collections.deque(candidates)
+        in_flight = {}  # future -> (pano_id, whether it is the artifact write rather than the request)
+        requesting = 0  # of which requests
+        last_request_at = None
+        try:
+            while (pending and stop_reason is None) or in_flight:
+                while pending and stop_reason is None and requesting < depth_workers:
+                    pano_info = pending.popleft()
+                    pano_id = pano_info['pano_id']
+
+                    artifact_path = os.path.join(storage_path, pano_id[:2], pano_id + DEPTH_ARTIFACT_SUFFIX)
+                    if store_catalog.isfile(artifact_path):
+                        # Artifact exists but the ledger doesn't know it (e.g. the ledger was deleted): self-heal.
+                        try:
+                            record(pano_id, 'saved')
+                        except OSError as e:
+                            # Deliberately not a failure (the artifact is safe; next run self-heals again), but it
+                            # must feed last_error: a full store failing every self-heal write used to end the
+                            # phase with zero stdout, indistinguishable from a healthy fully-backfilled city.
+                            last_error = e
+                            logging.error("DEPTHDOWNLOAD: Could not ledger existing artifact for pano %s: %s",
+                                          pano_id, str(e))
+                        skipped_count += 1
+                        continue
+
+                    if max_runtime_minutes is not None and run_start_monotonic is not None:
+                        elapsed_minutes = (time.monotonic() - run_start_monotonic) / 60.0
+                        if elapsed_minutes >= max_runtime_minutes:
+                            stop_reason = DEPTH_STOP_MAX_RUNTIME
+                            print("DEPTHDOWNLOAD: Max runtime of %.1f minutes reached (%.1f elapsed). Stopping."
+                                  % (max_runtime_minutes, elapsed_minutes))
+                            break
+                    if max_requests is not None and request_count >= max_requests:
+                        stop_reason = DEPTH_STOP_MAX_REQUESTS
+                        print("DEPTHDOWNLOAD: Max depth requests (%d) reached. Stopping." % (max_requests))
+                        break
+                    if stop is not None and stop.is_set():
+                        stop_reason = DEPTH_STOP_RUN_ENDING
+                        print("DEPTHDOWNLOAD: The run is ending. Stopping.")
+                        break
+
+                    _pace(last_request_at)
+                    last_request_at = time.monotonic()
+
+                    print("DEPTHDOWNLOAD: Processing pano %s " % (pano_id))
+                    request_count += 1
+                    requesting += 1
+                    in_flight[requester.submit(_fetch_pano_with_depth_planes, pano_id, session)] = (pano_id, False)
+                if not in_flight:
+                    continue
+                # Panos a stop left in flight are still waited for and counted: their requests were made.
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pano_id, written = in_flight.pop(future)
+                    if not written:
+                        requesting -= 1
+                    if not settle(pano_id, future, written):
+                        continue
+
+                    total_completed = success_count + fail_count + skipped_count
+                    print("DEPTHDOWNLOAD: Completed %d of %d (%d success, %d failed [%d unavailable], %d skipped)"
+                          % (total_completed, total_panos, success_count, fail_count, unavailable_count,
+                             skipped_count))
+                    if stop_reason is not None:
+                        continue  # stopping already; the breaker and the retreat have nothing left to hold back
+
+                    if consecutive_failures >= DEPTH_MAX_CONSECUTIVE_FAILURES:
+                        stop_reason = DEPTH_STOP_CONSECUTIVE_FAILURES
+                        logging.error("DEPTHDOWNLOAD: Stopping depth phase after %d consecutive failures",
+                                      consecutive_failures)
+                        print("DEPTHDOWNLOAD: %d consecutive failures. Stopping the depth phase."
+                              % (consecutive_failures))
+                        continue
+                    # The retreat exists to give a network blip or rate limit time to clear. A full or unmounted
+                    # store cannot clear itself, so storage failures skip the wait (they still count toward the
+                    # breaker, which then trips fast) instead of burning up to 7.5 minutes of a shared
+                    # --max-runtime window.
+                    retreat_seconds = (None if failure_class == 'storage'
+                                       else DEPTH_RETREAT_SCHEDULE.get(consecutive_failures))
+                    if retreat_seconds and deadline is not None:
+                        # No point waiting past the budget: the next request stops on it anyway.
+                        retreat_seconds = min(retreat_seconds, max(0.0, deadline - time.monotonic()))
+                    if retreat_seconds:
+                        print("DEPTHDOWNLOAD: %d consecutive failures, backing off for %ds before continuing."
+                              % (consecutive_failures, retreat_seconds))
+                        # Up to five minutes: a run ending meanwhile (a SIGTERM on the image phase's thread) must
+                        # not have to wait it out. Requests already in flight carry on; no new one starts.
+                        if stop is not None:
+                            stop.wait(retreat_seconds)
+                        else:
+                            time.sleep(retreat_seconds)
+        finally:
+            # On the way out after a SIGTERM: requests already running finish on their own (a thread cannot be
+            # killed), and their panos are simply requested again next run. Writes already running land, and
+            # are self-healed into the ledger by the next run.
+            requester.shutdown(wait=True, cancel_futures=True)
+            if writer is not None:
+                writer.close()
 
     total_completed = success_count + fail_count + skipped_count
     # Loud on stdout because cron mails it: a phase that stopped early means nothing is progressing, and the
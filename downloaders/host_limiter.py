@@ -0,0 +1,168 @@
+# Host-wide request budget shared by every DownloadRunner process on one machine.
+#
+# The lab runs ~50 cities from a handful of boxes, one cron job per city, and their windows overlap. Every
+# throttle the scraper had was per-process: depth_min_request_interval paces one run's photometa requests, and
+# the tile fan-out had no cross-process limit at all. So the rate Google saw from a box was whatever each run
+# did, times however many happened to overlap that night - and uncoordinated overlap is what gets a box
+# blocked. A HostRateLimiter is a token bucket kept in a small file under a directory every run on the host is
+# configured with (config.host_rate_limit_dir); each request draws a token from it under an flock, so the
+# budget is the host's, whatever the number of runs.
+#
+# Fair between cities: a run may only queue so far ahead of the others (see reserve), so a city fanning out 32
+# tiles at once does not starve one whose depth phase asks for one request at a time.
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no flock. The scraper only runs on Linux; this keeps a dev box's import (and the suite) working.
+    fcntl = None
+
+# A run that has not drawn from the bucket for this long no longer counts toward the fair share - it has
+# finished, crashed, or moved on to a phase that does not use this bucket.
+MEMBER_TTL_SECONDS = 60.0
+
+
+class HostRateLimiter:
+    """A token bucket of `rate` requests per second, bursting to `burst`, stored in the file at `path`.
+
+    Every process that names the same path draws on the same bucket: the file holds the token count, the time
+    it was last refilled, and each member process's outstanding reservations, and is only read or written
+    under an exclusive flock. The lock is held for one small read-modify-write, never across a wait.
+
+    When the bucket is empty a request reserves the next free slot (the token count goes negative) and
+    sleeps until it. Unchecked, one process with many requests in flight would reserve every slot for the
+    next minute, so each process may hold at most burst / (active processes) reservations at once; past
+    that, it retries after one token's worth of time. Idle capacity is still used: a process alone on the
+    host gets the whole burst.
+
+    Best-effort like the tile cache: a bucket file that cannot be opened or parsed is logged once and the
+    request goes ahead unthrottled (or starts a fresh bucket), never fails the scrape.
+    """
+
+    def __init__(self, path, rate, burst=None, clock=time.time):
+        self.path = path
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst) if burst is not None else self.rate)
+        self._clock = clock
+        self._member = str(os.getpid())
+        self._warned = False
+
+    def reserve(self):
+        """Claim a token: the seconds to wait before making the request, or None when this process already
+        holds its fair share of reservations and should ask again later."""
+        # All of it, not just the open: a filesystem without flock (ENOLCK, EOPNOTSUPP on some NFS mounts) or a
+        # full disk under the write is as unusable a bucket as a missing directory.
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o664)
+            with os.fdopen(fd, 'r+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    state = self._read(f)
+                    wait = self._claim(state, self._clock())
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(state, f)
+                    # Before the unlock, not at close: a reader let in while the state is still in our buffer
+                    # would find an empty file and start a fresh, full bucket.
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        except OSError as e:
+            if not self._warned:
+                self._warned = True
+                logging.warning("Host rate limiter %s is unusable (%s); requests are not host-limited", self.path, e)
+            return 0.0
+        return wait
+
+    def _read(self, f):
+        try:
+            state = json.loads(f.read() or 'null')
+        except ValueError:
+            state = None
+        if (isinstance(state, dict) and _is_number(state.get('tokens'))
+                and 'stamp' in state and (state['stamp'] is None or _is_number(state['stamp']))
+                and isinstance(state.get('members'), dict)):
+            # Another version of the scraper, or a hand edit, may have left members _claim cannot read: drop
+            # those rather than the bucket, whose token count is still good.
+            state['members'] = {member: entry for member, entry in state['members'].items()
+                                if isinstance(entry, dict) and _is_number(entry.get('seen'))
+                                and isinstance(entry.get('slots'), list)
+                                and all(_is_number(slot) for slot in entry['slots'])}
+            return state
+        # A new bucket, or one a crash left half-written: start full, as after a long idle.
+        return {'tokens': self.burst, 'stamp': None, 'members': {}}
+
+    def _claim(self, state, now):
+        # Refill for the time since the last claim. A clock that went backwards (or a file from before a
+        # reboot) refills nothing rather than draining the bucket.
+        if state['stamp'] is not None:
+            state['tokens'] = min(self.burst, state['tokens'] + max(0.0, now - state['stamp']) * self.rate)
+        state['stamp'] = now
+        members = {member: entry for member, entry in state['members'].items()
+                   if entry['seen'] >= now - MEMBER_TTL_SECONDS}
+        for entry in members.values():
+            entry['slots'] = [slot for slot in entry['slots'] if slot > now]
+        mine = members.setdefault(self._member, {'seen': now, 'slots': []})
+        mine['seen'] = now
+        state['members'] = members
+
+        if state['tokens'] >= 1:
+            state['tokens'] -= 1
+            return 0.0
+        if len(mine['slots']) >= max(1, int(self.burst // len(members))):
+            return None
+        wait = (1 - state['tokens']) / self.rate
+        state['tokens'] -= 1
+        mine['slots'].append(now + wait)
+        return wait
+
+    def wait(self):
+        """Block until this process may make one request."""
+        while True:
+            wait = self.reserve()
+            if wait is not None:
+                break
+            time.sleep(1.0 / self.rate)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def wait_async(self):
+        """wait() for a coroutine. The claim runs on an executor thread - flock blocks for as long as another
+        process holds the lock, and the file I/O is disk I/O - and the waiting yields the loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            wait = await loop.run_in_executor(None, self.reserve)
+            if wait is not None:
+                break
+            await asyncio.sleep(1.0 / self.rate)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def _is_number(value):
+    # bool is an int to isinstance, but never a count or a timestamp.
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def from_config(directory, name, rate):
+    """The host's `name` bucket under `directory`, or None when host-wide limiting is off for it (no
+    directory configured, or a rate of 0)."""
+    if not directory or not rate or rate <= 0:
+        return None
+    if fcntl is None:
+        logging.warning("Host rate limiting needs flock, which this platform lacks; %s requests are not "
+                        "host-limited", name)
+        return None
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        logging.warning("Host rate limit directory %s is unusable (%s); %s requests are not host-limited",
+                        directory, e, name)
+        return None
+    return HostRateLimiter(os.path.join(directory, '%s.bucket' % name), rate)
@@ -0,0 +1,123 @@
+# Lossless assembly of a GSV pano from its tiles' DCT coefficients, when jpeglib is installed.
+#
+# At a pano's native zoom, with every tile a full 512x512 body and no crop or resize to make, the Pillow path
+# decodes 512 JPEGs, pastes them into a canvas and encodes the 16384x8192 result all over again: a second
+# generation of JPEG loss, and the encode is the largest single CPU cost of a pano. None of that work is needed.
+# CBK's tiles are baseline JPEGs from one encoder, cut on a 512 grid that is a whole number of MCUs at any
+# sampling, so the pano's quantised coefficients are the tiles' coefficients laid side by side. Copying them
+# skips the IDCT, the colour conversion, the forward DCT and the requantisation, and the saved pano carries
+# exactly the imagery Google sent.
+#
+# Optional twice over: jpeglib (https://pypi.org/project/jpeglib/) wraps libjpeg's coefficient access, and is
+# not in requirements.txt (requirements-dev.txt has it, so CI runs the real round trip); and the path is only
+# taken with config.lossless_stitch set. Otherwise - or for any pano that does not qualify (see
+# gsv._StreamingStitch) - the stitch takes the Pillow path it always has.
+
+import collections
+import os
+import tempfile
+
+import numpy as np
+
+try:
+    import jpeglib
+except ImportError:
+    jpeglib = None
+
+BLOCK = 8
+
+# An 8x8 block's DC coefficient is 8 x its mean level-shifted sample, so an all-black block's is 8 * (0 - 128).
+_BLACK_DC = -1024
+# The most a flat block's dequantised DC may sit above _BLACK_DC and still decode to sample 0: the IDCT divides
+# it by 8 and rounds, so anything under half a level does.
+_BLACK_DC_SLACK = 3
+
+# Where read_coefficients puts each body for jpeglib to read. A tmpfs where there is one: a zoom-5 pano is 512
+# tiles, and they have no business going anywhere near a disk. None is tempfile's default directory.
+_SCRATCH_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# One JPEG's quantised coefficients: `planes` is one (block rows, block cols, 8, 8) int16 array per component
+# (Y, Cb, Cr), `qt` its quantisation tables, `quant_tbl_no` which table each component uses, `samp_factor`
+# each component's sampling factors.
+TileCoefficients = collections.namedtuple('TileCoefficients', ['planes', 'qt', 'quant_tbl_no', 'samp_factor'])
+
+
+class IncompatibleTile(ValueError):
+    """A tile whose coefficients cannot be copied into the mosaic as they are: another size, other tables, or
+    other sampling. The stitch falls back to Pillow for the whole pano."""
+
+
+def available():
+    return jpeglib is not None
+
+
+def read_coefficients(data):
+    """The quantised DCT coefficients of one JPEG body. jpeglib reads from a path, hence the temp file."""
+    with tempfile.NamedTemporaryFile(suffix='.jpg', dir=_SCRATCH_DIR) as f:
+        f.write(data)
+        f.flush()
+        image = jpeglib.read_dct(f.name)
+        # Read while the file still exists: jpeglib loads lazily, on first attribute access.
+        planes = tuple(plane for plane in (image.Y, image.Cb, image.Cr) if plane is not None)
+        return TileCoefficients(planes, np.asarray(image.qt), tuple(image.quant_tbl_no[:len(planes)]),
+                                np.asarray(image.samp_factor))
+
+
+def black_pixels(tile):
+    """How many of the tile's luma samples decode to exact black, judged from coefficients alone.
+
+    The DC-domain stand-in for gsv._black_fraction: a block counts (all 64 samples) when it is flat - every
+    AC coefficient zero - at the black level. That is what an out-of-range tile is made of, so the grid faults
+    the guard exists for count in full; a block of real imagery is almost never flat black, and one that is
+    only nearly so counts for nothing rather than for a guess.
+    """
+    luma = tile.planes[0]
+    q_dc = int(tile.qt[tile.quant_tbl_no[0]][0, 0])
+    flat = ~luma.reshape(luma.shape[:2] + (BLOCK * BLOCK,))[..., 1:].any(axis=-1)
+    black = luma[..., 0, 0].astype(np.int32) * q_dc <= _BLACK_DC + _BLACK_DC_SLACK
+    return int(np.count_nonzero(flat & black)) * BLOCK * BLOCK
+
+
+class DctMosaic:
+    """A tiles_x by tiles_y grid of tile_size tiles, assembled in the coefficient domain.
+
+    Shaped by the first tile placed: every later one must have the same size, tables and sampling, or place()
+    raises IncompatibleTile. A cell never placed holds flat black blocks, as the Pillow canvas's background is.
+
+    Quacks like as much of a PIL Image as download_single_pano's save needs: .size, and .save(path, 'jpeg').
+    Holds 2 bytes per coefficient - 3 bytes a pixel at 4:2:0, the same as the RGB canvas it stands in for.
+    """
+
+    def __init__(self, tiles_x, tiles_y, tile_size, first):
+        self.size = (tiles_x * tile_size, tiles_y * tile_size)
+        self._qt, self._quant_tbl_no, self._samp_factor = first.qt, first.quant_tbl_no, first.samp_factor
+        self._block_shapes = [plane.shape for plane in first.planes]
+        if self._block_shapes[0][:2] != (tile_size // BLOCK, tile_size // BLOCK):
+            raise IncompatibleTile('a %dx%d-block tile in a %dpx grid' % (self._block_shapes[0][:2] + (tile_size,)))
+        self.planes = []
+        for index, (rows, cols, _h, _w) in enumerate(self._block_shapes):
+            plane = np.zeros((rows * tiles_y, cols * tiles_x, BLOCK, BLOCK), dtype=np.int16)
+            if index == 0:
+                # Floor division: a DC that rounds the other way would decode to 1, not black.
+                plane[..., 0, 0] = _BLACK_DC // int(self._qt[self._quant_tbl_no[0]][0, 0])
+            # Chroma zero is neutral, so the block is (0, 0, 0).
+            self.planes.append(plane)
+
+    def place(self, x, y, tile):
+        if [plane.shape for plane in tile.planes] != self._block_shapes:
+            raise IncompatibleTile('tile (%d, %d) has another size or sampling' % (x, y))
+        if not (np.array_equal(tile.qt, self._qt) and tuple(tile.quant_tbl_no) == tuple(self._quant_tbl_no)
+                and np.array_equal(tile.samp_factor, self._samp_factor)):
+            raise IncompatibleTile('tile (%d, %d) has other quantisation tables or sampling' % (x, y))
+        for plane, tile_plane in zip(self.planes, tile.planes):
+            rows, cols = tile_plane.shape[:2]
+            plane[y * rows:(y + 1) * rows, x * cols:(x + 1) * cols] = tile_plane
+
+    def save(self, fp, format=None):
+        """Write the mosaic as a baseline JPEG, coefficients as they are. `format` is accepted for Image.save
+        parity; the output is always JPEG."""
+        components = dict(zip(('Y', 'Cb', 'Cr'), self.planes))
+        # The tiles' sampling factors too: left to jpeglib's default, a mosaic of tiles sampled otherwise would be
+        # written with chroma planes that do not match the header.
+        jpeglib.from_dct(qt=self._qt, quant_tbl_no=np.asarray(self._quant_tbl_no),
+                         samp_factor=np.asarray(self._samp_factor), **components).write_dct(fp)
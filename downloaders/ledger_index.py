@@ -0,0 +1,151 @@
+# A compacted snapshot of each resume ledger, so a run start stops re-parsing years of CSV.
+#
+# pano_id_log.csv and depth_log.csv only ever grow, and every run start parsed each of them in full - the depth
+# ledger twice, once for the --min-depth-runtime backlog count and once for the phase itself. On a large city
+# over sshfs that is minutes of csv.reader before the first request, growing without bound.
+#
+# With indexing on (DownloadRunner's --ledger-index), a ledger's parse is kept beside it in <ledger>.idx: the
+# ids per status and the row counts, for the CSV up to a byte offset. A later read loads the snapshot and
+# parses only the rows appended since, and rewrites the snapshot once that tail has grown. The CSV is still
+# the ledger: every append goes there exactly as before, it is the view ops grep and export, and the snapshot
+# is a cache of it that is always safe to delete. SQLite was the obvious alternative and the wrong one here -
+# its locking, and WAL mode outright, do not work on the network filesystems the stores live on.
+#
+# A snapshot only counts while the CSV still starts with the bytes it was taken from; one that does not (the
+# ledger deleted or rewritten - the force-retry levers in docs/ops.md) is rebuilt by a full parse.
+
+import collections
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import zlib
+
+from .common import atomic_output_path
+
+INDEX_SUFFIX = '.idx'
+
+_MAGIC = b'SIDEWALK-LEDGER-INDEX 1\n'
+# The snapshot is rewritten once this many rows have been appended past it. Parsing a tail that size costs
+# well under a second; rewriting costs a full snapshot's worth of I/O, so not every run.
+SNAPSHOT_EVERY_ROWS = 20000
+# How much of the CSV, at each end of the covered prefix, the snapshot checks before it is trusted. Any edit
+# that adds or removes rows shifts the bytes at the end of the prefix, so a replaced or trimmed ledger fails
+# the check without a full read.
+_CHECK_BYTES = 4096
+
+# A ledger read: for each status, the set of ids with at least one row of it, and how many rows have it.
+LedgerSummary = collections.namedtuple('LedgerSummary', ['ids', 'rows'])
+
+# Whether reads go through the snapshot; see indexing().
+_enabled = False
+
+
+@contextlib.contextmanager
+def indexing(enabled=True):
+    """Read ledgers through their snapshots for the duration of the block."""
+    global _enabled
+    previous, _enabled = _enabled, enabled
+    try:
+        yield
+    finally:
+        _enabled = previous
+
+
+def read_ledger(csv_path, statuses):
+    """Summarise the `pano_id,<status>` ledger at csv_path, keeping rows whose status is one of `statuses`.
+
+    Row-tolerant the way both ledgers' readers always were: the header, a line torn by a crash mid-append and
+    any row that is not exactly (id, known status) are skipped. A missing ledger is empty. With indexing on,
+    the answer is identical - the snapshot is a parse of the same rows - and a snapshot that cannot be read or
+    written is logged and worked around, never fatal.
+    """
+    statuses = tuple(statuses)
+    summary = LedgerSummary({status: set() for status in statuses}, dict.fromkeys(statuses, 0))
+    if not os.path.isfile(csv_path):
+        return summary
+    with open(csv_path, 'rb') as f:
+        if not _enabled:
+            _parse(f.read(), summary)
+            return summary
+        offset = _load_snapshot(csv_path + INDEX_SUFFIX, f, statuses, summary)
+        f.seek(offset)
+        tail = f.read()
+        # The snapshot may only cover whole lines: a torn last line gets completed (or glued to) by the next
+        # append, and must be parsed again then.
+        covered = tail.rfind(b'\n') + 1
+        appended = _parse(tail[:covered], summary)
+        if offset == 0 or appended >= SNAPSHOT_EVERY_ROWS:
+            f.seek(0)
+            _write_snapshot(csv_path + INDEX_SUFFIX, f, offset + covered, summary)
+        _parse(tail[covered:], summary)
+    return summary
+
+
+def _parse(data, summary):
+    """Fold the rows in `data` (bytes) into summary; the number of rows kept."""
+    kept = 0
+    for row in csv.reader(io.StringIO(data.decode('utf-8', 'surrogateescape'), newline='')):
+        if len(row) != 2 or row[0] == 'pano_id' or row[1] not in summary.ids:
+            continue
+        summary.ids[row[1]].add(row[0])
+        summary.rows[row[1]] += 1
+        kept += 1
+    return kept
+
+
+def _check(f, offset):
+    """A digest of the CSV's first and last _CHECK_BYTES before offset, or None when it is shorter."""
+    f.seek(0, os.SEEK_END)
+    if f.tell() < offset:
+        return None
+    f.seek(0)
+    digest = hashlib.sha256(f.read(min(offset, _CHECK_BYTES)))
+    f.seek(max(0, offset - _CHECK_BYTES))
+    digest.update(f.read(min(offset, _CHECK_BYTES)))
+    return digest.hexdigest()
+
+
+def _load_snapshot(index_path, f, statuses, summary):
+    """Fold the snapshot into summary and return the CSV offset it covers, or 0 when there is none usable."""
+    try:
+        with open(index_path, 'rb') as index:
+            if index.readline() != _MAGIC:
+                raise ValueError('not a ledger index')
+            header = json.loads(index.readline())
+            if tuple(header['statuses']) != statuses or _check(f, header['offset']) != header['check']:
+                return 0  # another ledger's, or this one has been replaced or edited since
+            for status, size, rows in zip(statuses, header['sizes'], header['rows']):
+                block = zlib.decompress(index.read(size))
+                ids = block.decode('utf-8', 'surrogateescape').split('\n') if block else []
+                summary.ids[status].update(ids)
+                summary.rows[status] += rows
+            return header['offset']
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, KeyError, TypeError, zlib.error) as e:
+        for status in statuses:  # a snapshot that fails half-way must not leave half its ids behind
+            summary.ids[status].clear()
+            summary.rows[status] = 0
+        logging.warning("Ledger index %s is unreadable (%s); reading the ledger in full", index_path, e)
+        return 0
+
+
+def _write_snapshot(index_path, f, offset, summary):
+    # Level 1: pano ids are close to random, so harder compression buys little and costs seconds per write.
+    blocks = [zlib.compress('\n'.join(summary.ids[status]).encode('utf-8', 'surrogateescape'), 1)
+              for status in summary.ids]
+    header = {'statuses': list(summary.ids), 'offset': offset, 'check': _check(f, offset),
+              'sizes': [len(block) for block in blocks], 'rows': [summary.rows[status] for status in summary.ids]}
+    try:
+        with atomic_output_path(index_path) as tmp_path:
+            with open(tmp_path, 'wb') as index:
+                index.write(_MAGIC)
+                index.write(json.dumps(header).encode() + b'\n')
+                for block in blocks:
+                    index.write(block)
+    except OSError as e:
+        logging.warning("Could not write ledger index %s (%s); the next run reads the ledger in full", index_path, e)
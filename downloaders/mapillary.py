@@ -6,13 +6,14 @@
 
 import logging
 import os
-import stat
 
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
-from .common import DownloadResult, atomic_output_path
+from . import store_catalog
+from .common import (DeadlineExceeded, DownloadResult, atomic_output_path, check_deadline, ensure_shard_dir,
+                     request_timeout, seconds_left)
 
 GRAPH_API_BASE = 'https://graph.mapillary.com'
 TOKEN_ENV_VAR = 'MAPILLARY_ACCESS_TOKEN'
@@ -35,18 +36,12 @@ def download_single_pano(storage_path, pano_info):
     pano_id = pano_info['pano_id']
 
     destination_dir = os.path.join(storage_path, pano_id[:2])
-    if not os.path.isdir(destination_dir):
-        # exist_ok: concurrent runs race on shard dirs.
-        os.makedirs(destination_dir, exist_ok=True)
-        try:
-            os.chmod(destination_dir, 0o775 | stat.S_ISGID)
-        except PermissionError:
-            pass  # lost the race to another user's process; their dir, their modes — must not fail the pano
-
     out_image_name = os.path.join(destination_dir, pano_id + ".jpg")
-    if os.path.isfile(out_image_name):
+    if store_catalog.isfile(out_image_name):
         return DownloadResult.skipped
 
+    ensure_shard_dir(destination_dir)
+
     token = os.environ.get(TOKEN_ENV_VAR)
     if not token:
         # A property of the RUN, not of this pano, so it raises rather than returning failure (#41):
@@ -55,12 +50,23 @@ def download_single_pano(storage_path, pano_info):
         # environment variable.
         raise RuntimeError("%s is not set; cannot download Mapillary pano %s" % (TOKEN_ENV_VAR, pano_id))
 
+    try:
+        return _download(pano_id, token, out_image_name)
+    except requests.RequestException as e:
+        # The timeouts below are capped by the run's deadline (common.deadline), so a request that fails once
+        # it has passed was cut off by the budget, not by Mapillary.
+        if seconds_left() == 0:
+            raise DeadlineExceeded('the run deadline passed with pano %s in flight (%s)' % (pano_id, e)) from e
+        raise
+
+
+def _download(pano_id, token, out_image_name):
     # Context-managed so the per-pano connection pool is released deterministically, not at GC (#51).
     with _session() as session:
         meta_resp = session.get(
             f'{GRAPH_API_BASE}/{pano_id}',
             params={'fields': 'thumb_original_url', 'access_token': token},
-            timeout=30,
+            timeout=request_timeout(30),
         )
         if meta_resp.status_code == 404:
             # The Graph API doesn't know this id: a permanent property of the pano, so it ledgers (#41).
@@ -84,7 +90,7 @@ def download_single_pano(storage_path, pano_info):
             logging.error("Mapillary metadata for %s missing thumb_original_url", pano_id)
             return DownloadResult.failure
 
-        image_resp = session.get(image_url, stream=True, timeout=120)
+        image_resp = session.get(image_url, stream=True, timeout=request_timeout(120))
         # The signed URL is short-lived, so a non-200 here is a stale URL or a CDN hiccup, never a property
         # of the pano - the metadata request above already proved the imagery exists (#41).
         image_resp.raise_for_status()
@@ -96,4 +102,7 @@ def download_single_pano(storage_path, pano_info):
                 for chunk in image_resp.iter_content(chunk_size=1 << 16):
                     if chunk:
                         f.write(chunk)
+                    # A read timeout bounds each chunk, not the stream; the deadline is checked between them.
+                    # Raising here removes the .part, so a cut-off download leaves nothing behind.
+                    check_deadline()
     return DownloadResult.success
@@ -0,0 +1,59 @@
+# The order each phase spends its budget in.
+#
+# Neither phase's budget covers its backlog on a big city - that is what --max-runtime and --max-depth-requests
+# are for - so the order candidates are attempted in decides which panos become usable first. Until this
+# existed the only policy was random.shuffle: fair, and it stops a cluster that fails every night from
+# monopolising the head of the queue (#40, #41), but it spends a mapathon's labelled panos and a never-labelled
+# parking lot at the same rate.
+#
+# 'priority' orders by value instead, with the shuffle's fairness kept: each pano draws a random key weighted by
+# what it is worth (Efraimidis-Spirakis weighted sampling without replacement), and the phase works through the
+# keys from the top. Panos of equal worth come out in a uniformly random order - exactly the shuffle - and a
+# low-worth pano is never starved, only made less likely to be early: it is ahead of any one higher-worth pano
+# with probability w_low / (w_low + w_high), every night, and so is reached within a bounded number of nights
+# in expectation. That stands in for explicit age-boosting, which would need a persistent first-seen time for
+# every pano in the backlog.
+
+import random
+
+SHUFFLE = 'shuffle'
+PRIORITY = 'priority'
+SCHEDULES = (SHUFFLE, PRIORITY)
+
+# Relative worth. Labelled panos are why the scrape exists: the cropper turns their labels into training data,
+# so an image for one is worth many for a pano nobody has labelled (only attempted at all with --all-panos).
+LABELLED_WEIGHT = 32.0
+# Depth is sampled under labels on the pano image (see docs/depth.md), so depth for a pano whose image is
+# already on the store is usable tonight; depth for one still waiting on its image is not.
+IMAGED_WEIGHT = 4.0
+
+
+def image_weight(pano_info):
+    """An image-phase candidate's worth. A record with no has_labels counts as labelled, as it does in
+    DownloadRunner.select_image_panos."""
+    return LABELLED_WEIGHT if pano_info.get('has_labels', True) else 1.0
+
+
+def depth_weight(imaged_ids):
+    """A depth-phase candidate's worth, given the ids of the panos whose image is on the store."""
+    def weight(pano_info):
+        return image_weight(pano_info) * (IMAGED_WEIGHT if pano_info['pano_id'] in imaged_ids else 1.0)
+    return weight
+
+
+def order(candidates, schedule=SHUFFLE, weight=image_weight):
+    """Put `candidates` (pano dicts) in the order a phase should attempt them, in place.
+
+    @param schedule One of SCHEDULES: SHUFFLE is a uniform shuffle, PRIORITY a shuffle weighted by `weight`.
+    @param weight   Pano dict -> positive worth; only read under PRIORITY.
+    """
+    if schedule == SHUFFLE:
+        random.shuffle(candidates)
+        return
+    if schedule != PRIORITY:
+        raise ValueError("Unknown schedule %r; expected one of %s" % (schedule, ', '.join(SCHEDULES)))
+    # u ** (1 / w) for u uniform on [0, 1): sorting by it descending draws panos in proportion to their
+    # weight, one at a time, without replacement.
+    keys = [random.random() ** (1.0 / weight(pano_info)) for pano_info in candidates]
+    ranked = sorted(range(len(candidates)), key=keys.__getitem__, reverse=True)
+    candidates[:] = [candidates[i] for i in ranked]
@@ -0,0 +1,140 @@
+# One directory listing instead of a stat per file, for the existence checks that gate every pano.
+#
+# Whether a pano is already done is decided by whether its file exists: the image downloaders skip a pano
+# whose .jpg is on the store, the depth phase self-heals a pano whose .npz is there but unledgered, and the
+# cropper counts a pano with no .jpg as missing and a label whose crop exists as done. Each of those was an
+# os.path.isfile, and on the sshfs store every one is a network round trip - tens of thousands a run on a city
+# of any size, and ~400k for the cropper's label check alone.
+#
+# A StoreCatalog answers the same question from a listing: the second time anything in a directory is asked
+# about, the whole directory is read with one os.scandir and every later check in it is a dict lookup. (The
+# first is a plain stat, so a run that only ever touches one pano per shard costs what it did before.) Writes
+# through common.atomic_output_path are added as they land, so the catalog never misses this run's own files.
+# Shard directories are checked the same way, against the store root's listing (common.ensure_shard_dir): a
+# shard that exists costs nothing once the root has been read, and one that does not is created when its first
+# pano is written, not up front - most shards of a city exist after its first night, and the rest are only
+# needed if a pano lands in them.
+#
+# It does not see another process's writes after it has listed a directory: a pano another run on the same
+# store downloads meanwhile looks absent, and is downloaded again - the atomic rename makes that harmless, and
+# it is the race an unlucky isfile had anyway. Only presence is kept. Sizes and mtimes would take a stat per
+# file again, and the ledgers already say what each pano's outcome was (see ledger_index).
+
+import contextlib
+import os
+import threading
+
+# A directory is listed the Nth time anything in it is checked; before that each check is a stat.
+LIST_AFTER_CHECKS = 2
+
+
+class StoreCatalog:
+    """Which files and directories exist, by parent directory, read with one scandir per directory once it is
+    checked often enough.
+
+    A directory that cannot be listed (other than one that does not exist yet) is not cached: its checks fall
+    back to os.path.isfile / isdir, so a flaky mount costs what it always did rather than a wrong answer.
+
+    Thread-safe: the --pano-workers threads and the write-behind pool share one instance. A listing runs
+    outside the lock; two threads racing to list the same directory both do, and either result is right.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listed = {}  # directory -> {name: whether it is a directory} for what is in it
+        self._checks = {}  # directory -> checks so far, for directories not listed yet
+        self._added = {}  # path -> whether it is a directory, for what this run created, wherever it is
+
+    def isfile(self, path):
+        """os.path.isfile(path), from its directory's listing when there is one."""
+        return self._exists(path, False, os.path.isfile)
+
+    def isdir(self, path):
+        """os.path.isdir(path), from its parent's listing when there is one - for a shard, the store root's."""
+        return self._exists(path, True, os.path.isdir)
+
+    def added(self, path):
+        """Note that a file now exists at path: this run wrote it."""
+        with self._lock:
+            self._added[path] = False
+
+    def made_dir(self, path):
+        """Note that a directory now exists at path: this run created it (or lost the race to)."""
+        with self._lock:
+            self._added[path] = True
+
+    def _exists(self, path, is_dir, fallback):
+        directory, name = os.path.split(path)
+        listing = self._listed.get(directory)
+        if listing is None:
+            with self._lock:
+                checks = self._checks[directory] = self._checks.get(directory, 0) + 1
+            if checks < LIST_AFTER_CHECKS:
+                return fallback(path)
+            listing = self._list(directory)
+            if listing is None:
+                return fallback(path)
+        return listing.get(name) is is_dir or self._added.get(path) is is_dir
+
+    def _list(self, directory):
+        try:
+            with os.scandir(directory) as entries:
+                listing = {}
+                for entry in entries:
+                    if entry.is_dir():
+                        listing[entry.name] = True
+                    elif entry.is_file():
+                        listing[entry.name] = False
+        except FileNotFoundError:
+            listing = {}  # a shard nothing has been written to yet
+        except OSError:
+            return None
+        with self._lock:
+            self._checks.pop(directory, None)
+            return self._listed.setdefault(directory, listing)
+
+
+# The run's StoreCatalog, when one is installed (see cataloguing).
+_catalog = None
+
+
+@contextlib.contextmanager
+def cataloguing():
+    """Install a fresh StoreCatalog for the duration of the block; the functions below go through it."""
+    global _catalog
+    catalog, previous = StoreCatalog(), _catalog
+    _catalog = catalog
+    try:
+        yield catalog
+    finally:
+        _catalog = previous
+
+
+def isfile(path):
+    """os.path.isfile(path), through the run's catalog if one is installed."""
+    catalog = _catalog
+    if catalog is None:
+        return os.path.isfile(path)
+    return catalog.isfile(path)
+
+
+def isdir(path):
+    """os.path.isdir(path), through the run's catalog if one is installed."""
+    catalog = _catalog
+    if catalog is None:
+        return os.path.isdir(path)
+    return catalog.isdir(path)
+
+
+def added(path):
+    """Tell the run's catalog, if there is one, that a file now exists at path."""
+    catalog = _catalog
+    if catalog is not None:
+        catalog.added(path)
+
+
+def made_dir(path):
+    """Tell the run's catalog, if there is one, that a directory now exists at path."""
+    catalog = _catalog
+    if catalog is not None:
+        catalog.made_dir(path)
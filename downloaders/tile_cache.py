@@ -0,0 +1,155 @@
+# On-disk cache of GSV tile bodies, kept from panos whose tile fan-out failed part-way.
+#
+# One failed tile fails the whole pano (#45), and a failed pano is retried next run (#41) - from scratch, so on a
+# city where CBK flakes most of the image bandwidth went on re-fetching tiles the previous night already had.
+# With a cache, gsv.download_single_pano spills the bodies it did get when a pano fails, and its retry fetches
+# only the cells that are still missing. Nothing is written on the happy path: a pano that downloads cleanly
+# never touches the cache.
+
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+
+from .common import atomic_output_path
+
+# Under the pano store, beside the two-character shard dirs and the ledgers. Never two characters long, so it
+# cannot collide with a shard.
+TILE_CACHE_DIRNAME = 'tile_cache'
+
+_TILE_SUFFIX = '.jpg'
+
+
+class TileCache:
+    """Tile bodies for panos that failed part-way, keyed by pano_id/zoom/x/y and bounded at max_bytes.
+
+    Layout: <root>/<pano_id>/<zoom>_<x>_<y>.jpg, each written atomically. A pano's tiles are only useful
+    together - its retry needs every cell it already has - so eviction removes a whole pano at a time, least
+    recently used first. Sizes are scanned from disk once, on first use, and tracked in memory after that; a
+    concurrent run on the same store can make that view stale, which costs at most a late eviction.
+
+    Best-effort throughout: the cache exists to save bandwidth, so a cache I/O error is logged and treated as a
+    miss (or a lost spill), never allowed to fail a pano or mask the error that failed it.
+
+    Thread-safe: the --pano-workers threads share one instance.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = None  # pano_id -> [bytes, last used]
+
+    def _pano_dir(self, pano_id):
+        return os.path.join(self.root, pano_id)
+
+    def _scanned(self):
+        """The in-memory view of what is on disk, built by one scan on first use. Caller holds the lock."""
+        if self._entries is None:
+            self._entries = {}
+            try:
+                pano_dirs = [entry for entry in os.scandir(self.root) if entry.is_dir()]
+            except OSError:
+                pano_dirs = []  # no cache yet (or none possible - put() will say why)
+            for pano_dir in pano_dirs:
+                try:
+                    size = sum(tile.stat().st_size for tile in os.scandir(pano_dir.path)
+                               if tile.name.endswith(_TILE_SUFFIX))
+                    self._entries[pano_dir.name] = [size, pano_dir.stat().st_mtime]
+                except OSError:
+                    pass  # evicted by a concurrent run on the same store mid-scan
+        return self._entries
+
+    def load(self, pano_id, zoom):
+        """Every cached body for pano_id at zoom, as {(x, y): bytes}; {} on a miss or an unreadable entry."""
+        with self._lock:
+            if pano_id not in self._scanned():
+                # The common case - nearly every pano is a first attempt - answered from memory, not a scandir
+                # per pano. A spill by a concurrent run since our scan is missed, which costs its refetch.
+                return {}
+        prefix = '%d_' % zoom
+        tiles = {}
+        try:
+            with os.scandir(self._pano_dir(pano_id)) as entries:
+                for entry in entries:
+                    if not (entry.name.startswith(prefix) and entry.name.endswith(_TILE_SUFFIX)):
+                        continue
+                    _zoom, x, y = entry.name[:-len(_TILE_SUFFIX)].split('_')
+                    with open(entry.path, 'rb') as f:
+                        tiles[(int(x), int(y))] = f.read()
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning("IMAGEDOWNLOAD: tile cache entry for pano %s is unreadable (%s); fetching it afresh",
+                            pano_id, e)
+            self.discard(pano_id)
+            return {}
+        if tiles:
+            with self._lock:
+                entry = self._scanned().get(pano_id)
+                if entry is not None:
+                    entry[1] = time.time()
+        return tiles
+
+    def put(self, pano_id, zoom, tiles):
+        """Spill (x, y, bytes) bodies for pano_id at zoom, then evict down to max_bytes."""
+        with self._lock:
+            self._scanned()  # before writing, or the scan would count this spill and the += below again
+        pano_dir = self._pano_dir(pano_id)
+        written = 0
+        try:
+            if not os.path.isdir(pano_dir):
+                os.makedirs(pano_dir, exist_ok=True)
+                try:
+                    # Group-writable like the shard dirs: other lab users' runs share the store.
+                    os.chmod(self.root, 0o775 | stat.S_ISGID)
+                    os.chmod(pano_dir, 0o775 | stat.S_ISGID)
+                except PermissionError:
+                    pass  # another user's dir, their modes
+            for x, y, data in tiles:
+                with atomic_output_path(os.path.join(pano_dir, '%d_%d_%d%s' % (zoom, x, y, _TILE_SUFFIX))) \
+                        as tmp_path:
+                    with open(tmp_path, 'wb') as f:
+                        f.write(data)
+                written += len(data)
+        except OSError as e:
+            logging.warning("IMAGEDOWNLOAD: could not spill tiles for pano %s to the tile cache: %s", pano_id, e)
+        with self._lock:
+            entry = self._scanned().setdefault(pano_id, [0, 0.0])
+            entry[0] += written
+            entry[1] = time.time()
+            self._evict()
+
+    def discard(self, pano_id):
+        """Forget pano_id's tiles - it downloaded, or its entry is unusable."""
+        with self._lock:
+            if self._scanned().pop(pano_id, None) is None:
+                return  # nothing cached, so nothing on disk to remove (see load)
+        shutil.rmtree(self._pano_dir(pano_id), ignore_errors=True)
+
+    def cleanup(self, keep):
+        """Drop every pano keep(pano_id) rejects (the image phase passes "not yet ledgered"), then evict down
+        to max_bytes. A pano resolved since its tiles were spilled - downloaded, or by another run - has no
+        use for them."""
+        with self._lock:
+            stale = [pano_id for pano_id in self._scanned() if not keep(pano_id)]
+        for pano_id in stale:
+            self.discard(pano_id)
+        with self._lock:
+            self._evict()
+
+    def size_bytes(self):
+        with self._lock:
+            return sum(size for size, _used in self._scanned().values())
+
+    def _evict(self):
+        """Remove least-recently-used panos until the cache fits max_bytes. Caller holds the lock."""
+        entries = self._scanned()
+        total = sum(size for size, _used in entries.values())
+        for pano_id in sorted(entries, key=lambda p: entries[p][1]):
+            if total <= self.max_bytes:
+                break
+            total -= entries.pop(pano_id)[0]
+            shutil.rmtree(self._pano_dir(pano_id), ignore_errors=True)
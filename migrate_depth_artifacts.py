@@ -1,20 +1,27 @@
 # !/usr/bin/python3
-"""Rewrite pre-v2 depth artifacts (x-mirrored, no 'format_version' field) into the v2 JPEG column order.
+"""Bring depth artifacts up to the newest format each can reach offline: pre-v2 to v2, and v3 to v4.
 
 Artifacts written before the #58 fix store streetlevel's raw decode, which is horizontally flipped relative
 to the pano JPEG, and carry no 'format_version' field. The scraper never revisits an existing artifact
 (download_depth_maps short-circuits on file existence, and the ledger self-heal re-registers without
 rewriting), so a store scraped before the fix keeps mirrored artifacts forever unless they are corrected
 offline. This script scans a storage root for <pano_id[:2]>/<pano_id>.depth.npz files, flips every pre-v2
-artifact's depth array in x, stamps format_version=2, and leaves v2+ artifacts byte-for-byte untouched -
-so it is idempotent and safe to run (and re-run) on any store.
+artifact's depth array in x, and stamps format_version=2.
 
-This script implements exactly the v1 -> v2 transform and nothing newer: v2 artifacts are deliberately NOT
-upgraded to v3 (#56), because the plane fields v3 adds were never stored pre-v3 and can only come from a
-re-fetch - delete the artifact and its depth_log.csv row to trigger one.
+v3 artifacts are compacted to v4: the float 'depth' raster is dropped, since the plane fields reconstruct it
+(gsv.load_depth_artifact). One way only - once the raster is gone, only the planes say what it was - so the
+raster is rebuilt from the planes first and the artifact is rewritten only if that matches the stored one
+bit for bit; one that does not is reported and left as it is.
+
+v2 and v4 artifacts are left byte-for-byte untouched, so the script is idempotent and safe to run (and re-run)
+on any store. v2 artifacts are deliberately NOT upgraded (#56): the plane fields v3 adds were never stored
+pre-v3 and can only come from a re-fetch - delete the artifact and its depth_log.csv row to trigger one.
+
+Rewritten artifacts are compressed with --codec (gsv.parse_depth_codec; default deflate, as the scraper writes);
+artifacts the sweep leaves alone keep whatever codec wrote them.
 
 Usage:
-    python3 migrate_depth_artifacts.py <storage_path> [--dry-run]
+    python3 migrate_depth_artifacts.py <storage_path> [--dry-run] [--codec CODEC]
 """
 
 import argparse
@@ -23,10 +30,12 @@ from collections import namedtuple
 
 import numpy as np
 
-from downloaders.gsv import DEPTH_ARTIFACT_SUFFIX
+from downloaders.gsv import (DEFAULT_DEPTH_CODEC, DEPTH_ARTIFACT_SUFFIX, DepthArtifact, save_depth_fields,
+                             parse_depth_codec)
 
-# 'migrated' counts artifacts rewritten - or, under --dry-run, artifacts that would have been.
-MigrationSummary = namedtuple('MigrationSummary', ['scanned', 'migrated', 'skipped', 'failed'])
+# 'migrated' counts pre-v2 artifacts rewritten as v2 and 'compacted' v3 artifacts rewritten as v4 - or, under
+# --dry-run, artifacts that would have been.
+MigrationSummary = namedtuple('MigrationSummary', ['scanned', 'migrated', 'skipped', 'failed', 'compacted'])
 
 
 def _find_depth_artifacts(storage_path):
@@ -42,31 +51,24 @@ def _find_depth_artifacts(storage_path):
                 yield os.path.join(dirpath, filename)
 
 
-def _needs_migration(path):
-    """True for a pre-v2 artifact: no 'format_version' field, or one below 2.
+def _format_version(path):
+    """The artifact's format_version, or 1 for a pre-v2 artifact with none.
 
-    This script implements exactly the v1 -> v2 transform (the x-flip), so the threshold is a literal 2:
-    v3 (#56) added fields that were never stored before it, so no offline migration to v3 can exist.
+    Below 2 is the v1 -> v2 transform, the x-flip. A v2 artifact stays v2: v3 (#56) added fields that were never
+    stored before it, so no offline migration from v2 to v3 can exist.
     """
     with np.load(path) as d:
-        return 'format_version' not in d.files or int(d['format_version']) < 2
-
+        return int(d['format_version']) if 'format_version' in d.files else 1
 
-def _migrate_artifact(path):
-    """Rewrite one pre-v2 artifact in place: depth flipped to the JPEG's column order, format_version stamped,
-    every other field carried over unchanged."""
-    with np.load(path) as d:
-        contents = {name: d[name] for name in d.files}
-    contents['depth'] = contents['depth'][:, ::-1].astype(np.float32)
-    contents['format_version'] = 2
 
+def _rewrite(path, contents, codec=DEFAULT_DEPTH_CODEC):
+    """Replace the artifact at path with `contents`, compressed with `codec`, atomically."""
     tmp_path = path + '.part'
     try:
-        # Same dance as gsv._write_depth_artifact: savez_compressed needs an open file object (given a bare
-        # path it silently appends .npz), and the atomic rename means a crash mid-write can never leave a
+        # Same dance as gsv._write_depth_artifact: the atomic rename means a crash mid-write can never leave a
         # truncated artifact where a good one used to be.
         with open(tmp_path, 'wb') as f:
-            np.savez_compressed(f, **contents)
+            save_depth_fields(f, contents, codec)
         os.chmod(tmp_path, 0o664)
         os.replace(tmp_path, path)
     except BaseException:
@@ -77,53 +79,104 @@ def _migrate_artifact(path):
         raise
 
 
-def migrate_store(storage_path, dry_run=False):
-    """Scan storage_path and bring every pre-v2 depth artifact up to v2; see the module docstring.
+def _migrate_artifact(path, codec=DEFAULT_DEPTH_CODEC):
+    """Rewrite one pre-v2 artifact in place: depth flipped to the JPEG's column order, format_version stamped,
+    every other field carried over unchanged."""
+    with np.load(path) as d:
+        contents = {name: d[name] for name in d.files}
+    contents['depth'] = contents['depth'][:, ::-1].astype(np.float32)
+    contents['format_version'] = 2
+    _rewrite(path, contents, codec)
+
+
+def _compact_artifact(path, dry_run=False, codec=DEFAULT_DEPTH_CODEC):
+    """Rewrite one v3 artifact in place as v4: the 'depth' raster dropped, format_version stamped, every other
+    field carried over unchanged.
+
+    @raise ValueError if the raster its planes reconstruct is not the stored one, bit for bit - then dropping
+           the stored one would lose data, so nothing is written (under dry_run too, so a dry run reports it).
+    """
+    with np.load(path) as d:
+        contents = {name: d[name] for name in d.files}
+    stored = contents.pop('depth')
+    rebuilt = DepthArtifact(contents)['depth']
+    if stored.shape != rebuilt.shape or not np.array_equal(stored, rebuilt, equal_nan=True):
+        mismatched = (int(np.count_nonzero(~((stored == rebuilt) | (np.isnan(stored) & np.isnan(rebuilt)))))
+                      if stored.shape == rebuilt.shape else stored.size)
+        raise ValueError("the raster its planes reconstruct differs from the stored one at %d pixel(s); "
+                         "left as v3" % mismatched)
+    if dry_run:
+        return
+    contents['format_version'] = 4
+    _rewrite(path, contents, codec)
+
+
+def migrate_store(storage_path, dry_run=False, codec=DEFAULT_DEPTH_CODEC):
+    """Scan storage_path, bring every pre-v2 depth artifact up to v2 and compact every v3 one to v4; see the
+    module docstring.
 
     @param storage_path Root of the pano store (the directory holding the 2-char shard dirs).
     @param dry_run      Report what would be rewritten without writing anything.
-    @return             MigrationSummary(scanned, migrated, skipped, failed).
+    @param codec        The gsv.DepthCodec rewritten artifacts are written with.
+    @return             MigrationSummary(scanned, migrated, skipped, failed, compacted).
     """
-    scanned, migrated, skipped, failed = 0, 0, 0, 0
+    scanned, migrated, skipped, failed, compacted = 0, 0, 0, 0, 0
     for path in _find_depth_artifacts(storage_path):
         scanned += 1
         try:
-            if not _needs_migration(path):
+            version = _format_version(path)
+            if version < 2:
+                if not dry_run:
+                    _migrate_artifact(path, codec)
+                migrated += 1
+                print("%s %s" % ('Would migrate' if dry_run else 'Migrated', path))
+            elif version == 3:
+                _compact_artifact(path, dry_run=dry_run, codec=codec)
+                compacted += 1
+                print("%s %s" % ('Would compact' if dry_run else 'Compacted', path))
+            else:
                 skipped += 1
-                continue
-            if not dry_run:
-                _migrate_artifact(path)
-            migrated += 1
-            print("%s %s" % ('Would migrate' if dry_run else 'Migrated', path))
         except Exception as e:
             # A truncated or foreign file: report it and leave the bytes for a human rather than guessing, and
             # keep going - one bad artifact must not stop a sweep of a multi-terabyte store.
             failed += 1
             print("FAILED %s: %s" % (path, e))
-    return MigrationSummary(scanned, migrated, skipped, failed)
+    return MigrationSummary(scanned, migrated, skipped, failed, compacted)
+
+
+def _codec(value):
+    try:
+        return parse_depth_codec(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description='Rewrite pre-v2 (x-mirrored) depth artifacts into the v2 JPEG column order. Idempotent: '
-                    'v2 artifacts are never touched, so re-running on a migrated store changes nothing.')
+        description='Rewrite pre-v2 (x-mirrored) depth artifacts into the v2 JPEG column order, and compact v3 '
+                    'artifacts to v4 by dropping the depth raster their planes reconstruct. Idempotent: v2 and '
+                    'v4 artifacts are never touched, so re-running on a migrated store changes nothing.')
     parser.add_argument('storage_path',
                         help='Root of the pano store - the directory holding the 2-char shard dirs and depth_log.csv.')
     parser.add_argument('--dry-run', action='store_true',
                         help='Only report which artifacts would be rewritten; write nothing.')
+    parser.add_argument('--codec', type=_codec, default=DEFAULT_DEPTH_CODEC,
+                        help='How rewritten artifacts are compressed: store, deflate (the default), delta or packed, '
+                             'with an optional zlib level as in deflate:9. See DownloadRunner.py --depth-codec.')
     args = parser.parse_args()
 
-    summary = migrate_store(args.storage_path, dry_run=args.dry_run)
-    print("Scanned %d depth artifact(s): %d %s, %d already v2, %d failed."
-          % (summary.scanned, summary.migrated,
-             'would be migrated' if args.dry_run else 'migrated', summary.skipped, summary.failed))
+    summary = migrate_store(args.storage_path, dry_run=args.dry_run, codec=args.codec)
+    print("Scanned %d depth artifact(s): %d %s, %d %s, %d already current, %d failed."
+          % (summary.scanned, summary.migrated, 'would be migrated to v2' if args.dry_run else 'migrated to v2',
+             summary.compacted, 'would be compacted to v4' if args.dry_run else 'compacted to v4',
+             summary.skipped, summary.failed))
     if summary.migrated:
-        # The output of this script is v2, which the scraper no longer writes. Saying so here saves the next
-        # person the puzzle of a "migrated" store that still lacks the plane fields (#56).
-        print("NOTE: this produces format v2. The scraper now writes v3, which adds Google's plane list "
-              "(camera height, ground tilt) - data that was never stored pre-v3 and cannot be recovered "
-              "offline. To bring a pano up to v3, delete its .depth.npz AND its depth_log.csv row, which "
-              "makes the next run re-fetch it.")
+        # The output of the v1 -> v2 rewrite is v2, which the scraper no longer writes. Saying so here saves the
+        # next person the puzzle of a "migrated" store that still lacks the plane fields (#56).
+        print("NOTE: this produces format v2. The scraper now writes v4, whose plane list (camera height, "
+              "ground tilt) is data that was never stored pre-v3 and cannot be recovered offline. To bring a "
+              "pano up to date, delete its .depth.npz AND its depth_log.csv row, which makes the next run "
+              "re-fetch it.")
     return 1 if summary.failed else 0
 
 
@@ -0,0 +1,117 @@
+# !/usr/bin/python3
+"""Pack a store's depth artifacts into one memory-mappable depth pack per shard (downloaders/depth_pack.py).
+
+Reading a pano's depth from its .npz costs an open, a zip directory parse and an inflate - several network
+round trips on the sshfs stores - and a training job that samples panos at random pays that for each one. A
+depth pack holds a shard's v3 and v4 artifacts uncompressed, in a fixed layout that np.memmap opens once:
+
+    from downloaders.depth_pack import PackedStore
+    artifact = PackedStore(storage_path).load(pano_id)  # what gsv.load_depth_artifact(<its .npz>) returns
+
+The .npz files stay the source of truth, and nothing here touches them. A pack is rebuilt only when its shard
+has changed since - an artifact written, rewritten or deleted - so re-running after each scrape costs one
+listing and a stat per artifact, plus a rebuild of the shards the scrape wrote to. Packs of shards that no
+longer hold any artifact are removed.
+
+Usage:
+    python3 pack_depth_artifacts.py <storage_path> [--output DIR] [--force]
+"""
+
+import argparse
+import os
+from collections import namedtuple
+
+from downloaders.depth_pack import PACK_DIR_NAME, PACK_SUFFIX, DepthPack, pack_path, write_pack
+from downloaders.gsv import DEPTH_ARTIFACT_SUFFIX
+
+# Shard counts ('packed' rebuilt, 'current' left as they were, 'removed' orphaned packs deleted) and artifact
+# counts ('artifacts' packed, 'left_out' with no plane fields to pack, 'failed' that could not be packed).
+PackSummary = namedtuple('PackSummary', ['packed', 'current', 'removed', 'artifacts', 'left_out', 'failed'])
+
+
+def _shards(storage_path):
+    """Yield (shard, artifact paths) for every shard dir of storage_path holding at least one artifact."""
+    for shard in sorted(os.listdir(storage_path)):
+        shard_path = os.path.join(storage_path, shard)
+        if len(shard) != 2 or not os.path.isdir(shard_path):
+            continue
+        paths = [os.path.join(shard_path, name) for name in sorted(os.listdir(shard_path))
+                 if name.endswith(DEPTH_ARTIFACT_SUFFIX)]
+        if paths:
+            yield shard, paths
+
+
+def _sources(paths):
+    """pano id -> (size, mtime_ns) for the artifacts at paths, as DepthPack.sources records them."""
+    sources = {}
+    for path in paths:
+        stat = os.stat(path)
+        sources[os.path.basename(path)[:-len(DEPTH_ARTIFACT_SUFFIX)]] = (stat.st_size, stat.st_mtime_ns)
+    return sources
+
+
+def _is_current(path, sources):
+    try:
+        return DepthPack(path).sources == sources
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        print("Rebuilding unreadable pack %s: %s" % (path, e))
+        return False
+
+
+def pack_store(storage_path, output=None, force=False):
+    """Bring every shard's depth pack up to date with its artifacts; see the module docstring.
+
+    @param storage_path Root of the pano store (the directory holding the 2-char shard dirs).
+    @param output       Where the packs go; default <storage_path>/depth_packs.
+    @param force        Rebuild every pack, current or not.
+    @return             PackSummary.
+    """
+    output = os.path.join(storage_path, PACK_DIR_NAME) if output is None else output
+    os.makedirs(output, exist_ok=True)
+    packed = current = removed = artifacts = left_out = failed = 0
+    shards = set()
+    for shard, paths in _shards(storage_path):
+        shards.add(shard)
+        path = pack_path(output, shard)
+        if not force and _is_current(path, _sources(paths)):
+            current += 1
+            continue
+        shard_packed, shard_left_out, shard_failed = write_pack(paths, path)
+        for artifact_path, reason in shard_failed:
+            print("FAILED %s: %s" % (artifact_path, reason))
+        packed += 1
+        artifacts += len(shard_packed)
+        left_out += len(shard_left_out)
+        failed += len(shard_failed)
+        print("Packed %s: %d artifact(s)" % (path, len(shard_packed)))
+    for name in sorted(os.listdir(output)):
+        if name.endswith(PACK_SUFFIX) and name[:-len(PACK_SUFFIX)] not in shards:
+            os.remove(os.path.join(output, name))
+            removed += 1
+            print("Removed %s: its shard holds no artifacts" % os.path.join(output, name))
+    return PackSummary(packed, current, removed, artifacts, left_out, failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pack each shard\'s v3/v4 depth artifacts into one memory-mappable depth pack, a read-optimised '
+                    'copy of the store\'s .npz files. Only shards that changed since their pack was built are '
+                    'repacked.')
+    parser.add_argument('storage_path',
+                        help='Root of the pano store - the directory holding the 2-char shard dirs and depth_log.csv.')
+    parser.add_argument('--output', default=None,
+                        help='Directory to write the packs to (default: <storage_path>/%s).' % PACK_DIR_NAME)
+    parser.add_argument('--force', action='store_true', help='Rebuild every pack, even ones that are current.')
+    args = parser.parse_args()
+
+    summary = pack_store(args.storage_path, output=args.output, force=args.force)
+    print("Packed %d shard(s) (%d artifact(s)), %d already current, %d orphaned pack(s) removed; %d artifact(s) "
+          "without plane fields read from their .npz, %d failed."
+          % (summary.packed, summary.artifacts, summary.current, summary.removed, summary.left_out, summary.failed))
+    return 1 if summary.failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
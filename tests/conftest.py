@@ -56,6 +56,22 @@ def pytest_configure(config):
         os.environ['SIDEWALK_COVERAGE_ROOT'] = REPO_ROOT
 
 
+class FakeClock:
+    """A stand-in for time.time / time.monotonic, for the classes that take a clock= argument: reads `now`,
+    which the test advances by hand."""
+
+    def __init__(self, now=1_800_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
 @pytest.fixture
 def fake_streetview(monkeypatch):
     """Install a stub streetlevel.streetview module and return it for per-test find_panorama_by_id stubbing.
@@ -0,0 +1,93 @@
+"""Smoke tests for benchmarks/: each one runs end to end on a tiny workload and reports what it promises.
+
+The timings themselves are not asserted - CI machines are too noisy for that to mean anything - but the
+parity checks the benchmarks print are, since a benchmark that compares against the wrong thing is worse
+than none.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+sys.path.insert(0, BENCHMARKS)
+
+import depth_codecs  # noqa: E402
+import depth_raster  # noqa: E402
+import payloads  # noqa: E402
+
+
+class TestStreetPlanes:
+    def test_deterministic_in_the_seed(self):
+        a, b = payloads.street_planes(3), payloads.street_planes(3)
+
+        np.testing.assert_array_equal(a.indices, b.indices)
+        np.testing.assert_array_equal(a.normals, b.normals)
+        assert not np.array_equal(a.indices, payloads.street_planes(4).indices)
+
+    def test_shaped_like_a_real_payload(self):
+        planes = payloads.street_planes(0)
+
+        assert planes.indices.shape == (256, 512) and planes.indices.dtype == np.uint8
+        assert int(planes.indices.max()) < len(planes.normals) == len(planes.distances)
+        assert (planes.indices[0] == 0).all()  # sky across the top
+        assert (planes.indices[-1] == 1).all()  # the ground under the horizon
+
+
+class TestDepthRaster:
+    def test_runs_and_reports_parity(self, capsys):
+        assert depth_raster.main(['--panos', '2', '--repeat', '1']) == 0
+
+        out = capsys.readouterr().out
+        assert 'bit-for-bit: yes' in out
+        assert 'gsv._compute_depth_raster' in out and 'speed-up' in out
+
+    def test_a_mismatch_fails_the_run(self, monkeypatch, capsys):
+        real = depth_raster.gsv._compute_depth_raster
+        monkeypatch.setattr(depth_raster.gsv, '_compute_depth_raster', lambda planes: real(planes) + 1)
+
+        assert depth_raster.main(['--panos', '2', '--repeat', '1']) == 1
+        assert 'NO - 2 pano(s) differ' in capsys.readouterr().out
+
+    @pytest.mark.parametrize('seed', [0, 1])
+    def test_the_reference_is_the_formula_the_artifact_documents(self, seed):
+        """Guard the guard: the reference must itself be right, or agreeing with it proves nothing."""
+        planes = payloads.street_planes(seed, height=4, width=8, facades=3, clutter=0)
+        raster = depth_raster.reference_raster(planes)
+        h, w = raster.shape
+        for r in range(h):
+            theta = (h - r - 0.5) / h * np.pi
+            for c in range(w):
+                i = planes.indices[r, c]
+                if i == 0:
+                    assert raster[r, c] == -1.0
+                    continue
+                phi = (w - c - 0.5) / w * 2 * np.pi + np.pi / 2
+                ray = (np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta))
+                assert raster[r, c] == pytest.approx(abs(planes.distances[i] / np.dot(ray, planes.normals[i])),
+                                                     rel=1e-5)
+
+
+class TestDepthCodecs:
+    def test_runs_and_reports_every_codec_against_the_baseline(self, capsys):
+        assert depth_codecs.main(['--panos', '2', '--repeat', '1']) == 0
+
+        out = capsys.readouterr().out
+        assert 'round trip: exact' in out
+        assert all(spec in out for spec in (depth_codecs.BASELINE,) + depth_codecs.CODECS)
+
+    def test_a_lossy_codec_fails_the_run(self, monkeypatch, capsys):
+        real = depth_codecs.gsv._decode_plane_indices
+
+        def lossy(fields):
+            fields = real(fields)
+            if 'plane_indices' in fields:
+                fields['plane_indices'] = fields['plane_indices'] & 0x0f
+            return fields
+
+        monkeypatch.setattr(depth_codecs.gsv, '_decode_plane_indices', lossy)
+
+        assert depth_codecs.main(['--panos', '2', '--repeat', '1', '--codecs', 'packed']) == 1
+        assert 'NOT EXACT - np.savez_compressed (2 pano(s)), packed (2 pano(s))' in capsys.readouterr().out
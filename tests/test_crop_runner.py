@@ -550,6 +550,31 @@ class TestBulkExtractCrops:
                           'dims_mismatch': 0, 'out_of_frame': 0, 'shifted_vertically': 0,
                           'errors': 0}
 
+    def test_a_repeated_label_row_finds_its_crop_cut(self, crop_runner, tmp_path):
+        """The existence checks come from a listing (downloaders/store_catalog.py) taken before this run's
+        crops were cut; a crop cut since must still count as existing."""
+        store, out = tmp_path / 'store', tmp_path / 'crops'
+        put_pano(store, 'testpano0001')
+        labels = [label_row(label_id=n, pano_x=150) for n in (1, 2, 3, 1, 2)]
+
+        counts = crop_runner.bulk_extract_crops(labels, str(store), str(out))
+
+        assert (counts['success'], counts['skipped_existing']) == (3, 2)
+
+    def test_the_existence_checks_list_each_folder_instead_of_stating_each_file(self, crop_runner, tmp_path,
+                                                                               monkeypatch):
+        store, out = tmp_path / 'store', tmp_path / 'crops'
+        put_pano(store, 'testpano0001')
+        crop_runner.bulk_extract_crops([label_row(label_id=n) for n in range(1, 4)], str(store), str(out))
+        stats = []
+        real_isfile = os.path.isfile
+        monkeypatch.setattr(os.path, 'isfile', lambda path: stats.append(path) or real_isfile(path))
+
+        counts = crop_runner.bulk_extract_crops([label_row(label_id=n) for n in range(1, 4)], str(store), str(out))
+
+        assert counts['skipped_existing'] == 3
+        assert len(stats) == 2, "one stat for the pano, one for the first crop; the rest from a listing"
+
     def test_every_outcome_is_accounted_for_exactly_once(self, crop_runner, tmp_path):
         """One label per disjoint outcome, all in one run: the documented invariant is that they
         sum to total. It went stale the moment dims_mismatch was added without being added to the
@@ -554,9 +554,11 @@ class TestJsonToCsvConversion:
 # Everything the scraper or the cropper runs. log_analyzer/ and reports/scripts/ are deliberately
 # absent: both still use pandas, and both are dev/ops tools rather than production code.
 PRODUCTION_MODULES = ['DownloadRunner.py', 'CropRunner.py', 'config.py',
-                      'migrate_depth_artifacts.py', 'flag_panos/json_to_csv.py',
-                      'downloaders/__init__.py', 'downloaders/common.py',
-                      'downloaders/gsv.py', 'downloaders/mapillary.py']
+                      'migrate_depth_artifacts.py', 'pack_depth_artifacts.py', 'flag_panos/json_to_csv.py',
+                      'downloaders/__init__.py', 'downloaders/common.py', 'downloaders/depth_pack.py',
+                      'downloaders/depth_sampling.py', 'downloaders/failure_log.py', 'downloaders/gsv.py', 'downloaders/host_limiter.py',
+                      'downloaders/jpeg_dct.py', 'downloaders/ledger_index.py', 'downloaders/mapillary.py',
+                      'downloaders/schedule.py', 'downloaders/store_catalog.py', 'downloaders/tile_cache.py']
 
 
 def imported_names(source):
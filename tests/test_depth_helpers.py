@@ -2,15 +2,19 @@
 derivation, and HTTP session hardening."""
 
 import os
+import time
+import zipfile
 from types import SimpleNamespace
 
 import numpy as np
 import pytest
 import requests
+import urllib3
 from requests.adapters import HTTPAdapter
 
-from conftest import encode_depth_payload, make_pano, posix_only
+from conftest import default_depth_array, encode_depth_payload, make_pano, posix_only
 from downloaders import gsv
+from downloaders.common import DeadlineExceeded
 
 
 def write_artifact(storage, pano_id, pano):
@@ -158,9 +162,10 @@ class TestWriteDepthArtifact:
         # No stray file from savez_compressed appending .npz to the temp name.
         assert sorted(os.listdir(os.path.join(storage, 'ab'))) == ['abcdef.depth.npz']
         with np.load(path) as d:
-            assert d['depth'].dtype == np.float32
-            # Stored in the JPEG's column order, i.e. streetlevel's array flipped in x (see #58).
-            np.testing.assert_allclose(d['depth'], [[-1.0, 1.0], [3.5, 2.5]])
+            # v4: no raster on disk - the planes are the depth (see TestLoadDepthArtifact).
+            assert 'depth' not in d.files
+            # The no-plane pixel sits where streetlevel's array, flipped in x to the JPEG's order, has -1 (#58).
+            np.testing.assert_array_equal(d['plane_indices'], [[0, 1], [1, 1]])
             assert float(d['heading']) == pytest.approx(0.5)
             assert np.isnan(float(d['pitch']))
             assert float(d['roll']) == pytest.approx(1.5)
@@ -172,21 +177,24 @@ class TestWriteDepthArtifact:
         mode = os.stat(os.path.join(storage, 'ab')).st_mode
         assert mode & 0o2777 == 0o2775
 
-    def test_unmirrors_streetlevels_x_order(self, tmp_path):
+    def test_the_loaded_raster_is_in_the_images_x_order(self, tmp_path):
         """streetlevel's decoder x-mirrors the payload (compute_depth_map writes column x to w-1-x), so the
-        array it hands us is horizontally flipped relative to the pano JPEG. The artifact must store the
-        image's column order, so a consumer indexing it with a pano_x needs no mirror correction. See #58.
+        array it hands us is horizontally flipped relative to the pano JPEG. The depth a consumer reads must be
+        in the image's column order, so indexing it with a pano_x needs no mirror correction. See #58.
         """
         storage = str(tmp_path)
-        # Asymmetric in x so a mirror can't be missed: streetlevel's column order is [near, far].
-        streetlevel_data = np.array([[2.0, 100.0], [3.0, 200.0]], dtype=np.float64)
+        # Asymmetric in x so a mirror can't be missed: streetlevel's column order is [near, far], and the
+        # planes are the ones whose reconstruction that is (the ray azimuth sets the magnitudes).
+        streetlevel_data = np.array([[-1.0, 1.0, 3.0, -1.0]])
+        planes = SimpleNamespace(indices=np.array([[0, 1, 1, 0]], dtype=np.uint8),
+                                 normals=np.array([[0.0, 0.0, 0.0], [2.0, 1.0, 0.0]]),
+                                 distances=np.array([0.0, 1.5 * np.sqrt(2)]))
 
-        write_artifact(storage, 'abcdef', make_pano(streetlevel_data))
+        gsv._write_depth_artifact(storage, 'abcdef', make_pano(streetlevel_data, planes=planes), planes)
 
-        path = os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX)
-        with np.load(path) as d:
-            # Image column order: [far, near] - the flip of what streetlevel delivered.
-            np.testing.assert_allclose(d['depth'], [[100.0, 2.0], [200.0, 3.0]])
+        artifact = gsv.read_depth_artifact(os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX))
+        # Image column order: [far, near] - the flip of what streetlevel delivered.
+        np.testing.assert_allclose(artifact['depth'], [[-1.0, 3.0, 1.0, -1.0]], rtol=1e-5)
 
     def test_stamps_format_version(self, tmp_path):
         """Artifacts written before the #58 un-mirroring carry no version field; consumers use its presence to
@@ -196,7 +204,7 @@ class TestWriteDepthArtifact:
         write_artifact(storage, 'abcdef', make_pano(np.zeros((1, 2))))
         path = os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX)
         with np.load(path) as d:
-            assert int(d['format_version']) == 3 == gsv.DEPTH_ARTIFACT_FORMAT_VERSION
+            assert int(d['format_version']) == 4 == gsv.DEPTH_ARTIFACT_FORMAT_VERSION
 
     def test_losing_the_shard_dir_race_is_not_an_error(self, tmp_path, monkeypatch):
         """Two processes (or the image and depth phases) can create the same shard dir concurrently; losing
@@ -260,7 +268,7 @@ class TestWriteDepthArtifact:
         def boom(*args, **kwargs):
             raise OSError(28, 'No space left on device')
 
-        monkeypatch.setattr(gsv.np, 'savez_compressed', boom)
+        monkeypatch.setattr(gsv, 'save_depth_fields', boom)
 
         with pytest.raises(OSError):
             write_artifact(storage, 'abcdef', make_pano(np.zeros((2, 2))))
@@ -298,9 +306,9 @@ class TestWriteDepthArtifact:
 
         gsv._write_depth_artifact(storage, 'abcdef', make_pano(depth, planes=planes), planes)
 
-        with np.load(os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX)) as d:
-            np.testing.assert_array_equal(d['plane_indices'], [[1, 1, 0]])
-            np.testing.assert_array_equal(d['plane_indices'] == 0, d['depth'] == -1)
+        d = gsv.read_depth_artifact(os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX))
+        np.testing.assert_array_equal(d['plane_indices'], [[1, 1, 0]])
+        np.testing.assert_array_equal(d['plane_indices'] == 0, d['depth'] == -1)
 
     def test_planes_reconstruct_the_stored_depth(self, tmp_path):
         """The operational definition of the stored frame: depth[r, c] == |d_i / (v(r, c) . n_i)| for
@@ -316,9 +324,9 @@ class TestWriteDepthArtifact:
 
         gsv._write_depth_artifact(storage, 'abcdef', make_pano(streetlevel_depth, planes=planes), planes)
 
-        with np.load(os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX)) as d:
-            depth, indices = d['depth'], d['plane_indices']
-            normals, distances = d['planes_n'], d['planes_d']
+        d = gsv.read_depth_artifact(os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX))
+        depth, indices = d['depth'], d['plane_indices']
+        normals, distances = d['planes_n'], d['planes_d']
         h, w = depth.shape
         reconstructed = np.full((h, w), -1.0)
         for r in range(h):
@@ -330,14 +338,22 @@ class TestWriteDepthArtifact:
                 ray = (np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta))
                 reconstructed[r, c] = abs(distances[indices[r, c]] / np.dot(ray, normals[indices[r, c]]))
         np.testing.assert_allclose(reconstructed, depth, rtol=1e-5)
+        # ...and it is the raster the seam handed the writer, which v4 no longer stores.
+        np.testing.assert_allclose(depth, streetlevel_depth[:, ::-1], rtol=1e-5)
 
     @pytest.mark.parametrize('bad_planes', [
         None,
-        SimpleNamespace(indices=np.zeros((5, 5), dtype=np.uint8),
+        SimpleNamespace(indices=np.zeros(4, dtype=np.uint8),
+                        normals=np.zeros((1, 3), dtype=np.float32), distances=np.zeros(1, dtype=np.float32)),
+        SimpleNamespace(indices=np.zeros((2, 2), dtype=np.float32),
                         normals=np.zeros((1, 3), dtype=np.float32), distances=np.zeros(1, dtype=np.float32)),
-    ], ids=['missing', 'shape-mismatch'])
-    def test_missing_or_mismatched_planes_refuse_to_write(self, tmp_path, bad_planes):
-        """An artifact without matching plane fields would be a malformed v3: refuse before the .part file
+        SimpleNamespace(indices=np.zeros((2, 2), dtype=np.uint8),
+                        normals=np.zeros((2, 3), dtype=np.float32), distances=np.zeros(1, dtype=np.float32)),
+        SimpleNamespace(indices=np.zeros((2, 2), dtype=np.uint8),
+                        normals=np.zeros(3, dtype=np.float32), distances=np.zeros(1, dtype=np.float32)),
+    ], ids=['missing', 'not-a-raster', 'not-uint8', 'length-mismatch', 'flat-normals'])
+    def test_missing_or_malformed_planes_refuse_to_write(self, tmp_path, bad_planes):
+        """An artifact without well-formed plane fields would be a malformed v4: refuse before the .part file
         is even opened, so nothing lands on the store."""
         storage = str(tmp_path)
 
@@ -347,32 +363,45 @@ class TestWriteDepthArtifact:
 
         assert not os.path.exists(os.path.join(storage, 'ab'))
 
-    @pytest.mark.parametrize('indices', [[[1, 1]], [[0, 0]], [[0, 1]]],
-                             ids=['no-sentinel', 'extra-sentinel', 'mirrored'])
-    def test_indices_disagreeing_with_the_raster_refuse_to_write(self, tmp_path, indices):
-        """docs/depth.md promises consumers that plane_indices == 0 exactly where depth == -1. That is the only
-        cross-check that streetlevel's decode of the payload (which produces the raster) and ours (which
-        produces the indices) still agree on column order and on which pixels have no plane, so it is
-        enforced rather than assumed - a one-shot backfill cannot be re-derived offline.
-
-        The 'mirrored' case is the one that matters most: it is what a future upstream change to the decode's
-        column order would look like, and its shape is identical to a correct artifact's.
-        """
+    @pytest.mark.parametrize('normals, distances, match', [
+        ([[0.0, 0.0, 0.0]], [0.0], 'past its 1-plane list'),
+        ([[0.0, 0.0, 0.0], [0.0, 0.0, 0.0]], [0.0, 2.5], 'zero normal'),
+        ([[0.0, 0.0, 0.0], [0.0, np.nan, 1.0]], [0.0, 2.5], 'non-finite'),
+        ([[0.0, 0.0, 0.0], [0.0, 0.0, 1.0]], [0.0, np.inf], 'non-finite'),
+    ], ids=['index-out-of-range', 'zero-normal', 'nan-normal', 'infinite-offset'])
+    def test_planes_that_would_not_reconstruct_refuse_to_write(self, tmp_path, normals, distances, match):
+        """The raster is neither stored nor computed on write, so the planes are what is checked: every index
+        inside the list, and every plane a pixel references with a finite, nonzero normal and a finite offset.
+        Anything else would store an artifact whose documented reconstruction gives garbage or infinities."""
         storage = str(tmp_path)
-        # streetlevel order [-1, 5.0] -> stored (JPEG) order [5.0, -1]: the sentinel ends up on the RIGHT,
-        # so only [[1, 0]] agrees with it.
-        depth = np.array([[-1.0, 5.0]])
-        planes = SimpleNamespace(indices=np.array(indices, dtype=np.uint8),
-                                 normals=np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.0]]),
-                                 distances=np.array([0.0, 2.5]))
+        planes = SimpleNamespace(indices=np.array([[1, 0]], dtype=np.uint8), normals=np.array(normals),
+                                 distances=np.array(distances))
 
-        with pytest.raises(gsv.DepthPayloadError, match='disagree'):
-            gsv._write_depth_artifact(storage, 'abcdef', make_pano(depth, planes=planes), planes)
+        with pytest.raises(gsv.DepthPayloadError, match=match):
+            gsv._write_depth_artifact(storage, 'abcdef', make_pano(None, planes=planes), planes)
 
         assert not os.path.exists(os.path.join(storage, 'ab'))
 
-    def test_the_agreeing_case_still_writes(self, tmp_path):
-        """Guard against the check above being satisfiable only by rejecting everything."""
+    def test_unreferenced_planes_are_not_checked(self, tmp_path):
+        """Plane 0 is never dereferenced, and is all zeros on the wire; neither is any plane no pixel uses."""
+        storage = str(tmp_path)
+        planes = SimpleNamespace(indices=np.array([[1, 0]], dtype=np.uint8),
+                                 normals=np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.0], [np.nan, 0.0, 0.0]]),
+                                 distances=np.array([0.0, 2.5, np.nan]))
+
+        gsv._write_depth_artifact(storage, 'abcdef', make_pano(None, planes=planes), planes)
+
+        assert os.path.isfile(os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX))
+
+    def test_the_write_never_computes_the_raster(self, tmp_path, monkeypatch):
+        """v4 stores no raster, so the writer has no use for one: its full-raster float64 temporaries were
+        most of what dropping it from the artifact was meant to save."""
+        monkeypatch.setattr(gsv, '_compute_depth_raster', lambda planes: pytest.fail('computed the raster'))
+
+        write_artifact(str(tmp_path), 'abcdef', make_pano(default_depth_array()))
+
+    def test_well_formed_planes_still_write(self, tmp_path):
+        """Guard against the checks above being satisfiable only by rejecting everything."""
         storage = str(tmp_path)
         depth = np.array([[-1.0, 5.0]])
         planes = SimpleNamespace(indices=np.array([[1, 0]], dtype=np.uint8),
@@ -381,9 +410,9 @@ class TestWriteDepthArtifact:
 
         gsv._write_depth_artifact(storage, 'abcdef', make_pano(depth, planes=planes), planes)
 
-        with np.load(os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX)) as d:
-            np.testing.assert_allclose(d['depth'], [[5.0, -1.0]])
-            np.testing.assert_array_equal(d['plane_indices'], [[1, 0]])
+        d = gsv.read_depth_artifact(os.path.join(storage, 'ab', 'abcdef' + gsv.DEPTH_ARTIFACT_SUFFIX))
+        np.testing.assert_array_equal(d['depth'] == -1, [[False, True]])
+        np.testing.assert_array_equal(d['plane_indices'], [[1, 0]])
 
 
 class TestComputeDepthRaster:
@@ -431,6 +460,90 @@ class TestComputeDepthRaster:
         np.testing.assert_allclose(ours, theirs[:, ::-1], rtol=1e-5)
 
 
+def reference_raster(planes):
+    """_compute_depth_raster as first written: (h, w, 3) rays and gathered normals, and an einsum. The rewrite
+    must match it bit for bit - a v3 raster is dropped on the strength of that (migrate_depth_artifacts.py)."""
+    indices = planes.indices
+    h, w = indices.shape
+    theta = (h - np.arange(h) - 0.5) / h * np.pi
+    phi = (w - np.arange(w) - 0.5) / w * 2.0 * np.pi + np.pi / 2.0
+    rays = np.empty((h, w, 3))
+    rays[..., 0] = np.sin(theta)[:, None] * np.cos(phi)[None, :]
+    rays[..., 1] = np.sin(theta)[:, None] * np.sin(phi)[None, :]
+    rays[..., 2] = np.broadcast_to(np.cos(theta)[:, None], (h, w))
+    index_grid = indices.astype(np.intp)
+    normals = np.asarray(planes.normals, dtype=np.float64)[index_grid]
+    offsets = np.asarray(planes.distances, dtype=np.float64)[index_grid]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raster = np.abs(offsets / np.einsum('hwc,hwc->hw', rays, normals))
+    return np.where(index_grid == 0, -1.0, raster).astype(np.float32)
+
+
+class TestComputeDepthRasterIsExact:
+    """The rewrite for speed (cached rays, one reused gather buffer, in-place arithmetic) changed no bit."""
+
+    @pytest.mark.parametrize('seed', range(12))
+    @pytest.mark.parametrize('shape', [(256, 512), (3, 5), (1, 1), (2, 7)])
+    def test_bit_for_bit_with_the_reference(self, seed, shape):
+        rng = np.random.default_rng(seed)
+        count = int(rng.integers(1, 256))
+        normals = rng.normal(size=(count, 3)).astype(np.float32)
+        normals[rng.integers(0, count)] = 0.0  # a degenerate plane: 0 / 0 and d / 0 where it is referenced
+        planes = gsv.DepthPlanes(rng.integers(0, count, size=shape).astype(np.uint8), normals,
+                                 (rng.normal(size=count) * 10).astype(np.float32))
+
+        ours = gsv._compute_depth_raster(planes)
+
+        assert ours.dtype == np.float32
+        np.testing.assert_array_equal(ours.view(np.uint32), reference_raster(planes).view(np.uint32))
+
+    def test_the_rays_are_computed_once_per_resolution(self):
+        assert gsv._depth_rays(256, 512) is gsv._depth_rays(256, 512)
+        x, y, z = gsv._depth_rays(4, 8)
+        assert (x.shape, y.shape, z.shape) == ((4, 8), (4, 8), (4, 1))
+        with pytest.raises(ValueError):
+            x[0, 0] = 0.0
+
+    @pytest.mark.parametrize('seed', range(6))
+    def test_a_few_pixels_are_the_rasters_bit_for_bit(self, seed):
+        rng = np.random.default_rng(seed)
+        normals = rng.normal(size=(64, 3)).astype(np.float32)
+        normals[5] = 0.0
+        planes = gsv.DepthPlanes(rng.integers(0, 64, size=(256, 512)).astype(np.uint8), normals,
+                                 (rng.normal(size=64) * 10).astype(np.float32))
+        rows, cols = rng.integers(0, 256, size=(3, 50)), rng.integers(0, 512, size=(3, 50))
+
+        pixels = gsv._depth_at_pixels(planes, rows, cols)
+
+        assert pixels.shape == (3, 50) and pixels.dtype == np.float32
+        raster = gsv._compute_depth_raster(planes)
+        np.testing.assert_array_equal(pixels.view(np.uint32), raster[rows, cols].view(np.uint32))
+
+    def test_a_few_pixels_of_a_planeless_or_malformed_raster(self):
+        indices = np.array([[0, 2]], dtype=np.uint8)
+        empty = gsv.DepthPlanes(indices, np.zeros((0, 3), dtype=np.float32), np.zeros(0, dtype=np.float32))
+        short = gsv.DepthPlanes(indices, np.zeros((2, 3), dtype=np.float32), np.zeros(2, dtype=np.float32))
+
+        assert gsv._depth_at_pixels(empty, np.array([0]), np.array([1])).tolist() == [-1.0]
+        with pytest.raises(IndexError, match='past the 2-plane list'):
+            gsv._depth_at_pixels(short, np.array([0]), np.array([1]))
+
+    def test_an_index_past_the_plane_list_is_refused(self):
+        """The gathers skip numpy's bounds check, so an artifact read back with a bad index must be caught
+        up front rather than served the last plane's distance."""
+        planes = gsv.DepthPlanes(np.array([[0, 2]], dtype=np.uint8), np.zeros((2, 3), dtype=np.float32),
+                                 np.zeros(2, dtype=np.float32))
+
+        with pytest.raises(IndexError, match='past the 2-plane list'):
+            gsv._compute_depth_raster(planes)
+
+    def test_an_empty_raster(self):
+        planes = gsv.DepthPlanes(np.zeros((0, 4), dtype=np.uint8), np.zeros((2, 3), dtype=np.float32),
+                                 np.zeros(2, dtype=np.float32))
+
+        assert gsv._compute_depth_raster(planes).shape == (0, 4)
+
+
 class TestGroundPlane:
     """ground_plane_from_artifact / camera_height_from_artifact: the derivation the artifact deliberately
     does NOT bake in - the plane list is stored verbatim so the ground heuristic stays fixable in code,
@@ -581,6 +694,214 @@ class TestGroundPlane:
         assert gsv.camera_height_from_artifact(artifact, default=2.4) == 2.4
 
 
+# The streetlevel mirror fixture in payload (= JPEG) order, over a ground plane below the horizon.
+MIRROR_PLANES = gsv.DepthPlanes(np.array([[0, 1, 1, 0], [2, 2, 0, 1]], dtype=np.uint8),
+                                np.array([[0.0, 0.0, 0.0], [2.0, 1.0, 0.0], [0.0, 0.0, 1.0]], dtype=np.float32),
+                                np.array([0.0, 1.5 * np.sqrt(2), -2.5], dtype=np.float32))
+
+
+def write_v3(path, planes=MIRROR_PLANES, depth=None):
+    """An artifact as the v3 writer left it: the plane fields and the raster they reconstruct, stored."""
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, depth=gsv._compute_depth_raster(planes) if depth is None else depth,
+                            plane_indices=planes.indices, planes_n=planes.normals, planes_d=planes.distances,
+                            heading=0.5, pitch=0.0, roll=0.0, format_version=3)
+    return path
+
+
+def write_v4(path, planes=MIRROR_PLANES):
+    gsv._write_depth_artifact(os.path.dirname(os.path.dirname(path)), os.path.basename(path)[:6],
+                              make_pano(gsv._compute_depth_raster(planes)[:, ::-1], planes=planes), planes)
+    return path
+
+
+class TestLoadDepthArtifact:
+    """read_depth_artifact / load_depth_artifact: v3 and v4 alike, 'depth' included."""
+
+    @pytest.fixture
+    def v4_path(self, tmp_path):
+        return write_v4(str(tmp_path / 'ab' / 'abcdef.depth.npz'))
+
+    def test_a_v4_raster_is_the_one_v3_stored_bit_for_bit(self, tmp_path, v4_path):
+        v3 = gsv.read_depth_artifact(write_v3(str(tmp_path / 'v3.npz')))
+        v4 = gsv.read_depth_artifact(v4_path)
+
+        assert v4['depth'].dtype == np.float32
+        np.testing.assert_array_equal(v4['depth'], v3['depth'])
+        assert sorted(v4.files) == sorted(v3.files)
+
+    def test_a_v3_raster_is_served_as_stored(self, tmp_path, monkeypatch):
+        stored = np.array([[-1.0, 7.0, 8.0, -1.0], [9.0, 9.5, -1.0, -1.0]], dtype=np.float32)
+        path = write_v3(str(tmp_path / 'v3.npz'), depth=stored)
+        monkeypatch.setattr(gsv, '_compute_depth_raster', lambda planes: pytest.fail('reconstructed'))
+
+        np.testing.assert_array_equal(gsv.read_depth_artifact(path)['depth'], stored)
+
+    def test_the_raster_is_reconstructed_once_and_only_when_asked_for(self, v4_path, monkeypatch):
+        calls = []
+        real = gsv._compute_depth_raster
+        monkeypatch.setattr(gsv, '_compute_depth_raster', lambda planes: calls.append(1) or real(planes))
+        artifact = gsv.read_depth_artifact(v4_path)
+
+        gsv.camera_height_from_artifact(artifact)
+        assert calls == []
+        assert artifact['depth'] is artifact['depth']
+        assert calls == [1]
+
+    def test_depth_at_reads_pixels_without_rebuilding_the_raster(self, v4_path, monkeypatch):
+        expected = gsv.read_depth_artifact(v4_path)['depth'][[0, 1], [1, 3]]
+        artifact = gsv.read_depth_artifact(v4_path)
+        monkeypatch.setattr(gsv, '_compute_depth_raster', lambda planes: pytest.fail('reconstructed'))
+
+        assert 'depth' in artifact and 'sky' not in artifact
+        np.testing.assert_array_equal(artifact.depth_at(np.array([0, 1]), np.array([1, 3])), expected)
+
+    def test_depth_at_a_v3_artifact_reads_the_stored_raster(self, tmp_path):
+        stored = np.array([[-1.0, 7.0, 8.0, -1.0], [9.0, 9.5, -1.0, -1.0]], dtype=np.float32)
+        artifact = gsv.read_depth_artifact(write_v3(str(tmp_path / 'v3.npz'), depth=stored))
+
+        assert artifact.depth_at(np.array([0, 1]), np.array([2, 1])).tolist() == [8.0, 9.5]
+
+    def test_it_stands_in_for_np_load(self, v4_path):
+        with gsv.read_depth_artifact(v4_path) as artifact, np.load(v4_path) as d:
+            assert set(d.files) < set(artifact.files) == set(artifact) and len(artifact) == len(d.files) + 1
+            assert gsv.camera_height_from_artifact(artifact) == gsv.camera_height_from_artifact(d) == 2.5
+
+    def test_its_arrays_are_read_only(self, v4_path):
+        artifact = gsv.read_depth_artifact(v4_path)
+
+        for name in ('depth', 'plane_indices'):
+            with pytest.raises(ValueError):
+                artifact[name][0, 0] = 0
+
+    def test_an_npz_that_is_not_a_depth_artifact_is_refused(self, tmp_path):
+        path = str(tmp_path / 'other.npz')
+        with open(path, 'wb') as f:
+            np.savez(f, plane_indices=np.zeros((1, 1), dtype=np.uint8))
+
+        with pytest.raises(ValueError, match='not a depth artifact'):
+            gsv.read_depth_artifact(path)
+
+
+class TestDepthArtifactCache:
+    def paths(self, tmp_path, count):
+        return [write_v4(str(tmp_path / 'ab' / ('ab%04d.depth.npz' % i))) for i in range(count)]
+
+    def test_a_second_load_is_the_same_artifact(self, tmp_path, monkeypatch):
+        cache = gsv.DepthArtifactCache()
+        path, = self.paths(tmp_path, 1)
+        first = cache.load(path)
+        monkeypatch.setattr(gsv, 'read_depth_artifact', lambda path: pytest.fail('read it again'))
+
+        assert cache.load(path) is first
+
+    def test_the_least_recently_used_is_evicted(self, tmp_path):
+        cache = gsv.DepthArtifactCache(max_entries=2)
+        a, b, c = self.paths(tmp_path, 3)
+        first_a = cache.load(a)
+        cache.load(b)
+        cache.load(a)  # b is now the least recently used
+
+        cache.load(c)
+
+        assert cache.load(a) is first_a
+        assert len(cache._entries) == 2 and all(key[0] != os.path.abspath(b) for key in cache._entries)
+
+    def test_an_artifact_rewritten_since_is_read_again(self, tmp_path):
+        cache = gsv.DepthArtifactCache()
+        path = write_v3(str(tmp_path / 'v3.npz'))
+        before = cache.load(path)
+        write_v3(path, depth=np.full((2, 4), 5.0, dtype=np.float32))
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+
+        assert cache.load(path)['depth'][0, 0] == 5.0 != before['depth'][0, 0]
+
+    def test_load_depth_artifact_goes_through_the_process_wide_cache(self, tmp_path):
+        path, = self.paths(tmp_path, 1)
+
+        assert gsv.load_depth_artifact(path) is gsv.load_depth_artifact(path)
+
+    def test_a_missing_artifact_is_an_os_error(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            gsv.DepthArtifactCache().load(str(tmp_path / 'ab' / 'abcdef.depth.npz'))
+
+
+def random_planes(seed, shape=(256, 512), count=40):
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, count, size=shape).astype(np.uint8)
+    return gsv.DepthPlanes(np.sort(indices, axis=1), rng.normal(size=(count, 3)).astype(np.float32),
+                           rng.normal(size=count).astype(np.float32))
+
+
+class TestDepthCodecs:
+    """Every codec writes an artifact read_depth_artifact gives back field for field, and records enough that
+    no reader has to be told which codec it was."""
+
+    CODECS = ['store', 'deflate', 'deflate:1', 'deflate:9', 'delta', 'delta:0', 'packed', 'packed:1']
+
+    def write(self, tmp_path, planes, spec):
+        path = str(tmp_path / spec.replace(':', '_') / 'ab' / 'abcdef.depth.npz')
+        raster = gsv._compute_depth_raster(planes)[:, ::-1]
+        gsv._write_depth_artifact(os.path.dirname(os.path.dirname(path)), 'abcdef',
+                                  make_pano(raster, planes=planes), planes, gsv.parse_depth_codec(spec))
+        return path
+
+    @pytest.mark.parametrize('spec', CODECS)
+    @pytest.mark.parametrize('planes', [MIRROR_PLANES, random_planes(0), random_planes(1, (3, 5), count=2),
+                                        random_planes(2, (7, 9), count=256)], ids=['mirror', 'street', 'tiny', 'wide'])
+    def test_it_reads_back_as_the_default_codec_wrote_it(self, tmp_path, spec, planes):
+        ours = gsv.read_depth_artifact(self.write(tmp_path, planes, spec))
+        default = gsv.read_depth_artifact(self.write(tmp_path, planes, 'deflate'))
+
+        assert sorted(ours.files) == sorted(default.files)
+        for name in default.files:
+            assert ours[name].dtype == default[name].dtype
+            np.testing.assert_array_equal(ours[name], default[name])
+
+    def test_the_default_is_the_v4_format_np_load_reads(self, tmp_path):
+        with np.load(self.write(tmp_path, MIRROR_PLANES, 'deflate')) as d:
+            assert sorted(d.files) == ['format_version', 'heading', 'pitch', 'plane_indices', 'planes_d', 'planes_n',
+                                       'roll']
+            np.testing.assert_array_equal(d['plane_indices'], MIRROR_PLANES.indices)
+
+    @pytest.mark.parametrize('spec', ['delta', 'packed'])
+    def test_an_encoded_raster_is_named_so_a_plain_np_load_cannot_misread_it(self, tmp_path, spec):
+        with np.load(self.write(tmp_path, MIRROR_PLANES, spec)) as d:
+            assert 'plane_indices' not in d.files and str(d['plane_indices_codec']) == spec
+
+    @pytest.mark.parametrize('spec, compress_type', [('store', zipfile.ZIP_STORED), ('packed:0', zipfile.ZIP_STORED),
+                                                     ('deflate:1', zipfile.ZIP_DEFLATED)])
+    def test_the_level_is_the_zip_members(self, tmp_path, spec, compress_type):
+        with zipfile.ZipFile(self.write(tmp_path, random_planes(0), spec)) as archive:
+            assert {info.compress_type for info in archive.infolist()} == {compress_type}
+
+    def test_the_encodings_shrink_a_street_raster(self, tmp_path):
+        planes = random_planes(0)
+        sizes = {spec: os.path.getsize(self.write(tmp_path, planes, spec)) for spec in ('store', 'deflate', 'packed:0')}
+
+        assert sizes['deflate'] < sizes['store'] and sizes['packed:0'] < sizes['store'] * 0.8
+
+    def test_an_unknown_encoding_is_refused(self, tmp_path):
+        path = str(tmp_path / 'future.npz')
+        with open(path, 'wb') as f:
+            np.savez(f, plane_indices_encoded=np.zeros(4, dtype=np.uint8), plane_indices_codec=np.array('rle'))
+
+        with pytest.raises(ValueError, match="unknown plane_indices encoding 'rle'"):
+            gsv.read_depth_artifact(path)
+        with pytest.raises(ValueError, match="unknown plane_indices encoding 'rle'"):
+            gsv._encode_plane_indices(MIRROR_PLANES.indices, 'rle')
+
+    @pytest.mark.parametrize('spec, codec', [('store', ('raw', 0)), ('deflate', ('raw', 6)), ('deflate:0', ('raw', 0)),
+                                             ('delta', ('delta', 6)), ('packed:9', ('packed', 9))])
+    def test_parse(self, spec, codec):
+        assert gsv.parse_depth_codec(spec) == gsv.DepthCodec(*codec)
+
+    @pytest.mark.parametrize('spec', ['raw', 'zstd', 'store:1', 'deflate:10', 'deflate:-1', 'delta:x', ''])
+    def test_parse_refuses(self, spec):
+        with pytest.raises(ValueError):
+            gsv.parse_depth_codec(spec)
+
+
 class TestNormalizeProxies:
     """config.py ships placeholder proxy values; anything that isn't a real proxy URL must reach requests as
     unset, per key (#51). The old all-or-nothing check blanked both entries only when the http key held its
@@ -696,6 +1017,94 @@ class TestTimeoutHTTPAdapter:
         adapter.send('request', timeout=5)
         assert captured_send['timeout'] == 5
 
+    def test_a_deadline_caps_the_timeout_by_the_time_left(self, captured_send):
+        adapter = gsv._TimeoutHTTPAdapter(timeout=30, deadline=time.monotonic() + 10)
+        adapter.send('request', timeout=None)
+        assert 0 < captured_send['timeout'] <= 10
+
+    def test_a_distant_deadline_leaves_the_timeout_alone(self, captured_send):
+        adapter = gsv._TimeoutHTTPAdapter(timeout=30, deadline=time.monotonic() + 3600)
+        adapter.send('request', timeout=None)
+        assert captured_send['timeout'] == 30
+
+    def test_nothing_is_sent_once_the_deadline_has_passed(self, captured_send):
+        adapter = gsv._TimeoutHTTPAdapter(timeout=30, deadline=time.monotonic() - 1)
+        with pytest.raises(DeadlineExceeded):
+            adapter.send('request', timeout=None)
+        assert captured_send == {}
+
+    def test_a_request_failing_after_the_deadline_was_cut_off_by_it(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr(gsv.time, 'monotonic', lambda: now[0])
+
+        def timed_out(self, request, **kwargs):
+            now[0] += kwargs['timeout']
+            raise requests.exceptions.ReadTimeout('read timed out')
+
+        monkeypatch.setattr(HTTPAdapter, 'send', timed_out)
+        adapter = gsv._TimeoutHTTPAdapter(timeout=30, deadline=110.0)
+
+        with pytest.raises(DeadlineExceeded) as raised:
+            adapter.send('request', timeout=None)
+        assert isinstance(raised.value.__cause__, requests.exceptions.ReadTimeout)
+
+    def test_a_request_failing_before_the_deadline_is_a_network_error(self, monkeypatch):
+        def refused(self, request, **kwargs):
+            raise requests.ConnectionError('connection refused')
+
+        monkeypatch.setattr(HTTPAdapter, 'send', refused)
+        adapter = gsv._TimeoutHTTPAdapter(timeout=30, deadline=time.monotonic() + 3600)
+
+        with pytest.raises(requests.ConnectionError):
+            adapter.send('request', timeout=None)
+
+
+class TestDeadlineRetry:
+    def failed_twice(self, deadline):
+        # urllib3 backs off from the second consecutive failure on: backoff_factor 1 makes that wait 2s.
+        retry = gsv._DeadlineRetry(total=5, backoff_factor=1, deadline=deadline)
+        for _ in range(2):
+            retry = retry.increment(method='GET', url='/photometa', error=urllib3.exceptions.ProtocolError('reset'))
+        return retry
+
+    def test_every_attempts_copy_keeps_the_deadline(self):
+        assert self.failed_twice(123.0).deadline == 123.0
+
+    def test_a_wait_that_fits_before_the_deadline_is_taken(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr(gsv.time, 'sleep', sleeps.append)
+
+        self.failed_twice(time.monotonic() + 3600).sleep()
+
+        assert sleeps == [2]
+
+    def test_a_wait_past_the_deadline_gives_up_instead(self, monkeypatch):
+        monkeypatch.setattr(gsv.time, 'sleep', lambda seconds: pytest.fail('slept past the deadline'))
+
+        with pytest.raises(DeadlineExceeded):
+            self.failed_twice(time.monotonic() + 1).sleep()
+
+    def test_a_retry_after_past_the_deadline_gives_up_too(self, monkeypatch):
+        monkeypatch.setattr(gsv.time, 'sleep', lambda seconds: pytest.fail('slept past the deadline'))
+        response = urllib3.response.HTTPResponse(status=429, headers={'Retry-After': '120'})
+
+        with pytest.raises(DeadlineExceeded, match='120s'):
+            self.failed_twice(time.monotonic() + 60).sleep(response)
+
+    def test_without_a_deadline_it_is_plain_retry(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr(gsv.time, 'sleep', sleeps.append)
+        response = urllib3.response.HTTPResponse(status=429, headers={'Retry-After': '120'})
+
+        self.failed_twice(None).sleep(response)
+
+        assert sleeps == [120]
+
+    def test_no_wait_no_sleep(self, monkeypatch):
+        monkeypatch.setattr(gsv.time, 'sleep', lambda seconds: pytest.fail('slept for nothing'))
+
+        gsv._DeadlineRetry(total=5, backoff_factor=1, deadline=time.monotonic() + 60).sleep()
+
 
 class TestDepthSession:
     def test_does_not_borrow_config_browser_headers(self, monkeypatch):
@@ -725,6 +1134,12 @@ class TestDepthSession:
             # Without jitter, concurrent city runs resynchronise onto one retry schedule after a shared outage.
             assert adapter.max_retries.backoff_jitter > 0
 
+    def test_a_deadline_reaches_the_adapter_and_its_retries(self):
+        session = gsv._depth_session(deadline=123.0)
+        adapter = session.get_adapter('https://example.com')
+        assert adapter._deadline == 123.0
+        assert adapter.max_retries.deadline == 123.0
+
     def test_session_type_accepted_by_requests(self):
         assert isinstance(gsv._depth_session(), requests.Session)
 
@@ -804,3 +1219,13 @@ class TestPace:
         monkeypatch.setattr(gsv, 'depth_min_request_interval', 1.0)
         gsv._pace(gsv.time.monotonic() - 60.0)
         assert slept == []
+
+    def test_draws_on_the_host_budget_when_one_is_configured(self, slept, monkeypatch):
+        """Every depth request, the first included: the per-process floor and the host's budget are separate."""
+        draws = []
+        monkeypatch.setattr(gsv, '_host_depth_limiter', SimpleNamespace(wait=lambda: draws.append(1)))
+        monkeypatch.setattr(gsv, 'depth_min_request_interval', 0.0)
+        gsv._pace(None)
+        gsv._pace(gsv.time.monotonic())
+        assert draws == [1, 1]
+        assert slept == []
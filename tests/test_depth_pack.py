@@ -0,0 +1,238 @@
+"""Tests for downloaders/depth_pack.py and pack_depth_artifacts.py: per-shard depth packs, memory-mapped.
+
+A pano read from a pack must be what reading its .npz gives - every field, 'depth' included, and the helpers'
+answers - while the .npz files stay the source of truth: never touched, and a pack whose shard has changed since
+it was built is rebuilt (and, with verify on, read around).
+"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from downloaders import depth_pack, gsv
+from downloaders.depth_pack import DepthPack, PackedStore, pack_path, write_pack
+import pack_depth_artifacts
+from test_depth_helpers import MIRROR_PLANES, write_v3, write_v4
+from test_depth_sampling import artifact_path, street
+
+
+def write_store(storage):
+    """Two shards: v4 and v3 artifacts of several shapes, a v2 one and a v3 one whose planes do not match."""
+    for pano_id, planes in (('abcdef', MIRROR_PLANES), ('abghij', street(1)), ('cdefgh', street(2, (8, 16)))):
+        write_v4(artifact_path(storage, pano_id), planes)
+    write_v3(artifact_path(storage, 'abmnop'), street(3))
+    with open(artifact_path(storage, 'abqrst'), 'wb') as f:
+        np.savez_compressed(f, depth=np.ones((2, 4), dtype=np.float32), heading=0.0, pitch=0.0, roll=0.0,
+                            format_version=2)
+    write_v3(artifact_path(storage, 'abuvwx'), depth=np.full((2, 4), 3.0, dtype=np.float32))
+    return str(storage)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return write_store(tmp_path / 'store')
+
+
+@pytest.fixture
+def packed(store, capsys):
+    pack_depth_artifacts.pack_store(store)
+    capsys.readouterr()
+    return store
+
+
+def packs(store):
+    return os.path.join(store, depth_pack.PACK_DIR_NAME)
+
+
+class TestWritePack:
+    def test_what_is_packed_left_out_and_failed(self, store, tmp_path):
+        paths = [os.path.join(store, 'ab', name) for name in os.listdir(os.path.join(store, 'ab'))]
+
+        packed, left_out, failed = write_pack(paths, str(tmp_path / 'ab.depthpack'))
+
+        assert packed == ['abcdef', 'abghij', 'abmnop']
+        assert left_out == [artifact_path(store, 'abqrst')]
+        assert [(path, 'differs' in reason) for path, reason in failed] == [(artifact_path(store, 'abuvwx'), True)]
+
+    def test_an_artifact_gone_since_it_was_listed_fails_and_is_not_recorded(self, store, tmp_path):
+        packed, _, failed = write_pack([artifact_path(store, 'abzzzz')], str(tmp_path / 'ab.depthpack'))
+
+        assert (packed, len(failed)) == ([], 1)
+        assert DepthPack(str(tmp_path / 'ab.depthpack')).sources == {}
+
+    @pytest.mark.parametrize('fields, reason', [
+        ({'format_version': 4}, 'no heading, pitch, roll field'),
+        ({'heading': 0.0, 'pitch': 0.0, 'roll': 0.0, 'format_version': 4, 'plane_indices': np.zeros(8, dtype=np.uint8)},
+         'plane_indices is not a raster'),
+    ])
+    def test_an_artifact_the_index_cannot_hold_fails(self, store, tmp_path, fields, reason):
+        path = artifact_path(store, 'abzzzz')
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **dict({'plane_indices': MIRROR_PLANES.indices, 'planes_n': MIRROR_PLANES.normals,
+                                           'planes_d': MIRROR_PLANES.distances}, **fields))
+
+        _, _, failed = write_pack([path], str(tmp_path / 'ab.depthpack'))
+
+        assert reason in failed[0][1]
+
+    def test_a_pack_of_nothing_opens_empty(self, tmp_path):
+        write_pack([], str(tmp_path / 'ab.depthpack'))
+
+        pack = DepthPack(str(tmp_path / 'ab.depthpack'))
+        assert (len(pack), list(pack), pack.sources) == (0, [], {})
+
+    def test_sections_are_aligned(self, packed):
+        with open(pack_path(packs(packed), 'ab'), 'rb') as f:
+            f.readline()
+            header_line = f.readline()
+        header = json.loads(header_line)
+
+        assert all(header[name] % depth_pack._ALIGN == 0 for name in ('index', 'normals', 'distances', 'rasters'))
+
+
+class TestReading:
+    @pytest.mark.parametrize('pano_id', ['abcdef', 'abghij', 'abmnop', 'cdefgh'])
+    def test_a_packed_pano_is_its_npz(self, packed, pano_id):
+        artifact = PackedStore(packed).load(pano_id)
+
+        with np.load(artifact_path(packed, pano_id)) as d:
+            assert sorted(artifact.files) == sorted(set(d.files) | {'depth'})
+            for name in d.files:
+                assert artifact[name].dtype == d[name].dtype and artifact[name].shape == d[name].shape
+                np.testing.assert_array_equal(artifact[name], d[name])
+            assert gsv.ground_plane_from_artifact(artifact) is not None
+            assert gsv.camera_height_from_artifact(artifact) == gsv.camera_height_from_artifact(d)
+        np.testing.assert_array_equal(artifact['depth'],
+                                      gsv.read_depth_artifact(artifact_path(packed, pano_id))['depth'])
+
+    def test_its_arrays_are_views_into_the_map(self, packed):
+        pack = DepthPack(pack_path(packs(packed), 'ab'))
+        artifact = pack['abghij']
+
+        for name in ('plane_indices', 'planes_n', 'planes_d'):
+            assert np.shares_memory(artifact[name], pack._map)
+            with pytest.raises(ValueError):
+                artifact[name].flat[0] = 0
+
+    def test_a_pano_no_pack_holds_is_read_from_its_npz(self, packed, monkeypatch):
+        loads = []
+        real = gsv.load_depth_artifact
+        monkeypatch.setattr(gsv, 'load_depth_artifact', lambda path: loads.append(path) or real(path))
+        store = PackedStore(packed)
+
+        assert store.load('abqrst')['depth'][0, 0] == 1.0
+        store.load('abcdef')
+        assert loads == [artifact_path(packed, 'abqrst')]
+
+    def test_a_shard_with_no_pack_and_a_pano_with_no_npz(self, store):
+        with pytest.raises(FileNotFoundError):
+            PackedStore(store).load('zzzzzz')
+        assert PackedStore(store).load('abcdef')['format_version'] == 4
+
+    def test_not_a_pack(self, tmp_path):
+        (tmp_path / 'ab.depthpack').write_bytes(b'PK\x03\x04')
+
+        with pytest.raises(ValueError, match='not a depth pack'):
+            DepthPack(str(tmp_path / 'ab.depthpack'))
+
+    def test_packs_copied_elsewhere(self, packed, tmp_path):
+        os.rename(packs(packed), str(tmp_path / 'local'))
+
+        assert 'abcdef' in DepthPack(pack_path(str(tmp_path / 'local'), 'ab'))
+        assert PackedStore(packed, pack_dir=str(tmp_path / 'local')).load('cdefgh')['plane_indices'].shape == (8, 16)
+
+
+class TestVerify:
+    def rewrite(self, store):
+        write_v4(artifact_path(store, 'abcdef'), street(9, (2, 4)))
+        os.utime(artifact_path(store, 'abcdef'), ns=(1, 1))
+
+    def test_off_a_pack_serves_what_was_packed(self, packed):
+        self.rewrite(packed)
+
+        np.testing.assert_array_equal(PackedStore(packed).load('abcdef')['planes_n'], MIRROR_PLANES.normals)
+
+    def test_on_a_rewritten_npz_is_read_instead(self, packed):
+        self.rewrite(packed)
+
+        assert not np.array_equal(PackedStore(packed, verify=True).load('abcdef')['planes_n'], MIRROR_PLANES.normals)
+
+    def test_on_an_unchanged_npz_is_not_read(self, packed, monkeypatch):
+        monkeypatch.setattr(gsv, 'load_depth_artifact', lambda path: pytest.fail('read the npz'))
+
+        assert PackedStore(packed, verify=True).load('abcdef')['format_version'] == 4
+
+    def test_on_a_pano_whose_npz_is_gone_the_pack_answers(self, packed):
+        os.remove(artifact_path(packed, 'abcdef'))
+
+        assert PackedStore(packed, verify=True).load('abcdef')['format_version'] == 4
+
+
+class TestPackStore:
+    def test_a_first_run_packs_every_shard(self, store, capsys):
+        summary = pack_depth_artifacts.pack_store(store)
+
+        assert summary == pack_depth_artifacts.PackSummary(2, 0, 0, 4, 1, 1)
+        assert 'FAILED %s' % artifact_path(store, 'abuvwx') in capsys.readouterr().out
+        assert sorted(os.listdir(packs(store))) == ['ab.depthpack', 'cd.depthpack']
+
+    def test_the_npz_files_are_not_touched(self, store):
+        before = {path: open(path, 'rb').read() for path in (artifact_path(store, pano_id) for pano_id in
+                                                              ('abcdef', 'abmnop', 'abqrst', 'abuvwx'))}
+
+        pack_depth_artifacts.pack_store(store)
+
+        assert before == {path: open(path, 'rb').read() for path in before}
+
+    def test_a_second_run_repacks_nothing(self, packed, monkeypatch):
+        monkeypatch.setattr(pack_depth_artifacts, 'write_pack', lambda *args: pytest.fail('repacked'))
+
+        assert pack_depth_artifacts.pack_store(packed) == pack_depth_artifacts.PackSummary(0, 2, 0, 0, 0, 0)
+
+    @pytest.mark.parametrize('change', ['add', 'rewrite', 'delete'])
+    def test_only_a_changed_shard_is_repacked(self, packed, change):
+        if change == 'add':
+            write_v4(artifact_path(packed, 'cdzzzz'), MIRROR_PLANES)
+        elif change == 'rewrite':
+            os.utime(artifact_path(packed, 'cdefgh'), ns=(1, 1))
+        else:
+            os.remove(artifact_path(packed, 'cdefgh'))
+            write_v4(artifact_path(packed, 'cdzzzz'), MIRROR_PLANES)
+
+        summary = pack_depth_artifacts.pack_store(packed)
+
+        assert (summary.packed, summary.current) == (1, 1)
+        assert ('cdefgh' in DepthPack(pack_path(packs(packed), 'cd'))) == (change != 'delete')
+
+    def test_force_repacks_everything(self, packed):
+        assert pack_depth_artifacts.pack_store(packed, force=True).packed == 2
+
+    def test_an_unreadable_pack_is_rebuilt(self, packed, capsys):
+        with open(pack_path(packs(packed), 'cd'), 'wb') as f:
+            f.write(b'truncated')
+
+        assert pack_depth_artifacts.pack_store(packed).packed == 1
+        assert 'Rebuilding unreadable pack' in capsys.readouterr().out
+
+    def test_a_pack_whose_shard_is_gone_is_removed(self, packed):
+        for name in os.listdir(os.path.join(packed, 'cd')):
+            os.remove(os.path.join(packed, 'cd', name))
+
+        assert pack_depth_artifacts.pack_store(packed).removed == 1
+        assert os.listdir(packs(packed)) == ['ab.depthpack']
+
+    def test_other_directories_in_the_store_are_not_shards(self, store, tmp_path):
+        os.makedirs(os.path.join(store, 'abc'))
+        (tmp_path / 'store' / 'xy').write_text('a file, not a shard')
+
+        assert pack_depth_artifacts.pack_store(store, output=str(tmp_path / 'out')).packed == 2
+
+    def test_main(self, store, monkeypatch, capsys):
+        monkeypatch.setattr('sys.argv', ['pack_depth_artifacts.py', store])
+
+        assert pack_depth_artifacts.main() == 1
+        assert ('Packed 2 shard(s) (4 artifact(s)), 0 already current, 0 orphaned pack(s) removed; 1 artifact(s) '
+                'without plane fields read from their .npz, 1 failed.') in capsys.readouterr().out
+        assert pack_depth_artifacts.main() == 0
@@ -4,6 +4,7 @@ import csv
 import logging
 import os
 import sys
+import threading
 import time
 from types import SimpleNamespace
 
@@ -12,7 +13,7 @@ import pytest
 import requests
 
 from conftest import default_depth_array, make_pano
-from downloaders import gsv
+from downloaders import failure_log, gsv
 
 
 def pano_infos(*pano_ids):
@@ -55,17 +56,18 @@ def test_success_saves_artifact_and_ledgers(tmp_path, fake_streetview):
     path = artifact_path(storage, 'abcdef')
     assert os.path.isfile(path)
     with np.load(path) as d:
-        assert d['depth'].dtype == np.float32
-        assert d['depth'].shape == (2, 2)
-        # Stored in the JPEG's column order, i.e. streetlevel's array flipped in x (see #58).
-        np.testing.assert_allclose(d['depth'], [[4.5, -1.0], [10.0, 3.25]])
-        assert float(d['heading']) == pytest.approx(1.25)
-        # v3: the plane list rides along (#56) - indices in payload order (index 0 exactly where the
-        # stored depth is -1), normals and offsets verbatim. Version pinned as a literal.
+        # v4: the plane list (#56) and no raster - indices in payload order, which is the JPEG's, so index 0
+        # sits where streetlevel's array flipped in x has -1 (#58); normals and offsets verbatim. Version
+        # pinned as a literal.
+        assert 'depth' not in d.files
         np.testing.assert_array_equal(d['plane_indices'], [[1, 0], [1, 1]])
         assert d['planes_n'].shape == (2, 3)
         np.testing.assert_allclose(d['planes_d'], [0.0, 2.5])
-        assert int(d['format_version']) == 3
+        assert float(d['heading']) == pytest.approx(1.25)
+        assert int(d['format_version']) == 4
+    depth = gsv.read_depth_artifact(path)['depth']
+    assert depth.dtype == np.float32 and depth.shape == (2, 2)
+    np.testing.assert_array_equal(depth == -1, [[False, True], [False, False]])
     assert read_ledger(storage) == [['pano_id', 'status'], ['abcdef', 'saved']]
     # No leftover temp file from the atomic write.
     assert not os.path.exists(path + '.part')
@@ -112,17 +114,15 @@ def test_no_depth_payload_ledgers_unavailable(tmp_path, fake_streetview):
     assert read_ledger(storage) == [['pano_id', 'status'], ['abcdef', 'unavailable']]
 
 
-def test_non_2d_depth_payload_ledgers_unavailable_and_never_retries(tmp_path, fake_streetview):
-    """A depth payload that isn't an (h, w) grid is unusable, and that's a property of the pano, not of the
-    network. It must take the same path as no-depth - ledgered 'unavailable' - rather than raise inside the
-    artifact write's [:, ::-1], where the catch-all would count it transient and re-request it every run
-    forever."""
+def test_a_payload_with_no_planes_ledgers_unavailable_and_never_retries(tmp_path, fake_streetview):
+    """The seam hands back no planes only when the response carries no depth payload (a malformed one raises
+    there instead), so that is the same verdict as no depth at all: 'unavailable', and never re-requested."""
     storage = str(tmp_path)
     calls = []
 
     def find(pano_id, **kwargs):
         calls.append(pano_id)
-        return make_pano(np.array([1.0, 2.0]))  # 1-D: no column axis to unmirror
+        return make_pano(default_depth_array(), planes=None)
 
     fake_streetview.find_panorama_by_id = find
 
@@ -136,26 +136,31 @@ def test_non_2d_depth_payload_ledgers_unavailable_and_never_retries(tmp_path, fa
 
 
 @pytest.mark.parametrize('planes', [
-    None,
-    SimpleNamespace(indices=np.zeros((9, 9), dtype=np.uint8),
-                    normals=np.zeros((1, 3), dtype=np.float32), distances=np.zeros(1, dtype=np.float32)),
-], ids=['missing', 'shape-mismatch'])
-def test_depth_present_but_planes_missing_is_transient(tmp_path, fake_streetview, planes):
-    """A depth raster with no matching plane data can only mean the payload path or wire format drifted
-    upstream. Depth exists, so 'unavailable' would be a lie - the pano must count as a transient failure,
-    stay unledgered, and retry next run (#56)."""
+    SimpleNamespace(indices=np.array([1, 0], dtype=np.uint8),
+                    normals=np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.0]], dtype=np.float32),
+                    distances=np.array([0.0, 2.5], dtype=np.float32)),
+    SimpleNamespace(indices=np.array([[2, 0]], dtype=np.uint8),
+                    normals=np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.0]], dtype=np.float32),
+                    distances=np.array([0.0, 2.5], dtype=np.float32)),
+    SimpleNamespace(indices=np.array([[1, 0]], dtype=np.uint8),
+                    normals=np.zeros((2, 3), dtype=np.float32), distances=np.array([0.0, 2.5], dtype=np.float32)),
+], ids=['not-a-raster', 'index-out-of-range', 'zero-normal'])
+def test_malformed_planes_are_transient(tmp_path, fake_streetview, planes):
+    """Planes the writer refuses (gsv._check_depth_planes) can only mean the decode or the wire format drifted.
+    Depth exists, so 'unavailable' would be a lie, permanently writing off a pano whose depth Google still
+    serves: no artifact, nothing half-written, no ledger row, and retried next run (#56)."""
     storage = str(tmp_path)
     calls = []
 
     def find(pano_id, **kwargs):
         calls.append(pano_id)
-        return make_pano(default_depth_array(), planes=planes)
+        return make_pano(None, planes=planes)
 
     fake_streetview.find_panorama_by_id = find
 
     assert gsv.download_depth_maps(storage, pano_infos('abcdef')) == (0, 1, 0, 1)
     assert read_ledger(storage) == [['pano_id', 'status']]
-    assert not os.path.isfile(artifact_path(storage, 'abcdef'))
+    assert not os.path.exists(os.path.join(storage, 'ab'))
 
     # Not ledgered, so a later run tries again.
     assert gsv.download_depth_maps(storage, pano_infos('abcdef')) == (0, 1, 0, 1)
@@ -185,34 +190,6 @@ def test_malformed_payload_is_classed_unexpected_not_network(tmp_path, fake_stre
     assert read_ledger(storage) == [['pano_id', 'status']]
 
 
-def test_indices_disagreeing_with_the_raster_is_transient(tmp_path, fake_streetview):
-    """The writer's cross-check between streetlevel's raster and our plane indices (#56 review) must behave
-    like the other malformed-v3 cases end to end: no artifact, no ledger row, retried next run - never
-    'unavailable', which would permanently write off a pano whose depth Google is still serving."""
-    storage = str(tmp_path)
-    calls = []
-    # Sentinel on the LEFT in stored (JPEG) order; indices claim it is on the right.
-    depth = np.array([[-1.0, 5.0]])          # streetlevel order -> stored [5.0, -1.0]
-    planes = SimpleNamespace(indices=np.array([[0, 1]], dtype=np.uint8),
-                             normals=np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.0]], dtype=np.float32),
-                             distances=np.array([0.0, 2.5], dtype=np.float32))
-
-    def find(pano_id, **kwargs):
-        calls.append(pano_id)
-        return make_pano(depth, planes=planes)
-
-    fake_streetview.find_panorama_by_id = find
-
-    assert gsv.download_depth_maps(storage, pano_infos('abcdef')) == (0, 1, 0, 1)
-    assert read_ledger(storage) == [['pano_id', 'status']]
-    assert not os.path.isfile(artifact_path(storage, 'abcdef'))
-    # Nothing half-written left behind either.
-    assert not os.path.exists(os.path.join(storage, 'ab'))
-
-    assert gsv.download_depth_maps(storage, pano_infos('abcdef')) == (0, 1, 0, 1)
-    assert calls == ['abcdef', 'abcdef']
-
-
 @pytest.mark.parametrize('error', [requests.ConnectionError('boom'), ValueError('not json'), RuntimeError('bug')])
 def test_errors_fail_without_ledgering_so_next_run_retries(tmp_path, fake_streetview, error):
     storage = str(tmp_path)
@@ -607,6 +584,233 @@ def test_network_failures_keep_the_retreat_sleeps(tmp_path, fake_streetview, mon
     assert sleeps == [30]
 
 
+
+class TestStoppingWithTheRun:
+    """Beside the image phase (DownloadRunner's --concurrent-phases) the depth phase runs on its own thread, and
+    a run ending on the main thread has to be able to stop it."""
+
+    def test_no_request_is_started_once_the_run_is_ending(self, tmp_path, fake_streetview, capsys):
+        stop = threading.Event()
+        calls = []
+
+        def find(pano_id, **kwargs):
+            calls.append(pano_id)
+            stop.set()
+            return make_pano(default_depth_array())
+
+        fake_streetview.find_panorama_by_id = find
+
+        result = gsv.download_depth_maps(str(tmp_path), many_pano_infos(5), stop=stop)
+
+        assert len(calls) == 1 and result == (1, 0, 0, 1)
+        assert 'The run is ending' in capsys.readouterr().out
+
+    def test_a_retreat_wakes_up_for_it(self, tmp_path, fake_streetview, monkeypatch):
+        monkeypatch.setattr(gsv, 'DEPTH_RETREAT_SCHEDULE', {1: 300})
+        monkeypatch.setattr(gsv.time, 'sleep', lambda seconds: pytest.fail('slept through the run ending'))
+        stop = threading.Event()
+
+        def find(pano_id, **kwargs):
+            stop.set()  # as a SIGTERM on the main thread would, mid-request
+            raise requests.ConnectionError('network down')
+
+        fake_streetview.find_panorama_by_id = find
+        started = time.monotonic()
+
+        assert gsv.download_depth_maps(str(tmp_path), many_pano_infos(5), stop=stop) == (0, 1, 0, 1)
+        assert time.monotonic() - started < 60
+@pytest.mark.parametrize('depth_workers', [1, 2])
+def test_artifacts_are_written_with_the_phases_codec(tmp_path, fake_streetview, depth_workers):
+    fake_streetview.find_panorama_by_id = lambda pano_id, **kwargs: make_pano(default_depth_array())
+    infos = many_pano_infos(3)
+
+    gsv.download_depth_maps(str(tmp_path), infos, depth_workers=depth_workers,
+                            depth_codec=gsv.parse_depth_codec('delta'))
+
+    for info in infos:
+        with np.load(artifact_path(str(tmp_path), info['pano_id'])) as d:
+            assert str(d['plane_indices_codec']) == 'delta'
+        np.testing.assert_array_equal(gsv.read_depth_artifact(artifact_path(str(tmp_path), info['pano_id']))
+                                      ['plane_indices'], make_pano(default_depth_array()).planes.indices)
+
+
+class TestPipelinedRequests:
+    """depth_workers > 1 (DownloadRunner's --depth-workers): several photometa requests in flight, artifact writes
+    on a pool beside them, and the serial loop's bookkeeping - ledger, counters, breaker, retreat - unchanged."""
+
+    def test_every_pano_is_saved_and_ledgered_once(self, tmp_path, fake_streetview):
+        fake_streetview.find_panorama_by_id = lambda pano_id, **kwargs: make_pano(default_depth_array())
+        infos = many_pano_infos(12)
+
+        result = gsv.download_depth_maps(str(tmp_path), infos, depth_workers=4)
+
+        assert result == (12, 0, 0, 12)
+        rows = read_ledger(str(tmp_path))[1:]
+        assert sorted(rows) == sorted([p['pano_id'], 'saved'] for p in infos)
+        assert all(os.path.isfile(artifact_path(str(tmp_path), p['pano_id'])) for p in infos)
+
+    def test_requests_are_in_flight_together(self, tmp_path, fake_streetview):
+        together = threading.Barrier(3, timeout=10)
+
+        def find(pano_id, **kwargs):
+            together.wait()  # a serial loop would never get past the first
+            return make_pano(default_depth_array())
+
+        fake_streetview.find_panorama_by_id = find
+
+        assert gsv.download_depth_maps(str(tmp_path), many_pano_infos(6), depth_workers=3) == (6, 0, 0, 6)
+
+    def test_artifacts_are_written_off_the_request_threads(self, tmp_path, fake_streetview, monkeypatch):
+        fake_streetview.find_panorama_by_id = lambda pano_id, **kwargs: make_pano(default_depth_array())
+        writers = []
+        real_write = gsv._write_depth_artifact
+
+        def write(*args):
+            writers.append(threading.current_thread().name)
+            return real_write(*args)
+
+        monkeypatch.setattr(gsv, '_write_depth_artifact', write)
+
+        gsv.download_depth_maps(str(tmp_path), many_pano_infos(4), depth_workers=2)
+
+        assert len(writers) == 4 and all(name.startswith('pano-writer') for name in writers)
+
+    def test_every_request_is_paced_from_the_phases_thread(self, tmp_path, fake_streetview, monkeypatch):
+        fake_streetview.find_panorama_by_id = lambda pano_id, **kwargs: make_pano(default_depth_array())
+        paced = []
+        monkeypatch.setattr(gsv, '_pace', lambda last_request_at: paced.append(threading.current_thread()))
+
+        gsv.download_depth_maps(str(tmp_path), many_pano_infos(5), depth_workers=3)
+
+        assert paced == [threading.current_thread()] * 5
+
+    def test_a_failed_write_is_a_storage_failure(self, tmp_path, fake_streetview, monkeypatch):
+        fake_streetview.find_panorama_by_id = lambda pano_id, **kwargs: make_pano(default_depth_array())
+        monkeypatch.setattr(gsv, '_write_depth_artifact', full_disk)
+
+        assert gsv.download_depth_maps(str(tmp_path), many_pano_infos(3), depth_workers=2) == (0, 3, 0, 3)
+        assert read_ledger(str(tmp_path)) == [['pano_id', 'status']]
+
+    def test_the_request_budget_is_exact(self, tmp_path, fake_streetview):
+        calls = []
+
+        def find(pano_id, **kwargs):
+            calls.append(pano_id)
+            return make_pano(default_depth_array())
+
+        fake_streetview.find_panorama_by_id = find
+
+        gsv.download_depth_maps(str(tmp_path), many_pano_infos(10), max_requests=4, depth_workers=3)
+
+        assert len(calls) == 4
+
+    def test_google_refusing_stops_new_requests_and_says_so_once(self, tmp_path, fake_streetview, capsys):
+        calls = []
+
+        def find(pano_id, **kwargs):
+            calls.append(pano_id)
+            raise gsv.DepthBlockedError('redirected to https://www.google.com/sorry/index')
+
+        fake_streetview.find_panorama_by_id = find
+
+        success, failed, skipped, total = gsv.download_depth_maps(str(tmp_path), many_pano_infos(20),
+                                                                  depth_workers=3)
+
+        assert len(calls) <= 3 and failed == len(calls)
+        assert capsys.readouterr().out.count('Google is refusing requests') == 1
+
+    def test_requests_cut_off_together_stop_the_phase_once(self, tmp_path, fake_streetview, capsys):
+        together = threading.Barrier(3, timeout=10)
+
+        def find(pano_id, **kwargs):
+            together.wait()
+            raise gsv.DeadlineExceeded('the run is out of time')
+
+        fake_streetview.find_panorama_by_id = find
+
+        assert gsv.download_depth_maps(str(tmp_path), many_pano_infos(9), max_runtime_minutes=60,
+                                      run_start_monotonic=time.monotonic(), depth_workers=3) == (0, 0, 0, 0)
+        assert capsys.readouterr().out.count('reached mid-request') == 1
+        assert read_ledger(str(tmp_path)) == [['pano_id', 'status']]
+
+    def test_the_breaker_and_the_retreat_keep_their_thresholds(self, tmp_path, fake_streetview, monkeypatch,
+                                                                capsys):
+        monkeypatch.setattr(gsv, 'DEPTH_MAX_CONSECUTIVE_FAILURES', 4)
+        monkeypatch.setattr(gsv, 'DEPTH_RETREAT_SCHEDULE', {2: 30})
+        sleeps = []
+        monkeypatch.setattr(gsv.time, 'sleep', sleeps.append)
+
+        def find(pano_id, **kwargs):
+            raise requests.ConnectionError('network down')
+
+        fake_streetview.find_panorama_by_id = find
+
+        success, failed, skipped, total = gsv.download_depth_maps(str(tmp_path), many_pano_infos(30),
+                                                                  depth_workers=3)
+
+        # The breaker trips on the 4th failure in completion order; what was already in flight then is
+        # still waited for and counted, but nothing new starts.
+        assert 4 <= failed <= 4 + 2
+        assert sleeps == [30]
+        out = capsys.readouterr().out
+        assert out.count('consecutive failures. Stopping the depth phase') == 1
+        assert 'stopped early after' in out
+
+
+class TestCuttingOffAtTheDeadline:
+    """--max-runtime reaches into the request in flight (gsv._TimeoutHTTPAdapter): a photometa request still
+    running when the budget ends is cut off, and its pano is neither counted, ledgered nor backed off."""
+
+    def test_the_session_carries_the_budgets_deadline(self, tmp_path, fake_streetview):
+        deadlines = []
+
+        def find(pano_id, session=None, **kwargs):
+            deadlines.append(session.get_adapter('https://www.google.com')._deadline)
+            return make_pano(default_depth_array())
+
+        fake_streetview.find_panorama_by_id = find
+
+        started = time.monotonic()
+        gsv.download_depth_maps(str(tmp_path), pano_infos('abcdef'), run_start_monotonic=started,
+                                max_runtime_minutes=5)
+
+        assert deadlines == [started + 300.0]
+
+    def test_a_request_cut_off_stops_the_phase_without_a_verdict(self, tmp_path, fake_streetview, capsys):
+        calls = []
+
+        def find(pano_id, **kwargs):
+            calls.append(pano_id)
+            raise gsv.DeadlineExceeded('the run deadline passed with the request in flight')
+
+        fake_streetview.find_panorama_by_id = find
+
+        result = gsv.download_depth_maps(str(tmp_path), many_pano_infos(5), run_start_monotonic=time.monotonic(),
+                                         max_runtime_minutes=5)
+
+        assert len(calls) == 1 and result == (0, 0, 0, 0)
+        assert read_ledger(str(tmp_path)) == [['pano_id', 'status']]
+        assert not os.path.exists(os.path.join(str(tmp_path), failure_log.DEPTH_FAILURE_LOG_FILENAME))
+        out = capsys.readouterr().out
+        assert 'reached mid-request. Stopping.' in out
+        assert 'WARNING' not in out
+
+    def test_a_retreat_ends_with_the_budget(self, tmp_path, fake_streetview, monkeypatch):
+        monkeypatch.setattr(gsv, 'DEPTH_RETREAT_SCHEDULE', {1: 300})
+        sleeps = []
+        monkeypatch.setattr(gsv.time, 'sleep', sleeps.append)
+
+        def find(pano_id, **kwargs):
+            raise requests.ConnectionError('network down')
+
+        fake_streetview.find_panorama_by_id = find
+
+        gsv.download_depth_maps(str(tmp_path), many_pano_infos(5), run_start_monotonic=time.monotonic(),
+                                max_runtime_minutes=1)
+
+        assert len(sleeps) == 1 and 0 < sleeps[0] <= 60
+
+
 @pytest.mark.parametrize('error', [
     gsv.DepthBlockedError('redirected to https://www.google.com/sorry/index'),
     requests.exceptions.RetryError('too many 429s'),
@@ -649,6 +853,66 @@ def test_persistent_failures_cannot_starve_the_request_budget(tmp_path, fake_str
     assert len(attempted) > 5
 
 
+class TestRepeatedTransientFailuresBackOff:
+    """A pano whose photometa request fails transiently night after night sits out a doubling window
+    (downloaders/failure_log.py) rather than spending a request - and max_requests - every run."""
+
+    @pytest.fixture
+    def nights(self, monkeypatch):
+        clock = [1_800_000_000.0]
+        monkeypatch.setattr(failure_log, 'time', SimpleNamespace(time=lambda: clock[0]))
+
+        def run(storage, count, infos):
+            results = []
+            for _ in range(count):
+                results.append(gsv.download_depth_maps(storage, infos))
+                clock[0] += 24 * 60 * 60
+            return results
+        return run
+
+    def test_a_pano_failing_every_night_is_requested_ever_more_rarely(self, tmp_path, fake_streetview, nights,
+                                                                       capsys):
+        calls = []
+
+        def find(pano_id, **kwargs):
+            calls.append(pano_id)
+            if pano_id == 'badbad':
+                raise requests.ConnectionError('boom')
+            return make_pano(default_depth_array())
+
+        fake_streetview.find_panorama_by_id = find
+
+        results = nights(str(tmp_path), 8, pano_infos('badbad', 'goodgd'))
+
+        assert calls.count('badbad') == 4  # nights 1, 2, 4 and 8
+        assert results[2] == (0, 0, 1, 1), "a deferred pano is neither attempted nor counted"
+        assert 'backing off after repeated transient failures' in capsys.readouterr().out
+        assert ['badbad', 'saved'] not in read_ledger(str(tmp_path))
+
+    def test_a_resolved_outcome_clears_the_record(self, tmp_path, fake_streetview, nights):
+        answers = iter([requests.ConnectionError('boom'), None])
+
+        def find(pano_id, **kwargs):
+            answer = next(answers)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        fake_streetview.find_panorama_by_id = find
+        nights(str(tmp_path), 2, pano_infos('abcdef'))
+
+        with open(os.path.join(str(tmp_path), failure_log.DEPTH_FAILURE_LOG_FILENAME), newline='') as f:
+            assert [row[:2] for row in csv.reader(f)][1:] == [['abcdef', '1'], ['abcdef', '0']]
+
+    def test_a_storage_failure_is_not_held_against_the_pano(self, tmp_path, fake_streetview, nights, monkeypatch):
+        """A full store fails every pano alike; backing each off would idle the backlog after the fix."""
+        fake_streetview.find_panorama_by_id = lambda pano_id, **kwargs: make_pano(default_depth_array())
+        monkeypatch.setattr(gsv, '_write_depth_artifact', full_disk)
+
+        assert nights(str(tmp_path), 3, pano_infos('abcdef'))[2] == (0, 1, 0, 1)
+        assert not os.path.exists(os.path.join(str(tmp_path), failure_log.DEPTH_FAILURE_LOG_FILENAME))
+
+
 class TestCountUnresolvedDepth:
     """count_unresolved_depth backs DownloadRunner's decision to reserve image time for depth at all: a
     reservation with nothing unresolved would burn image throughput for a phase that returns in milliseconds."""
@@ -668,6 +932,15 @@ class TestCountUnresolvedDepth:
             f.write('pano_id,status\nbbbbbb,saved\naaaaaa\n')
         assert gsv.count_unresolved_depth(str(tmp_path), pano_infos('aaaaaa', 'bbbbbb')) == 1
 
+    def test_panos_backing_off_do_not_count(self, tmp_path):
+        """The phase will not request them tonight, so image time reserved for them would be wasted."""
+        path = os.path.join(str(tmp_path), failure_log.DEPTH_FAILURE_LOG_FILENAME)
+        with failure_log.TransientFailureLog(path) as log:
+            log.failed('aaaaaa', 'network')
+            log.failed('aaaaaa', 'network')
+            log.failed('bbbbbb', 'network')
+        assert gsv.count_unresolved_depth(str(tmp_path), pano_infos('aaaaaa', 'bbbbbb', 'cccccc')) == 2
+
     def test_unreadable_ledger_counts_as_no_backlog(self, tmp_path, monkeypatch):
         """When the ledger can't be read, download_depth_maps sits the run out — nothing to reserve for."""
 
@@ -0,0 +1,211 @@
+"""Tests for downloaders/depth_sampling.py: depth under a whole table of labels at once.
+
+Every sample must be what docs/depth.md's one-label recipe reads for that label, on v3 and v4 artifacts alike,
+while each pano's artifact is loaded once and a v4 raster is never rebuilt in full to read a few pixels of it.
+"""
+
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from conftest import make_pano
+from downloaders import depth_sampling, gsv
+from downloaders.depth_sampling import sample_depth
+from test_depth_helpers import MIRROR_PLANES, write_v3, write_v4
+
+PANO_WIDTH, PANO_HEIGHT = 16384, 8192
+
+
+def artifact_path(storage, pano_id):
+    return os.path.join(str(storage), pano_id[:2], pano_id + gsv.DEPTH_ARTIFACT_SUFFIX)
+
+
+def street(seed, shape=(16, 32)):
+    """Random planes with no degenerate normal, so the writer's plane checks pass."""
+    rng = np.random.default_rng(seed)
+    count = 40
+    normals = rng.normal(size=(count, 3)).astype(np.float32)
+    normals[-1] = (0.0, 0.0, 1.0)
+    indices = rng.integers(0, count, size=shape).astype(np.uint8)
+    indices[shape[0] // 2:, :shape[1] // 2] = count - 1  # a ground plane under half the lower half
+    return gsv.DepthPlanes(indices, normals, (rng.uniform(1.0, 30.0, size=count)).astype(np.float32))
+
+
+def write_store(storage, version):
+    """Three panos in `storage`, as the v3 or the v4 writer left them; their planes by pano id."""
+    planes = {'abcdef': MIRROR_PLANES, 'cdefgh': street(1), 'efghij': street(2)}
+    for pano_id, pano_planes in planes.items():
+        path = artifact_path(storage, pano_id)
+        if version == 3:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_v3(path, pano_planes)
+        else:
+            write_v4(path, pano_planes)
+    return planes
+
+
+def recipe(storage, pano_id, pano_x, pano_y, pano_width, pano_height):
+    """docs/depth.md's "Sampling depth under a label", verbatim."""
+    d = gsv.read_depth_artifact(artifact_path(storage, pano_id))
+    col = int(pano_x / pano_width * d["depth"].shape[1]) % d["depth"].shape[1]
+    row = min(int(pano_y / pano_height * d["depth"].shape[0]), d["depth"].shape[0] - 1)
+    return d["depth"][row, col], d["plane_indices"][row, col]
+
+
+def labels_on(pano_ids, count, seed=0):
+    """Labels scattered over the panos in a shuffled order, the frame's edges and a wrap-around included."""
+    rng = np.random.default_rng(seed)
+    labels = [(str(rng.choice(pano_ids)), float(rng.uniform(-PANO_WIDTH, 2 * PANO_WIDTH)),
+               float(rng.uniform(0, PANO_HEIGHT)), PANO_WIDTH, PANO_HEIGHT) for _ in range(count)]
+    for pano_id in pano_ids:
+        labels += [(pano_id, 0, 0, PANO_WIDTH, PANO_HEIGHT), (pano_id, PANO_WIDTH, PANO_HEIGHT, PANO_WIDTH,
+                                                              PANO_HEIGHT), (pano_id, 13312, 6656, 13312, 6656)]
+    return labels
+
+
+class TestSamples:
+    @pytest.mark.parametrize('version', [3, 4])
+    def test_every_label_is_the_recipes_sample(self, tmp_path, version):
+        planes = write_store(tmp_path, version)
+        labels = labels_on(sorted(planes), 300)
+
+        samples = sample_depth(str(tmp_path), labels)
+
+        expected = [recipe(tmp_path, *label) for label in labels]
+        np.testing.assert_array_equal(samples.depth.view(np.uint32),
+                                      np.array([depth for depth, _ in expected], dtype=np.float32).view(np.uint32))
+        np.testing.assert_array_equal(samples.plane_index, [index for _, index in expected])
+        assert samples.depth.dtype == np.float32 and samples.plane_index.dtype == np.int16
+
+    def test_the_ground_distance_is_the_panos_camera_height(self, tmp_path):
+        planes = write_store(tmp_path, 4)
+        labels = labels_on(sorted(planes), 20)
+
+        samples = sample_depth(str(tmp_path), labels)
+
+        heights = {pano_id: gsv.camera_height_from_artifact(gsv.read_depth_artifact(artifact_path(tmp_path, pano_id)))
+                   for pano_id in planes}
+        np.testing.assert_array_equal(samples.ground_distance,
+                                      np.array([heights[label[0]] for label in labels], dtype=np.float32))
+        assert heights['abcdef'] == 2.5
+
+    def test_a_pano_without_a_ground_plane_has_no_ground_distance(self, tmp_path):
+        path = artifact_path(tmp_path, 'abcdef')
+        os.makedirs(os.path.dirname(path))
+        write_v3(path, gsv.DepthPlanes(MIRROR_PLANES.indices, MIRROR_PLANES.normals[[0, 1, 1]],
+                                       MIRROR_PLANES.distances))
+
+        samples = sample_depth(str(tmp_path), [('abcdef', 10, 7000, PANO_WIDTH, PANO_HEIGHT)])
+
+        assert np.isnan(samples.ground_distance[0]) and samples.plane_index[0] == 2
+
+    def test_labels_can_be_a_one_shot_iterable(self, tmp_path):
+        """A csv.reader or an itertuples() - how a city-sized table arrives - can only be read once."""
+        planes = write_store(tmp_path, 4)
+        labels = labels_on(sorted(planes), 50)
+
+        samples = sample_depth(str(tmp_path), (label for label in labels))
+
+        expected = sample_depth(str(tmp_path), labels)
+        for column, expected_column in zip(samples, expected):
+            np.testing.assert_array_equal(column, expected_column)
+        assert len(samples.depth) == len(labels)
+
+    def test_no_labels(self, tmp_path):
+        samples = sample_depth(str(tmp_path), [])
+
+        assert [len(column) for column in samples] == [0, 0, 0]
+
+
+class TestCost:
+    def test_each_artifact_is_loaded_once(self, tmp_path, monkeypatch):
+        planes = write_store(tmp_path, 4)
+        loads = []
+        real = gsv.load_depth_artifact
+        monkeypatch.setattr(gsv, 'load_depth_artifact', lambda path: loads.append(path) or real(path))
+
+        sample_depth(str(tmp_path), labels_on(sorted(planes), 200))
+
+        assert sorted(loads) == sorted(artifact_path(tmp_path, pano_id) for pano_id in planes)
+
+    def test_a_v4_raster_is_never_rebuilt_in_full(self, tmp_path, monkeypatch):
+        planes = write_store(tmp_path, 4)
+        monkeypatch.setattr(gsv, '_compute_depth_raster', lambda planes: pytest.fail('rebuilt the raster'))
+
+        samples = sample_depth(str(tmp_path), labels_on(sorted(planes), 50))
+
+        assert not np.isnan(samples.depth).any()
+
+    def test_a_process_pool_gives_the_same_samples(self, tmp_path, monkeypatch):
+        planes = write_store(tmp_path, 4)
+        labels = labels_on(sorted(planes), 100) + [('gone00', 1, 1, PANO_WIDTH, PANO_HEIGHT)]
+        monkeypatch.setattr(depth_sampling, 'PANOS_PER_TASK', 1)
+
+        serial, pooled = sample_depth(str(tmp_path), labels), sample_depth(str(tmp_path), labels, workers=2)
+
+        for ours, theirs in zip(serial, pooled):
+            np.testing.assert_array_equal(ours, theirs)
+
+
+class TestUnsampled:
+    @pytest.fixture
+    def store(self, tmp_path):
+        write_store(tmp_path, 4)
+        return tmp_path
+
+    def sample(self, store, pano_id, pano_y=7000):
+        return sample_depth(str(store), [('abcdef', 10, 7000, PANO_WIDTH, PANO_HEIGHT),
+                                         (pano_id, 10, pano_y, PANO_WIDTH, PANO_HEIGHT)])
+
+    def assert_unsampled(self, samples):
+        assert np.isnan(samples.depth[1]) and samples.plane_index[1] == -1 and np.isnan(samples.ground_distance[1])
+        assert samples.depth[0] > 0
+
+    def test_a_pano_with_no_artifact(self, store, caplog):
+        self.assert_unsampled(self.sample(store, 'zzzzzz'))
+        assert caplog.text == ''
+
+    def test_an_unreadable_artifact_is_logged(self, store, caplog):
+        path = artifact_path(store, 'ghijkl')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'truncated')
+
+        with caplog.at_level(logging.WARNING):
+            self.assert_unsampled(self.sample(store, 'ghijkl'))
+        assert 'is unreadable' in caplog.text
+
+    def test_a_pre_v2_artifact_is_mirrored_so_it_is_not_sampled(self, store, caplog):
+        path = artifact_path(store, 'ghijkl')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, depth=np.ones((2, 4), dtype=np.float32), heading=0.0, pitch=0.0, roll=0.0)
+
+        with caplog.at_level(logging.WARNING):
+            self.assert_unsampled(self.sample(store, 'ghijkl'))
+        assert 'migrate_depth_artifacts.py' in caplog.text
+
+    @pytest.mark.parametrize('pano_y', [-1, PANO_HEIGHT + 1, float('nan')])
+    def test_a_label_outside_the_pano(self, store, pano_y):
+        self.assert_unsampled(self.sample(store, 'abcdef', pano_y))
+
+    def test_a_v2_artifact_has_depth_but_no_planes(self, store):
+        path = artifact_path(store, 'ghijkl')
+        os.makedirs(os.path.dirname(path))
+        depth = np.arange(8, dtype=np.float32).reshape(2, 4) + 1
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, depth=depth, heading=0.0, pitch=0.0, roll=0.0, format_version=2)
+
+        samples = sample_depth(str(store), [('ghijkl', PANO_WIDTH * 0.6, 10, PANO_WIDTH, PANO_HEIGHT)])
+
+        assert (samples.depth[0], samples.plane_index[0]) == (depth[0, 2], -1)
+        assert np.isnan(samples.ground_distance[0])
+
+
+def test_label_pixels_wraps_columns_and_clamps_the_bottom_row():
+    rows, cols = depth_sampling.label_pixels(np.array([-1.0, 0.0, 99.9, 100.0]), np.array([0.0, 24.9, 25.0, 50.0]),
+                                             100.0, 50.0, 2, 4)
+
+    assert (rows.tolist(), cols.tolist()) == ([0, 0, 1, 1], [0, 0, 3, 0])
@@ -12,18 +12,23 @@ functions directly with plain arguments.
 """
 
 import ast
+import concurrent.futures
+import csv
 import logging
 import logging.handlers
 import os
 import signal
 import subprocess
 import sys
+import threading
 import time
+import types
 
 import requests
 
 import downloaders
 import DownloadRunner
+from downloaders import failure_log
 
 import pytest
 
@@ -803,7 +808,7 @@ class TestSourceOrdering:
         is what #40 is about; the shuffle has its own tests in TestFailedPanosDoNotMonopoliseTheQueue.
         """
         monkeypatch.setenv(downloaders.mapillary.TOKEN_ENV_VAR, 'test-token')
-        monkeypatch.setattr(DownloadRunner.random, 'shuffle', lambda seq: None)
+        monkeypatch.setattr(DownloadRunner.schedule.random, 'shuffle', lambda seq: None)
         storage = tmp_path / 'storage'
         storage.mkdir()
         clock = [0.0]
@@ -840,7 +845,7 @@ class TestFailedPanosDoNotMonopoliseTheQueue:
         storage.mkdir()
         (storage / 'pano_id_log.csv').write_text('pano_id,downloaded\n%s,1\n' % GSV_PANO_IDS[0])
         shuffled = []
-        monkeypatch.setattr(DownloadRunner.random, 'shuffle', lambda seq: shuffled.append(list(seq)))
+        monkeypatch.setattr(DownloadRunner.schedule.random, 'shuffle', lambda seq: shuffled.append(list(seq)))
         monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano([]))
 
         DownloadRunner.download_panorama_images(str(storage), gsv_pano_infos())
@@ -860,9 +865,11 @@ class TestFailedPanosDoNotMonopoliseTheQueue:
         run = [0]
 
         def rotate(seq):
-            seq[:] = seq[run[0] % len(seq):] + seq[:run[0] % len(seq)]
+            # Empty once the healthy panos are ledgered and the failing ones are backing off.
+            if seq:
+                seq[:] = seq[run[0] % len(seq):] + seq[:run[0] % len(seq)]
 
-        monkeypatch.setattr(DownloadRunner.random, 'shuffle', rotate)
+        monkeypatch.setattr(DownloadRunner.schedule.random, 'shuffle', rotate)
         clock = [0.0]
         monkeypatch.setattr(DownloadRunner.time, 'monotonic', lambda: clock[0])
 
@@ -886,6 +893,178 @@ class TestFailedPanosDoNotMonopoliseTheQueue:
             "the failing panos still must not be ledgered - they stay retryable (#41)"
 
 
+class TestRepeatedTransientFailuresBackOff:
+    """A pano that fails transiently run after run sits out a doubling window (downloaders/failure_log.py)
+    instead of costing a full attempt every night - without ever becoming a ledger row (#41)."""
+
+    def run_nightly(self, monkeypatch, storage, nights, download):
+        clock = [1_800_000_000.0]
+        monkeypatch.setattr(failure_log, 'time', types.SimpleNamespace(time=lambda: clock[0]))
+        monkeypatch.setattr(DownloadRunner, 'download_pano', download)
+        results = []
+        for _ in range(nights):
+            results.append(DownloadRunner.download_panorama_images(str(storage), gsv_pano_infos()[:2]))
+            clock[0] += 24 * 60 * 60
+        return results
+
+    def test_a_pano_failing_every_night_is_attempted_ever_more_rarely(self, monkeypatch, tmp_path, capsys):
+        storage = tmp_path / 'storage'
+        storage.mkdir()
+        attempts = []
+
+        def first_always_fails(storage_path, pano_info):
+            attempts.append(pano_info['pano_id'])
+            if pano_info['pano_id'] == GSV_PANO_IDS[0]:
+                raise requests.ConnectionError('blip')
+            return downloaders.DownloadResult.success
+
+        self.run_nightly(monkeypatch, storage, 8, first_always_fails)
+
+        # Nights 1 and 2 (a first failure costs nothing), then 2 and 4 nights on: 1, 2, 4 and 8.
+        assert attempts.count(GSV_PANO_IDS[0]) == 4
+        assert 'backing off after repeated transient failures' in capsys.readouterr().out
+        with open(storage / 'pano_id_log.csv') as f:
+            assert GSV_PANO_IDS[0] not in f.read(), "backing off is never a verdict"
+
+    def test_a_deferred_pano_is_left_out_of_the_counters(self, monkeypatch, tmp_path):
+        storage = tmp_path / 'storage'
+        storage.mkdir()
+        results = self.run_nightly(monkeypatch, storage, 3, failing_download_pano([], requests.ConnectionError()))
+
+        assert results[2] == (0, 0, 0, 0, 0)
+
+    def test_a_success_clears_the_record(self, monkeypatch, tmp_path):
+        storage = tmp_path / 'storage'
+        storage.mkdir()
+        verdicts = iter([requests.ConnectionError(), downloaders.DownloadResult.success])
+
+        def fails_then_succeeds(storage_path, pano_info):
+            verdict = next(verdicts)
+            if isinstance(verdict, Exception):
+                raise verdict
+            return verdict
+
+        self.run_nightly(monkeypatch, storage, 2, lambda storage_path, pano_info: fails_then_succeeds(
+            storage_path, pano_info) if pano_info['pano_id'] == GSV_PANO_IDS[0]
+            else downloaders.DownloadResult.success)
+
+        with open(storage / failure_log.IMAGE_FAILURE_LOG_FILENAME) as f:
+            assert [line.split(',')[:2] for line in f.read().splitlines()[1:]] == \
+                [[GSV_PANO_IDS[0], '1'], [GSV_PANO_IDS[0], '0']]
+
+    def test_deleting_the_sidecar_is_a_force_retry(self, monkeypatch, tmp_path):
+        storage = tmp_path / 'storage'
+        storage.mkdir()
+        attempts = []
+        self.run_nightly(monkeypatch, storage, 2, failing_download_pano(attempts, requests.ConnectionError()))
+        (storage / failure_log.IMAGE_FAILURE_LOG_FILENAME).unlink()
+
+        self.run_nightly(monkeypatch, storage, 1, failing_download_pano(attempts, requests.ConnectionError()))
+
+        assert len(attempts) == 6
+
+    @pytest.mark.parametrize('write_workers', [0, 2])
+    def test_a_failing_write_is_no_strike_against_the_pano(self, monkeypatch, tmp_path, write_workers):
+        """A full store fails every pano alike: backing each off would keep the backlog out for nights after
+        the store was fixed. Inline (atomic_output_path itself) or on the write-behind, the log stays untouched."""
+        storage = tmp_path / 'storage'
+        storage.mkdir()
+
+        def full_store(storage_path, pano_info):
+            def save():
+                with downloaders.common.atomic_output_path(str(storage / pano_info['pano_id'])):
+                    raise OSError(28, 'No space left on device')
+            return downloaders.common.deferred_write(save)
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', full_store)
+        for _ in range(3):
+            result = DownloadRunner.download_panorama_images(str(storage), gsv_pano_infos(),
+                                                             write_workers=write_workers)
+            assert result == (0, 0, 3, 0, 3), "every pano is attempted, and counted as failed, every run"
+
+        assert not (storage / failure_log.IMAGE_FAILURE_LOG_FILENAME).exists()
+
+    def test_a_network_error_is_still_a_strike(self, monkeypatch, tmp_path):
+        """requests' errors are OSErrors too: one raised mid-stream into the .part is the network's, not the
+        store's."""
+        storage = tmp_path / 'storage'
+        storage.mkdir()
+
+        def reset_mid_stream(storage_path, pano_info):
+            with downloaders.common.atomic_output_path(str(storage / pano_info['pano_id'])):
+                raise requests.exceptions.ChunkedEncodingError('connection reset')
+
+        self.run_nightly(monkeypatch, storage, 1, reset_mid_stream)
+
+        with open(storage / failure_log.IMAGE_FAILURE_LOG_FILENAME) as f:
+            assert len(f.read().splitlines()) == 1 + len(GSV_PANO_IDS[:2])
+
+
+class TestTheScheduleFlag:
+    """--schedule picks the order both phases spend their budgets in (downloaders/schedule.py)."""
+
+    def test_the_default_keeps_the_shuffle(self, monkeypatch, tmp_path):
+        seen = {}
+        real = DownloadRunner.download_panorama_images
+
+        def spy(*args, **kwargs):
+            seen.update(kwargs)
+            return real(*args, **kwargs)
+
+        monkeypatch.setattr(DownloadRunner, 'download_panorama_images', spy)
+        call_main(monkeypatch, tmp_path, GSV_CSV_ROWS)
+
+        assert seen['schedule_name'] == 'shuffle'
+
+    def test_priority_reaches_the_image_loop(self, monkeypatch, tmp_path):
+        orders = []
+        monkeypatch.setattr(DownloadRunner.schedule, 'order',
+                            lambda candidates, schedule_name, weight: orders.append(schedule_name))
+        call_main(monkeypatch, tmp_path, GSV_CSV_ROWS, '--schedule', 'priority')
+
+        assert orders == ['priority']
+
+    def test_an_unknown_schedule_fails_at_parse_time(self, tmp_path):
+        with pytest.raises(SystemExit) as exc:
+            DownloadRunner.build_parser().parse_args(['d', str(tmp_path), '--schedule', 'fifo'])
+        assert exc.value.code == 2
+
+    def test_depth_weighs_the_images_the_ledger_has_after_the_image_phase(self, monkeypatch, tmp_path):
+        """Tonight's image download lifts its pano's depth in the same run."""
+        seen = {}
+
+        def fake_depth(storage, panos, order=None, **kwargs):
+            seen['weights'] = {p['pano_id']: order.keywords['weight'](p) for p in panos}
+            seen['schedule'] = order.keywords['schedule']
+            return 0, 0, 0, 0
+
+        monkeypatch.setattr(DownloadRunner.gsv, 'download_depth_maps', fake_depth)
+        monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano([]))
+        (tmp_path / 'pano_id_log.csv').write_text('pano_id,downloaded\n%s,0\n' % GSV_PANO_IDS[1])
+
+        DownloadRunner.run_scraper_and_log_results(str(tmp_path), gsv_pano_infos()[:1], gsv_pano_infos(), False,
+                                                   schedule_name='priority')
+
+        imaged = downloaders.schedule.LABELLED_WEIGHT * downloaders.schedule.IMAGED_WEIGHT
+        assert seen == {'schedule': 'priority', 'weights': {
+            GSV_PANO_IDS[0]: imaged,
+            GSV_PANO_IDS[1]: downloaders.schedule.LABELLED_WEIGHT,  # ledgered 0: no image
+            GSV_PANO_IDS[2]: downloaders.schedule.LABELLED_WEIGHT}}
+
+    def test_the_shuffle_does_not_read_the_image_ledger_for_depth(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(DownloadRunner.gsv, 'download_depth_maps', lambda *args, **kwargs: (0, 0, 0, 0))
+        monkeypatch.setattr(DownloadRunner, 'downloaded_pano_ids', lambda path: pytest.fail('read the ledger'))
+
+        DownloadRunner.run_scraper_and_log_results(str(tmp_path), [], gsv_pano_infos(), False)
+
+    def test_downloaded_ids_skip_damaged_rows_and_a_missing_ledger(self, tmp_path):
+        path = tmp_path / 'pano_id_log.csv'
+        assert DownloadRunner.downloaded_pano_ids(str(path)) == set()
+
+        path.write_text('pano_id,downloaded\naaa,1\nbbb,0\nccc\nddd,1,extra\n')
+        assert DownloadRunner.downloaded_pano_ids(str(path)) == {'aaa'}
+
+
 # --- Numeric pano ids and ledger hygiene (#46, #55) -----------------------------------------------------------
 
 NUMERIC_PANO_IDS = ['123456789012345', '987654321098765']
@@ -1217,3 +1396,627 @@ class TestAServerFetchIsCheckedAndNormalised:
         assert all(isinstance(i, str) for i in ids), ids
         assert ids == ['123456789012345', 'gsvPanoIdAAAAAAAAAAAAA'], \
             'the numeric duplicate, the empty id and the tutorial pano should all be gone'
+
+
+class TestPanoWorkers:
+    """--pano-workers: up to N panos in flight at once, with everything run-wide (ledger, counters, the
+    --max-runtime check) still on the main thread. The two-arg download_pano seam is unchanged, so every
+    fake above doubles as a worker."""
+
+    def test_n_workers_really_overlap(self, monkeypatch, tmp_path):
+        """A barrier of 3 only releases when three downloads are in flight together; a serial loop would
+        hang on it until the timeout and fail every pano."""
+        barrier = threading.Barrier(3, timeout=10)
+
+        def rendezvous(storage_path, pano_info):
+            barrier.wait()
+            return downloaders.DownloadResult.success
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', rendezvous)
+
+        result = DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), pano_workers=3)
+
+        assert result == (3, 0, 0, 0, 3)
+        rows = (tmp_path / 'pano_id_log.csv').read_text().strip().splitlines()
+        assert rows[0] == 'pano_id,downloaded'
+        assert sorted(rows[1:]) == sorted('%s,1' % p for p in GSV_PANO_IDS), "one row per pano, no torn lines"
+
+    def test_the_ledger_is_appended_only_from_the_main_thread(self, monkeypatch, tmp_path):
+        writers = set()
+        real_writer = csv.writer
+
+        def spying_writer(*args, **kwargs):
+            inner = real_writer(*args, **kwargs)
+
+            class _Spy:
+                def writerow(self, row):
+                    writers.add(threading.current_thread().name)
+                    return inner.writerow(row)
+            return _Spy()
+
+        monkeypatch.setattr(DownloadRunner.csv, 'writer', spying_writer)
+        monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano([]))
+
+        DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), pano_workers=3)
+
+        assert writers == {threading.main_thread().name}
+
+    def test_transient_and_permanent_verdicts_keep_their_ledger_semantics(self, monkeypatch, tmp_path):
+        """#41 under workers: an exception raised on a worker is still transient (counted, not ledgered)."""
+        verdicts = {GSV_PANO_IDS[0]: downloaders.DownloadResult.success,
+                    GSV_PANO_IDS[1]: downloaders.DownloadResult.failure}
+
+        def mixed(storage_path, pano_info):
+            if pano_info['pano_id'] in verdicts:
+                return verdicts[pano_info['pano_id']]
+            raise requests.ConnectionError('mid-download blip')
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', mixed)
+
+        result = DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), pano_workers=3)
+
+        assert result == (1, 0, 2, 0, 3)
+        rows = (tmp_path / 'pano_id_log.csv').read_text().strip().splitlines()[1:]
+        assert sorted(rows) == sorted(['%s,1' % GSV_PANO_IDS[0], '%s,0' % GSV_PANO_IDS[1]])
+
+    def test_a_worker_killed_by_a_non_exception_stops_the_run(self, monkeypatch, tmp_path):
+        """SystemExit on a worker (the SIGTERM translation, or sys.exit in a bug) must end the phase as it
+        would the serial loop - not be counted as one failed pano."""
+        def stop(storage_path, pano_info):
+            raise SystemExit(143)
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', stop)
+
+        with pytest.raises(SystemExit):
+            DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), pano_workers=2)
+
+    def test_the_memory_cap_limits_gsv_panos_in_flight(self, monkeypatch, tmp_path):
+        """Three full-size panos (384 MB decoded each) under an 800 MB cap: never more than two at once,
+        however many workers there are."""
+        lock = threading.Lock()
+        live, peak = [0], [0]
+
+        def tracking(storage_path, pano_info):
+            with lock:
+                live[0] += 1
+                peak[0] = max(peak[0], live[0])
+            time.sleep(0.05)
+            with lock:
+                live[0] -= 1
+            return downloaders.DownloadResult.success
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', tracking)
+        panos = [dict(p, width=16384, height=8192) for p in gsv_pano_infos()]
+
+        result = DownloadRunner.download_panorama_images(str(tmp_path), panos, pano_workers=3,
+                                                         pano_memory_mb=800)
+
+        assert result == (3, 0, 0, 0, 3)
+        assert peak[0] == 2
+
+    def test_a_pano_bigger_than_the_cap_still_runs_alone(self, monkeypatch, tmp_path):
+        calls = []
+        monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano(calls))
+        panos = [dict(p, width=16384, height=8192) for p in gsv_pano_infos()]
+
+        result = DownloadRunner.download_panorama_images(str(tmp_path), panos, pano_workers=2, pano_memory_mb=1)
+
+        assert sorted(calls) == sorted(GSV_PANO_IDS), "an oversized pano must not wedge the loop"
+        assert result == (3, 0, 0, 0, 3)
+
+    def test_mapillary_panos_weigh_nothing_against_the_cap(self):
+        assert DownloadRunner._canvas_bytes({'pano_id': '1', 'source': 'mapillary', 'width': 5760,
+                                             'height': 2880}) == 0
+        assert DownloadRunner._canvas_bytes({'pano_id': 'a', 'source': 'gsv', 'width': 16384,
+                                             'height': 8192}) == 384 * 1024 * 1024
+        assert DownloadRunner._canvas_bytes({'pano_id': 'a', 'source': 'gsv', 'width': None}) == 0
+
+    def test_an_exhausted_budget_starts_nothing_under_workers(self, monkeypatch, tmp_path):
+        calls = []
+        monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano(calls))
+
+        result = DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(),
+                                                         run_start_monotonic=time.monotonic() - 600,
+                                                         max_runtime_minutes=5.0, pano_workers=3)
+
+        assert calls == []
+        assert result == (0, 0, 0, 0, 0)
+
+    def test_a_duplicate_id_is_not_started_while_its_twin_is_in_flight(self, monkeypatch, tmp_path):
+        calls = []
+        monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano(calls))
+
+        DownloadRunner.download_panorama_images(str(tmp_path), [{'pano_id': 'pano-twice', 'source': 'gsv'}] * 2,
+                                                pano_workers=2)
+
+        assert calls == ['pano-twice']
+
+    def test_the_flags_reach_the_image_loop(self, monkeypatch, tmp_path):
+        seen = {}
+        real = DownloadRunner.download_panorama_images
+
+        def spy(*args, **kwargs):
+            seen.update(kwargs)
+            return real(*args, **kwargs)
+
+        monkeypatch.setattr(DownloadRunner, 'download_panorama_images', spy)
+        call_main(monkeypatch, tmp_path, GSV_CSV_ROWS, '--pano-workers', '3', '--pano-memory-mb', '2048')
+
+        assert seen['pano_workers'] == 3
+        assert seen['pano_memory_mb'] == 2048.0
+
+    @pytest.mark.parametrize('argv', [['--pano-workers', '0'], ['--pano-workers', 'two'],
+                                      ['--pano-memory-mb', '0'], ['--pano-memory-mb', 'nan'],
+                                      ['--pano-memory-mb', 'lots'], ['--tile-cache-mb', '-1'],
+                                      ['--tile-cache-mb', 'inf'], ['--tile-cache-mb', 'lots'],
+                                      ['--write-workers', '-1'], ['--write-workers', 'x']])
+    def test_bad_values_fail_at_parse_time(self, argv):
+        with pytest.raises(SystemExit) as excinfo:
+            DownloadRunner.build_parser().parse_args(['host', 'storage', *argv])
+        assert excinfo.value.code == 2
+
+
+def test_the_image_phase_runs_inside_one_tile_session(monkeypatch, tmp_path):
+    """Every pano of the phase sees the same gsv.TileSession, and it is gone once the phase returns."""
+    sessions = []
+
+    def fake(storage_path, pano_info):
+        sessions.append(downloaders.gsv._tile_session)
+        return downloaders.DownloadResult.success
+
+    monkeypatch.setattr(DownloadRunner, 'download_pano', fake)
+
+    DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), pano_workers=2)
+
+    assert len(sessions) == 3 and sessions[0] is not None
+    assert all(s is sessions[0] for s in sessions)
+    assert downloaders.gsv._tile_session is None
+
+
+class TestTheRunDeadline:
+    """--max-runtime reaches into the panos in flight (common.deadline): one still downloading when the budget
+    ends is cut off, and the phase treats it like a pano it never started."""
+
+    def test_every_pano_runs_under_the_budgets_deadline(self, monkeypatch, tmp_path):
+        deadlines = []
+
+        def fake(storage_path, pano_info):
+            deadlines.append(downloaders.common._deadline)
+            return downloaders.DownloadResult.success
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', fake)
+        started = time.monotonic()
+
+        DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), run_start_monotonic=started,
+                                                max_runtime_minutes=5.0, pano_workers=2)
+
+        assert deadlines == [started + 300.0] * 3
+        assert downloaders.common._deadline is None
+
+    def test_no_budget_no_deadline(self, monkeypatch, tmp_path):
+        deadlines = []
+        monkeypatch.setattr(DownloadRunner, 'download_pano',
+                            lambda storage_path, pano_info: deadlines.append(downloaders.common._deadline))
+
+        DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos())
+
+        assert deadlines == [None] * 3
+
+    def test_a_pano_cut_off_is_neither_counted_ledgered_nor_backed_off(self, monkeypatch, tmp_path):
+        storage = tmp_path / 'storage'
+        storage.mkdir()
+        attempts = []
+        monkeypatch.setattr(DownloadRunner, 'download_pano',
+                            failing_download_pano(attempts, downloaders.DeadlineExceeded('tiles in flight')))
+
+        result = DownloadRunner.download_panorama_images(str(storage), gsv_pano_infos()[:1],
+                                                         run_start_monotonic=time.monotonic(),
+                                                         max_runtime_minutes=5.0)
+
+        assert result == (0, 0, 0, 0, 0)
+        with open(storage / 'pano_id_log.csv') as f:
+            assert f.read().strip() == 'pano_id,downloaded'
+        assert not (storage / failure_log.IMAGE_FAILURE_LOG_FILENAME).exists()
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano(attempts))
+        DownloadRunner.download_panorama_images(str(storage), gsv_pano_infos()[:1])
+
+        assert attempts == [GSV_PANO_IDS[0]] * 2, "the next run must attempt it again"
+
+    def test_the_log_row_is_still_written(self, monkeypatch, tmp_path):
+        csv_path = tmp_path / 'panos.csv'
+        csv_path.write_text(CSV_HEADER + GSV_CSV_ROWS)
+        storage = tmp_path / 'storage'
+        monkeypatch.setattr(DownloadRunner, 'download_pano',
+                            failing_download_pano([], downloaders.DeadlineExceeded('tiles in flight')))
+        monkeypatch.chdir(tmp_path)
+
+        DownloadRunner.main(['sidewalk-test.invalid', str(storage), '-c', str(csv_path), '--skip-depth',
+                             '--max-runtime', '5'])
+
+        fields = last_log_fields(storage)
+        assert len(fields) == DownloadRunner.LOG_CSV_FIELD_COUNT
+        assert fields[6:11] == ['0', '0', '0', '0', '0']
+
+
+class TestTheTileCacheFlag:
+    def test_off_by_default(self, monkeypatch, tmp_path):
+        caches = []
+        monkeypatch.setattr(DownloadRunner, 'download_pano',
+                            lambda storage_path, pano_info: caches.append(downloaders.gsv._tile_session.cache))
+
+        DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos())
+
+        assert caches == [None] * 3
+        assert not (tmp_path / 'tile_cache').exists()
+
+    def test_every_pano_of_the_phase_sees_the_one_cache(self, monkeypatch, tmp_path):
+        caches = []
+
+        def fake(storage_path, pano_info):
+            caches.append(downloaders.gsv._tile_session.cache)
+            return downloaders.DownloadResult.success
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', fake)
+
+        DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), pano_workers=2, tile_cache_mb=1.5)
+
+        assert len(caches) == 3 and all(c is caches[0] for c in caches)
+        assert caches[0].root == str(tmp_path / 'tile_cache')
+        assert caches[0].max_bytes == 1536 * 1024
+
+    def test_a_ledgered_panos_tiles_are_dropped_before_the_phase_starts(self, monkeypatch, tmp_path):
+        """Ledgered by this store's last run, or by another user's run, since its tiles were spilled."""
+        (tmp_path / 'pano_id_log.csv').write_text('pano_id,downloaded\n%s,1\n' % GSV_PANO_IDS[0])
+        for pano_id in GSV_PANO_IDS[:2]:
+            (tmp_path / 'tile_cache' / pano_id).mkdir(parents=True)
+            (tmp_path / 'tile_cache' / pano_id / '5_1_0.jpg').write_bytes(b'tile')
+        listings = []
+
+        def fake(storage_path, pano_info):
+            listings.append(sorted(os.listdir(tmp_path / 'tile_cache')))
+            return downloaders.DownloadResult.success
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', fake)
+
+        DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), tile_cache_mb=1)
+
+        assert listings[0] == [GSV_PANO_IDS[1]]
+
+    def test_the_flag_reaches_the_image_loop(self, monkeypatch, tmp_path):
+        seen = {}
+        real = DownloadRunner.download_panorama_images
+
+        def spy(*args, **kwargs):
+            seen.update(kwargs)
+            return real(*args, **kwargs)
+
+        monkeypatch.setattr(DownloadRunner, 'download_panorama_images', spy)
+        call_main(monkeypatch, tmp_path, GSV_CSV_ROWS, '--tile-cache-mb', '256')
+
+        assert seen['tile_cache_mb'] == 256.0
+
+
+class TestWriteBehind:
+    """--write-workers: a GSV download that hands back a Future of its verdict (common.deferred_write) frees
+    its worker at once, but is counted and ledgered only when that Future resolves - after the rename."""
+
+    @staticmethod
+    def deferring_download_pano(writes):
+        """Each pano's verdict is a Future the test resolves by hand, standing in for a write still running."""
+        def fake(storage_path, pano_info):
+            future = concurrent.futures.Future()
+            writes[pano_info['pano_id']] = future
+            return future
+        return fake
+
+    def test_the_next_pano_starts_while_a_write_is_still_running(self, monkeypatch, tmp_path):
+        writes = {}
+        resolver_saw = []
+
+        def resolve_when_all_started():
+            # One worker: the third pano can only start if the first two's writes did not hold it.
+            deadline = time.monotonic() + 10
+            while len(writes) < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            resolver_saw.append(sorted(writes))
+            ledger = tmp_path / 'pano_id_log.csv'
+            resolver_saw.append(ledger.read_text() if ledger.exists() else '')
+            for future in writes.values():
+                future.set_result(downloaders.DownloadResult.success)
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', self.deferring_download_pano(writes))
+        resolver = threading.Thread(target=resolve_when_all_started)
+        resolver.start()
+
+        result = DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), pano_workers=1)
+        resolver.join()
+
+        assert resolver_saw[0] == sorted(GSV_PANO_IDS)
+        assert GSV_PANO_IDS[0] not in resolver_saw[1], "ledgered before its write landed"
+        assert result == (3, 0, 0, 0, 3)
+        rows = (tmp_path / 'pano_id_log.csv').read_text().strip().splitlines()[1:]
+        assert sorted(rows) == sorted('%s,1' % p for p in GSV_PANO_IDS)
+
+    def test_a_failed_write_is_a_transient_failure(self, monkeypatch, tmp_path):
+        def fake(storage_path, pano_info):
+            future = concurrent.futures.Future()
+            if pano_info['pano_id'] == GSV_PANO_IDS[0]:
+                future.set_exception(OSError(28, 'No space left on device'))
+            else:
+                future.set_result(downloaders.DownloadResult.fallback_success)
+            return future
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', fake)
+
+        result = DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), pano_workers=2)
+
+        assert result == (0, 2, 1, 0, 3)
+        rows = (tmp_path / 'pano_id_log.csv').read_text().strip().splitlines()[1:]
+        assert sorted(rows) == sorted('%s,1' % p for p in GSV_PANO_IDS[1:])
+
+    def test_a_panos_canvas_stays_budgeted_until_its_write_lands(self, monkeypatch, tmp_path):
+        """Two 384 MB panos under a 500 MB cap: the second may not start while the first's canvas is still
+        waiting on the store, however free the worker is."""
+        writes = {}
+        started_before_resolve = []
+
+        def resolve_later():
+            deadline = time.monotonic() + 10
+            while not writes and time.monotonic() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+            started_before_resolve.append(len(writes))
+            first, = writes.values()
+            first.set_result(downloaders.DownloadResult.success)
+            while len(writes) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            for future in writes.values():
+                if not future.done():
+                    future.set_result(downloaders.DownloadResult.success)
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', self.deferring_download_pano(writes))
+        resolver = threading.Thread(target=resolve_later)
+        resolver.start()
+        panos = [dict(p, width=16384, height=8192) for p in gsv_pano_infos()[:2]]
+
+        result = DownloadRunner.download_panorama_images(str(tmp_path), panos, pano_workers=2,
+                                                         pano_memory_mb=500)
+        resolver.join()
+
+        assert started_before_resolve == [1]
+        assert result == (2, 0, 0, 0, 2)
+
+    def test_the_phase_installs_a_writer_of_the_requested_size(self, monkeypatch, tmp_path):
+        writers = []
+
+        def fake(storage_path, pano_info):
+            writers.append(downloaders.common._write_behind)
+            return downloaders.DownloadResult.success
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', fake)
+
+        DownloadRunner.download_panorama_images(str(tmp_path), gsv_pano_infos(), write_workers=3)
+        assert writers[0] is not None and all(w is writers[0] for w in writers)
+        assert writers[0]._pool._max_workers == 3
+        assert downloaders.common._write_behind is None
+
+        writers.clear()
+        (tmp_path / 'inline').mkdir()
+        DownloadRunner.download_panorama_images(str(tmp_path / 'inline'), gsv_pano_infos(), write_workers=0)
+        assert writers == [None] * 3
+
+    def test_the_flag_reaches_the_image_loop(self, monkeypatch, tmp_path):
+        seen = {}
+        real = DownloadRunner.download_panorama_images
+
+        def spy(*args, **kwargs):
+            seen.update(kwargs)
+            return real(*args, **kwargs)
+
+        monkeypatch.setattr(DownloadRunner, 'download_panorama_images', spy)
+        call_main(monkeypatch, tmp_path, GSV_CSV_ROWS, '--write-workers', '0')
+
+        assert seen['write_workers'] == 0
+
+
+class TestTheDepthWorkersFlag:
+    """--depth-workers pipelines the depth phase (gsv.download_depth_maps' depth_workers)."""
+
+    def test_the_flag_reaches_the_depth_phase(self, monkeypatch, tmp_path):
+        seen = {}
+
+        def depth(*args, **kwargs):
+            seen.update(kwargs)
+            return 0, 0, 0, 0
+
+        monkeypatch.setattr(DownloadRunner.gsv, 'download_depth_maps', depth)
+        monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano([]))
+        csv_path = tmp_path / 'panos.csv'
+        csv_path.write_text(CSV_HEADER + GSV_CSV_ROWS)
+        monkeypatch.chdir(tmp_path)
+
+        DownloadRunner.main(['sidewalk-test.invalid', str(tmp_path / 'storage'), '-c', str(csv_path),
+                             '--depth-workers', '4'])
+
+        assert seen['depth_workers'] == 4
+
+    def test_one_is_the_default(self):
+        assert DownloadRunner.build_parser().parse_args(['host', 'storage']).depth_workers == 1
+
+    @pytest.mark.parametrize('value', ['0', '-2', 'many'])
+    def test_bad_values_fail_at_parse_time(self, value):
+        with pytest.raises(SystemExit) as excinfo:
+            DownloadRunner.build_parser().parse_args(['host', 'storage', '--depth-workers', value])
+        assert excinfo.value.code == 2
+
+
+class TestTheDepthCodecFlag:
+    """--depth-codec picks how the depth phase compresses artifacts (gsv.download_depth_maps' depth_codec)."""
+
+    def test_the_flag_reaches_the_depth_phase(self, monkeypatch, tmp_path):
+        seen = {}
+
+        def depth(*args, **kwargs):
+            seen.update(kwargs)
+            return 0, 0, 0, 0
+
+        monkeypatch.setattr(DownloadRunner.gsv, 'download_depth_maps', depth)
+        monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano([]))
+        csv_path = tmp_path / 'panos.csv'
+        csv_path.write_text(CSV_HEADER + GSV_CSV_ROWS)
+        monkeypatch.chdir(tmp_path)
+
+        DownloadRunner.main(['sidewalk-test.invalid', str(tmp_path / 'storage'), '-c', str(csv_path),
+                             '--depth-codec', 'packed:1'])
+
+        assert seen['depth_codec'] == DownloadRunner.gsv.DepthCodec('packed', 1)
+
+    def test_deflate_is_the_default(self):
+        assert DownloadRunner.build_parser().parse_args(['host', 'storage']).depth_codec == \
+            DownloadRunner.gsv.DEFAULT_DEPTH_CODEC
+
+    @pytest.mark.parametrize('value', ['zstd', 'deflate:10', 'store:1'])
+    def test_bad_values_fail_at_parse_time(self, value, capsys):
+        with pytest.raises(SystemExit) as excinfo:
+            DownloadRunner.build_parser().parse_args(['host', 'storage', '--depth-codec', value])
+        assert excinfo.value.code == 2
+        assert 'depth codec' in capsys.readouterr().err
+
+
+class TestTheLedgerIndexFlag:
+    """--ledger-index reads the resume ledgers through their snapshots (downloaders/ledger_index.py)."""
+
+    def test_a_second_run_leaves_a_snapshot_beside_the_image_ledger(self, monkeypatch, tmp_path):
+        call_main(monkeypatch, tmp_path, GSV_CSV_ROWS, '--ledger-index')
+        storage, calls = call_main(monkeypatch, tmp_path, GSV_CSV_ROWS, '--ledger-index')
+
+        assert calls == [], "the snapshot's answer still skips every pano the ledger resolved"
+        assert (storage / ('pano_id_log.csv' + downloaders.ledger_index.INDEX_SUFFIX)).is_file()
+        assert not downloaders.ledger_index._enabled, "switched off again once the run is over"
+
+    def test_off_by_default(self, monkeypatch, tmp_path):
+        call_main(monkeypatch, tmp_path, GSV_CSV_ROWS)
+        storage, _ = call_main(monkeypatch, tmp_path, GSV_CSV_ROWS)
+
+        assert not list(storage.glob('*' + downloaders.ledger_index.INDEX_SUFFIX))
+
+
+def test_run_checks_the_store_through_a_catalog(monkeypatch, tmp_path):
+    """Both phases' "already on the store?" checks go through one store_catalog for the run
+    (downloaders/store_catalog.py), and it is gone once the run is over."""
+    seen = []
+
+    def download(storage_path, pano_info):
+        seen.append(downloaders.store_catalog._catalog)
+        return downloaders.DownloadResult.success
+
+    monkeypatch.setattr(DownloadRunner, 'download_pano', download)
+    csv_path = tmp_path / 'panos.csv'
+    csv_path.write_text(CSV_HEADER + GSV_CSV_ROWS)
+    DownloadRunner.run('sidewalk-test.invalid', str(tmp_path), pano_metadata_csv=str(csv_path), skip_depth=True)
+
+    assert len(set(map(id, seen))) == 1 and seen[0] is not None
+    assert downloaders.store_catalog._catalog is None
+
+
+class TestConcurrentPhases:
+    """--concurrent-phases runs the depth phase on its own thread beside the image phase, both to the end of
+    --max-runtime, and still writes one row with each phase's own counts."""
+
+    @staticmethod
+    def scrape(tmp_path, **kwargs):
+        DownloadRunner.run_scraper_and_log_results(str(tmp_path), gsv_pano_infos(), gsv_pano_infos(), False,
+                                                   concurrent_phases=True, **kwargs)
+
+    def test_the_phases_overlap(self, monkeypatch, tmp_path):
+        """Each phase waits for the other to have started: only possible side by side."""
+        image_started, depth_started = threading.Event(), threading.Event()
+
+        def download(storage_path, pano_info):
+            image_started.set()
+            assert depth_started.wait(10), "the depth phase never started while images were downloading"
+            return downloaders.DownloadResult.success
+
+        def depth(storage, panos, **kwargs):
+            depth_started.set()
+            assert image_started.wait(10)
+            return 3, 0, 0, 3
+
+        monkeypatch.setattr(DownloadRunner, 'download_pano', download)
+        monkeypatch.setattr(DownloadRunner.gsv, 'download_depth_maps', depth)
+        self.scrape(tmp_path)
+
+        fields = last_log_fields(tmp_path)
+        assert len(fields) == 18
+        assert fields[6:11] == ['3', '0', '0', '0', '3']
+        assert fields[12:16] == ['3', '0', '0', '3']
+
+    def test_both_phases_get_the_whole_window(self, monkeypatch, tmp_path, capsys):
+        budgets = {}
+
+        def images(storage, panos, max_runtime_minutes=None, **kwargs):
+            budgets['image'] = max_runtime_minutes
+            return 0, 0, 0, 0, 0
+
+        def depth(storage, panos, max_runtime_minutes=None, stop=None, **kwargs):
+            budgets['depth'] = max_runtime_minutes
+            return 0, 0, 0, 0
+
+        monkeypatch.setattr(DownloadRunner, 'download_panorama_images', images)
+        monkeypatch.setattr(DownloadRunner.gsv, 'download_depth_maps', depth)
+        monkeypatch.setattr(DownloadRunner.gsv, 'count_unresolved_depth',
+                            lambda *args: pytest.fail('no tail to reserve, so no backlog to count'))
+        self.scrape(tmp_path, max_runtime_minutes=120, min_depth_runtime=45)
+
+        assert budgets == {'image': 120, 'depth': 120}
+        assert 'run side by side' in capsys.readouterr().out
+
+    def test_a_run_ending_in_the_image_phase_stops_the_depth_phase(self, monkeypatch, tmp_path):
+        depth_stopped = []
+
+        def depth(storage, panos, stop=None, **kwargs):
+            depth_stopped.append(stop.wait(10))
+            return 0, 0, 0, 0
+
+        def images(*args, **kwargs):
+            raise SystemExit(143)  # the SIGTERM translation
+
+        monkeypatch.setattr(DownloadRunner.gsv, 'download_depth_maps', depth)
+        monkeypatch.setattr(DownloadRunner, 'download_panorama_images', images)
+        with pytest.raises(SystemExit):
+            self.scrape(tmp_path)
+
+        assert depth_stopped == [True]
+        fields = last_log_fields(tmp_path)
+        assert len(fields) == 18 and fields[6:] == [''] * 12
+
+    def test_a_depth_crash_keeps_the_image_counts(self, monkeypatch, tmp_path):
+        def depth(*args, **kwargs):
+            raise RuntimeError('depth bug')
+
+        monkeypatch.setattr(DownloadRunner.gsv, 'download_depth_maps', depth)
+        monkeypatch.setattr(DownloadRunner, 'download_panorama_images', lambda *args, **kwargs: (2, 1, 0, 0, 3))
+        with pytest.raises(RuntimeError, match='depth bug'):
+            self.scrape(tmp_path)
+
+        fields = last_log_fields(tmp_path)
+        assert fields[6:11] == ['2', '1', '0', '0', '3']
+        assert fields[12:] == [''] * 6
+
+    def test_skip_depth_runs_the_image_phase_alone(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(DownloadRunner.gsv, 'download_depth_maps',
+                            lambda *args, **kwargs: pytest.fail('depth is skipped'))
+        monkeypatch.setattr(DownloadRunner, 'download_pano', recording_download_pano([]))
+        DownloadRunner.run_scraper_and_log_results(str(tmp_path), gsv_pano_infos(), gsv_pano_infos(), True,
+                                                   concurrent_phases=True)
+
+        assert last_log_fields(tmp_path)[12:17] == ['0'] * 5
+
+    def test_the_flag_reaches_the_scrape(self, monkeypatch, tmp_path):
+        seen = {}
+        monkeypatch.setattr(DownloadRunner, 'run_scraper_and_log_results',
+                            lambda *args, **kwargs: seen.update(kwargs))
+        call_main(monkeypatch, tmp_path, GSV_CSV_ROWS, '--concurrent-phases')
+
+        assert seen['concurrent_phases'] is True
@@ -0,0 +1,196 @@
+"""Tests for downloaders/failure_log.py: the sidecar that backs off panos failing transiently run after run.
+
+The schedule (a first failure costs nothing, then the wait doubles up to a cap), the file's last-row-wins
+round trip across runs, and its promises to the phases: a resolved pano is forgotten, and an unusable sidecar
+degrades to attempting everything - never to an exception.
+"""
+
+import csv
+
+import pytest
+
+from downloaders import failure_log
+from downloaders.failure_log import TransientFailureLog
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / failure_log.IMAGE_FAILURE_LOG_FILENAME)
+
+
+def reopen(path, clock, keep=None):
+    """The next run's view of the sidecar."""
+    return TransientFailureLog(path, clock=clock).load(keep=keep)
+
+
+def rows(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+class TestTheSchedule:
+    def test_a_first_failure_is_retried_next_run_as_before(self):
+        assert failure_log.backoff_seconds(1) == 0.0
+
+    def test_each_further_failure_doubles_the_wait(self):
+        slack = failure_log.BACKOFF_SLACK_SECONDS
+        assert [failure_log.backoff_seconds(n) + slack for n in (2, 3, 4, 5)] == [2 * DAY, 4 * DAY, 8 * DAY, 16 * DAY]
+
+    def test_the_wait_is_capped(self):
+        assert failure_log.backoff_seconds(40) == failure_log.BACKOFF_MAX_SECONDS - failure_log.BACKOFF_SLACK_SECONDS
+
+    def test_two_nights_still_means_two_runs_on_when_cron_starts_early(self, path, clock):
+        with TransientFailureLog(path, clock=clock) as log:
+            log.failed('panoA', 'ConnectionError')
+            log.failed('panoA', 'ConnectionError')
+
+        clock.now += DAY
+        assert reopen(path, clock).deferred('panoA')
+        clock.now += DAY - 10 * 60
+        assert not reopen(path, clock).deferred('panoA')
+
+
+class TestAcrossRuns:
+    def test_a_failing_pano_sits_out_its_window_then_comes_back(self, path, clock):
+        for _ in range(3):
+            with reopen(path, clock) as log:
+                log.failed('panoA', 'ConnectionError')
+
+        log = reopen(path, clock)
+        assert log.deferred('panoA')
+        clock.now += failure_log.backoff_seconds(3) + 1
+        assert not log.deferred('panoA')
+
+    def test_the_file_says_what_failed_and_until_when(self, path, clock):
+        with TransientFailureLog(path, clock=clock) as log:
+            log.failed('panoA', 'ConnectionError')
+
+        assert rows(path) == [['pano_id', 'attempts', 'last_failure', 'next_eligible'],
+                              ['panoA', '1', 'ConnectionError', '2027-01-15T08:00:00Z']]
+
+    def test_attempts_accumulate_over_runs(self, path, clock):
+        for _ in range(4):
+            with reopen(path, clock) as log:
+                log.failed('panoA', 'TimeoutError')
+            clock.now += failure_log.BACKOFF_MAX_SECONDS
+
+        assert rows(path)[-1][:3] == ['panoA', '4', 'TimeoutError']
+
+    def test_a_resolved_pano_is_forgotten(self, path, clock):
+        with TransientFailureLog(path, clock=clock) as log:
+            log.failed('panoA', 'ConnectionError')
+            log.failed('panoA', 'ConnectionError')
+            log.resolved('panoA')
+            log.resolved('panoB')  # never failing: nothing to write
+
+        assert not reopen(path, clock).deferred('panoA')
+        assert [row[0] for row in rows(path)[1:]] == ['panoA'] * 3
+
+    def test_a_pano_the_ledger_resolved_since_is_dropped_on_load(self, path, clock):
+        with TransientFailureLog(path, clock=clock) as log:
+            log.failed('panoA', 'ConnectionError')
+            log.failed('panoA', 'ConnectionError')
+
+        assert not reopen(path, clock, keep=lambda pano_id: pano_id != 'panoA').deferred('panoA')
+
+    def test_partition_keeps_the_order_of_both_halves(self, path, clock):
+        with TransientFailureLog(path, clock=clock) as log:
+            for pano_id in ('panoB', 'panoD'):
+                log.failed(pano_id, 'ConnectionError')
+                log.failed(pano_id, 'ConnectionError')
+            eligible, deferred = log.partition([{'pano_id': p} for p in ('panoA', 'panoB', 'panoC', 'panoD')])
+
+        assert [p['pano_id'] for p in eligible] == ['panoA', 'panoC']
+        assert [p['pano_id'] for p in deferred] == ['panoB', 'panoD']
+
+    def test_damaged_rows_are_skipped(self, path, clock):
+        with TransientFailureLog(path, clock=clock) as log:
+            log.failed('panoA', 'ConnectionError')
+            log.failed('panoA', 'ConnectionError')
+        with open(path, 'a') as f:
+            f.write('panoB,2,Connection\npanoC,x,Error,2027-01-15T08:00:00Z\n')
+
+        log = reopen(path, clock)
+        assert log.deferred('panoA')
+        assert not log.deferred('panoB') and not log.deferred('panoC')
+
+
+class TestCompaction:
+    def test_outgrown_rows_are_rewritten_away(self, path, clock, monkeypatch):
+        monkeypatch.setattr(failure_log, '_COMPACT_AFTER_DEAD_ROWS', 3)
+        with TransientFailureLog(path, clock=clock) as log:
+            for pano_id in ('panoA', 'panoB', 'panoC'):
+                log.failed(pano_id, 'ConnectionError')
+                log.resolved(pano_id)
+            log.failed('panoD', 'ConnectionError')
+            log.failed('panoD', 'ConnectionError')
+
+        log = reopen(path, clock)
+
+        assert rows(path)[1:] == [['panoD', '2', 'ConnectionError', '2027-01-17T06:00:00Z']]
+        assert log.deferred('panoD')
+
+    def test_a_file_within_the_margin_is_left_alone(self, path, clock):
+        with TransientFailureLog(path, clock=clock) as log:
+            log.failed('panoA', 'ConnectionError')
+            log.resolved('panoA')
+
+        reopen(path, clock)
+
+        assert len(rows(path)) == 3
+
+
+class TestBestEffort:
+    def test_an_unreadable_sidecar_starts_empty_and_says_so_once(self, tmp_path, clock, caplog):
+        log = reopen(str(tmp_path), clock)  # a directory: open() raises IsADirectoryError
+
+        log.failed('panoA', 'ConnectionError')
+        log.failed('panoB', 'ConnectionError')
+
+        assert not log.deferred('panoA')
+        assert caplog.text.count('is unreadable') == 1
+
+    def test_an_unwritable_sidecar_is_logged_once_and_ignored(self, tmp_path, clock, caplog):
+        log = TransientFailureLog(str(tmp_path / 'missing-dir' / 'retry.csv'), clock=clock)
+
+        log.failed('panoA', 'ConnectionError')
+        log.failed('panoA', 'ConnectionError')
+        log.close()
+
+        assert caplog.text.count('is unwritable') == 1
+        assert log.deferred('panoA'), "this run's memory still holds"
+
+    def test_a_compaction_that_cannot_land_leaves_the_old_file(self, path, clock, monkeypatch, caplog):
+        monkeypatch.setattr(failure_log, '_COMPACT_AFTER_DEAD_ROWS', 1)
+        with TransientFailureLog(path, clock=clock) as log:
+            log.failed('panoA', 'ConnectionError')
+            log.resolved('panoA')
+        before = rows(path)
+
+        def no_rename(*args):
+            raise OSError(28, 'No space left on device')
+
+        monkeypatch.setattr(failure_log.os, 'replace', no_rename)
+        reopen(path, clock)
+
+        assert rows(path) == before
+        assert 'is unwritable' in caplog.text
+
+    def test_a_failed_chmod_does_not_lose_the_row(self, path, clock, monkeypatch):
+        def not_yours(*args):
+            raise PermissionError(1, 'Operation not permitted')
+
+        monkeypatch.setattr(failure_log.os, 'chmod', not_yours)
+        with TransientFailureLog(path, clock=clock) as log:
+            log.failed('panoA', 'ConnectionError')
+
+        assert rows(path)[1][0] == 'panoA'
+
+    @pytest.mark.skipif(failure_log.os.name != 'posix', reason='file modes are posix-only')
+    def test_the_sidecar_is_group_writable_like_the_ledgers(self, path, clock):
+        with TransientFailureLog(path, clock=clock) as log:
+            log.failed('panoA', 'ConnectionError')
+
+        assert failure_log.os.stat(path).st_mode & 0o777 == 0o664
@@ -1,20 +1,25 @@
 """Tests for the GSV tile stitcher: grid arithmetic (#44), failed-tile handling (#45), stitch geometry,
 and the atomic image save. Network-free throughout - tile downloads and the zoom probes are stubbed at the
-gsv module boundary."""
+gsv module boundary, or (for the run-scoped tile session) answered by a loopback server."""
 
 import asyncio
 import logging
 import os
+import threading
+import time
 from io import BytesIO
 from types import SimpleNamespace
 
 import aiohttp
+import backoff
+import backoff._async
 import numpy as np
 import pytest
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 
+from conftest import FakeClock
 from downloaders import gsv
-from downloaders.common import DownloadResult
+from downloaders.common import DeadlineExceeded, DownloadResult, deadline
 from test_gsv_tile_contract import MIXED_BLOCK, fixture_bytes, fixture_image
 
 RED = (200, 30, 30)
@@ -178,6 +183,7 @@ class TestFetchTile:
         message = str(excinfo.value)
         assert 'text/html' in message
         assert '(3, 1)' in message
+        assert isinstance(excinfo.value, gsv._UnexpectedContentTypeError), 'the grid watch keys on this type'
 
     def test_jpeg_content_type_returns_coords_and_bytes(self):
         body = jpeg_bytes(RED, (4, 4))
@@ -189,6 +195,23 @@ class TestFetchTile:
         response = _FakeResponse(headers={'Content-Type': 'image/jpeg; charset=UTF-8'}, body=body)
         assert fetch_tile(response) == (3, 1, body)
 
+    def test_each_attempt_draws_on_the_host_tile_budget_first(self, monkeypatch):
+        events = []
+
+        class Limiter:
+            async def wait_async(self):
+                events.append('draw')
+
+        class Response(_FakeResponse):
+            async def read(self):
+                events.append('request')
+                return self._body
+
+        monkeypatch.setattr(gsv, '_host_tile_limiter', Limiter())
+        fetch_tile(Response(headers={'Content-Type': 'image/jpeg'}, body=b'body'))
+
+        assert events == ['draw', 'request']
+
     def test_retrying_variant_wraps_the_bare_fetch(self):
         assert gsv._download_tile is not gsv._fetch_tile
         assert gsv._download_tile.__wrapped__ is gsv._fetch_tile
@@ -356,15 +379,85 @@ class TestStitchTilesWithMixedBodySizes:
         degraded_first = [(0, 0, jpeg_bytes(RED, (256, 256))), (1, 0, jpeg_bytes(BLUE, (512, 512)))]
         full_first = [(0, 0, jpeg_bytes(BLUE, (512, 512))), (1, 0, jpeg_bytes(RED, (256, 256)))]
 
-        assert gsv._stitch_cell_size(degraded_first) == (512, 512)
-        assert gsv._stitch_cell_size(full_first) == (512, 512)
+        assert streamed(degraded_first, (1024, 512)).cell_size == (512, 512)
+        assert streamed(full_first, (1024, 512)).cell_size == (512, 512)
         assert gsv._stitch_tiles(degraded_first, (1024, 512), (1024, 512)).size == (1024, 512)
 
     def test_undersized_tile_count_reports_the_degradation(self):
         tiles = [(0, 0, jpeg_bytes(RED, (512, 512))), (1, 0, jpeg_bytes(BLUE, (256, 256))),
                  (2, 0, jpeg_bytes(BLUE, (256, 256)))]
-        assert gsv._undersized_tile_count(tiles) == 2
-        assert gsv._undersized_tile_count(tiles[:1]) == 0
+        assert streamed(tiles, (1536, 512)).undersized == 2
+        assert streamed(tiles[:1], (1536, 512)).undersized == 0
+
+
+def streamed(tiles, zoom_dims):
+    """Feed `tiles` through a _StreamingStitch in order and finish it at zoom_dims; return the stitch."""
+    stitch = gsv._StreamingStitch(zoom_dims)
+    for x, y, body in tiles:
+        stitch.add(x, y, body)
+    stitch.image = stitch.finish(zoom_dims)
+    return stitch
+
+
+class TestStreamingStitch:
+    """The stitch is built while the fan-out runs, so it sees bodies in arrival order, from several threads.
+    Whatever that order, the result must be the one the whole list would have produced."""
+
+    def test_a_half_size_body_arriving_after_full_size_ones_is_scaled_into_its_cell(self):
+        tiles = [(0, 0, jpeg_bytes(RED)), (1, 0, jpeg_bytes(BLUE)), (2, 0, jpeg_bytes(YELLOW, (256, 256)))]
+
+        stitch = streamed(tiles, (1536, 512))
+
+        assert stitch.cell_size == (512, 512)
+        assert stitch.undersized == 1
+        for probe in [(1030, 10), (1300, 256), (1535, 511)]:
+            assert_color(stitch.image.getpixel(probe), YELLOW)
+
+    def test_half_size_bodies_that_arrive_first_wait_for_the_cell_size(self):
+        """Pasting them at a guessed 256 cell would throw away every full-size body that follows."""
+        tiles = [(1, 0, jpeg_bytes(YELLOW, (256, 256))), (2, 0, jpeg_bytes(BLUE, (256, 256))),
+                 (0, 0, jpeg_bytes(RED))]
+
+        stitch = streamed(tiles, (1536, 512))
+
+        assert stitch.cell_size == (512, 512)
+        assert stitch.image.size == (1536, 512)
+        assert_color(stitch.image.getpixel((100, 100)), RED)
+        assert_color(stitch.image.getpixel((1000, 500)), YELLOW)
+        assert_color(stitch.image.getpixel((1500, 500)), BLUE)
+
+    def test_a_body_larger_than_the_cell_grows_the_canvas(self):
+        """Not something CBK does; pinned so the cell is the largest body whatever the arrival order."""
+        tiles = [(0, 0, jpeg_bytes(RED)), (1, 0, jpeg_bytes(BLUE, (640, 640)))]
+
+        stitch = streamed(tiles, (1024, 512))
+
+        assert stitch.cell_size == (640, 640)
+        assert_color(stitch.image.getpixel((100, 100)), RED)
+        assert_color(stitch.image.getpixel((1000, 500)), BLUE)
+
+    def test_arrival_order_does_not_change_the_pixels(self):
+        tiles = [(x, y, jpeg_bytes(color)) for (x, y), color in
+                 zip([(0, 0), (1, 0), (0, 1), (1, 1)], [RED, BLUE, YELLOW, RED])]
+
+        forward = np.asarray(streamed(tiles, (1024, 1024)).image)
+        backward = np.asarray(streamed(tiles[::-1], (1024, 1024)).image)
+
+        assert np.array_equal(forward, backward)
+
+    def test_concurrent_adds_from_many_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        colors = [RED, BLUE, YELLOW]
+        tiles = [(x, y, jpeg_bytes(colors[(x + y) % 3])) for y in range(4) for x in range(8)]
+        stitch = gsv._StreamingStitch((8 * 512, 4 * 512))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda tile: stitch.add(*tile), tiles))
+        image = stitch.finish((8 * 512, 4 * 512))
+
+        assert stitch.count == 32
+        assert np.array_equal(np.asarray(image), np.asarray(streamed(tiles, (8 * 512, 4 * 512)).image))
 
 
 class TestRejectMostlyBlackStitch:
@@ -422,6 +515,256 @@ class TestRejectMostlyBlackStitch:
         gsv._reject_mostly_black_stitch(canvas, 'panoZ', zoom=5)
 
 
+class TestBlackAccountingDuringTheStitch:
+    """_StreamingStitch counts each cell's exact-black pixels as it pastes, so the guard gets the same number
+    _black_fraction would read off the finished frame - without the second, full-frame luma copy (128 MB for
+    a 16384x8192 pano) - and a grid that is already failing it can be refused before the stitch completes."""
+
+    @staticmethod
+    def half_black(color, size=(512, 512)):
+        """A body whose right half is exact black, encoded losslessly enough for the count to be exact."""
+        image = Image.new('RGB', size, color)
+        image.paste(Image.new('RGB', (size[0] // 2, size[1]), (0, 0, 0)), (size[0] // 2, 0))
+        buf = BytesIO()
+        image.save(buf, 'png')
+        return buf.getvalue()
+
+    def test_the_count_matches_the_finished_frame_exactly(self):
+        """Edge cells cropped, one cell never pasted, a greyscale body converted as paste converts it."""
+        grey = BytesIO()
+        Image.new('L', (512, 512), 0).save(grey, 'png')
+        tiles = [(0, 0, self.half_black(RED)), (1, 0, jpeg_bytes(BLUE)), (2, 0, self.half_black(YELLOW)),
+                 (0, 1, grey.getvalue()), (1, 1, self.half_black(BLUE))]
+
+        stitch = streamed(tiles, (1300, 700))
+
+        assert stitch.black_fraction is not None
+        assert stitch.black_fraction == gsv._black_fraction(stitch.image)
+
+    def test_a_frame_the_finish_resizes_is_counted_from_the_frame_instead(self):
+        stitch = gsv._StreamingStitch((1024, 512), (2048, 1024))
+        stitch.add(0, 0, self.half_black(RED))
+        image = stitch.finish((2048, 1024))
+
+        assert stitch.black_fraction is None
+        assert stitch.known_black_fraction() > 0
+
+        with pytest.raises(gsv.StitchedPanoMostlyBlackError):
+            gsv._reject_mostly_black_stitch(image, 'panoZ', zoom=3, black=stitch.black_fraction)
+
+    def test_a_grown_canvas_gives_up_on_the_per_cell_counts(self):
+        stitch = gsv._StreamingStitch((1024, 512))
+        stitch.add(0, 0, jpeg_bytes(RED))
+        stitch.add(1, 0, jpeg_bytes(BLUE, (640, 640)))
+        image = stitch.finish((1280, 640))  # the grown canvas's own size: no resize, yet no usable counts
+
+        assert image.size == (1280, 640)
+        assert stitch.black_fraction is None
+        assert stitch.known_black_fraction() == 0.0
+
+    def test_once_the_limit_is_out_of_reach_later_bodies_are_not_even_decoded(self, monkeypatch):
+        blank = jpeg_bytes((0, 0, 0))
+        stitch = gsv._StreamingStitch((4 * 512, 512))
+        stitch.add(0, 0, blank)
+        stitch.add(1, 0, blank)
+        assert not stitch.over_black_budget, 'exactly half is not over the limit'
+        stitch.add(2, 0, blank)
+        assert stitch.over_black_budget
+        assert stitch.known_black_fraction() == 0.75
+
+        stitch.add(3, 0, b'not even a jpeg')
+        assert stitch.count == 3
+
+    def test_no_fail_fast_where_a_resize_would_change_the_count(self):
+        blank = jpeg_bytes((0, 0, 0))
+        stitch = gsv._StreamingStitch((2 * 512, 512), (4 * 512, 2 * 512))
+        stitch.add(0, 0, blank)
+        stitch.add(1, 0, blank)
+        assert not stitch.over_black_budget
+
+    def test_black_fraction_counts_band_by_band_with_the_same_answer(self, monkeypatch):
+        monkeypatch.setattr(gsv, 'BLACK_COUNT_BAND_ROWS', 7)
+        striped = Image.new('RGB', (64, 50), (0, 0, 0))
+        for row in range(1, 50, 3):
+            striped.paste(Image.new('RGB', (64, 1), RED), (0, row))
+
+        assert gsv._black_fraction(striped) == striped.convert('L').histogram()[0] / (64 * 50)
+
+    def test_a_failing_grid_is_refused_before_the_retry_pass(self, tmp_path, monkeypatch, caplog):
+        """Seven blank cells streamed in and one failed: the black guard already fails, so there is no
+        second-chance pass for the failed tile and nothing is saved."""
+        stub_probe(monkeypatch, pick_zoom=5)
+        blank = fixture_bytes('z3_blank_out_of_range.jpg')
+        passes = []
+
+        async def streaming_fan_out(tiles, on_tile=None):
+            passes.append(tiles)
+            results = []
+            for x, y, _url in tiles:
+                if (x, y) == (3, 1):
+                    results.append(aiohttp.ClientConnectionError('reset'))
+                else:
+                    on_tile(x, y, blank)
+                    results.append((x, y, None))
+            return results
+
+        monkeypatch.setattr(gsv, '_download_tiles', streaming_fan_out)
+
+        with pytest.raises(gsv.StitchedPanoMostlyBlackError):
+            gsv.download_single_pano(str(tmp_path), {'pano_id': 'stitchPanoAAAAAAAAAAAA', 'width': 2048,
+                                                     'height': 1024})
+
+        assert len(passes) == 1
+        assert not (tmp_path / 'st' / 'stitchPanoAAAAAAAAAAAA.jpg').exists()
+        assert 'retrying' not in caplog.text
+
+
+class TestTheLosslessPath:
+    """_StreamingStitch(lossless=True) copies the bodies' DCT coefficients into a jpeg_dct.DctMosaic rather
+    than decoding them, wherever the Pillow path would neither crop nor resize. jpeglib's read is replaced
+    here by coefficients made to measure for each body (tests/test_jpeg_dct.py covers the mosaic itself), so
+    what is under test is the stitch's choice of path, and its retreat to Pillow."""
+
+    @pytest.fixture
+    def coefficients(self, monkeypatch):
+        """Serve read_coefficients from a {body: TileCoefficients} table; a body not in it is unreadable."""
+        from downloaders import jpeg_dct
+        table = {}
+
+        def read(data):
+            if data not in table:
+                raise ValueError('not a JPEG jpeglib can read')
+            return table[data]
+
+        monkeypatch.setattr(jpeg_dct, 'available', lambda: True)
+        monkeypatch.setattr(jpeg_dct, 'read_coefficients', read)
+        return table
+
+    @staticmethod
+    def coefficients_for(size=512, luma_dc=0):
+        from downloaders import jpeg_dct
+        luma = np.zeros((size // 8, size // 8, 8, 8), dtype=np.int16)
+        luma[..., 0, 0] = luma_dc
+        chroma = np.zeros((size // 16, size // 16, 8, 8), dtype=np.int16)
+        qt = np.full((2, 8, 8), 8, dtype=np.uint16)
+        return jpeg_dct.TileCoefficients((luma, chroma, chroma.copy()), qt, (0, 1, 1),
+                                         np.array([[2, 2], [1, 1], [1, 1]]))
+
+    def test_a_native_zoom_grid_is_assembled_without_a_decode(self, coefficients, monkeypatch):
+        from downloaders import jpeg_dct
+        bodies = {(x, 0): jpeg_bytes(color) for x, color in enumerate([RED, BLUE])}
+        for body in bodies.values():
+            coefficients[body] = self.coefficients_for()
+        monkeypatch.setattr(Image, 'open', lambda *args: pytest.fail('the lossless path decoded a body'))
+        stitch = gsv._StreamingStitch((1024, 512), (1024, 512), lossless=True)
+
+        for (x, y), body in bodies.items():
+            stitch.add(x, y, body)
+        result = stitch.finish((1024, 512))
+
+        assert isinstance(result, jpeg_dct.DctMosaic)
+        assert result.size == (1024, 512)
+        assert stitch.count == 2
+        assert stitch.black_fraction == 0.0
+
+    def test_black_is_judged_from_the_coefficients_and_can_still_fail_fast(self, coefficients):
+        blank = jpeg_bytes((0, 0, 0))
+        coefficients[blank] = self.coefficients_for(luma_dc=-128)
+        stitch = gsv._StreamingStitch((3 * 512, 512), (3 * 512, 512), lossless=True)
+
+        stitch.add(0, 0, blank)
+        assert stitch.known_black_fraction() == pytest.approx(1 / 3)
+        stitch.add(1, 0, blank)
+        assert stitch.over_black_budget
+
+    def test_a_cell_never_filled_counts_as_black(self, coefficients):
+        body = jpeg_bytes(RED)
+        coefficients[body] = self.coefficients_for()
+        stitch = gsv._StreamingStitch((1024, 512), (1024, 512), lossless=True)
+        stitch.add(0, 0, body)
+        stitch.finish((1024, 512))
+
+        assert stitch.black_fraction == 0.5
+
+    def test_an_undersized_body_sends_the_pano_back_to_pillow(self, coefficients):
+        full, half = jpeg_bytes(RED), jpeg_bytes(BLUE, (256, 256))
+        coefficients[full] = self.coefficients_for()
+        coefficients[half] = self.coefficients_for(size=256)
+        stitch = gsv._StreamingStitch((1024, 512), (1024, 512), lossless=True)
+
+        stitch.add(0, 0, full)
+        stitch.add(1, 0, half)
+        image = stitch.finish((1024, 512))
+
+        assert not stitch.lossless
+        assert isinstance(image, Image.Image)
+        assert_color(image.getpixel((100, 100)), RED)
+        assert_color(image.getpixel((900, 400)), BLUE)
+        assert stitch.undersized == 1 and stitch.count == 2
+        assert stitch.black_fraction == gsv._black_fraction(image)
+
+    def test_an_unreadable_body_goes_to_pillow_too(self, coefficients):
+        stitch = gsv._StreamingStitch((512, 512), (512, 512), lossless=True)
+        stitch.add(0, 0, jpeg_bytes(RED))
+
+        assert not stitch.lossless
+        assert_color(stitch.finish((512, 512)).getpixel((10, 10)), RED)
+
+    def test_a_finish_at_other_dims_replays_the_placed_bodies(self, coefficients):
+        body = jpeg_bytes(RED)
+        coefficients[body] = self.coefficients_for()
+        stitch = gsv._StreamingStitch((512, 512), (512, 512), lossless=True)
+        stitch.add(0, 0, body)
+
+        image = stitch.finish((1024, 1024))
+
+        assert image.size == (1024, 1024)
+        assert_color(image.getpixel((600, 600)), RED)
+
+    def test_a_body_read_as_another_one_leaves_the_path(self, coefficients):
+        """A second thread that read its coefficients before the first left the path must not place them."""
+        body = jpeg_bytes(RED)
+        coefficients[body] = self.coefficients_for()
+        stitch = gsv._StreamingStitch((1024, 512), (1024, 512), lossless=True)
+        stitch.lossless = False  # as if another body had just sent the pano back
+
+        assert stitch._place_coefficients(0, 0, body) is False
+        assert stitch._mosaic is None
+
+    @pytest.mark.parametrize('zoom_dims, final_dims', [((1300, 512), (1300, 512)), ((1024, 512), (2048, 1024))])
+    def test_a_crop_or_a_resize_means_pillow_from_the_start(self, coefficients, zoom_dims, final_dims):
+        assert not gsv._StreamingStitch(zoom_dims, final_dims, lossless=True).lossless
+
+    @pytest.mark.parametrize('configured', [False, True])
+    def test_download_single_pano_takes_the_path_only_when_configured(self, tmp_path, monkeypatch, configured):
+        """jpeglib alone is not enough: the coefficient path is opt-in (config.lossless_stitch), off by default."""
+        monkeypatch.setattr(gsv, 'lossless_stitch', configured)
+        stub_probe(monkeypatch, pick_zoom=5)
+        stub_tiles(monkeypatch, lambda tile: (tile[0], tile[1], jpeg_bytes(BLUE)))
+        asked = []
+        real_stitch = gsv._StreamingStitch
+
+        def recording_stitch(*args, lossless=False):
+            asked.append(lossless)
+            return real_stitch(*args)  # Pillow either way: no jpeglib here to save a mosaic with
+
+        monkeypatch.setattr(gsv, '_StreamingStitch', recording_stitch)
+
+        gsv.download_single_pano(str(tmp_path), {'pano_id': 'stitchPanoAAAAAAAAAAAA', 'width': 1024,
+                                                 'height': 512})
+
+        assert asked == [configured]
+
+    def test_it_is_off_in_the_shipped_config(self):
+        import config
+        assert config.lossless_stitch is False
+
+    def test_without_jpeglib_there_is_no_lossless_path(self, monkeypatch):
+        from downloaders import jpeg_dct
+        monkeypatch.setattr(jpeg_dct, 'jpeglib', None)
+        assert not gsv._StreamingStitch((1024, 512), (1024, 512), lossless=True).lossless
+
+
 # The stitched JPEG is written through common.atomic_output_path, the same helper the depth artifacts and
 # the Mapillary downloader use. Its contract - rename on success, remove the .part on any BaseException
 # including SIGTERM's SystemExit, 0o664 on the result - is covered by tests/test_image_downloaders.py's
@@ -431,22 +774,32 @@ class TestRejectMostlyBlackStitch:
 
 # --- download_single_pano end to end (probes and tile fan-out stubbed) ---------------------------------------
 
-def stub_probe(monkeypatch, pick_zoom):
+def stub_probe(monkeypatch, pick_zoom, size=(512, 512)):
     """Make the zoom probe pick `pick_zoom` without a network: probe requests for that zoom return a
-    non-blank JPEG, every other zoom a black one (Google's no-imagery answer)."""
+    non-blank RED tile body, every other zoom a black one (Google's no-imagery answer). The picked zoom's
+    probe IS its tile (0, 0), so it lands in the stitch. Returns the list of probe URLs asked for."""
+    asked = []
 
     def fake_get_response(url, session, stream=False):
+        asked.append(url)
         color = RED if ('zoom=%d&' % pick_zoom) in url else (0, 0, 0)
-        return BytesIO(jpeg_bytes(color, (16, 16)))
+        return BytesIO(jpeg_bytes(color, size))
 
     monkeypatch.setattr(gsv, '_get_response', fake_get_response)
+    return asked
+
+
+@pytest.fixture
+def no_retry_pass_delay(monkeypatch):
+    """Skip the pause before a failed pano's second-chance pass; the pass itself still runs."""
+    monkeypatch.setattr(gsv, 'TILE_RETRY_PASS_DELAY_SECONDS', 0)
 
 
 def stub_tiles(monkeypatch, result_for_tile):
     """Replace the tile fan-out with canned per-tile results; records the tile list it was asked for."""
     requested = []
 
-    async def fake_download_tiles(tiles):
+    async def fake_download_tiles(tiles, on_tile=None):
         requested.extend(tiles)
         return [result_for_tile(tile) for tile in tiles]
 
@@ -486,7 +839,8 @@ class TestDownloadSinglePano:
         # fallback_success, not success: this pano's own dims need zoom 4, so the zoom-3 stitch is upscaled
         # to reach them (#52 item 2, log.csv column 8). TestFallbackResolutionIsReported owns that split.
         assert result == DownloadResult.fallback_success
-        assert {(x, y) for x, y, _ in requested} == {(x, y) for x in range(8) for y in range(4)}
+        # Every cell but (0, 0), which the zoom-3 probe already fetched.
+        assert {(x, y) for x, y, _ in requested} == {(x, y) for x in range(8) for y in range(4)} - {(0, 0)}
         assert all('zoom=3' in url for _, _, url in requested)
         with Image.open(tmp_path / 'st' / 'stitchPanoAAAAAAAAAAAA.jpg') as image:
             assert image.size == (8192, 4096)
@@ -504,7 +858,7 @@ class TestDownloadSinglePano:
         result = gsv.download_single_pano(str(tmp_path), self.pano_info(width=3328, height=1664))
 
         assert result == DownloadResult.success
-        assert {(x, y) for x, y, _ in requested} == {(x, y) for x in range(7) for y in range(4)}
+        assert {(x, y) for x, y, _ in requested} == {(x, y) for x in range(7) for y in range(4)} - {(0, 0)}
         with Image.open(tmp_path / 'st' / 'stitchPanoAAAAAAAAAAAA.jpg') as image:
             assert image.size == (3328, 1664)
             assert gsv._black_fraction(image) == 0.0
@@ -572,7 +926,7 @@ class TestDownloadSinglePano:
         """The regression this review caught, end to end: every body arrives at half size (cbk's load-shed
         rendering). The saved pano must still be full-frame imagery at the reported dims, and the run must
         SAY the imagery was degraded - it is a real resolution loss, just not a corruption."""
-        stub_probe(monkeypatch, pick_zoom=5)
+        stub_probe(monkeypatch, pick_zoom=5, size=(256, 256))
         stub_tiles(monkeypatch, lambda tile: (tile[0], tile[1],
                                               jpeg_bytes(RED if tile[0] == 0 else BLUE, (256, 256))))
 
@@ -618,21 +972,25 @@ class TestDownloadSinglePano:
         """The #44 failure mode itself, driven with REAL out-of-range tile bytes. Google answers an
         out-of-range tile 200 OK with a valid all-black JPEG, so nothing below the stitch can tell that the
         grid was wrong. The stitched frame can, and the pano must fail rather than be ledgered
-        downloaded=1 with a black file that is never re-attempted."""
+        downloaded=1 with a black file that is never re-attempted.
+
+        The probe tile is imagery by construction (a blank one picks no zoom), so the grid is 4x2 here: the
+        seven cells the fan-out fetched are out of range, as every cell past the first is in the real case."""
         stub_probe(monkeypatch, pick_zoom=5)
         blank = fixture_bytes('z3_blank_out_of_range.jpg')
         stub_tiles(monkeypatch, lambda tile: (tile[0], tile[1], blank))
 
         with caplog.at_level(logging.ERROR):
             with pytest.raises(gsv.StitchedPanoMostlyBlackError):
-                gsv.download_single_pano(str(tmp_path), self.pano_info())
+                gsv.download_single_pano(str(tmp_path), self.pano_info(width=2048, height=1024))
 
         shard = tmp_path / 'st'
         assert not (shard / 'stitchPanoAAAAAAAAAAAA.jpg').exists()
         assert list(shard.glob('*.part')) == []
         assert 'stitchPanoAAAAAAAAAAAA' in caplog.text
 
-    def test_failed_tile_fails_the_pano_loudly_and_writes_nothing(self, tmp_path, monkeypatch, caplog):
+    def test_failed_tile_fails_the_pano_loudly_and_writes_nothing(self, tmp_path, monkeypatch, caplog,
+                                                                  no_retry_pass_delay):
         """#45: one failed tile must fail the pano with the REAL cause in scrape.log - not a TypeError from
         subscripting the exception object - and must not leave a partial file that the skip-if-exists check
         would treat as done forever. Raising (rather than returning failure) marks the failure transient:
@@ -653,6 +1011,30 @@ class TestDownloadSinglePano:
         assert not (shard / 'stitchPanoAAAAAAAAAAAA.jpg').exists()
         assert list(shard.glob('*.part')) == []
 
+    def test_streamed_and_returned_bodies_land_in_the_same_stitch(self, tmp_path, monkeypatch):
+        """The real fan-out streams every body through on_tile; a fan-out that returns them instead (every
+        stub above) is stitched after the fact. Either way, or both in one pano, the frame is complete."""
+        stub_probe(monkeypatch, pick_zoom=5)
+
+        async def half_streaming(tiles, on_tile=None):
+            results = []
+            for x, y, _url in tiles:
+                body = jpeg_bytes(BLUE if x % 2 else YELLOW)
+                if x % 2:
+                    on_tile(x, y, body)
+                    body = None
+                results.append((x, y, body))
+            return results
+
+        monkeypatch.setattr(gsv, '_download_tiles', half_streaming)
+
+        pano = self.pano_info(width=2048, height=1024)
+        assert gsv.download_single_pano(str(tmp_path), pano) == DownloadResult.success
+        with Image.open(tmp_path / 'st' / 'stitchPanoAAAAAAAAAAAA.jpg') as image:
+            assert_color(image.getpixel((100, 100)), RED)        # the probe
+            assert_color(image.getpixel((700, 100)), BLUE)       # streamed
+            assert_color(image.getpixel((1100, 900)), YELLOW)    # returned
+
     def test_existing_file_short_circuits_before_any_probe(self, tmp_path, monkeypatch):
         shard = tmp_path / 'st'
         shard.mkdir()
@@ -672,9 +1054,124 @@ class TestDownloadSinglePano:
         assert gsv.download_single_pano(str(tmp_path), pano) == DownloadResult.failure
 
     def test_blank_probes_at_both_zooms_fail_the_pano(self, tmp_path, monkeypatch):
-        stub_probe(monkeypatch, pick_zoom=-1)  # every probe zoom comes back blank
+        asked = stub_probe(monkeypatch, pick_zoom=-1)  # every probe zoom comes back blank
 
         assert gsv.download_single_pano(str(tmp_path), self.pano_info()) == DownloadResult.failure
+        assert [('zoom=5&' in url, 'zoom=3&' in url) for url in asked] == [(True, False), (False, True)]
+
+
+class TestTheRetryPass:
+    """A pano's failed tiles get one more, gentler go in the same run before the pano is given up to the next."""
+
+    def pano_info(self):
+        return {'pano_id': 'retryPanoAAAAAAAAAAAAA', 'width': 2048, 'height': 1024}  # a 4x2 grid at zoom 5
+
+    def flaky_fan_out(self, monkeypatch, failures, streaming=False):
+        """Tiles fail as many times as `failures` says, then answer RED. Returns each call's cells."""
+        calls = []
+        remaining = dict(failures)
+
+        async def fake_download_tiles(tiles, on_tile=None):
+            calls.append([tuple(tile[:2]) for tile in tiles])
+            results = []
+            for x, y, _url in tiles:
+                if remaining.get((x, y), 0):
+                    remaining[(x, y)] -= 1
+                    results.append(aiohttp.ClientError('tile (%d, %d) reset' % (x, y)))
+                elif streaming:
+                    on_tile(x, y, jpeg_bytes(BLUE))
+                    results.append((x, y, None))
+                else:
+                    results.append((x, y, jpeg_bytes(BLUE)))
+            return results
+
+        monkeypatch.setattr(gsv, '_download_tiles', fake_download_tiles)
+        return calls
+
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_a_momentary_failure_is_recovered_in_the_same_run(self, tmp_path, monkeypatch, caplog,
+                                                              no_retry_pass_delay, streaming):
+        stub_probe(monkeypatch, pick_zoom=5)
+        calls = self.flaky_fan_out(monkeypatch, {(3, 1): 1, (1, 0): 1}, streaming=streaming)
+
+        with caplog.at_level(logging.WARNING):
+            assert gsv.download_single_pano(str(tmp_path), self.pano_info()) == DownloadResult.success
+
+        assert 'retryPanoAAAAAAAAAAAAA: 2/8 tiles failed; retrying them' in caplog.text
+        # The second pass asks for the failed cells only.
+        assert sorted(cell for call in calls[1:] for cell in call) == [(1, 0), (3, 1)]
+        with Image.open(tmp_path / 're' / 'retryPanoAAAAAAAAAAAAA.jpg') as image:
+            assert_color(image.getpixel((700, 100)), BLUE)      # (1, 0)
+            assert_color(image.getpixel((1800, 900)), BLUE)     # (3, 1)
+
+    def test_a_tile_that_fails_both_passes_still_fails_the_pano(self, tmp_path, monkeypatch, caplog,
+                                                                no_retry_pass_delay):
+        stub_probe(monkeypatch, pick_zoom=5)
+        self.flaky_fan_out(monkeypatch, {(3, 1): 2, (1, 0): 1})
+
+        with caplog.at_level(logging.ERROR):
+            with pytest.raises(aiohttp.ClientError, match=r'tile \(3, 1\) reset'):
+                gsv.download_single_pano(str(tmp_path), self.pano_info())
+
+        # Counted after the second pass: (1, 0) recovered.
+        assert '1/8 tiles failed; first failure: tile (3, 1)' in caplog.text
+        assert not (tmp_path / 're' / 'retryPanoAAAAAAAAAAAAA.jpg').exists()
+
+    def test_a_clean_fan_out_makes_no_second_pass(self, tmp_path, monkeypatch):
+        stub_probe(monkeypatch, pick_zoom=5)
+        calls = self.flaky_fan_out(monkeypatch, {})
+
+        assert gsv.download_single_pano(str(tmp_path), self.pano_info()) == DownloadResult.success
+        assert len(calls) == 1
+
+    def test_the_pass_waits_then_asks_a_few_at_a_time(self, monkeypatch):
+        monkeypatch.setattr(gsv, 'TILE_RETRY_PASS_DELAY_SECONDS', 0.2)
+        monkeypatch.setattr(gsv, 'TILE_RETRY_PASS_CONCURRENCY', 2)
+        calls = self.flaky_fan_out(monkeypatch, {})
+        tiles = [(x, 0, 'https://tile.invalid/%d' % x) for x in range(5)]
+
+        started = time.monotonic()
+        results = asyncio.run(gsv._retry_failed_tiles(tiles))
+
+        assert time.monotonic() - started >= 0.2
+        assert calls == [[(0, 0), (1, 0)], [(2, 0), (3, 0)], [(4, 0)]]
+        assert [result[:2] for result in results] == [(x, 0) for x in range(5)]
+
+
+class TestTheZoomProbe:
+    """The probe that picks the zoom is that zoom's tile (0, 0): asked once, and only as often as needed."""
+
+    def pano_info(self):
+        return {'pano_id': 'probePanoAAAAAAAAAAAAA', 'width': 1024, 'height': 512}
+
+    def test_zoom_3_is_not_asked_when_zoom_5_has_imagery(self, tmp_path, monkeypatch):
+        asked = stub_probe(monkeypatch, pick_zoom=5)
+        stub_tiles(monkeypatch, lambda tile: (tile[0], tile[1], jpeg_bytes(BLUE)))
+
+        assert gsv.download_single_pano(str(tmp_path), self.pano_info()) == DownloadResult.success
+
+        assert len(asked) == 1 and 'zoom=5&' in asked[0]
+
+    def test_zoom_3_is_asked_only_after_a_blank_zoom_5(self, tmp_path, monkeypatch):
+        asked = stub_probe(monkeypatch, pick_zoom=3)
+        stub_tiles(monkeypatch, lambda tile: (tile[0], tile[1], jpeg_bytes(BLUE)))
+
+        gsv.download_single_pano(str(tmp_path), self.pano_info())
+
+        assert [('zoom=5&' in url, 'zoom=3&' in url) for url in asked] == [(True, False), (False, True)]
+
+    def test_the_probe_body_is_cell_0_0_and_the_fan_out_never_refetches_it(self, tmp_path, monkeypatch):
+        asked = stub_probe(monkeypatch, pick_zoom=5)
+        requested = stub_tiles(monkeypatch, lambda tile: (tile[0], tile[1], jpeg_bytes(BLUE)))
+
+        gsv.download_single_pano(str(tmp_path), self.pano_info())
+
+        assert [(x, y) for x, y, _ in requested] == [(1, 0)]
+        # Same URL the grid would have asked for (0, 0) - so the body really is that cell.
+        assert asked[0] == gsv._generate_tile_urls('probePanoAAAAAAAAAAAAA', 1024, 512, 5)[0][2]
+        with Image.open(tmp_path / 'pr' / 'probePanoAAAAAAAAAAAAA.jpg') as image:
+            assert_color(image.getpixel((100, 100)), RED)
+            assert_color(image.getpixel((900, 100)), BLUE)
 
 
 class TestTheTileFanOutContract:
@@ -730,10 +1227,11 @@ class TestTheTileFanOutContract:
     def tiles(self, count):
         return [(x, 0, 'https://example.invalid/tile?x=%d' % x) for x in range(count)]
 
-    def test_the_connector_carries_the_configured_concurrency_cap(self, monkeypatch, fake_aiohttp):
-        """gsv binds thread_count by value at import (`from config import ...`), so the patch point is
-        gsv.thread_count - patching config.thread_count changes nothing here."""
-        monkeypatch.setattr(gsv, 'thread_count', 3)
+    def test_the_connector_carries_the_configured_concurrency_ceiling(self, monkeypatch, fake_aiohttp):
+        """gsv binds its config values by value at import (`from config import ...`), so the patch point is
+        gsv.tile_concurrency_max - patching config changes nothing here. The connector only caps; the tiles
+        actually in flight are _AdaptiveConcurrency's call, starting from thread_count."""
+        monkeypatch.setattr(gsv, 'tile_concurrency_max', 3)
         self.stub_tile_fetch(monkeypatch, {0: b'a', 1: b'b'})
 
         asyncio.run(gsv._download_tiles(self.tiles(2)))
@@ -777,10 +1275,738 @@ class TestTheTileFanOutContract:
         assert [x for x, _y, _data in ok] == [0, 2]
         assert failed == [((1, 0), boom)]
 
+    def test_on_tile_gets_each_body_and_the_result_drops_it(self, monkeypatch, fake_aiohttp):
+        """The streaming contract: a body handed to on_tile is not held again in the result list."""
+        self.stub_tile_fetch(monkeypatch, {0: b'zero', 1: b'one'})
+        handed = []
+
+        results = asyncio.run(gsv._download_tiles(self.tiles(2), on_tile=lambda *tile: handed.append(tile)))
+
+        assert sorted(handed) == [(0, 0, b'zero'), (1, 0, b'one')]
+        assert results == [(0, 0, None), (1, 0, None)]
+
+    def test_on_tile_raising_fails_only_that_tile(self, monkeypatch, fake_aiohttp):
+        """A body Pillow cannot read is a failed tile - the pano raises (transient), nothing is saved."""
+        self.stub_tile_fetch(monkeypatch, {0: b'zero', 1: b'not a jpeg'})
+
+        def consume(x, y, data):
+            if data == b'not a jpeg':
+                raise OSError('cannot identify image file')
+
+        results = asyncio.run(gsv._download_tiles(self.tiles(2), on_tile=consume))
+
+        assert results[0] == (0, 0, None)
+        assert isinstance(results[1], OSError)
+
+
+class TestAbortingAnEvidentlyWrongGrid:
+    """A grid fault (the #44 class) answers every cell with a valid all-black JPEG, or with something that
+    is not a JPEG at all. Once the cells seen make the black limit unreachable, the fan-out stops: the rest
+    of the pano's requests are cancelled and StitchedPanoMostlyBlackError raised, instead of a full pano's
+    bandwidth and a 384 MB stitch being spent on a frame the guard will refuse."""
+
+    def tiles(self, count):
+        return [(x, 0, 'https://example.invalid/tile?x=%d' % x) for x in range(count)]
+
+    def test_an_abort_from_on_tile_cancels_the_tiles_still_to_come(self, monkeypatch):
+        fetched = []
+
+        async def fake_download_tile(session, tile):
+            fetched.append(tile[0])
+            await asyncio.sleep(0.01)  # a tile's network time dwarfs its hand-off to on_tile
+            return tile[0], 0, b'body'
+
+        def on_tile(x, y, data):
+            if x == 1:
+                raise gsv.StitchedPanoMostlyBlackError('grid is wrong')
+
+        monkeypatch.setattr(gsv, '_download_tile', fake_download_tile)
+        controller = gsv._AdaptiveConcurrency(1, 1)
+
+        with pytest.raises(gsv.StitchedPanoMostlyBlackError):
+            asyncio.run(gsv._gather_tiles(None, self.tiles(20), on_tile, controller))
+
+        assert len(fetched) < 5, 'the queued tiles must never be requested'
+        assert controller._in_flight == 0 and not controller._waiters, 'cancelled tiles give their slots back'
+
+    def test_an_abort_is_not_pushback_from_google(self, monkeypatch):
+        async def aborting_download_tile(session, tile):
+            raise gsv.StitchedPanoMostlyBlackError('raised from the backoff hook')
+
+        monkeypatch.setattr(gsv, '_download_tile', aborting_download_tile)
+        controller = gsv._AdaptiveConcurrency(4, 4)
+
+        with pytest.raises(gsv.StitchedPanoMostlyBlackError):
+            asyncio.run(gsv._gather_tiles(None, self.tiles(3), lambda *tile: None, controller))
+
+        assert controller._window_errors == 0 and not controller.cuts
+
+    def test_a_non_jpeg_answer_is_reported_to_on_tile_once_its_retries_are_spent(self):
+        reported = []
+        error = gsv._UnexpectedContentTypeError(SimpleNamespace(real_url='u'), (), message='text/html')
+        token = gsv._active_on_tile.set(lambda *cell: reported.append(cell))
+        try:
+            gsv._note_tile_retry({'exception': error, 'args': (None, (3, 2, 'u'))})
+            gsv._note_tile_giveup({'exception': error, 'args': (None, (4, 2, 'u'))})
+            gsv._note_tile_giveup({'exception': aiohttp.ClientError('reset'), 'args': (None, (5, 2, 'u'))})
+        finally:
+            gsv._active_on_tile.reset(token)
+
+        assert reported == [(4, 2, None)], \
+            'only a wrong Content-Type to the last retry says anything about the grid'
+
+    def test_a_burst_of_html_that_a_retry_gets_past_does_not_refuse_the_pano(self, tmp_path, monkeypatch):
+        """A rate-limit or interstitial page across the tiles in flight is not a grid fault: backoff retries
+        them, the real bodies arrive, and the pano is saved. Through the real retrying _download_tile, with
+        every cell past the probe answering text/html once first."""
+        stub_probe(monkeypatch, pick_zoom=5)
+        attempts = {}
+        burst_over = []
+
+        class FlakySession:
+            def get(self, url, **kwargs):
+                attempts[url] = attempts.get(url, 0) + 1
+                first = attempts[url] == 1
+                if first:
+                    response = _FakeResponse({'Content-Type': 'text/html'}, b'<html>slow down</html>')
+                else:
+                    response = _FakeResponse({'Content-Type': 'image/jpeg'}, jpeg_bytes(BLUE))
+
+                class Ctx:
+                    async def __aenter__(self):
+                        if not first:
+                            # The burst covers every tile in flight before any retry lands.
+                            while len(attempts) < 7:
+                                await asyncio.sleep(0.001)
+                            burst_over.append(url)
+                        return response
+
+                    async def __aexit__(self, *exc):
+                        return False
+
+                return Ctx()
+
+        class FakeClientSession:
+            def __init__(self, **kwargs):
+                pass
+
+            async def __aenter__(self):
+                return FlakySession()
+
+            async def __aexit__(self, *args):
+                return False
+
+        async def no_wait(seconds):
+            pass
+
+        monkeypatch.setattr(gsv.aiohttp, 'TCPConnector', lambda limit=None: None)
+        monkeypatch.setattr(gsv.aiohttp, 'ClientSession', FakeClientSession)
+        # Every tile in flight at once: a burst this size would otherwise halve the adaptive limit, and the tiles
+        # it holds back would only ask after the retries have landed.
+        monkeypatch.setattr(gsv, 'thread_count', 8)
+        monkeypatch.setattr(gsv, 'TILE_ERROR_BURST', 8)
+        # backoff's own sleep between attempts, so the retry costs the test nothing.
+        monkeypatch.setattr(backoff._async, 'asyncio', SimpleNamespace(sleep=no_wait,
+                                                                       iscoroutinefunction=asyncio.iscoroutinefunction))
+
+        result = gsv.download_single_pano(str(tmp_path), {'pano_id': 'stitchPanoAAAAAAAAAAAA', 'width': 2048,
+                                                          'height': 1024})
+
+        assert result == DownloadResult.success
+        assert len(attempts) == 7 and set(attempts.values()) == {2} and len(burst_over) == 7
+        assert (tmp_path / 'st' / 'stitchPanoAAAAAAAAAAAA.jpg').is_file()
+
+    def test_the_stitch_counts_a_non_imagery_cell_as_black_until_a_body_arrives(self):
+        stitch = gsv._StreamingStitch((3 * 512, 512))
+        stitch.add(0, 0, jpeg_bytes(RED))
+        stitch.add(1, 0, None)
+        assert stitch.known_black_fraction() == pytest.approx(1 / 3)
+
+        stitch.add(1, 0, jpeg_bytes(BLUE))
+        assert stitch.known_black_fraction() == 0.0
+
+        stitch.add(1, 0, None)
+        stitch.add(2, 0, None)
+        assert stitch.over_black_budget
+
+    def test_a_non_imagery_report_before_the_cell_size_is_known_is_ignored(self):
+        stitch = gsv._StreamingStitch((2 * 512, 512))
+        stitch.add(1, 0, None)
+        stitch.add(0, 0, jpeg_bytes(RED))
+
+        assert stitch.known_black_fraction() == 0.0
+        assert stitch.finish((1024, 512)).size == (1024, 512)
+        assert stitch.black_fraction == 0.5
+
+    def test_download_single_pano_refuses_the_pano_without_fetching_the_rest(self, tmp_path, monkeypatch,
+                                                                              caplog):
+        """End to end through the real gather: a 4x2 grid whose every cell past the probe answers blank. The
+        limit is out of reach after four blank cells, so with one tile in flight at a time most of the grid is
+        never requested."""
+        stub_probe(monkeypatch, pick_zoom=5)
+        blank = fixture_bytes('z3_blank_out_of_range.jpg')
+        fetched = []
+
+        async def blank_download_tile(session, tile):
+            fetched.append(tile[:2])
+            await asyncio.sleep(0.05)
+            return tile[0], tile[1], blank
+
+        monkeypatch.setattr(gsv, '_download_tile', blank_download_tile)
+        monkeypatch.setattr(gsv, 'thread_count', 1)
+        monkeypatch.setattr(gsv, 'tile_concurrency_max', 1)
+
+        with caplog.at_level(logging.ERROR):
+            with pytest.raises(gsv.StitchedPanoMostlyBlackError):
+                gsv.download_single_pano(str(tmp_path), {'pano_id': 'stitchPanoAAAAAAAAAAAA', 'width': 2048,
+                                                         'height': 1024})
+
+        assert len(fetched) < 7
+        assert not (tmp_path / 'st' / 'stitchPanoAAAAAAAAAAAA.jpg').exists()
+        assert caplog.text.count('refusing to save') == 1
+
+    def test_an_abort_the_stitch_did_not_ask_for_still_propagates(self, tmp_path, monkeypatch):
+        stub_probe(monkeypatch, pick_zoom=5)
+
+        async def aborting_fan_out(tiles, on_tile=None):
+            raise gsv.StitchedPanoMostlyBlackError('from somewhere else')
+
+        monkeypatch.setattr(gsv, '_download_tiles', aborting_fan_out)
+
+        with pytest.raises(gsv.StitchedPanoMostlyBlackError, match='from somewhere else'):
+            gsv.download_single_pano(str(tmp_path), {'pano_id': 'stitchPanoAAAAAAAAAAAA', 'width': 2048,
+                                                     'height': 1024})
+
+
+def complete_tiles(controller, clock, count, seconds_each, error=None):
+    """Push `count` tiles through `controller` one after another, each `seconds_each` long."""
+    async def go():
+        for _ in range(count):
+            await controller.acquire()
+            clock.now += seconds_each
+            controller.record(seconds_each, error)
+            controller.release()
+
+    asyncio.run(go())
+
+
+def complete_together(controller, clock, count, seconds, error=None):
+    """Start `count` tiles at once, then finish them one by one, each `seconds` after the last."""
+    async def go():
+        for _ in range(count):
+            await controller.acquire()
+        for _ in range(count):
+            clock.now += seconds
+            controller.record(seconds, error)
+            controller.release()
+
+    asyncio.run(go())
+
+
+def throttled():
+    return aiohttp.ClientResponseError(None, (), status=429, message='Too Many Requests')
+
+
+class TestAdaptiveTileConcurrency:
+    """_AdaptiveConcurrency: additive increase while throughput holds, multiplicative decrease on pushback."""
+
+    def controller(self, initial=4, ceiling=8, floor=1):
+        clock = FakeClock(1000.0)
+        return gsv._AdaptiveConcurrency(initial, ceiling, floor=floor, clock=clock), clock
+
+    def test_the_start_is_clamped_into_range(self):
+        assert gsv._AdaptiveConcurrency(50, 8).limit == 8
+        assert gsv._AdaptiveConcurrency(0, 8).limit == 1
+
+    def test_a_clean_window_raises_the_limit_by_one(self):
+        controller, clock = self.controller(initial=4)
+
+        complete_tiles(controller, clock, 3, 0.1)
+        assert controller.limit == 4, 'a window is one round at the current level'
+        complete_tiles(controller, clock, 1, 0.1)
+        assert controller.limit == 5
+        complete_tiles(controller, clock, 5, 0.1)
+        assert controller.limit == 6
+
+    def test_never_past_the_ceiling(self):
+        controller, clock = self.controller(initial=7, ceiling=8)
+
+        complete_tiles(controller, clock, 100, 0.1)
+
+        assert controller.limit == 8
+
+    def test_falling_throughput_holds_the_level(self):
+        controller, clock = self.controller(initial=4)
+        complete_tiles(controller, clock, 4, 0.1)
+        assert controller.limit == 5
+
+        complete_tiles(controller, clock, 5, 0.2)  # half the throughput of the window before
+
+        assert controller.limit == 5
+
+    def test_throughput_within_tolerance_still_raises(self):
+        controller, clock = self.controller(initial=4)
+        complete_tiles(controller, clock, 4, 0.100)
+        complete_tiles(controller, clock, 5, 0.105)
+
+        assert controller.limit == 6
+
+    @pytest.mark.parametrize('error', [throttled(), asyncio.TimeoutError()], ids=['429', 'timeout'])
+    def test_pushback_halves_the_limit(self, error):
+        controller, clock = self.controller(initial=8, ceiling=16)
+
+        complete_tiles(controller, clock, 1, 0.1, error)
+
+        assert controller.limit == 4
+
+    def test_the_tiles_in_flight_at_a_cut_cannot_cut_again(self):
+        """Eight tiles were in flight when the first 429 came back; the seven after it are the same overload."""
+        controller, clock = self.controller(initial=8, ceiling=16)
+
+        complete_together(controller, clock, 8, 0.1, throttled())
+        assert controller.limit == 4
+        complete_tiles(controller, clock, 1, 0.1, throttled())
+        assert controller.limit == 2
+
+    def test_the_window_after_a_cut_does_not_raise(self):
+        controller, clock = self.controller(initial=8, ceiling=16)
+
+        async def go():
+            for _ in range(8):
+                await controller.acquire()
+            controller.record(0.1, throttled())
+            controller.release()
+            for _ in range(7):
+                clock.now += 0.1
+                controller.record(0.1)
+                controller.release()
+
+        asyncio.run(go())
+        assert controller.limit == 4
+        complete_tiles(controller, clock, 4, 0.1)
+        assert controller.limit == 5
+
+    def test_never_below_the_floor(self):
+        controller, clock = self.controller(initial=2, floor=2)
+
+        complete_tiles(controller, clock, 1, 0.1, throttled())
+
+        assert controller.limit == 2
+
+    def test_a_few_client_errors_are_noise_and_a_burst_is_not(self):
+        controller, clock = self.controller(initial=8, ceiling=16)
+        reset = aiohttp.ClientError('connection reset')
+
+        for _ in range(gsv.TILE_ERROR_BURST - 1):
+            controller.note_retry(reset)
+        assert controller.limit == 8
+        controller.note_retry(reset)
+        assert controller.limit == 4
+        assert controller.cuts == {'client errors': 1}
+
+    def test_errors_that_are_not_the_networks_are_ignored(self):
+        controller, clock = self.controller(initial=8, ceiling=16)
+
+        complete_tiles(controller, clock, 5, 0.1, OSError('cannot identify image file'))
+
+        assert controller.limit == 8
+
+    def test_never_more_in_flight_than_the_limit_and_waiters_go_in_order(self):
+        controller, clock = self.controller(initial=2)
+        started = []
+
+        async def tile(n, gate):
+            await controller.acquire()
+            started.append(n)
+            await gate.wait()
+            controller.release()
+
+        async def go():
+            gate = asyncio.Event()
+            tasks = [asyncio.ensure_future(tile(n, gate)) for n in range(5)]
+            await asyncio.sleep(0)
+            assert started == [0, 1]
+            assert list(controller._waiters) and controller._in_flight == 2
+            gate.set()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(go())
+
+        assert started == [0, 1, 2, 3, 4]
+        assert controller._in_flight == 0
+
+    def test_a_raised_limit_lets_a_waiter_in_at_once(self):
+        controller, clock = self.controller(initial=1)
+
+        async def go():
+            await controller.acquire()
+            waiting = asyncio.ensure_future(controller.acquire())
+            await asyncio.sleep(0)
+            assert not waiting.done()
+            controller._set_limit(2, 'test')
+            await asyncio.sleep(0)
+            assert waiting.done()
+
+        asyncio.run(go())
+
+    def test_a_cancelled_waiter_gives_up_its_place(self):
+        controller, clock = self.controller(initial=1)
+
+        async def go():
+            await controller.acquire()
+            waiting = asyncio.ensure_future(controller.acquire())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+            controller.release()
+            assert controller._in_flight == 0
+            assert not controller._waiters
+
+        asyncio.run(go())
+
+    def test_a_waiter_cancelled_as_it_is_handed_a_slot_hands_it_back(self):
+        controller, clock = self.controller(initial=1)
+
+        async def go():
+            await controller.acquire()
+            waiting = asyncio.ensure_future(controller.acquire())
+            await asyncio.sleep(0)
+            controller.release()  # resolves the waiter's future...
+            waiting.cancel()      # ...before the waiter runs
+            await asyncio.gather(waiting, return_exceptions=True)
+            assert controller._in_flight == 0
+
+        asyncio.run(go())
+
+    def test_backoffs_retries_reach_the_fan_outs_controller(self, monkeypatch):
+        """The retry hook has only backoff's details to go on; the controller comes from the tile task's
+        context, which _gather_tiles sets before creating the tasks."""
+        controller, clock = self.controller(initial=8, ceiling=16)
+
+        async def fake_download_tile(session, tile):
+            gsv._note_tile_retry({'exception': throttled()})
+            return tile[0], tile[1], b'body'
+
+        monkeypatch.setattr(gsv, '_download_tile', fake_download_tile)
+
+        asyncio.run(gsv._gather_tiles(None, [(0, 0, 'u')], None, controller))
+
+        assert controller.retries == 1
+        assert controller.cuts == {'429': 1}
+        assert gsv._active_concurrency.get() is None
+        gsv._note_tile_retry({'exception': throttled()})  # outside any fan-out: nothing to tell
+
+    def test_the_summary_tells_the_nights_story(self, caplog):
+        controller, clock = self.controller(initial=4)
+        complete_tiles(controller, clock, 4, 0.1)
+        clock.now += 60
+        complete_tiles(controller, clock, 1, 0.1, asyncio.TimeoutError())
+
+        with caplog.at_level(logging.INFO):
+            controller.log_summary()
+
+        assert ('tile concurrency: started at 4, ended at 2 (range 2-5) over 5 tiles and 0 retried attempts; '
+                'cuts: 1 on timeout; history: 0s:4 0s:5 60s:2') in caplog.text
+
+    def test_a_long_history_is_trimmed_in_the_summary(self, caplog, monkeypatch):
+        monkeypatch.setattr(gsv, 'TILE_CONCURRENCY_HISTORY_SHOWN', 2)
+        controller, clock = self.controller(initial=1, ceiling=8)
+        complete_tiles(controller, clock, 20, 0.1)
+
+        with caplog.at_level(logging.INFO):
+            controller.log_summary()
+
+        assert 'history (last 2 changes): ' in caplog.text
+        assert 'cuts: none' in caplog.text
+
+    def test_no_tiles_no_summary(self, caplog):
+        controller, clock = self.controller()
+        with caplog.at_level(logging.INFO):
+            controller.log_summary()
+        assert caplog.text == ''
+
+
+class TestTheRunScopedTileSession:
+    """gsv.TileSession: one event loop and one keep-alive pool for every pano in a run, probes included.
+
+    Served from a loopback aiohttp server rather than a fake session, because what is being pinned is the
+    pool's actual behaviour: connections are reused across panos instead of re-handshaken per pano.
+    """
+
+    @pytest.fixture
+    def cbk(self, monkeypatch):
+        """A loopback stand-in for the CBK host: every request gets a solid 512px JPEG; records each
+        request's client port (one per TCP connection) and URL."""
+        from aiohttp import web
+
+        body = jpeg_bytes(RED)
+        seen = SimpleNamespace(ports=set(), urls=[])
+
+        async def tile(request):
+            seen.ports.add(request.transport.get_extra_info('peername')[1])
+            seen.urls.append(str(request.url))
+            return web.Response(body=body, content_type='image/jpeg')
+
+        loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get('/cbk', tile)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        loop.run_until_complete(site.start())
+        port = runner.addresses[0][1]
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        monkeypatch.setattr(gsv, '_CBK_BASE_URL', 'http://127.0.0.1:%d/cbk?output=tile' % port)
+        monkeypatch.setattr(gsv, '_proxies', {'http': None, 'https': None})
+        yield seen
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    def pano(self, letter):
+        return {'pano_id': 'sessionPano%s' % (letter * 11), 'width': 1024, 'height': 512}
+
+    def test_every_pano_and_probe_rides_one_pool(self, tmp_path, monkeypatch, cbk, caplog):
+        monkeypatch.setattr(gsv, 'thread_count', 2)
+
+        with caplog.at_level(logging.INFO), gsv.tile_session():
+            for letter in 'ABC':
+                assert gsv.download_single_pano(str(tmp_path), self.pano(letter)) == DownloadResult.success
+
+        # 3 panos x (the zoom-5 probe, which is tile (0, 0), + the rest of a 2x1 grid): six requests, all
+        # through the session's pool.
+        assert len(cbk.urls) == 6
+        assert sum('x=0&y=0' in url for url in cbk.urls) == 3
+        # Never more connections than the controller allows - a per-pano pool would open at least one per pano.
+        assert len(cbk.ports) <= 2
+        # ...and the controller's night is in scrape.log once the session closes.
+        assert 'tile concurrency: started at 2' in caplog.text
+
+    def test_without_a_session_a_pano_still_downloads_on_a_one_shot_pool(self, tmp_path, cbk):
+        assert gsv._tile_session is None
+        assert gsv.download_single_pano(str(tmp_path), self.pano('A')) == DownloadResult.success
+        assert len(cbk.urls) == 2
+
+    def test_worker_threads_share_the_one_loop(self, tmp_path, cbk):
+        """The --pano-workers shape: several threads handing panos to the same session at once."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        with gsv.tile_session() as session:
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                results = list(pool.map(lambda letter: gsv.download_single_pano(str(tmp_path), self.pano(letter)),
+                                        'ABC'))
+            loop_threads = [t for t in threading.enumerate() if t.name == 'gsv-tile-loop']
+
+        assert results == [DownloadResult.success] * 3
+        assert len(loop_threads) == 1
+        assert session.http is None, 'closed on exit'
+        assert not any(t.name == 'gsv-tile-loop' for t in threading.enumerate()), 'the loop thread is joined'
+
+    def test_an_unused_session_starts_nothing_and_the_previous_one_is_restored(self):
+        before = set(threading.enumerate())
+        with gsv.tile_session() as outer:
+            with gsv.tile_session() as inner:
+                assert gsv._tile_session is inner
+            assert gsv._tile_session is outer
+        assert gsv._tile_session is None
+        assert set(threading.enumerate()) == before
+
+    def test_a_probe_without_a_session_draws_on_the_host_tile_budget(self, monkeypatch):
+        draws = []
+        monkeypatch.setattr(gsv, '_host_tile_limiter', SimpleNamespace(wait=lambda: draws.append(1)))
+        monkeypatch.setattr(gsv, '_get_response', lambda url, session, stream=False: BytesIO(b'body'))
+
+        assert gsv._probe_body('https://tile.invalid/5') == b'body'
+        assert draws == [1]
+
+    def test_a_failed_probe_raises_rather_than_picking_a_zoom(self, monkeypatch):
+        boom = aiohttp.ClientError('probe died')
+
+        async def fake_download_tiles(tiles, on_tile=None):
+            return [boom]
+
+        monkeypatch.setattr(gsv, '_download_tiles', fake_download_tiles)
+
+        with gsv.tile_session():
+            with pytest.raises(aiohttp.ClientError, match='probe died'):
+                gsv._probe_body('https://tile.invalid/5')
+
+    def test_closing_cancels_a_fan_out_still_in_flight(self):
+        """A SIGTERM lands in the main thread; the abandoned pano's tasks must not outlive the pool."""
+        started = threading.Event()
+        cancelled = threading.Event()
+
+        async def hang():
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with gsv.tile_session() as session:
+            worker = threading.Thread(target=lambda: pytest.raises(BaseException, session.run, hang()),
+                                      daemon=True)
+            worker.start()
+            assert started.wait(5)
+
+        worker.join(5)
+        assert cancelled.is_set()
+
+
+class TestTheTileCacheAcrossAttempts:
+    """A pano that fails part-way spills the tiles it did get (tile_cache.py); its retry fetches only the rest."""
+
+    PANO = {'pano_id': 'cachedPanoAAAAAAAAAAAA', 'width': 2048, 'height': 1024}  # a 4x2 grid at zoom 5
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        from downloaders.tile_cache import TileCache
+        return TileCache(str(tmp_path / 'tile_cache'), max_bytes=10 * 1024 * 1024)
+
+    @pytest.fixture
+    def fan_out(self, monkeypatch):
+        """The session's fan-out, probes included: every tile a RED body except those listed in `failing`.
+        Bodies are streamed to on_tile when `streaming` is set, as the real fan-out does."""
+        state = SimpleNamespace(failing=set(), streaming=False, requested=[])
+
+        async def fake_download_tiles(tiles, on_tile=None):
+            results = []
+            for x, y, url in tiles:
+                if (x, y) == (0, 0):  # a zoom probe; the fan-out itself never asks for the probe's cell
+                    results.append((x, y, jpeg_bytes(RED if 'zoom=5&' in url else (0, 0, 0))))
+                    continue
+                state.requested.append((x, y))
+                if (x, y) in state.failing:
+                    results.append(aiohttp.ClientError('tile (%d, %d) timed out' % (x, y)))
+                elif state.streaming and on_tile is not None:
+                    on_tile(x, y, jpeg_bytes(RED))
+                    results.append((x, y, None))
+                else:
+                    results.append((x, y, jpeg_bytes(RED)))
+            return results
+
+        monkeypatch.setattr(gsv, '_download_tiles', fake_download_tiles)
+        return state
+
+    def attempt(self, tmp_path, cache):
+        with gsv.tile_session(cache=cache):
+            return gsv.download_single_pano(str(tmp_path), self.PANO)
+
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_a_failed_pano_spills_what_it_got_and_the_retry_fetches_only_the_rest(self, tmp_path, cache, fan_out,
+                                                                                  streaming, no_retry_pass_delay):
+        fan_out.streaming = streaming
+        fan_out.failing = {(3, 1)}
+        with pytest.raises(aiohttp.ClientError):
+            self.attempt(tmp_path, cache)
+
+        # Everything but the failed cell and the probe's, which every attempt fetches anyway.
+        assert set(cache.load(self.PANO['pano_id'], 5)) == {(1, 0), (2, 0), (3, 0), (0, 1), (1, 1), (2, 1)}
+
+        fan_out.failing, fan_out.requested = set(), []
+        assert self.attempt(tmp_path, cache) == DownloadResult.success
+
+        assert fan_out.requested == [(3, 1)]
+        assert not os.path.exists(os.path.join(cache.root, self.PANO['pano_id']))
+        with Image.open(tmp_path / 'ca' / (self.PANO['pano_id'] + '.jpg')) as saved:
+            assert saved.size == (2048, 1024)
+            assert_color(saved.getpixel((2047, 1023)), RED)
+            assert_color(saved.getpixel((600, 100)), RED)
+
+    def test_a_clean_download_writes_nothing_to_the_cache(self, tmp_path, cache, fan_out):
+        assert self.attempt(tmp_path, cache) == DownloadResult.success
+        assert not os.path.exists(cache.root)
+
+    def test_a_cached_body_that_will_not_decode_is_dropped_and_fetched_afresh(self, tmp_path, cache, fan_out):
+        cache.put(self.PANO['pano_id'], 5, [(1, 0, b'not a jpeg')])
+
+        with pytest.raises(UnidentifiedImageError):
+            self.attempt(tmp_path, cache)
+        assert cache.load(self.PANO['pano_id'], 5) == {}
+
+        assert self.attempt(tmp_path, cache) == DownloadResult.success
+        assert (1, 0) in fan_out.requested
+
+    def test_a_spill_at_the_other_zoom_is_dropped_once_the_pano_succeeds(self, tmp_path, cache, fan_out):
+        cache.put(self.PANO['pano_id'], 3, [(1, 0, jpeg_bytes(RED))])
+
+        assert self.attempt(tmp_path, cache) == DownloadResult.success
+
+        assert len(fan_out.requested) == 7, 'a zoom-3 body is no use to a zoom-5 stitch'
+        assert cache.size_bytes() == 0
+
+
+class TestTheRunDeadline:
+    """common.deadline reaches into the fan-out: a pano still fetching tiles when the image phase's budget ends
+    is cut off - every tile request cancelled, nothing written - rather than overrunning the cron slot."""
+
+    PANO = TestTheTileCacheAcrossAttempts.PANO
+
+    @pytest.fixture
+    def stalled_fan_out(self, monkeypatch):
+        """The session's fan-out, probes answered at once, that streams two tiles and then hangs on the rest.
+        Records whether the hang was cancelled."""
+        state = SimpleNamespace(requested=[], cancelled=False)
+
+        async def fake_download_tiles(tiles, on_tile=None):
+            if tiles[0][:2] == (0, 0):
+                state.requested.append('probe')
+                return [(0, 0, jpeg_bytes(RED))]
+            state.requested.extend(tile[:2] for tile in tiles)
+            for x, y, _url in tiles[:2]:
+                on_tile(x, y, jpeg_bytes(RED))
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                state.cancelled = True
+                raise
+
+        monkeypatch.setattr(gsv, '_download_tiles', fake_download_tiles)
+        return state
+
+    def test_a_fan_out_running_past_the_deadline_is_cancelled(self, tmp_path, stalled_fan_out):
+        started = time.monotonic()
+        with gsv.tile_session(), deadline(time.monotonic() + 0.5):
+            with pytest.raises(DeadlineExceeded):
+                gsv.download_single_pano(str(tmp_path), self.PANO)
+
+        assert time.monotonic() - started < 10
+        assert stalled_fan_out.cancelled
+        assert os.listdir(tmp_path / 'ca') == []
+
+    def test_what_arrived_before_the_deadline_is_kept_for_next_run(self, tmp_path, stalled_fan_out):
+        from downloaders.tile_cache import TileCache
+        cache = TileCache(str(tmp_path / 'tile_cache'), max_bytes=10 * 1024 * 1024)
+
+        with gsv.tile_session(cache=cache), deadline(time.monotonic() + 0.5):
+            with pytest.raises(DeadlineExceeded):
+                gsv.download_single_pano(str(tmp_path), self.PANO)
+
+        assert set(cache.load(self.PANO['pano_id'], 5)) == {(1, 0), (2, 0)}
+
+    def test_nothing_is_requested_once_it_has_passed(self, tmp_path, stalled_fan_out):
+        with gsv.tile_session(), deadline(time.monotonic() - 1):
+            with pytest.raises(DeadlineExceeded):
+                gsv.download_single_pano(str(tmp_path), self.PANO)
+
+        assert stalled_fan_out.requested == []
+
+    def test_a_one_shot_loop_is_cut_off_too(self):
+        with deadline(time.monotonic() + 0.2), pytest.raises(DeadlineExceeded):
+            gsv._run_tile_coroutine(asyncio.sleep(60))
+
+    def test_without_one_nothing_is_cut_off(self):
+        assert gsv._run_tile_coroutine(asyncio.sleep(0, result='done')) == 'done'
+
 
 class TestAnEmptyFanOutStillHasACellSize:
 
     def test_no_tiles_yields_the_nominal_tile_size(self):
         """`max()` over an empty sequence raises, which would turn a zero-tile fan-out from "mostly black,
         refused by the black guard" into an unexplained ValueError with no pano id attached."""
-        assert gsv._stitch_cell_size([]) == (gsv.TILE_SIZE, gsv.TILE_SIZE)
+        stitch = streamed([], (1024, 512))
+        assert stitch.cell_size == (gsv.TILE_SIZE, gsv.TILE_SIZE)
+        assert gsv._black_fraction(stitch.image) == 1.0
@@ -356,17 +356,29 @@ class TestTheContractTheseFixturesImply:
     """The three module-level facts, restated as assertions against gsv's helpers, so a future change to
     either the helpers or the fixtures has to face them together."""
 
+    @staticmethod
+    def stitch(tiles):
+        """Run `tiles` through gsv's stitch, rebased so the block's top-left cell is (0, 0)."""
+        x0, y0 = min(x for x, _y, _ in tiles), min(y for _x, y, _ in tiles)
+        zoom_dims = (gsv.TILE_SIZE * (max(x for x, _y, _ in tiles) - x0 + 1),
+                     gsv.TILE_SIZE * (max(y for _x, y, _ in tiles) - y0 + 1))
+        stitch = gsv._StreamingStitch(zoom_dims)
+        for x, y, body in tiles:
+            stitch.add(x - x0, y - y0, body)
+        stitch.finish(zoom_dims)
+        return stitch
+
     def test_stitch_cell_size_is_the_largest_body_in_the_fanout(self):
         tiles = [(x, y, fixture_bytes(name)) for name, x, y, _ in MIXED_BLOCK]
-        assert gsv._stitch_cell_size(tiles) == (512, 512)
+        assert self.stitch(tiles).cell_size == (512, 512)
 
     def test_an_all_degraded_fanout_stitches_at_the_degraded_cell_size(self):
         tiles = [(x, y, fixture_bytes(name)) for name, x, y, sz in MIXED_BLOCK if sz == (256, 256)]
-        assert gsv._stitch_cell_size(tiles) == (256, 256)
+        assert self.stitch(tiles).cell_size == (256, 256)
 
     def test_undersized_bodies_are_counted_so_the_run_can_say_so(self):
         tiles = [(x, y, fixture_bytes(name)) for name, x, y, _ in MIXED_BLOCK]
-        assert gsv._undersized_tile_count(tiles) == 2
+        assert self.stitch(tiles).undersized == 2
 
 
 # --- opt-in live checks ---------------------------------------------------------------------------------
@@ -490,14 +502,13 @@ def test_live_full_download_has_no_undersized_tiles(tmp_path, monkeypatch):
     """End to end, on the production path: a real pano download must now report zero undersized bodies.
     Before the fover fix this was 320 of 512."""
     seen = {}
-    real = gsv._undersized_tile_count
 
-    def counting(tile_results):
-        seen['undersized'] = real(tile_results)
-        seen['total'] = len(tile_results)
-        return seen['undersized']
+    class CountingStitch(gsv._StreamingStitch):
+        def finish(self, final_dims):
+            seen['undersized'], seen['total'] = self.undersized, self.count
+            return super().finish(final_dims)
 
-    monkeypatch.setattr(gsv, '_undersized_tile_count', counting)
+    monkeypatch.setattr(gsv, '_StreamingStitch', CountingStitch)
     label, pano_id, width, height = LIVE_PANOS[0]
     Image.MAX_IMAGE_PIXELS = None
 
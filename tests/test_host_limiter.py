@@ -0,0 +1,239 @@
+"""Tests for downloaders/host_limiter.py: the token bucket every DownloadRunner on a host draws from.
+
+The bucket arithmetic and the fair share are driven through one process with a fake clock (a second member
+is a second instance with another member id - the file cannot tell the difference). The one thing a single
+process cannot show, that two real processes actually share the budget, gets a subprocess test of its own.
+"""
+
+import asyncio
+import errno
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from downloaders import host_limiter
+from downloaders.host_limiter import HostRateLimiter
+
+needs_flock = pytest.mark.skipif(host_limiter.fcntl is None, reason='flock is unavailable on this platform')
+pytestmark = needs_flock
+
+
+def limiter(tmp_path, clock, rate=10.0, burst=4, member='1001'):
+    bucket = HostRateLimiter(str(tmp_path / 'tiles.bucket'), rate, burst=burst, clock=clock)
+    bucket._member = member
+    return bucket
+
+
+class TestTheBucket:
+    def test_a_full_bucket_answers_at_once_then_spaces_requests_at_the_rate(self, tmp_path, clock):
+        bucket = limiter(tmp_path, clock, rate=10.0, burst=4)
+
+        assert [bucket.reserve() for _ in range(4)] == [0.0] * 4
+        # Empty: the next ones reserve slots 0.1s apart.
+        assert bucket.reserve() == pytest.approx(0.1)
+        assert bucket.reserve() == pytest.approx(0.2)
+
+    def test_it_refills_with_time_up_to_the_burst(self, tmp_path, clock):
+        bucket = limiter(tmp_path, clock, rate=10.0, burst=4)
+        for _ in range(4):
+            bucket.reserve()
+
+        clock.now += 0.25
+        assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+        assert bucket.reserve() == pytest.approx(0.05)
+
+        clock.now += 3600
+        assert [bucket.reserve() for _ in range(4)] == [0.0] * 4
+        assert bucket.reserve() > 0
+
+    def test_a_clock_that_goes_backwards_refills_nothing(self, tmp_path, clock):
+        bucket = limiter(tmp_path, clock, rate=10.0, burst=1)
+        bucket.reserve()
+
+        clock.now -= 3600
+        assert bucket.reserve() == pytest.approx(0.1)
+
+    def test_the_burst_defaults_to_one_seconds_worth(self, tmp_path):
+        assert HostRateLimiter(str(tmp_path / 'b'), 25).burst == 25
+        assert HostRateLimiter(str(tmp_path / 'b'), 0.5).burst == 1
+
+    def test_a_damaged_bucket_file_starts_a_fresh_bucket(self, tmp_path, clock):
+        (tmp_path / 'tiles.bucket').write_text('{"tokens": 0.0, "sta')
+        bucket = limiter(tmp_path, clock)
+
+        assert bucket.reserve() == 0.0
+        state = json.loads((tmp_path / 'tiles.bucket').read_text())
+        assert state['tokens'] == 3
+
+    def test_a_bucket_that_cannot_be_opened_lets_requests_through_and_says_so_once(self, tmp_path, clock, caplog):
+        bucket = HostRateLimiter(str(tmp_path / 'missing-dir' / 'tiles.bucket'), 10, clock=clock)
+
+        assert bucket.reserve() == 0.0
+        assert bucket.reserve() == 0.0
+        assert caplog.text.count('is unusable') == 1
+
+    def test_a_filesystem_without_flock_lets_requests_through_and_says_so_once(self, tmp_path, clock, caplog,
+                                                                                monkeypatch):
+        def no_locks(f, operation):
+            raise OSError(errno.ENOLCK, 'No locks available')
+
+        monkeypatch.setattr(host_limiter.fcntl, 'flock', no_locks)
+        bucket = limiter(tmp_path, clock)
+
+        assert bucket.reserve() == 0.0
+        assert bucket.reserve() == 0.0
+        assert caplog.text.count('is unusable') == 1
+
+    def test_a_full_disk_under_the_write_lets_requests_through(self, tmp_path, clock, caplog, monkeypatch):
+        def disk_full(state, f):
+            raise OSError(errno.ENOSPC, 'No space left on device')
+
+        monkeypatch.setattr(host_limiter.json, 'dump', disk_full)
+
+        assert limiter(tmp_path, clock).reserve() == 0.0
+        assert 'is unusable' in caplog.text
+
+    @pytest.mark.parametrize('members', [
+        {'1002': {'seen': 'yesterday', 'slots': []}},
+        {'1002': {'slots': [1.0]}},
+        {'1002': {'seen': 1_800_000_000.0, 'slots': None}},
+        {'1002': {'seen': 1_800_000_000.0, 'slots': ['soon']}},
+        {'1002': []},
+    ])
+    def test_a_member_entry_it_cannot_read_is_dropped_not_the_bucket(self, tmp_path, clock, members):
+        (tmp_path / 'tiles.bucket').write_text(json.dumps({'tokens': 0.0, 'stamp': clock.now,
+                                                           'members': members}))
+        bucket = limiter(tmp_path, clock)
+
+        assert bucket.reserve() == pytest.approx(0.1), 'the token count survives'
+        assert set(json.loads((tmp_path / 'tiles.bucket').read_text())['members']) == {'1001'}
+
+    def test_a_bucket_missing_its_stamp_starts_afresh(self, tmp_path, clock):
+        (tmp_path / 'tiles.bucket').write_text(json.dumps({'tokens': 0.0, 'members': {}}))
+
+        assert limiter(tmp_path, clock).reserve() == 0.0
+
+
+class TestFairSharing:
+    def test_a_member_may_only_queue_its_share_ahead(self, tmp_path, clock):
+        greedy = limiter(tmp_path, clock, rate=10.0, burst=4, member='1001')
+        polite = limiter(tmp_path, clock, rate=10.0, burst=4, member='1002')
+        polite.reserve()  # joins: two active members, so a share of 4 // 2 = 2 reservations each
+        for _ in range(3):
+            greedy.reserve()  # drains the bucket
+
+        assert greedy.reserve() is not None
+        assert greedy.reserve() is not None
+        assert greedy.reserve() is None, 'over its share: ask again later'
+        assert polite.reserve() is not None, 'the other city still gets a slot'
+
+    def test_reservations_that_have_come_due_free_the_share(self, tmp_path, clock):
+        bucket = limiter(tmp_path, clock, rate=10.0, burst=1)
+        bucket.reserve()
+        assert bucket.reserve() == pytest.approx(0.1)
+        assert bucket.reserve() is None
+
+        clock.now += 0.15
+        assert bucket.reserve() is not None
+
+    def test_a_member_that_has_gone_quiet_stops_counting(self, tmp_path, clock):
+        gone = limiter(tmp_path, clock, rate=10.0, burst=4, member='1001')
+        alone = limiter(tmp_path, clock, rate=10.0, burst=4, member='1002')
+        gone.reserve()
+        clock.now += host_limiter.MEMBER_TTL_SECONDS + 1
+        for _ in range(4):
+            alone.reserve()
+
+        # Alone again, so the whole burst of 4 may be queued.
+        assert [alone.reserve() is not None for _ in range(5)] == [True] * 4 + [False]
+        assert set(json.loads((tmp_path / 'tiles.bucket').read_text())['members']) == {'1002'}
+
+
+class TestWaiting:
+    def test_wait_sleeps_its_slot_and_asks_again_when_over_its_share(self, tmp_path, monkeypatch):
+        answers = iter([None, 0.3])
+        slept = []
+        bucket = HostRateLimiter(str(tmp_path / 'b'), 10)
+        monkeypatch.setattr(bucket, 'reserve', lambda: next(answers))
+        monkeypatch.setattr(host_limiter.time, 'sleep', slept.append)
+
+        bucket.wait()
+
+        assert slept == [pytest.approx(0.1), 0.3]
+
+    def test_wait_async_yields_the_loop_instead(self, tmp_path, monkeypatch):
+        answers = iter([None, 0.01])
+        bucket = HostRateLimiter(str(tmp_path / 'b'), 100)
+        monkeypatch.setattr(bucket, 'reserve', lambda: next(answers))
+
+        asyncio.run(bucket.wait_async())
+
+    def test_wait_async_claims_off_the_event_loop_thread(self, tmp_path, monkeypatch):
+        # The flock blocks while another process holds it: never on the loop every tile shares.
+        claimed_on = []
+        bucket = HostRateLimiter(str(tmp_path / 'b'), 100)
+        monkeypatch.setattr(bucket, 'reserve', lambda: claimed_on.append(threading.get_ident()) or 0.0)
+
+        asyncio.run(bucket.wait_async())
+
+        assert claimed_on and claimed_on[0] != threading.get_ident()
+
+    def test_a_free_token_means_no_sleep(self, tmp_path, monkeypatch):
+        slept = []
+        monkeypatch.setattr(host_limiter.time, 'sleep', slept.append)
+        HostRateLimiter(str(tmp_path / 'b'), 10).wait()
+        assert slept == []
+
+
+class TestFromConfig:
+    @pytest.mark.parametrize('directory, rate', [(None, 10), ('', 10), ('set', 0), ('set', None)])
+    def test_off_unless_both_a_directory_and_a_rate_are_set(self, tmp_path, directory, rate):
+        if directory:
+            directory = str(tmp_path / directory)
+        assert host_limiter.from_config(directory, 'tiles', rate) is None
+
+    def test_one_bucket_file_per_name_under_the_directory(self, tmp_path):
+        bucket = host_limiter.from_config(str(tmp_path / 'limits'), 'depth', 2)
+        assert bucket.path == str(tmp_path / 'limits' / 'depth.bucket')
+        assert bucket.rate == 2.0
+        assert (tmp_path / 'limits').is_dir()
+
+    def test_an_unusable_directory_disables_it_with_a_warning(self, tmp_path, caplog):
+        (tmp_path / 'limits').write_text('a file, not a directory')
+        assert host_limiter.from_config(str(tmp_path / 'limits'), 'tiles', 10) is None
+        assert 'tiles requests are not host-limited' in caplog.text
+
+
+DRAW = '''
+import sys, time
+sys.path.insert(0, sys.argv[1])
+from downloaders.host_limiter import HostRateLimiter
+bucket = HostRateLimiter(sys.argv[2], rate=50, burst=5)
+print(time.time(), flush=True)
+for _ in range(20):
+    bucket.wait()
+print(time.time(), flush=True)
+'''
+
+
+def test_two_processes_share_one_budget(tmp_path):
+    """Two runs drawing 20 requests each from a 50/s bucket with a burst of 5 take (40 - 5) / 50 = 0.7s
+    together. Each alone would be done in (20 - 5) / 50 = 0.3s - which is what two per-process throttles
+    would let through, at twice the host's rate."""
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    bucket = str(tmp_path / 'tiles.bucket')
+    runs = [subprocess.Popen([sys.executable, '-c', DRAW, repo, bucket], stdout=subprocess.PIPE, text=True)
+            for _ in range(2)]
+    stamps = [[float(line) for line in run.communicate(timeout=30)[0].split()] for run in runs]
+
+    started = min(first for first, _last in stamps)
+    finished = max(last for _first, last in stamps)
+    assert finished - started >= 0.7 - 0.05
+    # And both made progress throughout, rather than one finishing before the other started.
+    assert all(last - first >= 0.3 for first, last in stamps)
+    assert time.time() - started < 30
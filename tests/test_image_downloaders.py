@@ -12,12 +12,14 @@ Network-free: the Mapillary tests install a fake session, and the GSV tests stub
 import io
 import os
 import sys
+import threading
 
 import pytest
 import requests
 from PIL import Image
 
 import downloaders
+from downloaders import common
 from downloaders.common import DownloadResult, atomic_output_path
 
 from conftest import posix_only
@@ -87,6 +89,27 @@ class TestAtomicOutputPath:
         assert not os.path.exists(final)
         assert not os.path.exists(final + '.part')
 
+    def test_a_failed_write_is_marked_as_the_stores(self, tmp_path):
+        final = str(tmp_path / 'pano.jpg')
+
+        with pytest.raises(OSError) as raised:
+            with atomic_output_path(final):
+                raise OSError(5, 'Input/output error')
+
+        assert common.is_storage_failure(raised.value)
+
+    @pytest.mark.parametrize('error', [requests.exceptions.ChunkedEncodingError('reset'), RuntimeError('a bug')])
+    def test_network_errors_and_bugs_are_not(self, tmp_path, error):
+        """requests' errors subclass OSError, and mapillary streams into the .part from inside the block."""
+        final = str(tmp_path / 'pano.jpg')
+
+        with pytest.raises(type(error)) as raised:
+            with atomic_output_path(final):
+                raise error
+
+        assert not common.is_storage_failure(raised.value)
+        assert not common.is_storage_failure(requests.ConnectionError('not raised in a write at all'))
+
     @posix_only
     def test_the_renamed_file_is_group_writable(self, tmp_path):
         final = str(tmp_path / 'pano.jpg')
@@ -97,6 +120,60 @@ class TestAtomicOutputPath:
         assert os.stat(final).st_mode & 0o777 == 0o664
 
 
+class TestWriteBehind:
+    """common.WriteBehind / write_behind / deferred_write: the pool a stitched pano's encode and write go to."""
+
+    def test_without_a_writer_the_write_runs_inline(self):
+        assert common.deferred_write(lambda: DownloadResult.success) == DownloadResult.success
+
+    def test_with_one_the_caller_gets_a_future_of_the_verdict(self):
+        with common.write_behind(1):
+            future = common.deferred_write(lambda: DownloadResult.fallback_success)
+            assert future.result(timeout=10) == DownloadResult.fallback_success
+
+    def test_submits_past_twice_the_workers_wait_for_a_write_to_finish(self):
+        release = threading.Event()
+        writer = common.WriteBehind(1)
+        try:
+            running = writer.submit(lambda: release.wait(10))
+            queued = writer.submit(lambda: DownloadResult.success)
+            third = threading.Thread(target=writer.submit, args=(lambda: DownloadResult.success,))
+            third.start()
+            third.join(0.1)
+            assert third.is_alive(), "a third write for a one-thread writer should have blocked"
+            release.set()
+            third.join(10)
+            assert not third.is_alive()
+            assert running.result(timeout=10) and queued.result(timeout=10) == DownloadResult.success
+        finally:
+            release.set()
+            writer.close()
+
+    def test_close_finishes_running_writes_and_drops_queued_ones(self):
+        release = threading.Event()
+        writer = common.WriteBehind(1)
+        running = writer.submit(lambda: release.wait(10) and DownloadResult.success)
+        queued = writer.submit(lambda: DownloadResult.success)
+        threading.Timer(0.05, release.set).start()
+
+        writer.close()
+
+        assert running.result() == DownloadResult.success
+        assert queued.cancelled()
+
+    def test_zero_workers_installs_nothing(self):
+        with common.write_behind(0) as writer:
+            assert writer is None
+            assert common._write_behind is None
+
+    def test_the_previous_writer_is_restored(self):
+        with common.write_behind(1) as outer:
+            with common.write_behind(2) as inner:
+                assert common._write_behind is inner
+            assert common._write_behind is outer
+        assert common._write_behind is None
+
+
 class TestDownloadResultIsARealEnum:
     """#52 item 2. `DownloadResult` was a hand-rolled class whose members were tuple indices, which cost
     three things the stdlib gives away: `skipped` was 0 and therefore FALSY (so `if result:` anywhere
@@ -156,6 +233,7 @@ class FakeSession:
     def __init__(self, *responses):
         self.responses = list(responses)
         self.urls = []
+        self.timeouts = []
 
     def __enter__(self):
         return self
@@ -165,6 +243,7 @@ class FakeSession:
 
     def get(self, url, **kwargs):
         self.urls.append(url)
+        self.timeouts.append(kwargs.get('timeout'))
         return self.responses.pop(0)
 
 
@@ -250,6 +329,83 @@ class TestMapillaryTransientConditions:
         assert os.listdir(tmp_path / '12') == ['%s.jpg' % MAPILLARY_PANO['pano_id']]
 
 
+class TestMapillaryAtTheDeadline:
+    """Under the image phase's deadline (common.deadline) a Mapillary download is cut off like a GSV fan-out:
+    its timeouts are capped by the time left, and a stream still running when it passes is abandoned."""
+
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(common.time, 'monotonic', lambda: now[0])
+        return now
+
+    def test_timeouts_are_capped_by_the_time_left(self, monkeypatch, tmp_path, mapillary_token, clock):
+        session = FakeSession(FakeResponse(payload={'thumb_original_url': 'https://cdn/x.jpg'}),
+                              FakeResponse(chunks=[jpeg_bytes(120)]))
+        monkeypatch.setattr(downloaders.mapillary, '_session', lambda: session)
+
+        with common.deadline(1060.0):
+            downloaders.mapillary.download_single_pano(str(tmp_path), MAPILLARY_PANO)
+
+        assert session.timeouts == [30, 60]
+
+    def test_a_stream_running_past_it_leaves_nothing_behind(self, monkeypatch, tmp_path, mapillary_token, clock):
+        class SlowStream(FakeResponse):
+            def iter_content(self, chunk_size=None):
+                yield b'\xff\xd8\xff\xe0 partial'
+                clock[0] += 120
+                yield b'more'
+
+        session = FakeSession(FakeResponse(payload={'thumb_original_url': 'https://cdn/x.jpg'}), SlowStream())
+        monkeypatch.setattr(downloaders.mapillary, '_session', lambda: session)
+
+        with common.deadline(1060.0), pytest.raises(common.DeadlineExceeded):
+            downloaders.mapillary.download_single_pano(str(tmp_path), MAPILLARY_PANO)
+
+        assert os.listdir(tmp_path / '12') == []
+
+    def test_a_request_failing_after_it_was_cut_off(self, monkeypatch, tmp_path, mapillary_token, clock):
+        class TimedOut(FakeSession):
+            def get(self, url, **kwargs):
+                clock[0] += kwargs['timeout']
+                raise requests.ConnectionError('read timed out')
+
+        monkeypatch.setattr(downloaders.mapillary, '_session', TimedOut)
+
+        with common.deadline(1010.0), pytest.raises(common.DeadlineExceeded):
+            downloaders.mapillary.download_single_pano(str(tmp_path), MAPILLARY_PANO)
+
+    def test_a_request_failing_before_it_is_still_the_network(self, monkeypatch, tmp_path, mapillary_token, clock):
+        monkeypatch.setattr(downloaders.mapillary, '_session',
+                            lambda: FakeSession(FakeResponse(status_code=500)))
+
+        with common.deadline(1060.0), pytest.raises(requests.HTTPError):
+            downloaders.mapillary.download_single_pano(str(tmp_path), MAPILLARY_PANO)
+
+
+class TestTheDeadline:
+    def test_without_one_there_is_no_time_limit(self):
+        assert common.seconds_left() is None
+        assert common.request_timeout(30) == 30
+        common.check_deadline()
+
+    def test_the_time_left_never_goes_negative(self, monkeypatch):
+        monkeypatch.setattr(common.time, 'monotonic', lambda: 1000.0)
+        with common.deadline(900.0):
+            assert common.seconds_left() == 0
+            with pytest.raises(common.DeadlineExceeded):
+                common.check_deadline()
+            with pytest.raises(common.DeadlineExceeded):
+                common.request_timeout(30)
+
+    def test_the_previous_deadline_is_restored(self):
+        with common.deadline(100.0):
+            with common.deadline(None):
+                assert common.seconds_left() is None
+            assert common._deadline == 100.0
+        assert common._deadline is None
+
+
 class TestGsvAtomicSave:
     """The GSV path stitches tiles in memory and writes one JPEG at the end; that write is where a full store
     or a killed container leaves a stub behind."""
@@ -268,7 +424,7 @@ class TestGsvAtomicSave:
         # The fan-out hands back (x, y, jpeg_bytes) per tile, one entry per requested grid position
         # (#44/#45 replaced the old ['<x> <y>', bytes] pairs). Stubbing _download_tiles rather than
         # asyncio.run keeps this at the module's own seam.
-        async def fake_download_tiles(tiles):
+        async def fake_download_tiles(tiles, on_tile=None):
             return [(x, y, tile) for x, y, _url in tiles]
 
         monkeypatch.setattr(downloaders.gsv, '_download_tiles', fake_download_tiles)
@@ -291,6 +447,38 @@ class TestGsvAtomicSave:
         assert os.listdir(tmp_path / 'gs') == [], "a stub .jpg would be read as done by every later run"
 
 
+    def test_under_a_writer_the_save_happens_behind_the_download(self, monkeypatch, tmp_path, stitchable):
+        release = threading.Event()
+        real_save = Image.Image.save
+
+        def slow_save(self, fp, *args, **kwargs):
+            release.wait(10)
+            return real_save(self, fp, *args, **kwargs)
+
+        monkeypatch.setattr(Image.Image, 'save', slow_save)
+
+        with common.write_behind(1):
+            future = downloaders.gsv.download_single_pano(str(tmp_path), GSV_PANO)
+            assert not future.done()
+            assert '%s.jpg' % GSV_PANO['pano_id'] not in os.listdir(tmp_path / 'gs')
+            release.set()
+            assert future.result(timeout=10) == DownloadResult.success
+        assert os.listdir(tmp_path / 'gs') == ['%s.jpg' % GSV_PANO['pano_id']]
+
+    def test_a_failed_deferred_save_surfaces_through_the_future(self, monkeypatch, tmp_path, stitchable):
+        def full_disk(self, fp, *args, **kwargs):
+            open(fp, 'wb').write(b'\xff\xd8 truncated')
+            raise OSError(28, 'No space left on device')
+
+        monkeypatch.setattr(Image.Image, 'save', full_disk)
+
+        with common.write_behind(1):
+            future = downloaders.gsv.download_single_pano(str(tmp_path), GSV_PANO)
+            with pytest.raises(OSError):
+                future.result(timeout=10)
+        assert os.listdir(tmp_path / 'gs') == []
+
+
 class TestDownloadPanoRoutesBySource:
     """`downloaders.download_pano` itself — the dispatcher whose docstring states the #41 contract the two
     modules above are held to, and which nothing called with a real source string until #57.
@@ -391,6 +579,36 @@ class TestAnImageAlreadyOnDiskIsItsOwnResumeMarker:
             == DownloadResult.skipped
 
 
+    @pytest.mark.parametrize('download_single_pano', [downloaders.gsv.download_single_pano,
+                                                      downloaders.mapillary.download_single_pano])
+    def test_under_a_store_catalog_a_listed_shard_answers_without_a_stat(self, monkeypatch, tmp_path,
+                                                                         download_single_pano):
+        """The skip is checked before the shard dir is, so once the catalog has listed the shard
+        (downloaders/store_catalog.py) a pano already on the store costs no filesystem call of its own."""
+        shard = tmp_path / MAPILLARY_PANO['pano_id'][:2]
+        shard.mkdir()
+        (shard / (MAPILLARY_PANO['pano_id'] + '.jpg')).write_bytes(jpeg_bytes(80))
+        with downloaders.store_catalog.cataloguing() as catalog:
+            for _ in range(downloaders.store_catalog.LIST_AFTER_CHECKS):
+                catalog.isfile(str(shard / 'listed.jpg'))
+
+            def no_stat(path):
+                raise AssertionError('stat %s' % path)
+
+            monkeypatch.setattr(os.path, 'isfile', no_stat)
+            monkeypatch.setattr(os.path, 'isdir', no_stat)
+
+            assert download_single_pano(str(tmp_path), MAPILLARY_PANO) == DownloadResult.skipped
+
+    def test_a_new_pano_in_an_existing_shard_still_downloads(self, monkeypatch, tmp_path, mapillary_token):
+        (tmp_path / MAPILLARY_PANO['pano_id'][:2]).mkdir()
+        session = FakeSession(FakeResponse(payload={'thumb_original_url': 'https://cdn/x.jpg'}),
+                              FakeResponse(chunks=[jpeg_bytes(120)]))
+        monkeypatch.setattr(downloaders.mapillary, '_session', lambda: session)
+
+        assert downloaders.mapillary.download_single_pano(str(tmp_path), MAPILLARY_PANO) \
+            == DownloadResult.success
+
 class TestALostShardDirRaceDoesNotFailThePano:
     """Both downloaders chmod the shard directory they just created, and swallow PermissionError.
 
@@ -431,7 +649,7 @@ class TestALostShardDirRaceDoesNotFailThePano:
         monkeypatch.setattr(downloaders.gsv, '_get_response',
                             lambda url, session, stream=False: io.BytesIO(tile))
 
-        async def fake_download_tiles(tiles):
+        async def fake_download_tiles(tiles, on_tile=None):
             return [(x, y, tile) for x, y, _url in tiles]
 
         monkeypatch.setattr(downloaders.gsv, '_download_tiles', fake_download_tiles)
@@ -0,0 +1,118 @@
+"""Tests for downloaders/jpeg_dct.py: assembling a pano from its tiles' DCT coefficients.
+
+The mosaic and the black count are plain numpy over coefficient arrays, so they are driven here with arrays
+built by hand - no JPEG library needed. Reading and writing real JPEGs goes through jpeglib, an optional
+dependency; the round trip at the bottom runs wherever it is installed.
+"""
+
+import io
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from downloaders import jpeg_dct
+from downloaders.jpeg_dct import BLOCK, DctMosaic, IncompatibleTile, TileCoefficients
+
+QT = np.stack([np.full((8, 8), 8, dtype=np.uint16), np.full((8, 8), 9, dtype=np.uint16)])
+SAMPLING = np.array([[2, 2], [1, 1], [1, 1]])
+
+
+def tile(size=16, luma_dc=0, qt=QT, ac=0):
+    """A 4:2:0 tile `size` pixels square, every luma block flat at luma_dc (with `ac` in one AC slot)."""
+    luma = np.zeros((size // BLOCK, size // BLOCK, BLOCK, BLOCK), dtype=np.int16)
+    luma[..., 0, 0] = luma_dc
+    luma[..., 0, 1] = ac
+    chroma = np.zeros((size // 16, size // 16, BLOCK, BLOCK), dtype=np.int16)
+    return TileCoefficients((luma, chroma, chroma.copy()), qt, (0, 1, 1), SAMPLING)
+
+
+class TestTheMosaic:
+    def test_each_tile_lands_in_its_own_blocks(self):
+        mosaic = DctMosaic(3, 2, 16, tile(luma_dc=1))
+        mosaic.place(2, 1, tile(luma_dc=7))
+        mosaic.place(0, 0, tile(luma_dc=5))
+
+        luma = mosaic.planes[0]
+        assert mosaic.size == (48, 32)
+        assert luma.shape == (4, 6, 8, 8)
+        assert (luma[2:4, 4:6, 0, 0] == 7).all()
+        assert (luma[0:2, 0:2, 0, 0] == 5).all()
+        assert mosaic.planes[1].shape == (2, 3, 8, 8)
+
+    def test_a_cell_never_placed_is_black(self):
+        mosaic = DctMosaic(2, 1, 16, tile())
+
+        # -1024 / 8 exactly; floor division so that any other table's rounding still decodes to 0, not 1.
+        assert (mosaic.planes[0][..., 0, 0] == -128).all()
+        assert not mosaic.planes[1].any() and not mosaic.planes[2].any()
+        assert (DctMosaic(1, 1, 16, tile(qt=QT * 0 + 5)).planes[0][..., 0, 0] == -205).all()
+
+    @pytest.mark.parametrize('other', [tile(size=8 * BLOCK * 4), tile(qt=QT + 1)])
+    def test_a_tile_of_another_size_or_table_is_refused(self, other):
+        mosaic = DctMosaic(2, 1, 16, tile())
+        with pytest.raises(IncompatibleTile):
+            mosaic.place(1, 0, other)
+
+    def test_other_sampling_is_refused(self):
+        other = tile()._replace(samp_factor=np.array([[1, 1], [1, 1], [1, 1]]))
+        with pytest.raises(IncompatibleTile):
+            DctMosaic(2, 1, 16, tile()).place(1, 0, other)
+
+    def test_a_first_tile_that_is_not_a_grid_cell_is_refused(self):
+        with pytest.raises(IncompatibleTile):
+            DctMosaic(2, 1, 32, tile(size=16))
+
+    def test_save_writes_the_tiles_sampling_not_jpeglibs_default(self, monkeypatch):
+        written = {}
+
+        def from_dct(**kwargs):
+            written.update(kwargs)
+            return SimpleNamespace(write_dct=lambda fp: written.setdefault('fp', fp))
+
+        monkeypatch.setattr(jpeg_dct, 'jpeglib', SimpleNamespace(from_dct=from_dct))
+        DctMosaic(2, 1, 16, tile()).save('pano.jpg', 'jpeg')
+
+        assert np.array_equal(written['samp_factor'], SAMPLING)
+        assert written['fp'] == 'pano.jpg'
+
+
+class TestBlackPixels:
+    def test_flat_black_blocks_count_in_full(self):
+        assert jpeg_dct.black_pixels(tile(luma_dc=-128)) == 16 * 16
+
+    def test_a_block_with_any_texture_does_not(self):
+        assert jpeg_dct.black_pixels(tile(luma_dc=-128, ac=1)) == 0
+
+    def test_nearly_black_is_not_black(self):
+        """Night imagery: flat but one level up is real, and the guard must not count it."""
+        assert jpeg_dct.black_pixels(tile(luma_dc=-127)) == 0
+
+    def test_a_mixed_tile_counts_block_by_block(self):
+        mixed = tile(luma_dc=40)
+        mixed.planes[0][0, 1, 0, 0] = -128
+        assert jpeg_dct.black_pixels(mixed) == BLOCK * BLOCK
+
+
+def test_a_real_round_trip_matches_the_decoded_tiles(tmp_path):
+    """Two Pillow-encoded tiles, assembled without a decode, read back as the tiles they were."""
+    pytest.importorskip('jpeglib', reason='jpeglib is optional')
+    bodies = []
+    for color in [(200, 30, 30), (30, 30, 200)]:
+        buf = io.BytesIO()
+        Image.new('RGB', (512, 512), color).save(buf, 'jpeg', quality=90)
+        bodies.append(buf.getvalue())
+    tiles = [jpeg_dct.read_coefficients(body) for body in bodies]
+    mosaic = DctMosaic(2, 1, 512, tiles[0])
+    for x, coefficients in enumerate(tiles):
+        mosaic.place(x, 0, coefficients)
+
+    mosaic.save(str(tmp_path / 'pano.jpg'), 'jpeg')
+
+    with Image.open(tmp_path / 'pano.jpg') as assembled:
+        pixels = np.asarray(assembled.convert('RGB'), dtype=int)
+    expected = np.hstack([np.asarray(Image.open(io.BytesIO(body)).convert('RGB'), dtype=int) for body in bodies])
+    assert pixels.shape == expected.shape
+    # Chroma upsampling blends across the seam; everywhere else the coefficients are the tiles' own.
+    assert np.abs(pixels - expected)[:, :500].max() <= 1
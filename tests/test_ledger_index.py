@@ -0,0 +1,179 @@
+"""Tests for downloaders/ledger_index.py: the snapshot kept beside each resume ledger.
+
+The promise is that a read through the snapshot is the same answer as a full parse - after appends, after a
+crash tore the last line, after ops deleted or rewrote the ledger - and that a snapshot that cannot be used
+costs a full parse and a warning, never the run.
+"""
+
+import os
+
+import pytest
+
+from downloaders import ledger_index
+from downloaders.ledger_index import INDEX_SUFFIX, read_ledger
+
+STATUSES = ('saved', 'unavailable')
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    path = tmp_path / 'depth_log.csv'
+    path.write_text('pano_id,status\r\npanoA,saved\r\npanoB,unavailable\r\npanoA,saved\r\n', newline='')
+    return str(path)
+
+
+@pytest.fixture
+def indexed():
+    with ledger_index.indexing():
+        yield
+
+
+def append(path, text):
+    with open(path, 'a', newline='') as f:
+        f.write(text)
+
+
+def plain(path, statuses=STATUSES):
+    with ledger_index.indexing(False):
+        return read_ledger(path, statuses)
+
+
+class CountingParse:
+    """Wraps _parse to record how many bytes each read hands it."""
+
+    def __init__(self, monkeypatch):
+        self.parsed = 0
+        self._parse = ledger_index._parse
+        monkeypatch.setattr(ledger_index, '_parse', self)
+
+    def __call__(self, data, summary):
+        self.parsed += len(data)
+        return self._parse(data, summary)
+
+
+class TestAPlainRead:
+    def test_ids_and_row_counts_per_status(self, ledger):
+        summary = plain(ledger)
+
+        assert summary.ids == {'saved': {'panoA'}, 'unavailable': {'panoB'}}
+        assert summary.rows == {'saved': 2, 'unavailable': 1}
+
+    def test_rows_that_are_not_a_known_status_are_skipped(self, ledger):
+        append(ledger, 'panoC,error\r\npanoD\r\npanoE,saved,extra\r\n')
+
+        assert plain(ledger).rows == {'saved': 2, 'unavailable': 1}
+
+    def test_a_missing_ledger_is_empty(self, tmp_path):
+        assert plain(str(tmp_path / 'none.csv')).ids == {'saved': set(), 'unavailable': set()}
+
+    def test_no_snapshot_is_written(self, ledger):
+        plain(ledger)
+        assert not os.path.exists(ledger + INDEX_SUFFIX)
+
+
+@pytest.mark.usefixtures('indexed')
+class TestAnIndexedRead:
+    def test_the_first_read_writes_the_snapshot(self, ledger):
+        assert read_ledger(ledger, STATUSES) == plain(ledger)
+        assert os.path.isfile(ledger + INDEX_SUFFIX)
+
+    def test_a_later_read_parses_only_the_appended_rows(self, ledger, monkeypatch):
+        read_ledger(ledger, STATUSES)
+        append(ledger, 'panoC,saved\r\n')
+        counting = CountingParse(monkeypatch)
+
+        summary = read_ledger(ledger, STATUSES)
+
+        assert counting.parsed == len(b'panoC,saved\r\n')
+        assert summary == plain(ledger)
+        assert summary.rows['saved'] == 3
+
+    def test_the_snapshot_is_rewritten_once_the_tail_has_grown(self, ledger, monkeypatch):
+        monkeypatch.setattr(ledger_index, 'SNAPSHOT_EVERY_ROWS', 2)
+        read_ledger(ledger, STATUSES)
+        append(ledger, 'panoC,saved\r\npanoD,saved\r\n')
+        read_ledger(ledger, STATUSES)
+        counting = CountingParse(monkeypatch)
+
+        summary = read_ledger(ledger, STATUSES)
+
+        assert counting.parsed == 0
+        assert summary == plain(ledger)
+
+    def test_a_torn_last_line_is_parsed_again_once_the_next_append_completes_it(self, ledger):
+        append(ledger, 'panoC,sav')
+        assert read_ledger(ledger, STATUSES) == plain(ledger)
+
+        append(ledger, 'ed\r\n')
+        assert 'panoC' in read_ledger(ledger, STATUSES).ids['saved']
+
+    def test_a_line_a_crash_cut_short_stays_skipped_after_the_next_append(self, ledger):
+        append(ledger, 'panoC,sav')
+        read_ledger(ledger, STATUSES)
+        append(ledger, 'panoD,saved\r\n')  # glued on: "panoC,savpanoD,saved"
+
+        assert read_ledger(ledger, STATUSES) == plain(ledger)
+
+    @pytest.mark.parametrize('rewrite', [
+        'pano_id,status\r\npanoZ,saved\r\n',                                           # deleted, regrown
+        'pano_id,status\r\npanoA,saved\r\npanoB,unavailable\r\n',                      # trimmed
+        'pano_id,status\r\npanoA,saved\r\npanoX,unavailable\r\npanoA,saved\r\n',       # edited in place
+    ])
+    def test_a_ledger_replaced_since_the_snapshot_is_read_in_full(self, ledger, rewrite):
+        read_ledger(ledger, STATUSES)
+        with open(ledger, 'w', newline='') as f:
+            f.write(rewrite)
+
+        assert read_ledger(ledger, STATUSES) == plain(ledger)
+
+    def test_another_set_of_statuses_does_not_use_the_snapshot(self, ledger):
+        read_ledger(ledger, STATUSES)
+
+        assert read_ledger(ledger, ('saved',)) == plain(ledger, ('saved',))
+
+    def test_ids_survive_the_round_trip_byte_for_byte(self, tmp_path):
+        path = str(tmp_path / 'pano_id_log.csv')
+        with open(path, 'wb') as f:
+            f.write(b'pano_id,downloaded\npano\xff-A,1\n"pano,B",0\n')
+        read_ledger(path, ('0', '1'))
+
+        assert read_ledger(path, ('0', '1')) == plain(path, ('0', '1'))
+
+
+@pytest.mark.usefixtures('indexed')
+class TestBestEffort:
+    @pytest.mark.parametrize('damage', [b'', b'not an index\n', ledger_index._MAGIC + b'{"offset": 3}\n',
+                                        ledger_index._MAGIC + b'{broken\n'])
+    def test_an_unreadable_snapshot_is_read_around(self, ledger, damage, caplog):
+        with open(ledger + INDEX_SUFFIX, 'wb') as f:
+            f.write(damage)
+
+        assert read_ledger(ledger, STATUSES) == plain(ledger)
+        assert 'is unreadable' in caplog.text
+
+    def test_a_snapshot_that_fails_half_way_leaves_nothing_behind(self, ledger, caplog):
+        read_ledger(ledger, STATUSES)
+        with open(ledger + INDEX_SUFFIX, 'rb') as f:
+            data = f.read()
+        with open(ledger + INDEX_SUFFIX, 'wb') as f:
+            f.write(data[:-3])  # the last block cut short: the first decompresses, the second does not
+
+        assert read_ledger(ledger, STATUSES) == plain(ledger)
+        assert 'is unreadable' in caplog.text
+
+    def test_a_snapshot_that_cannot_be_written_is_logged(self, ledger, monkeypatch, caplog):
+        def no_rename(*args):
+            raise OSError(28, 'No space left on device')
+
+        monkeypatch.setattr(os, 'replace', no_rename)
+
+        assert read_ledger(ledger, STATUSES) == plain(ledger)
+        assert 'Could not write ledger index' in caplog.text
+
+
+def test_indexing_restores_the_previous_setting():
+    with ledger_index.indexing():
+        with ledger_index.indexing(False):
+            assert not ledger_index._enabled
+        assert ledger_index._enabled
+    assert not ledger_index._enabled
@@ -1,12 +1,14 @@
 """Tests for migrate_depth_artifacts.py: the offline rewriter that brings pre-v2 (x-mirrored) depth
-artifacts up to the v2 column order (#58).
+artifacts up to the v2 column order (#58), and compacts v3 artifacts to v4.
 
 A pre-v2 artifact stores streetlevel's raw decode - x-mirrored relative to the pano JPEG - and carries no
-'format_version' field. The migrator must flip exactly those, stamp them, leave v2 stores byte-for-byte
-alone (so it is safe to run on any store, any number of times), and touch nothing under --dry-run.
+'format_version' field. The migrator must flip exactly those, stamp them, drop the raster from v3 artifacts
+only where their planes give it back bit for bit, leave v2 and v4 stores byte-for-byte alone (so it is safe
+to run on any store, any number of times), and touch nothing under --dry-run.
 """
 
 import os
+import zipfile
 
 import numpy as np
 import pytest
@@ -46,6 +48,22 @@ def write_v2(storage, pano_id='abcdef'):
     return path
 
 
+V3_PLANES = gsv.DepthPlanes(np.array([[0, 1], [1, 0]], dtype=np.uint8),
+                            np.array([[0.0, 0.0, 0.0], [2.0, 1.0, 0.0]], dtype=np.float32),
+                            np.array([0.0, 1.5], dtype=np.float32))
+
+
+def write_v3(storage, pano_id='abcdef', depth=None):
+    """Write an artifact exactly as the v3 writer did: the plane fields plus the raster they reconstruct."""
+    path = v1_path(storage, pano_id)
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, depth=gsv._compute_depth_raster(V3_PLANES) if depth is None else depth,
+                            plane_indices=V3_PLANES.indices, planes_n=V3_PLANES.normals,
+                            planes_d=V3_PLANES.distances, heading=0.5, pitch=float('nan'), roll=1.5,
+                            format_version=3)
+    return path
+
+
 def read_bytes(path):
     with open(path, 'rb') as f:
         return f.read()
@@ -101,6 +119,101 @@ def test_current_version_artifact_is_untouched_byte_for_byte(tmp_path):
     assert read_bytes(path) == before
 
 
+class TestCompactingV3:
+    def test_the_raster_is_dropped_and_reconstructs_bit_for_bit(self, tmp_path):
+        storage = str(tmp_path)
+        path = write_v3(storage)
+        with np.load(path) as d:
+            before = {name: d[name] for name in d.files}
+
+        summary = migrate_depth_artifacts.migrate_store(storage)
+
+        assert (summary.scanned, summary.compacted, summary.migrated, summary.skipped, summary.failed) == \
+            (1, 1, 0, 0, 0)
+        with np.load(path) as d:
+            assert 'depth' not in d.files
+            assert int(d['format_version']) == 4
+            for name in ('plane_indices', 'planes_n', 'planes_d', 'heading', 'roll'):
+                np.testing.assert_array_equal(d[name], before[name])
+            assert np.isnan(float(d['pitch']))
+        np.testing.assert_array_equal(gsv.read_depth_artifact(path)['depth'], before['depth'])
+        assert sorted(os.listdir(os.path.dirname(path))) == [os.path.basename(path)]
+
+    def test_a_raster_its_planes_do_not_give_back_is_left_alone(self, tmp_path, capsys):
+        """One way only: once the raster is gone nothing else says what it was, so a v3 artifact whose stored
+        raster is not its planes' reconstruction - a hand edit, a writer bug - keeps it, and is reported."""
+        storage = str(tmp_path)
+        path = write_v3(storage, depth=np.array([[-1.0, 4.0], [4.0, -1.0]], dtype=np.float32))
+        before = read_bytes(path)
+
+        summary = migrate_depth_artifacts.migrate_store(storage)
+
+        assert (summary.compacted, summary.failed) == (0, 1)
+        assert read_bytes(path) == before
+        assert 'differs from the stored one at 2 pixel(s)' in capsys.readouterr().out
+
+    def test_a_raster_of_the_wrong_shape_is_left_alone(self, tmp_path):
+        storage = str(tmp_path)
+        path = write_v3(storage, depth=np.zeros((1, 2), dtype=np.float32))
+        before = read_bytes(path)
+
+        assert migrate_depth_artifacts.migrate_store(storage).failed == 1
+        assert read_bytes(path) == before
+
+    def test_a_dry_run_checks_the_raster_and_writes_nothing(self, tmp_path):
+        storage = str(tmp_path)
+        good = write_v3(storage, 'abcdef')
+        bad = write_v3(storage, 'ghijkl', depth=np.zeros((2, 2), dtype=np.float32))
+        before = {path: read_bytes(path) for path in (good, bad)}
+
+        summary = migrate_depth_artifacts.migrate_store(storage, dry_run=True)
+
+        assert (summary.compacted, summary.failed) == (1, 1)
+        assert {path: read_bytes(path) for path in (good, bad)} == before
+
+    def test_a_second_sweep_changes_nothing(self, tmp_path):
+        storage = str(tmp_path)
+        path = write_v3(storage)
+        migrate_depth_artifacts.migrate_store(storage)
+        after_first = read_bytes(path)
+
+        second = migrate_depth_artifacts.migrate_store(storage)
+
+        assert (second.compacted, second.skipped) == (0, 1)
+        assert read_bytes(path) == after_first
+
+    def test_main_counts_both_rewrites(self, tmp_path, monkeypatch, capsys):
+        storage = str(tmp_path)
+        write_v1(storage, 'abcdef')
+        write_v3(storage, 'ghijkl')
+        monkeypatch.setattr('sys.argv', ['migrate_depth_artifacts.py', storage])
+
+        assert migrate_depth_artifacts.main() == 0
+
+        assert '1 migrated to v2, 1 compacted to v4, 0 already current, 0 failed' in capsys.readouterr().out
+
+    def test_rewrites_use_the_codec_asked_for(self, tmp_path, monkeypatch):
+        storage = str(tmp_path)
+        v1, v3 = write_v1(storage, 'abcdef'), write_v3(storage, 'ghijkl')
+        before = gsv.read_depth_artifact(v3)['depth']
+        monkeypatch.setattr('sys.argv', ['migrate_depth_artifacts.py', storage, '--codec', 'packed:0'])
+
+        assert migrate_depth_artifacts.main() == 0
+
+        with np.load(v3) as d:
+            assert str(d['plane_indices_codec']) == 'packed'
+        np.testing.assert_array_equal(gsv.read_depth_artifact(v3)['depth'], before)
+        with zipfile.ZipFile(v1) as archive:
+            assert {info.compress_type for info in archive.infolist()} == {zipfile.ZIP_STORED}
+
+    def test_an_unknown_codec_fails_at_parse_time(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.setattr('sys.argv', ['migrate_depth_artifacts.py', str(tmp_path), '--codec', 'zstd'])
+
+        with pytest.raises(SystemExit):
+            migrate_depth_artifacts.main()
+        assert 'unknown depth codec' in capsys.readouterr().err
+
+
 def test_dry_run_reports_but_touches_nothing(tmp_path):
     storage = str(tmp_path)
     v1 = write_v1(storage, 'abcdef')
@@ -197,13 +310,13 @@ class TestAFailedRewriteLeavesTheOriginalArtifactIntact:
 
     @staticmethod
     def fail_during_save(monkeypatch, when):
-        """Make savez_compressed fail either after writing bytes, or before writing any."""
-        def failing(file, **kwargs):
+        """Make the .npz write fail either after writing bytes, or before writing any."""
+        def failing(file, *args):
             if when == 'after':
                 file.write(b'\x50\x4b\x03\x04 truncated')
             raise OSError(28, 'No space left on device')
 
-        monkeypatch.setattr(migrate_depth_artifacts.np, 'savez_compressed', failing)
+        monkeypatch.setattr(migrate_depth_artifacts, 'save_depth_fields', failing)
 
     @pytest.mark.parametrize('when', ['after', 'before'])
     def test_the_v1_artifact_survives_byte_for_byte(self, tmp_path, monkeypatch, when):
@@ -0,0 +1,95 @@
+"""Tests for downloaders/schedule.py: the order the image and depth phases spend their budgets in.
+
+The two promises 'priority' makes are statistical, so they are checked over many seeded draws: more valuable
+panos come first far more often, and no pano - however little it is worth - is ever starved of the front.
+"""
+
+import random
+
+import pytest
+
+from downloaders import schedule
+
+
+def panos(*specs):
+    """(pano_id, has_labels) pairs as pano dicts."""
+    return [{'pano_id': pano_id, 'has_labels': labelled} for pano_id, labelled in specs]
+
+
+def ids(candidates):
+    return [p['pano_id'] for p in candidates]
+
+
+@pytest.fixture(autouse=True)
+def seeded():
+    state = random.getstate()
+    random.seed(20261018)
+    yield
+    random.setstate(state)
+
+
+class TestShuffle:
+    def test_it_is_the_plain_shuffle(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(schedule.random, 'shuffle', calls.append)
+        candidates = panos(('a', True), ('b', False))
+
+        schedule.order(candidates)
+
+        assert calls == [candidates]
+
+    def test_worth_is_ignored(self):
+        firsts = set()
+        for _ in range(200):
+            candidates = panos(('labelled', True), ('unlabelled', False))
+            schedule.order(candidates, schedule.SHUFFLE)
+            firsts.add(candidates[0]['pano_id'])
+        assert firsts == {'labelled', 'unlabelled'}
+
+
+class TestPriority:
+    def test_the_valuable_pano_usually_comes_first_but_not_always(self):
+        """w_low / (w_low + w_high) = 1/33 of nights the unlabelled pano goes first: never starved."""
+        firsts = []
+        for _ in range(2000):
+            candidates = panos(('labelled', True), ('unlabelled', False))
+            schedule.order(candidates, schedule.PRIORITY)
+            firsts.append(candidates[0]['pano_id'])
+
+        assert firsts.count('unlabelled') / len(firsts) == pytest.approx(1 / 33, abs=0.01)
+
+    def test_equal_worth_is_a_uniform_shuffle(self):
+        counts = {pano_id: 0 for pano_id in 'abcd'}
+        for _ in range(4000):
+            candidates = panos(*[(pano_id, True) for pano_id in 'abcd'])
+            schedule.order(candidates, schedule.PRIORITY)
+            counts[candidates[0]['pano_id']] += 1
+
+        assert all(count == pytest.approx(1000, rel=0.1) for count in counts.values())
+
+    def test_the_labelled_backlog_is_spent_first(self):
+        candidates = panos(*[('L%03d' % i, True) for i in range(100)] + [('U%03d' % i, False) for i in range(100)])
+
+        schedule.order(candidates, schedule.PRIORITY)
+
+        head = ids(candidates)[:50]
+        assert sum(pano_id.startswith('L') for pano_id in head) >= 45
+        assert sorted(ids(candidates)) == sorted('L%03d' % i for i in range(100)) + sorted(
+            'U%03d' % i for i in range(100)), "a reorder, never a filter"
+
+    def test_a_record_without_has_labels_counts_as_labelled(self):
+        assert schedule.image_weight({'pano_id': 'a'}) == schedule.LABELLED_WEIGHT
+
+    def test_an_unknown_schedule_is_refused(self):
+        with pytest.raises(ValueError, match='Unknown schedule'):
+            schedule.order(panos(('a', True)), 'alphabetical')
+
+
+class TestDepthWorth:
+    def test_an_image_on_the_store_lifts_its_depth(self):
+        weight = schedule.depth_weight({'imaged'})
+
+        assert weight({'pano_id': 'imaged', 'has_labels': True}) == schedule.LABELLED_WEIGHT * schedule.IMAGED_WEIGHT
+        assert weight({'pano_id': 'other', 'has_labels': True}) == schedule.LABELLED_WEIGHT
+        assert weight({'pano_id': 'imaged', 'has_labels': False}) == schedule.IMAGED_WEIGHT
+        assert weight({'pano_id': 'other', 'has_labels': False}) == 1.0
@@ -0,0 +1,207 @@
+"""Tests for downloaders/store_catalog.py: existence checks answered from one listing per directory.
+
+The answer must always be os.path.isfile's (or isdir's) - for files there before the listing, files this run wrote after
+it, directories that do not exist yet and directories that cannot be listed - while the number of filesystem
+calls drops to one scandir per directory that is checked more than once.
+"""
+
+import os
+
+import pytest
+
+from downloaders import common, store_catalog
+from downloaders.store_catalog import StoreCatalog
+
+
+class CountingFs:
+    """Counts os.path.isfile and os.scandir calls made through the catalog module."""
+
+    def __init__(self, monkeypatch):
+        self.stats = self.listings = 0
+        real_isfile, real_scandir = os.path.isfile, os.scandir
+
+        def isfile(path):
+            self.stats += 1
+            return real_isfile(path)
+
+        def scandir(path):
+            self.listings += 1
+            return real_scandir(path)
+
+        monkeypatch.setattr(store_catalog.os.path, 'isfile', isfile)
+        monkeypatch.setattr(store_catalog.os, 'scandir', scandir)
+
+
+@pytest.fixture
+def shard(tmp_path):
+    shard = tmp_path / 'ab'
+    shard.mkdir()
+    for name in ('abc.jpg', 'abd.jpg', 'abc.depth.npz'):
+        (shard / name).write_bytes(b'x')
+    (shard / 'abe.jpg').mkdir()  # not a file, so not there
+    return shard
+
+
+class TestAnswers:
+    @pytest.mark.parametrize('name', ['abc.jpg', 'abd.jpg', 'abc.depth.npz', 'abe.jpg', 'abz.jpg'])
+    def test_the_same_as_isfile_before_and_after_the_listing(self, shard, name):
+        catalog = StoreCatalog()
+        path = str(shard / name)
+
+        answers = [catalog.isfile(path) for _ in range(store_catalog.LIST_AFTER_CHECKS + 1)]
+
+        assert answers == [os.path.isfile(path)] * len(answers)
+
+    def test_a_shard_that_does_not_exist_yet_has_nothing_in_it(self, tmp_path):
+        catalog = StoreCatalog()
+        assert not any(catalog.isfile(str(tmp_path / 'zz' / 'zzz.jpg')) for _ in range(3))
+
+    def test_a_file_this_run_wrote_after_the_listing_is_there(self, shard):
+        catalog = StoreCatalog()
+        for _ in range(store_catalog.LIST_AFTER_CHECKS):
+            catalog.isfile(str(shard / 'abc.jpg'))
+        (shard / 'abf.jpg').write_bytes(b'x')
+
+        catalog.added(str(shard / 'abf.jpg'))
+
+        assert catalog.isfile(str(shard / 'abf.jpg'))
+
+    def test_a_directory_that_cannot_be_listed_falls_back_to_isfile(self, shard, monkeypatch):
+        catalog = StoreCatalog()
+
+        def unlistable(path):
+            raise PermissionError(13, 'Permission denied')
+
+        monkeypatch.setattr(store_catalog.os, 'scandir', unlistable)
+
+        assert all(catalog.isfile(str(shard / 'abc.jpg')) for _ in range(3))
+        assert not catalog.isfile(str(shard / 'abz.jpg'))
+
+
+    @pytest.mark.skipif(os.name != 'posix', reason='symlinks need privileges on Windows')
+    def test_a_dangling_symlink_is_neither(self, shard):
+        (shard / 'abg.jpg').symlink_to(shard / 'gone.jpg')
+        catalog = StoreCatalog()
+        for _ in range(store_catalog.LIST_AFTER_CHECKS):
+            catalog.isfile(str(shard / 'abc.jpg'))
+
+        assert not catalog.isfile(str(shard / 'abg.jpg')) and not catalog.isdir(str(shard / 'abg.jpg'))
+
+class TestDirectories:
+    @pytest.mark.parametrize('name', ['ab', 'zz', 'ab/abc.jpg'])
+    def test_isdir_is_the_same_as_the_filesystems(self, shard, name):
+        catalog = StoreCatalog()
+        path = str(shard.parent / name)
+
+        answers = [catalog.isdir(path) for _ in range(store_catalog.LIST_AFTER_CHECKS + 1)]
+
+        assert answers == [os.path.isdir(path)] * len(answers)
+
+    def test_a_file_is_not_a_directory_and_the_other_way_round(self, shard):
+        catalog = StoreCatalog()
+        for _ in range(store_catalog.LIST_AFTER_CHECKS):
+            catalog.isfile(str(shard / 'abc.jpg'))
+
+        assert not catalog.isdir(str(shard / 'abc.jpg'))
+        assert not catalog.isfile(str(shard / 'abe.jpg'))
+
+    def test_a_shard_made_after_the_root_was_listed_is_there(self, shard):
+        catalog = StoreCatalog()
+        for _ in range(store_catalog.LIST_AFTER_CHECKS):
+            catalog.isdir(str(shard))
+        (shard.parent / 'cd').mkdir()
+
+        catalog.made_dir(str(shard.parent / 'cd'))
+
+        assert catalog.isdir(str(shard.parent / 'cd'))
+        assert not catalog.isfile(str(shard.parent / 'cd'))
+
+
+class TestEnsureShardDir:
+    def test_a_missing_shard_is_created_group_writable(self, tmp_path):
+        common.ensure_shard_dir(str(tmp_path / 'ab'))
+
+        assert (tmp_path / 'ab').is_dir()
+        if os.name == 'posix':
+            assert (tmp_path / 'ab').stat().st_mode & 0o2777 == 0o2775
+
+    def test_once_the_root_is_listed_existing_shards_cost_nothing(self, tmp_path, monkeypatch):
+        for name in ('aa', 'ab', 'ac'):
+            (tmp_path / name).mkdir()
+        made = []
+        monkeypatch.setattr(common.os, 'makedirs', lambda path, exist_ok: made.append(path))
+        with store_catalog.cataloguing():
+            fs = CountingFs(monkeypatch)
+            stats = []
+            real_isdir = os.path.isdir
+            monkeypatch.setattr(store_catalog.os.path, 'isdir', lambda path: stats.append(path) or real_isdir(path))
+
+            for name in ('aa', 'ab', 'ac') * 10:
+                common.ensure_shard_dir(str(tmp_path / name))
+
+        assert (len(stats), fs.listings, made) == (store_catalog.LIST_AFTER_CHECKS - 1, 1, [])
+
+    def test_a_shard_it_creates_is_known_to_the_run(self, tmp_path, monkeypatch):
+        with store_catalog.cataloguing() as catalog:
+            common.ensure_shard_dir(str(tmp_path / 'ab'))
+            monkeypatch.setattr(common.os, 'makedirs', lambda *args, **kwargs: pytest.fail('made it twice'))
+
+            common.ensure_shard_dir(str(tmp_path / 'ab'))
+
+        assert catalog._added == {str(tmp_path / 'ab'): True}
+
+
+class TestCost:
+    def test_one_stat_then_one_listing_for_a_whole_shard(self, shard, monkeypatch):
+        fs = CountingFs(monkeypatch)
+        catalog = StoreCatalog()
+
+        for name in ('abc.jpg', 'abd.jpg', 'abz.jpg', 'abc.depth.npz', 'abd.depth.npz') * 3:
+            catalog.isfile(str(shard / name))
+
+        assert (fs.stats, fs.listings) == (store_catalog.LIST_AFTER_CHECKS - 1, 1)
+
+    def test_a_directory_checked_once_is_never_listed(self, tmp_path, monkeypatch):
+        fs = CountingFs(monkeypatch)
+        catalog = StoreCatalog()
+
+        for shard in ('aa', 'ab', 'ac'):
+            catalog.isfile(str(tmp_path / shard / (shard + 'x.jpg')))
+
+        assert (fs.stats, fs.listings) == (3, 0)
+
+
+class TestTheRunsCatalog:
+    def test_without_one_isfile_is_a_plain_stat(self, shard, monkeypatch):
+        fs = CountingFs(monkeypatch)
+
+        for _ in range(3):
+            assert store_catalog.isfile(str(shard / 'abc.jpg'))
+
+        assert (fs.stats, fs.listings) == (3, 0)
+
+    def test_atomic_writes_land_in_the_installed_catalog(self, shard):
+        path = str(shard / 'abf.jpg')
+        with store_catalog.cataloguing() as catalog:
+            for _ in range(store_catalog.LIST_AFTER_CHECKS):
+                assert not store_catalog.isfile(path)
+            with common.atomic_output_path(path) as tmp_path:
+                with open(tmp_path, 'wb') as f:
+                    f.write(b'x')
+
+            assert store_catalog.isfile(path)
+            assert catalog.isfile(path)
+        assert store_catalog._catalog is None
+
+    def test_a_write_that_fails_is_not_added(self, shard):
+        path = str(shard / 'abf.jpg')
+        with store_catalog.cataloguing() as catalog:
+            with pytest.raises(OSError):
+                with common.atomic_output_path(path):
+                    raise OSError(28, 'No space left on device')
+
+            assert path not in catalog._added
+
+    def test_added_without_a_catalog_is_a_no_op(self, shard):
+        store_catalog.added(str(shard / 'abc.jpg'))
+        assert store_catalog._catalog is None
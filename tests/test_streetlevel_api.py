@@ -39,7 +39,7 @@ def test_api_find_panorama_by_id_still_takes_the_arguments_we_pass():
 
 def test_panorama_still_exposes_the_attributes_we_read():
     fields = {f.name for f in dataclasses.fields(panorama.StreetViewPanorama)}
-    # _write_depth_artifact reads pano.depth / .heading / .pitch / .roll.
+    # _PanoOrientation mirrors .heading / .pitch / .roll, and the mirror pins below read .depth.
     assert {'depth', 'heading', 'pitch', 'roll'} <= fields, "streetlevel changed StreetViewPanorama's fields"
 
 
@@ -178,8 +178,9 @@ def test_fetch_seam_extracts_pano_and_planes_from_the_raw_response(monkeypatch):
     assert pano.heading == pytest.approx(np.pi)          # 180 degrees
     assert pano.pitch == pytest.approx(0.0)              # stored as 90 - raw, raw is 90
     assert pano.roll == pytest.approx(0.0)
-    assert pano.depth.data.shape == (MIRROR_HEADER['height'], MIRROR_HEADER['width'])
-    np.testing.assert_allclose(np.ravel(pano.depth.data), MIRROR_EXPECTED, rtol=1e-5)
+    assert not hasattr(pano, 'depth'), "the seam computes no raster; v4 artifacts store none"
+    # Payload order is the flip of streetlevel's.
+    np.testing.assert_allclose(np.ravel(gsv._compute_depth_raster(planes)), MIRROR_EXPECTED[::-1], rtol=1e-5)
     np.testing.assert_array_equal(planes.indices,
                                   np.array(MIRROR_INDICES, dtype=np.uint8).reshape(1, 4))
     np.testing.assert_allclose(planes.normals, [p['n'] for p in MIRROR_PLANES], rtol=1e-6)
@@ -197,8 +198,8 @@ def test_fetch_seam_survives_a_modelled_zenith(monkeypatch):
     """A payload whose FIRST index byte is nonzero - a modelled zenith: tunnels, overpass soffits, parking
     structures, a bit under 1% of panos - is exactly the class streetlevel's parser dies on (its uint16
     misread of the offset byte, see test_streetlevel_still_misreads_the_depth_offset, unfixed through
-    0.12.11 with the fix pending in sk-zk/streetlevel#45). Since the seam computes the raster from our own
-    decode instead of routing through streetlevel's, those panos must now resolve rather than re-request
+    0.12.11 with the fix pending in sk-zk/streetlevel#45). Since the seam decodes the payload itself
+    instead of routing through streetlevel's parser, those panos must now resolve rather than re-request
     forever."""
     # Payload indices [1, 1, 0, 0]: the first byte is the nonzero one that breaks streetlevel's offset read.
     payload = encode_depth_payload(MIRROR_PLANES, [1, 1, 0, 0], MIRROR_HEADER['width'],
@@ -220,10 +221,8 @@ def test_fetch_seam_survives_a_modelled_zenith(monkeypatch):
     pano, planes = gsv._fetch_pano_with_depth_planes(pano_id, object())
 
     # Payload-order raster for these indices is [1.0, 3.0, -1, -1] (the same plane hit from two azimuths -
-    # payload cols 0 and 2 share |v . n|, see the MIRROR fixture); the seam hands the raster back in
-    # streetlevel's x-mirrored order, which is what _write_depth_artifact's #58 un-mirror (and all its CI
-    # pins) expect.
-    np.testing.assert_allclose(np.ravel(pano.depth.data), [-1.0, -1.0, 3.0, 1.0], rtol=1e-5)
+    # payload cols 0 and 2 share |v . n|, see the MIRROR fixture).
+    np.testing.assert_allclose(np.ravel(gsv._compute_depth_raster(planes)), [1.0, 3.0, -1.0, -1.0], rtol=1e-5)
     np.testing.assert_array_equal(planes.indices, np.array([[1, 1, 0, 0]], dtype=np.uint8))
 
 
@@ -238,7 +237,7 @@ def test_fetch_seam_raises_on_an_unrecognized_envelope(monkeypatch):
 
 
 def test_depth_map_still_exposes_data():
-    # _write_depth_artifact reads pano.depth.data. Tolerate DepthMap becoming a plain class so this catches a
+    # The mirror pins read the parsed DepthMap's .data. Tolerate DepthMap becoming a plain class so this catches a
     # rename rather than a refactor.
     fields = set()
     if dataclasses.is_dataclass(panorama.DepthMap):
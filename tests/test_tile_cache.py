@@ -0,0 +1,139 @@
+"""Tests for downloaders/tile_cache.py: the on-disk cache a failed GSV pano spills its tiles to.
+
+What the retry relies on - a spill comes back intact, at the right zoom - plus the two bounds that keep the
+cache from growing without limit: LRU eviction of whole panos at max_bytes, and cleanup of panos the ledger
+has resolved since. And the cache's one promise to its caller: an I/O error is a miss, never an exception.
+"""
+
+import os
+import time
+
+import pytest
+
+from downloaders import tile_cache
+from downloaders.tile_cache import TileCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TileCache(str(tmp_path / 'tile_cache'), max_bytes=1000)
+
+
+def age(cache, pano_id, seconds):
+    """Backdate pano_id's last use, so LRU order does not depend on the clock's resolution."""
+    with cache._lock:
+        cache._scanned()[pano_id][1] -= seconds
+
+
+class TestLoadAndPut:
+    def test_a_spill_comes_back_at_its_zoom(self, cache):
+        cache.put('panoA', 5, [(1, 0, b'one'), (3, 1, b'three')])
+
+        assert cache.load('panoA', 5) == {(1, 0): b'one', (3, 1): b'three'}
+        assert cache.size_bytes() == len(b'one') + len(b'three')
+
+    def test_other_zooms_are_not_returned(self, cache):
+        cache.put('panoA', 5, [(1, 0, b'five')])
+        cache.put('panoA', 3, [(1, 0, b'three')])
+
+        assert cache.load('panoA', 3) == {(1, 0): b'three'}
+
+    def test_a_miss_is_empty(self, cache):
+        assert cache.load('panoA', 5) == {}
+
+    def test_a_second_spill_adds_to_the_first(self, cache):
+        cache.put('panoA', 5, [(1, 0, b'one')])
+        cache.put('panoA', 5, [(2, 0, b'two')])
+
+        assert cache.load('panoA', 5) == {(1, 0): b'one', (2, 0): b'two'}
+
+    def test_the_layout_on_disk(self, cache, tmp_path):
+        cache.put('panoA', 5, [(3, 1, b'body')])
+
+        assert (tmp_path / 'tile_cache' / 'panoA' / '5_3_1.jpg').read_bytes() == b'body'
+
+    def test_discard_removes_the_pano(self, cache, tmp_path):
+        cache.put('panoA', 5, [(1, 0, b'one')])
+        cache.discard('panoA')
+
+        assert not (tmp_path / 'tile_cache' / 'panoA').exists()
+        assert cache.load('panoA', 5) == {}
+        assert cache.size_bytes() == 0
+
+    def test_discarding_a_pano_that_is_not_there_is_a_no_op(self, cache):
+        cache.discard('panoA')
+
+    def test_a_pano_the_cache_does_not_hold_costs_no_disk_io(self, cache, monkeypatch):
+        # "A pano that downloads cleanly never touches the cache": after the one scan, its load and its discard
+        # are answered from memory.
+        cache.put('panoA', 5, [(1, 0, b'one')])
+
+        def no_io(*args, **kwargs):
+            raise AssertionError('disk I/O for a pano with nothing cached')
+
+        monkeypatch.setattr(tile_cache.os, 'scandir', no_io)
+        monkeypatch.setattr(tile_cache.shutil, 'rmtree', no_io)
+
+        assert cache.load('panoB', 5) == {}
+        cache.discard('panoB')
+        assert cache.size_bytes() == len(b'one')
+
+
+class TestBestEffort:
+    def test_an_unreadable_entry_is_a_miss_and_is_dropped(self, cache, tmp_path):
+        cache.put('panoA', 5, [(1, 0, b'one')])
+        (tmp_path / 'tile_cache' / 'panoA' / '5_junk.jpg').write_bytes(b'?')
+
+        assert cache.load('panoA', 5) == {}
+        assert not (tmp_path / 'tile_cache' / 'panoA').exists()
+
+    def test_a_failed_spill_is_logged_not_raised(self, cache, tmp_path, caplog):
+        # A file where the cache root belongs: nothing under it can be created.
+        (tmp_path / 'tile_cache').write_bytes(b'')
+
+        cache.put('panoA', 5, [(1, 0, b'one')])
+
+        assert 'could not spill tiles for pano panoA' in caplog.text
+        assert cache.size_bytes() == 0
+
+
+class TestBounds:
+    def test_over_max_bytes_the_least_recently_used_pano_goes_whole(self, cache):
+        cache.put('panoA', 5, [(1, 0, b'a' * 300), (2, 0, b'a' * 300)])
+        cache.put('panoB', 5, [(1, 0, b'b' * 300)])
+        age(cache, 'panoA', 20)
+        age(cache, 'panoB', 10)
+        assert cache.load('panoA', 5)  # panoA is now the most recently used
+
+        cache.put('panoC', 5, [(1, 0, b'c' * 300)])
+
+        assert cache.load('panoB', 5) == {}
+        assert set(cache.load('panoA', 5)) == {(1, 0), (2, 0)}
+        assert cache.size_bytes() == 900
+
+    def test_a_spill_bigger_than_the_whole_cache_is_not_kept(self, cache):
+        cache.put('panoA', 5, [(1, 0, b'a' * 1001)])
+
+        assert cache.load('panoA', 5) == {}
+
+    def test_cleanup_drops_what_keep_rejects(self, cache):
+        cache.put('panoA', 5, [(1, 0, b'one')])
+        cache.put('panoB', 5, [(1, 0, b'one')])
+
+        cache.cleanup(keep=lambda pano_id: pano_id != 'panoA')
+
+        assert cache.load('panoA', 5) == {}
+        assert cache.load('panoB', 5) == {(1, 0): b'one'}
+
+    def test_a_new_instance_sees_the_previous_runs_spills(self, cache, tmp_path):
+        cache.put('panoA', 5, [(1, 0, b'a' * 600)])
+        old = time.time() - 3600
+        os.utime(tmp_path / 'tile_cache' / 'panoA', (old, old))
+
+        next_run = TileCache(str(tmp_path / 'tile_cache'), max_bytes=1000)
+        assert next_run.size_bytes() == 600
+        next_run.put('panoB', 5, [(1, 0, b'b' * 600)])
+
+        # Sizes and ages came from the scan: the older spill is the one evicted.
+        assert next_run.load('panoA', 5) == {}
+        assert next_run.load('panoB', 5) == {(1, 0): b'b' * 600}